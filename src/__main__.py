@@ -16,6 +16,7 @@ from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.background import BlockingScheduler
 
 
+from newrelic_logging import backfill
 from newrelic_logging.config import Config, getenv
 from newrelic_logging.factory import Factory
 from newrelic_logging.limits import receiver as limits_receiver
@@ -84,6 +85,50 @@ def parse_args() -> optparse.Values:
         help='name of numeric fields mapping file',
     )
 
+    parser.add_option(
+        '--backfill_from',
+        default=None,
+        help='start date of the time range to backfill',
+    )
+
+    parser.add_option(
+        '--backfill_to',
+        default=None,
+        help='end date of the time range to backfill',
+    )
+
+    parser.add_option(
+        '--backfill_instance',
+        default=None,
+        help='name of the instance to backfill',
+    )
+
+    parser.add_option(
+        '--backfill_event_types',
+        default=None,
+        help='comma separated list of the event types to backfill',
+    )
+
+    parser.add_option(
+        '--backfill_max_api_calls',
+        type='int',
+        default=None,
+        help='maximum number of API calls made by the backfill',
+    )
+
+    parser.add_option(
+        '--backfill_concurrency',
+        type='int',
+        default=backfill.DEFAULT_BACKFILL_CONCURRENCY,
+        help='number of time windows and log files processed at the same time during the backfill',
+    )
+
+    parser.add_option(
+        '--backfill_file',
+        default=backfill.DEFAULT_BACKFILL_FILE,
+        help='file the backfill progress is saved to if the instance has no watermark store',
+    )
+
     # Parse arguments
     (values, _) = parser.parse_args()
 
@@ -154,14 +199,14 @@ def run_once(
     factory: Factory,
     config: Config,
     receivers: list[callable],
-    numeric_fields_list: set
+    numeric_fields_mapping: dict
 ):
     # Run the integration
     factory.new_integration(
         factory,
         config,
         receivers,
-        numeric_fields_list,
+        numeric_fields_mapping,
     ).run()
 
 
@@ -169,7 +214,7 @@ def run_as_service(
     factory: Factory,
     config: Config,
     receivers: list[callable],
-    numeric_fields_list: set,
+    numeric_fields_mapping: dict,
 ):
     scheduler = BlockingScheduler(
         jobstores={ 'default': MemoryJobStore() },
@@ -211,7 +256,7 @@ def run_as_service(
                 factory,
                 config,
                 receivers,
-                numeric_fields_list,
+                numeric_fields_mapping,
                 # pass index to know the exact instance we need to create the new integration
                 index
             ).run,
@@ -228,7 +273,7 @@ def run_as_service(
 def run(
     config: Config,
     event_type_fields_mapping: dict,
-    numeric_fields_list: set
+    numeric_fields_mapping: dict
 ):
     factory = Factory()
 
@@ -241,7 +286,7 @@ def run(
                 event_type_fields_mapping,
                 config.get_int(CRON_INTERVAL_MINUTES, 60),
             ),
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         return
 
@@ -254,7 +299,35 @@ def run(
             event_type_fields_mapping,
             0,
         ),
-        numeric_fields_list,
+        numeric_fields_mapping,
+    )
+
+
+def run_backfill(
+    options: optparse.Values,
+    config: Config,
+    event_type_fields_mapping: dict,
+    numeric_fields_mapping: dict
+):
+    if not options.backfill_from or not options.backfill_to:
+        sys.exit('both --backfill_from and --backfill_to are required')
+
+    backfill.Backfill(
+        backfill.parse_backfill_date(options.backfill_from),
+        backfill.parse_backfill_date(options.backfill_to),
+        options.backfill_instance,
+        set(
+            event_type.strip() \
+                for event_type in options.backfill_event_types.split(',')
+        ) if options.backfill_event_types else None,
+        options.backfill_max_api_calls,
+        options.backfill_concurrency,
+        options.backfill_file,
+    ).run(
+        Factory(),
+        config,
+        event_type_fields_mapping,
+        numeric_fields_mapping,
     )
 
 
@@ -285,14 +358,17 @@ def main():
         DEFAULT_NUMERIC_FIELDS_MAPPING,
     )
 
-    # Build the numeric fields list
-    numeric_fields_list = set()
-    for event_num_fields in numeric_fields_mapping.values():
-        for num_field in event_num_fields:
-            numeric_fields_list.add(num_field)
-
-    # Run the application or startup the service
-    run(config, event_type_fields_mapping, numeric_fields_list)
+    # Backfill a past time range or run the application or startup the
+    # service
+    if options.backfill_from or options.backfill_to:
+        run_backfill(
+            options,
+            config,
+            event_type_fields_mapping,
+            numeric_fields_mapping,
+        )
+    else:
+        run(config, event_type_fields_mapping, numeric_fields_mapping)
 
     print_info("Integration end.")
 
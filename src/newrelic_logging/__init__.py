@@ -30,9 +30,17 @@ class SalesforceApiException(Exception):
         super().__init__(*args)
 
 
+class ApiCallBudgetException(SalesforceApiException):
+    pass
+
+
 class CacheException(Exception):
     pass
 
 
 class NewRelicApiException(Exception):
     pass
+
+
+class PayloadTooLargeException(NewRelicApiException):
+    pass
@@ -1,33 +1,43 @@
+import json
 from requests import RequestException, Session, Response
+import threading
 from typing import Any
 
-from . import SalesforceApiException
+from . import ApiCallBudgetException, SalesforceApiException
 from .auth import Authenticator
+from .csv_parser import CsvParser
+from .json_parser import JsonRecordsParser
 from .telemetry import print_warn
 
 API_NAME_REST = 'rest'
 API_NAME_TOOLING = 'tooling'
+API_NAME_BULK = 'bulk'
 DEFAULT_API_NAME = API_NAME_REST
 
-def get(
+def send(
     auth: Authenticator,
     session: Session,
     serviceUrl: str,
     cb,
-    stream: bool = False,
+    request: callable,
+    extra_headers: dict = {},
 ) -> Any:
+    # request is called with the URL and the headers and sends the request
+    # with the session, once more if the access token has to be renewed.
     url = f'{auth.get_instance_url()}{serviceUrl}'
 
     try:
         headers = {
-            'Authorization': f'Bearer {auth.get_access_token()}'
+            'Authorization': f'Bearer {auth.get_access_token()}',
+            **extra_headers,
         }
 
-        response = session.get(url, headers=headers, stream=stream)
+        response = request(url, headers)
 
         status_code = response.status_code
 
-        if status_code == 200:
+        # 206 is returned for range requests
+        if status_code == 200 or status_code == 206:
             return cb(response)
 
         if status_code == 401:
@@ -37,11 +47,12 @@ def get(
             auth.reauthenticate(session)
 
             new_headers = {
-                'Authorization': f'Bearer {auth.get_access_token()}'
+                'Authorization': f'Bearer {auth.get_access_token()}',
+                **extra_headers,
             }
 
-            response = session.get(url, headers=new_headers, stream=stream)
-            if response.status_code == 200:
+            response = request(url, new_headers)
+            if response.status_code == 200 or response.status_code == 206:
                 return cb(response)
 
         raise SalesforceApiException(
@@ -62,6 +73,45 @@ def get(
         ) from e
 
 
+def get(
+    auth: Authenticator,
+    session: Session,
+    serviceUrl: str,
+    cb,
+    stream: bool = False,
+    extra_headers: dict = {},
+) -> Any:
+    return send(
+        auth,
+        session,
+        serviceUrl,
+        cb,
+        lambda url, headers : session.get(url, headers=headers, stream=stream),
+        extra_headers,
+    )
+
+
+def post(
+    auth: Authenticator,
+    session: Session,
+    serviceUrl: str,
+    data: dict,
+    cb,
+) -> Any:
+    return send(
+        auth,
+        session,
+        serviceUrl,
+        cb,
+        lambda url, headers : session.post(
+            url,
+            headers=headers,
+            data=json.dumps(data),
+        ),
+        { 'Content-Type': 'application/json' },
+    )
+
+
 def stream_lines(response: Response, chunk_size: int):
     if response.encoding is None:
         response.encoding = 'utf-8'
@@ -76,6 +126,87 @@ def stream_lines(response: Response, chunk_size: int):
     )
 
 
+def stream_rows(
+    response: Response,
+    read_size: int,
+    offset: int = 0,
+    header: tuple = None,
+) -> CsvParser:
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+
+    # Parse the response as CSV straight from the raw stream. The parser
+    # reads large blocks at a time and yields the header followed by one
+    # tuple of field values per row.
+
+    # A server that does not support range requests returns the whole file
+    if response.status_code != 206:
+        offset = 0
+        header = None
+
+    return CsvParser(
+        lambda size : response.raw.read(size, decode_content=True),
+        read_size,
+        encoding=response.encoding,
+        header=header,
+        offset=offset,
+    )
+
+
+def stream_range_rows(
+    response: Response,
+    read_size: int,
+    offset: int,
+    header: tuple,
+) -> CsvParser:
+    # Unlike the rest of a log file, a range in the middle of a log file can
+    # not fall back to the whole file.
+    if response.status_code != 206:
+        response.close()
+        raise SalesforceApiException(
+            response.status_code,
+            f'error reading log file range, ' \
+            f'status-code: {response.status_code}, ' \
+            f'reason: {response.reason}, '
+        )
+
+    return stream_rows(response, read_size, offset, header)
+
+
+def read_range(response: Response) -> bytes:
+    if response.status_code != 206:
+        response.close()
+        return None
+
+    return response.content
+
+
+def stream_records(response: Response) -> JsonRecordsParser:
+    # Decode the records of a page of query results one at a time as the
+    # response is read rather than decoding the whole page at once.
+    return JsonRecordsParser(
+        lambda size : response.raw.read(size, decode_content=True),
+        encoding=response.encoding if response.encoding else 'utf-8',
+    )
+
+
+def get_query_options_headers(batch_size: int = None) -> dict:
+    # The batch size is the number of records returned with each page of
+    # query results. Salesforce may return fewer records than requested.
+    if not batch_size:
+        return {}
+
+    return { 'Sforce-Query-Options': f'batchSize={batch_size}' }
+
+
+def get_locator(response: Response) -> str:
+    # The Sforce-Locator header is the string null once all of the results of
+    # a query job have been read.
+    locator = response.headers.get('Sforce-Locator')
+
+    return None if not locator or locator == 'null' else locator
+
+
 def get_query_api_path(api_ver: str, api_name: str) -> str:
     l_api_name = api_name.lower()
 
@@ -92,9 +223,29 @@ def get_query_api_path(api_ver: str, api_name: str) -> str:
 
 
 class Api:
-    def __init__(self, authenticator: Authenticator, api_ver: str):
+    def __init__(
+        self,
+        authenticator: Authenticator,
+        api_ver: str,
+        max_calls: int = None,
+    ):
         self.authenticator = authenticator
         self.api_ver = api_ver
+        # Every API operation is counted in calls. With max_calls, operations
+        # raise an ApiCallBudgetException once that many have been made.
+        self.max_calls = max_calls
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def count_call(self) -> None:
+        with self.lock:
+            if self.max_calls and self.calls >= self.max_calls:
+                raise ApiCallBudgetException(
+                    0,
+                    f'API call budget of {self.max_calls} calls used up',
+                )
+
+            self.calls += 1
 
     def authenticate(self, session: Session) -> None:
         self.authenticator.authenticate(session)
@@ -105,7 +256,11 @@ class Api:
         soql: str,
         api_ver: str = None,
         api_name: str = None,
+        batch_size: int = None,
+        stream: bool = False,
     ) -> dict:
+        self.count_call()
+
         ver = self.api_ver
         if not api_ver is None:
             ver = api_ver
@@ -120,19 +275,126 @@ class Api:
             self.authenticator,
             session,
             f'{url}?q={soql}',
-            lambda response : response.json()
+            stream_records if stream else lambda response : response.json(),
+            stream=stream,
+            extra_headers=get_query_options_headers(batch_size),
         )
 
     def query_more(
         self,
         session: Session,
         next_records_url: str,
+        batch_size: int = None,
+        stream: bool = False,
     ) -> dict:
+        self.count_call()
+
         return get(
             self.authenticator,
             session,
             next_records_url,
-            lambda response : response.json()
+            stream_records if stream else lambda response : response.json(),
+            stream=stream,
+            extra_headers=get_query_options_headers(batch_size),
+        )
+
+    def create_query_job(
+        self,
+        session: Session,
+        soql: str,
+        api_ver: str = None,
+    ) -> dict:
+        self.count_call()
+
+        ver = self.api_ver
+        if not api_ver is None:
+            ver = api_ver
+
+        return post(
+            self.authenticator,
+            session,
+            f'/services/data/v{ver}/jobs/query',
+            { 'operation': 'query', 'query': soql },
+            lambda response : response.json(),
+        )
+
+    def get_query_job(
+        self,
+        session: Session,
+        job_id: str,
+        api_ver: str = None,
+    ) -> dict:
+        self.count_call()
+
+        ver = self.api_ver
+        if not api_ver is None:
+            ver = api_ver
+
+        return get(
+            self.authenticator,
+            session,
+            f'/services/data/v{ver}/jobs/query/{job_id}',
+            lambda response : response.json(),
+        )
+
+    def describe_sobject(
+        self,
+        session: Session,
+        sobject_type: str,
+        api_ver: str = None,
+    ) -> dict:
+        self.count_call()
+
+        ver = self.api_ver
+        if not api_ver is None:
+            ver = api_ver
+
+        return get(
+            self.authenticator,
+            session,
+            f'/services/data/v{ver}/sobjects/{sobject_type}/describe',
+            lambda response : response.json(),
+        )
+
+    def get_query_job_results(
+        self,
+        session: Session,
+        job_id: str,
+        chunk_size: int,
+        locator: str = None,
+        max_records: int = None,
+        api_ver: str = None,
+    ) -> tuple[CsvParser, str]:
+        # Returns a parser over the CSV results of a query job starting at the
+        # given locator and the locator of the next results, or None if there
+        # are no more results.
+        self.count_call()
+
+        ver = self.api_ver
+        if not api_ver is None:
+            ver = api_ver
+
+        params = []
+        if locator:
+            params.append(f'locator={locator}')
+
+        if max_records:
+            params.append(f'maxRecords={max_records}')
+
+        url = f'/services/data/v{ver}/jobs/query/{job_id}/results'
+        if len(params) > 0:
+            url += '?' + '&'.join(params)
+
+        return get(
+            self.authenticator,
+            session,
+            url,
+            lambda response : (
+                stream_rows(response, chunk_size),
+                get_locator(response),
+            ),
+            stream=True,
+            extra_headers={ 'Accept': 'text/csv' },
         )
 
     def get_log_file(
@@ -140,16 +402,74 @@ class Api:
         session: Session,
         log_file_path: str,
         chunk_size: int,
+        offset: int = 0,
+        header: tuple = None,
+        end: int = None,
     ):
+        # With an offset, the log file is read from that byte offset on with
+        # a range request and header is the header row of the log file. The
+        # offset is a position in the uncompressed file so the rest of the
+        # file is requested without compression. With an end, only the bytes
+        # up to and including end are read.
+        self.count_call()
+
+        if offset > 0 or not end is None:
+            return get(
+                self.authenticator,
+                session,
+                log_file_path,
+                lambda response : stream_rows(
+                    response,
+                    chunk_size,
+                    offset,
+                    header,
+                ) if end is None else stream_range_rows(
+                    response,
+                    chunk_size,
+                    offset,
+                    header,
+                ),
+                stream=True,
+                extra_headers={
+                    'Range': f'bytes={offset}-{"" if end is None else end}',
+                    'Accept-Encoding': 'identity',
+                },
+            )
+
+        return get(
+            self.authenticator,
+            session,
+            log_file_path,
+            lambda response : stream_rows(response, chunk_size),
+            stream=True,
+        )
+
+    def get_log_file_range(
+        self,
+        session: Session,
+        log_file_path: str,
+        start: int,
+        end: int,
+    ) -> bytes:
+        # Returns the uncompressed bytes of the log file from start up to and
+        # including end, or None if range requests are not supported.
+        self.count_call()
+
         return get(
             self.authenticator,
             session,
             log_file_path,
-            lambda response : stream_lines(response, chunk_size),
+            read_range,
             stream=True,
+            extra_headers={
+                'Range': f'bytes={start}-{end}',
+                'Accept-Encoding': 'identity',
+            },
         )
 
     def list_limits(self, session: Session, api_ver: str = None) -> dict:
+        self.count_call()
+
         ver = self.api_ver
         if not api_ver is None:
             ver = api_ver
@@ -49,24 +49,27 @@ class Authenticator:
         self.access_token = access_token
         self.instance_url = instance_url
 
+    def can_cache_auth(self) -> bool:
+        # Credentials can not be stored in every type of cache
+        return self.data_cache is not None and \
+            hasattr(self.data_cache.backend, 'put_hash')
+
     def clear_auth(self) -> None:
         self.set_auth_data(None, None)
 
-        if self.data_cache:
+        if self.can_cache_auth():
             try:
-                # @TODO need to change all the places where redis is explicitly
-                # referenced since this breaks encapsulation.
-                self.data_cache.backend.redis.delete(AUTH_CACHE_KEY)
+                self.data_cache.backend.delete(AUTH_CACHE_KEY)
             except Exception as e:
                 print_warn(f'Failed deleting data from cache: {e}')
 
     def load_auth_from_cache(self) -> bool:
         try:
-            auth_exists = self.data_cache.backend.redis.exists(AUTH_CACHE_KEY)
+            auth_exists = self.data_cache.backend.exists(AUTH_CACHE_KEY)
             if auth_exists:
-                print_info('Retrieving credentials from Redis.')
+                print_info('Retrieving credentials from cache.')
                 try:
-                    auth = self.data_cache.backend.redis.hmget(
+                    auth = self.data_cache.backend.get_hash(
                         AUTH_CACHE_KEY,
                         ['access_token', 'instance_url'],
                     )
@@ -88,7 +91,7 @@ class Authenticator:
         self.access_token = auth_resp['access_token']
         self.instance_url = auth_resp['instance_url']
 
-        if self.data_cache:
+        if self.can_cache_auth():
             print_info('Storing credentials in cache.')
 
             auth = {
@@ -97,7 +100,7 @@ class Authenticator:
             }
 
             try:
-                self.data_cache.backend.redis.hmset(AUTH_CACHE_KEY, auth)
+                self.data_cache.backend.put_hash(AUTH_CACHE_KEY, auth)
             except Exception as e:
                 print_warn(f"Failed storing data in cache: {e}")
 
@@ -187,7 +190,7 @@ class Authenticator:
             raise LoginException(f'authentication failed for sfdc instance {self.instance_url}') from e
 
     def authenticate(self, session: Session) -> None:
-        if self.data_cache and self.load_auth_from_cache():
+        if self.can_cache_auth() and self.load_auth_from_cache():
             return
 
         oauth_type = self.get_grant_type()
@@ -0,0 +1,191 @@
+from datetime import datetime, timezone
+import time
+
+
+from . import ApiCallBudgetException, ConfigException
+from .api import Api
+from .cache import DataCache
+from .config import Config
+from .query import QueryFactory, receiver as query_receiver
+from .query.watermark import FileWatermarkStore, PrefixedWatermarkStore
+from .telemetry import print_info, print_warn
+
+
+DEFAULT_BACKFILL_FILE = 'backfill.json'
+DEFAULT_BACKFILL_WINDOW_MINUTES = 60
+DEFAULT_BACKFILL_CONCURRENCY = 4
+
+
+def parse_backfill_date(date_string: str) -> str:
+    # Returns a date or date and time in ISO-8601 format as a date in the
+    # format used for query time ranges. Dates without a time zone are UTC.
+    try:
+        date = datetime.fromisoformat(
+            date_string[:-1] + '+00:00' if date_string.endswith('Z') \
+                else date_string
+        )
+    except ValueError:
+        raise ConfigException('backfill', f'invalid date {date_string}')
+
+    if date.tzinfo:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date.isoformat(timespec='milliseconds') + 'Z'
+
+
+def get_instance_index(config: Config, instance_name: str = None) -> int:
+    if not 'instances' in config or len(config['instances']) == 0:
+        raise ConfigException('no instances found to run')
+
+    instances = config['instances']
+
+    if not instance_name:
+        if len(instances) > 1:
+            raise ConfigException(
+                'backfill',
+                'an instance name is required when there are several instances',
+            )
+
+        return 0
+
+    for index, i in enumerate(instances):
+        if i.get('name') == instance_name:
+            return index
+
+    raise ConfigException('backfill', f'instance {instance_name} not found')
+
+
+class Backfill:
+    def __init__(
+        self,
+        from_timestamp: str,
+        to_timestamp: str,
+        instance_name: str = None,
+        event_types: set = None,
+        max_api_calls: int = None,
+        concurrency: int = DEFAULT_BACKFILL_CONCURRENCY,
+        backfill_file: str = DEFAULT_BACKFILL_FILE,
+    ):
+        if from_timestamp >= to_timestamp:
+            raise ConfigException(
+                'backfill',
+                f'the start date {from_timestamp} is not before the end date {to_timestamp}',
+            )
+
+        self.from_timestamp = from_timestamp
+        self.to_timestamp = to_timestamp
+        self.instance_name = instance_name
+        self.event_types = event_types
+        self.max_api_calls = max_api_calls
+        self.concurrency = concurrency
+        self.backfill_file = backfill_file
+        self.apis = []
+
+    def get_watermark_prefix(self) -> str:
+        # The watermarks of a backfill are kept apart from the watermarks of
+        # regular runs and of backfills of other instances or time ranges so
+        # that running the same backfill again resumes it.
+        return f'backfill:{self.instance_name}:' \
+            f'{self.from_timestamp}:{self.to_timestamp}:'
+
+    def new_create_receiver_func(self, create_receiver: callable) -> callable:
+        def create(
+            instance_config: Config,
+            data_cache: DataCache,
+            api: Api,
+            instance_name: str = '',
+        ):
+            # Unless they are set for the instance, the time range is split
+            # into hourly windows and the windows and the log files of each
+            # window are processed concurrency at a time. The defaults are
+            # set on a copy so that the config of the instance is unchanged.
+            instance_config = Config(
+                dict(instance_config.config),
+                instance_config.prefix,
+            )
+
+            for key, value in [
+                ('window_minutes', DEFAULT_BACKFILL_WINDOW_MINUTES),
+                ('window_concurrency', self.concurrency),
+                ('download_concurrency', self.concurrency),
+            ]:
+                if instance_config.get(key) is None:
+                    instance_config[key] = value
+
+            receiver = create_receiver(
+                instance_config,
+                data_cache,
+                api,
+                instance_name,
+            )
+            receiver.set_time_range(self.from_timestamp, self.to_timestamp)
+            receiver.event_types = self.event_types
+
+            if not receiver.watermarks:
+                print_info(f'Using backfill file {self.backfill_file}')
+
+            receiver.watermarks = PrefixedWatermarkStore(
+                receiver.watermarks if receiver.watermarks \
+                    else FileWatermarkStore(self.backfill_file, instance_name),
+                self.get_watermark_prefix(),
+            )
+
+            api.max_calls = self.max_api_calls
+            self.apis.append(api)
+
+            return receiver
+
+        return create
+
+    def run(
+        self,
+        factory,
+        config: Config,
+        event_type_fields_mapping: dict,
+        numeric_fields_mapping: dict = {},
+    ) -> None:
+        index = get_instance_index(config, self.instance_name)
+        instance = config['instances'][index]
+
+        # Like regular runs, a backfill needs the name of the instance
+        if not 'name' in instance:
+            raise ConfigException(
+                f'missing instance name for instance at position {index + 1}',
+            )
+
+        self.instance_name = instance['name']
+
+        print_info(
+            f'Backfilling instance "{self.instance_name}" ' \
+            f'from {self.from_timestamp} to {self.to_timestamp}'
+        )
+
+        start = time.time()
+
+        try:
+            factory.new_integration(
+                factory,
+                config,
+                [
+                    self.new_create_receiver_func(
+                        query_receiver.new_create_receiver_func(
+                            config,
+                            QueryFactory(),
+                            event_type_fields_mapping,
+                            0,
+                        ),
+                    ),
+                ],
+                numeric_fields_mapping,
+                index,
+            ).run()
+        except ApiCallBudgetException as e:
+            print_warn(
+                f'{e}, run the backfill again with the same dates to resume it',
+            )
+            raise e
+        finally:
+            print_info(
+                f'Backfill made {sum(api.calls for api in self.apis)} API ' \
+                f'calls in {time.time() - start:.0f} seconds'
+            )
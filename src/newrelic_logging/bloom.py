@@ -0,0 +1,108 @@
+from hashlib import blake2b
+import math
+import mmap
+import os
+import struct
+
+
+BLOOM_MAGIC = b'SFBF'
+BLOOM_VERSION = 1
+# magic, version, number of bits, number of hashes, capacity, count
+BLOOM_HEADER = struct.Struct('<4sIQIQQ')
+COUNT_OFFSET = BLOOM_HEADER.size - 8
+
+
+def get_num_bits(capacity: int, false_positive_rate: float) -> int:
+    # Optimal number of bits for the given number of items and false
+    # positive rate, rounded up to a whole number of bytes.
+    bits = math.ceil(
+        -capacity * math.log(false_positive_rate) / (math.log(2) ** 2)
+    )
+
+    return max(8, (bits + 7) // 8 * 8)
+
+
+def get_num_hashes(capacity: int, num_bits: int) -> int:
+    return max(1, round(num_bits / capacity * math.log(2)))
+
+
+class BloomFilter:
+    def __init__(
+        self,
+        path: str,
+        capacity: int,
+        false_positive_rate: float,
+    ):
+        # The filter lives in a memory-mapped file so that only the pages that
+        # are touched are kept in memory and the filter survives restarts. The
+        # size of an existing file is kept even if the capacity or false
+        # positive rate have changed since it was created.
+        self.path = path
+
+        if not os.path.exists(path):
+            num_bits = get_num_bits(capacity, false_positive_rate)
+
+            with open(path, 'wb') as f:
+                f.write(BLOOM_HEADER.pack(
+                    BLOOM_MAGIC,
+                    BLOOM_VERSION,
+                    num_bits,
+                    get_num_hashes(capacity, num_bits),
+                    capacity,
+                    0,
+                ))
+                f.truncate(BLOOM_HEADER.size + num_bits // 8)
+
+        with open(path, 'r+b') as f:
+            self.mm = mmap.mmap(f.fileno(), 0)
+
+        magic, version, self.num_bits, self.num_hashes, self.capacity, \
+            self.count = BLOOM_HEADER.unpack_from(self.mm)
+
+        if magic != BLOOM_MAGIC or version != BLOOM_VERSION or \
+            len(self.mm) != BLOOM_HEADER.size + self.num_bits // 8:
+            self.mm.close()
+            raise ValueError(f'{path} is not a valid filter file')
+
+    def get_bits(self, item: bytes) -> list[int]:
+        # Double hashing of one 128 bit digest gives the bit of each hash
+        digest = blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return [
+            BLOOM_HEADER.size * 8 + (h1 + i * h2) % self.num_bits \
+                for i in range(self.num_hashes)
+        ]
+
+    def contains(self, item: bytes) -> bool:
+        mm = self.mm
+
+        for bit in self.get_bits(item):
+            if not mm[bit >> 3] & (1 << (bit & 7)):
+                return False
+
+        return True
+
+    def add(self, item: bytes) -> None:
+        mm = self.mm
+        added = False
+
+        for bit in self.get_bits(item):
+            mask = 1 << (bit & 7)
+            if not mm[bit >> 3] & mask:
+                mm[bit >> 3] |= mask
+                added = True
+
+        if added:
+            self.count += 1
+            struct.pack_into('<Q', mm, COUNT_OFFSET, self.count)
+
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+    def flush(self) -> None:
+        self.mm.flush()
+
+    def close(self) -> None:
+        self.mm.close()
@@ -1,25 +1,88 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import gc
+from hashlib import blake2b
+import json
+import os
 import redis
-from datetime import timedelta
+from datetime import datetime, timedelta
+import sqlite3
+import threading
+import time
 
 from . import CacheException
+from .bloom import BloomFilter
 from .config import Config
 from .telemetry import print_info, print_warn
 
 
 CONFIG_CACHE_ENABLED = 'cache_enabled'
+CONFIG_CACHE_BACKEND = 'cache_backend'
 CONFIG_REDIS_HOST = 'redis.host'
 CONFIG_REDIS_PORT = 'redis.port'
 CONFIG_REDIS_DB_NUMBER = 'redis.db_number'
 CONFIG_REDIS_PASSWORD = 'redis.password'
 CONFIG_REDIS_USE_SSL = 'redis.ssl'
 CONFIG_REDIS_EXPIRE_DAYS = 'redis.expire_days'
+CONFIG_REDIS_WRITE_BEHIND = 'redis.write_behind'
+CONFIG_REDIS_BATCH_LOOKUPS = 'redis.batch_lookups'
+CONFIG_CACHE_KEY_LAYOUT = 'cache_key_layout'
+CONFIG_CACHE_DIGESTS = 'cache_digests'
+CONFIG_CACHE_HOURLY_FILE_MARKERS = 'cache_hourly_file_markers'
+CONFIG_CACHE_LOG_FILE_CHECKPOINTS = 'cache_log_file_checkpoints'
+CONFIG_BLOOM_PATH = 'bloom.path'
+CONFIG_BLOOM_CAPACITY = 'bloom.capacity'
+CONFIG_BLOOM_FALSE_POSITIVE_RATE = 'bloom.false_positive_rate'
+CONFIG_BLOOM_EXPIRE_DAYS = 'bloom.expire_days'
+CONFIG_SQLITE_PATH = 'sqlite.path'
+CONFIG_SQLITE_EXPIRE_DAYS = 'sqlite.expire_days'
+CACHE_BACKEND_REDIS = 'redis'
+CACHE_BACKEND_BLOOM = 'bloom'
+CACHE_BACKEND_SQLITE = 'sqlite'
+KEY_LAYOUT_LEGACY = 'legacy'
+KEY_LAYOUT_BUCKETED = 'bucketed'
+LEGACY_RECORD_IDS_KEY = 'record_ids'
+UNDATED_RECORD_IDS_BUCKET = 'undated'
+# The fields of a log file checkpoint: the byte offset to resume from, the
+# number of rows before it, the number of rows delivered, the index of the
+# next log line and the header row of the log file.
+CHECKPOINT_FIELDS = ['offset', 'rows', 'delivered', 'row_index', 'header']
 DEFAULT_CACHE_ENABLED = False
+DEFAULT_CACHE_BACKEND = CACHE_BACKEND_REDIS
+DEFAULT_CACHE_KEY_LAYOUT = KEY_LAYOUT_LEGACY
+DEFAULT_CACHE_DIGESTS = False
+DEFAULT_CACHE_HOURLY_FILE_MARKERS = False
+DEFAULT_CACHE_LOG_FILE_CHECKPOINTS = False
+# Size in bytes of the digests stored in place of IDs when digests are enabled
+DIGEST_SIZE = 12
+# Minimum number of digests added to a DigestSet before they are merged into
+# its sorted array
+DIGEST_SET_MERGE_SIZE = 4096
 DEFAULT_REDIS_HOST = 'localhost'
 DEFAULT_REDIS_PORT = 6379
 DEFAULT_REDIS_DB_NUMBER = 0
 DEFAULT_REDIS_EXPIRE_DAYS = 2
 DEFAULT_REDIS_SSL = False
+DEFAULT_REDIS_WRITE_BEHIND = False
+DEFAULT_REDIS_BATCH_LOOKUPS = False
+DEFAULT_BLOOM_PATH = 'cache'
+DEFAULT_BLOOM_CAPACITY = 1000000
+DEFAULT_BLOOM_FALSE_POSITIVE_RATE = 0.001
+DEFAULT_BLOOM_EXPIRE_DAYS = 2
+BLOOM_FILE_SUFFIX = '.bloom'
+DEFAULT_SQLITE_PATH = 'cache.db'
+DEFAULT_SQLITE_EXPIRE_DAYS = 2
+# Maximum number of values bound to a single SQLite statement, well under the
+# default limit of 999 variables.
+SQLITE_CHUNK_SIZE = 500
+# Minimum number of seconds between deletes of expired SQLite rows
+SQLITE_CLEANUP_INTERVAL = 3600
+# Maximum number of commands sent in a single pipeline and maximum number of
+# members added to a set by a single SADD.
+WRITE_CHUNK_SIZE = 1000
+SET_ADD_CHUNK_SIZE = 5000
+# Maximum number of IDs checked by a single batched lookup.
+LOOKUP_CHUNK_SIZE = 1000
 
 
 # Going through this function makes testing easier
@@ -27,6 +90,27 @@ def redis_connect(**kwargs) -> redis.Redis: # pragma: no cover
     return redis.Redis(**kwargs)
 
 
+# Redis clients by connection arguments. Instances that use the same server
+# share a client and therefore its connection pool.
+_redis_clients = {}
+_redis_clients_lock = threading.Lock()
+
+
+def get_redis_client(redis_connector: callable, **kwargs):
+    key = (redis_connector, tuple(sorted(kwargs.items())))
+
+    with _redis_clients_lock:
+        if not key in _redis_clients:
+            _redis_clients[key] = redis_connector(**kwargs)
+
+        return _redis_clients[key]
+
+
+def chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class RedisBackend:
     def __init__(self, redis):
         self.redis = redis
@@ -40,12 +124,522 @@ class RedisBackend:
     def get_set(self, key):
         return self.redis.smembers(key)
 
+    def set_size(self, key) -> int:
+        return self.redis.scard(key)
+
     def set_add(self, key, *values):
         self.redis.sadd(key, *values)
 
     def set_expiry(self, key, days):
         self.redis.expire(key, timedelta(days=days))
 
+    def get_hash(self, key, fields: list) -> list:
+        return self.redis.hmget(key, fields)
+
+    def put_hash(self, key, mapping: dict) -> None:
+        self.redis.hmset(key, mapping)
+
+    def delete(self, key) -> None:
+        self.redis.delete(key)
+
+    def exists_many(self, keys: list) -> list[bool]:
+        # Checks if each key exists with pipelined EXISTS commands
+        results = []
+
+        for chunk in chunks(keys, LOOKUP_CHUNK_SIZE):
+            pipe = self.redis.pipeline(transaction=False)
+
+            for key in chunk:
+                pipe.exists(key)
+
+            results.extend(bool(result) for result in pipe.execute())
+
+        return results
+
+    def set_contains(self, key, values: list) -> list[bool]:
+        # Checks if each value is a member of the set at key with pipelined
+        # SISMEMBER commands, which unlike SMISMEMBER work with any server
+        # version.
+        results = []
+
+        for chunk in chunks(values, LOOKUP_CHUNK_SIZE):
+            pipe = self.redis.pipeline(transaction=False)
+
+            for value in chunk:
+                pipe.sismember(key, value)
+
+            results.extend(bool(result) for result in pipe.execute())
+
+        return results
+
+    def write(self, keys: list, sets: dict, days: int) -> None:
+        # Puts each key and adds the members of each set, setting the expiry
+        # of everything written. Commands are sent in pipelines of bounded
+        # size rather than one round trip per command.
+        expiry = timedelta(days=days)
+        pipe = self.redis.pipeline(transaction=False)
+        count = 0
+
+        def queued():
+            nonlocal count
+
+            count += 1
+            if count >= WRITE_CHUNK_SIZE:
+                pipe.execute()
+                count = 0
+
+        for key in keys:
+            pipe.set(key, 1, ex=expiry)
+            queued()
+
+        for key, values in sets.items():
+            for chunk in chunks(list(values), SET_ADD_CHUNK_SIZE):
+                pipe.sadd(key, *chunk)
+                queued()
+
+            pipe.expire(key, expiry)
+            queued()
+
+        if count > 0:
+            pipe.execute()
+
+
+class BloomBackend:
+    def __init__(
+        self,
+        path: str,
+        capacity: int,
+        false_positive_rate: float,
+        expire_days: int,
+        now: callable = datetime.utcnow, # makes testing easier
+    ):
+        # Keys and set members are added to Bloom filters partitioned by the
+        # UTC day they expire on, which is the day they were written on plus
+        # the days given to write(). Each day has one or more filter files
+        # named {YYYYMMDD}-{segment}.bloom and a new segment is started once
+        # the last one holds capacity items. Partitions are dropped once their
+        # day has passed.
+        #
+        # Lookups check every filter so each filter is sized for a fraction
+        # of false_positive_rate and the rate of all of them together stays
+        # below it, assuming entries are written for expire_days.
+        self.path = path
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.expire_days = expire_days
+        self.now = now
+        self.partitions = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(BLOOM_FILE_SUFFIX):
+                continue
+
+            partition, segment = name[:-len(BLOOM_FILE_SUFFIX)].split('-', 1)
+            self.partitions.setdefault(partition, []).append(
+                BloomFilter(
+                    os.path.join(path, name),
+                    capacity,
+                    self.get_filter_false_positive_rate(int(segment)),
+                )
+            )
+
+    def get_filter_false_positive_rate(self, segment: int) -> float:
+        # There are at most expire_days + 1 partitions. Each segment of a
+        # partition gets half the rate of the previous one so that the rates
+        # of all segments of a partition add up to less than the share of the
+        # partition, whatever the number of segments.
+        return self.false_positive_rate / (self.expire_days + 1) \
+            / 2 ** (segment + 1)
+
+    def get_filters(self) -> list[BloomFilter]:
+        # Drops expired partitions and returns the filters of the others
+        cutoff = self.now().strftime('%Y%m%d')
+
+        for partition in [p for p in self.partitions if p < cutoff]:
+            for f in self.partitions.pop(partition):
+                f.close()
+                os.remove(f.path)
+
+        return [f for filters in self.partitions.values() for f in filters]
+
+    def get_writable_filter(self, days: int) -> BloomFilter:
+        partition = (self.now() + timedelta(days=days)).strftime('%Y%m%d')
+        filters = self.partitions.setdefault(partition, [])
+
+        if len(filters) == 0 or filters[-1].is_full():
+            filters.append(
+                BloomFilter(
+                    os.path.join(
+                        self.path,
+                        f'{partition}-{len(filters):04d}{BLOOM_FILE_SUFFIX}',
+                    ),
+                    self.capacity,
+                    self.get_filter_false_positive_rate(len(filters)),
+                )
+            )
+
+        return filters[-1]
+
+    def contains(self, items: list[bytes]) -> list[bool]:
+        with self.lock:
+            filters = self.get_filters()
+
+            return [
+                any(f.contains(item) for f in filters) for item in items
+            ]
+
+    def add(self, items: list[bytes], days: int) -> None:
+        with self.lock:
+            self.get_filters()
+
+            for item in items:
+                self.get_writable_filter(days).add(item)
+
+            for filters in self.partitions.values():
+                for f in filters:
+                    f.flush()
+
+    def exists(self, key):
+        return self.contains([key_item(key)])[0]
+
+    def exists_many(self, keys: list) -> list[bool]:
+        return self.contains([key_item(key) for key in keys])
+
+    def put(self, key, item):
+        self.add([key_item(key)], self.expire_days)
+
+    def get_set(self, key):
+        raise CacheException(
+            f'failed loading {key}: sets can not be loaded from a Bloom filter'
+        )
+
+    def set_contains(self, key, values: list) -> list[bool]:
+        return self.contains([member_item(key, value) for value in values])
+
+    def set_add(self, key, *values):
+        self.add(
+            [key_item(key)] + [member_item(key, value) for value in values],
+            self.expire_days,
+        )
+
+    def set_expiry(self, key, days):
+        # Entries expire with the partition they were written to
+        pass
+
+    def write(self, keys: list, sets: dict, days: int) -> None:
+        items = [key_item(key) for key in keys]
+
+        for key, values in sets.items():
+            # Like Redis, a set only exists once it has a member
+            if len(values) > 0:
+                items.append(key_item(key))
+                items.extend(member_item(key, value) for value in values)
+
+        if len(items) > 0:
+            self.add(items, days)
+
+
+def to_bytes(value) -> bytes:
+    # Digests are already bytes, everything else is kept as its string form
+    if isinstance(value, bytes):
+        return value
+
+    return str(value).encode('utf-8')
+
+
+def to_column(value):
+    # Digests are stored as BLOBs, everything else as TEXT
+    if isinstance(value, bytes):
+        return value
+
+    return str(value)
+
+
+def key_item(key) -> bytes:
+    return b'k\0' + to_bytes(key)
+
+
+def member_item(key, value) -> bytes:
+    return b'm\0' + to_bytes(key) + b'\0' + to_bytes(value)
+
+
+# Bloom backends by path. Instances that use the same directory share a
+# backend so that its files are only mapped once.
+_bloom_backends = {}
+_bloom_backends_lock = threading.Lock()
+
+
+def get_bloom_backend(
+    path: str,
+    capacity: int,
+    false_positive_rate: float,
+    expire_days: int,
+) -> BloomBackend:
+    key = os.path.abspath(path)
+
+    with _bloom_backends_lock:
+        if not key in _bloom_backends:
+            _bloom_backends[key] = BloomBackend(
+                path,
+                capacity,
+                false_positive_rate,
+                expire_days,
+            )
+
+        return _bloom_backends[key]
+
+
+SQLITE_SCHEMA = [
+    # Keys and sets expire together like their Redis counterparts, so the
+    # expiry is kept once per key in an indexed column rather than per member.
+    '''CREATE TABLE IF NOT EXISTS keys (
+        key TEXT PRIMARY KEY,
+        expires INTEGER NOT NULL
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS keys_expires ON keys (expires)',
+    '''CREATE TABLE IF NOT EXISTS members (
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (key, value)
+    ) WITHOUT ROWID''',
+    # Like Redis, hashes only expire once an expiry has been set on them so
+    # the expiry is NULL for credentials and watermarks.
+    '''CREATE TABLE IF NOT EXISTS hashes (
+        key TEXT NOT NULL,
+        field TEXT NOT NULL,
+        value TEXT,
+        expires INTEGER,
+        PRIMARY KEY (key, field)
+    ) WITHOUT ROWID''',
+]
+SQLITE_HASHES_EXPIRES_INDEX = \
+    'CREATE INDEX IF NOT EXISTS hashes_expires ON hashes (expires)'
+
+
+class SqliteBackend:
+    def __init__(
+        self,
+        path: str,
+        expire_days: int,
+        now: callable = time.time, # makes testing easier
+    ):
+        self.path = path
+        self.expire_days = expire_days
+        self.now = now
+        self.last_cleanup = 0
+        # The connection is used by the worker threads and the write behind
+        # thread so every use goes through this lock.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+
+        for statement in SQLITE_SCHEMA:
+            self.db.execute(statement)
+
+        # Databases created before hashes could expire have no expiry column
+        if not 'expires' in [
+            row[1] for row in self.db.execute('PRAGMA table_info(hashes)')
+        ]:
+            self.db.execute('ALTER TABLE hashes ADD COLUMN expires INTEGER')
+
+        self.db.execute(SQLITE_HASHES_EXPIRES_INDEX)
+
+    def cleanup(self, now: int) -> None:
+        # Expired rows are deleted at most once per interval using the expiry
+        # index. The freed pages are reused by later writes so the database
+        # never needs to be vacuumed.
+        if now - self.last_cleanup < SQLITE_CLEANUP_INTERVAL:
+            return
+
+        self.last_cleanup = now
+
+        with self.db:
+            self.db.execute(
+                'DELETE FROM members WHERE key IN '
+                '(SELECT key FROM keys WHERE expires <= ?)',
+                (now,),
+            )
+            self.db.execute('DELETE FROM keys WHERE expires <= ?', (now,))
+            self.db.execute('DELETE FROM hashes WHERE expires <= ?', (now,))
+
+    def exists(self, key):
+        return self.exists_many([key])[0]
+
+    def exists_many(self, keys: list) -> list[bool]:
+        keys = [str(key) for key in keys]
+        found = set()
+
+        with self.lock:
+            now = int(self.now())
+            self.cleanup(now)
+
+            for chunk in chunks(keys, SQLITE_CHUNK_SIZE):
+                params = ','.join('?' * len(chunk))
+                found.update(
+                    row[0] for row in self.db.execute(
+                        f'SELECT key FROM keys WHERE key IN ({params}) '
+                        'AND expires > ? '
+                        f'UNION SELECT key FROM hashes WHERE key IN ({params}) '
+                        'AND (expires IS NULL OR expires > ?)',
+                        chunk + [now] + chunk + [now],
+                    )
+                )
+
+        return [key in found for key in keys]
+
+    def put(self, key, item):
+        self.write([key], {}, self.expire_days)
+
+    def get_set(self, key):
+        with self.lock:
+            return set(
+                row[0] for row in self.db.execute(
+                    'SELECT value FROM members WHERE key = ? AND EXISTS '
+                    '(SELECT 1 FROM keys WHERE key = ? AND expires > ?)',
+                    (str(key), str(key), int(self.now())),
+                )
+            )
+
+    def set_size(self, key) -> int:
+        with self.lock:
+            return self.db.execute(
+                'SELECT COUNT(*) FROM members WHERE key = ? AND EXISTS '
+                '(SELECT 1 FROM keys WHERE key = ? AND expires > ?)',
+                (str(key), str(key), int(self.now())),
+            ).fetchone()[0]
+
+    def set_contains(self, key, values: list) -> list[bool]:
+        key = str(key)
+        values = [to_column(value) for value in values]
+        found = set()
+
+        with self.lock:
+            if not self.db.execute(
+                'SELECT 1 FROM keys WHERE key = ? AND expires > ?',
+                (key, int(self.now())),
+            ).fetchone():
+                return [False] * len(values)
+
+            for chunk in chunks(values, SQLITE_CHUNK_SIZE):
+                params = ','.join('?' * len(chunk))
+                found.update(
+                    row[0] for row in self.db.execute(
+                        'SELECT value FROM members WHERE key = ? '
+                        f'AND value IN ({params})',
+                        [key] + chunk,
+                    )
+                )
+
+        return [value in found for value in values]
+
+    def set_add(self, key, *values):
+        self.write([], { key: values }, self.expire_days)
+
+    def set_expiry(self, key, days):
+        # Like Redis, sets the expiry of a key, set or hash that exists
+        with self.lock, self.db:
+            now = int(self.now())
+            expires = now + days * 86400
+
+            self.db.execute(
+                'UPDATE keys SET expires = ? WHERE key = ? AND expires > ?',
+                (expires, str(key), now),
+            )
+            self.db.execute(
+                'UPDATE hashes SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (expires, str(key), now),
+            )
+
+    def get_hash(self, key, fields: list) -> list:
+        with self.lock:
+            values = dict(
+                self.db.execute(
+                    'SELECT field, value FROM hashes WHERE key = ? '
+                    'AND (expires IS NULL OR expires > ?)',
+                    (str(key), int(self.now())),
+                ).fetchall()
+            )
+
+        return [values.get(field) for field in fields]
+
+    def put_hash(self, key, mapping: dict) -> None:
+        # Like Redis, the fields of a hash that has not expired keep its
+        # expiry and the fields of one that has expired do not come back.
+        with self.lock, self.db:
+            self.db.execute(
+                'DELETE FROM hashes WHERE key = ? AND expires <= ?',
+                (str(key), int(self.now())),
+            )
+            self.db.executemany(
+                'INSERT OR REPLACE INTO hashes (key, field, value, expires) '
+                'VALUES (?, ?, ?, '
+                '(SELECT MAX(expires) FROM hashes WHERE key = ?))',
+                [
+                    (str(key), field, value, str(key)) \
+                        for field, value in mapping.items()
+                ],
+            )
+
+    def delete(self, key) -> None:
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM hashes WHERE key = ?', (str(key),))
+            self.db.execute('DELETE FROM members WHERE key = ?', (str(key),))
+            self.db.execute('DELETE FROM keys WHERE key = ?', (str(key),))
+
+    def write(self, keys: list, sets: dict, days: int) -> None:
+        # Adds the keys and set members in a single transaction. Like Redis,
+        # writing a set sets the expiry of the whole set and a set only
+        # exists once it has a member. The entries expire after days.
+        with self.lock:
+            now = int(self.now())
+            expires = now + days * 86400
+            rows = [(str(key), expires) for key in keys]
+
+            for key, values in sets.items():
+                if len(values) > 0:
+                    rows.append((str(key), expires))
+
+            with self.db:
+                # Members of a set that expired but have not been cleaned up
+                # yet must not come back with the new expiry.
+                self.db.executemany(
+                    'DELETE FROM members WHERE key = ? AND key IN '
+                    '(SELECT key FROM keys WHERE key = ? AND expires <= ?)',
+                    [(key, key, now) for key, _ in rows],
+                )
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO keys (key, expires) VALUES (?, ?)',
+                    rows,
+                )
+
+                for key, values in sets.items():
+                    self.db.executemany(
+                        'INSERT OR IGNORE INTO members (key, value) '
+                        'VALUES (?, ?)',
+                        [(str(key), to_column(value)) for value in values],
+                    )
+
+
+# SQLite backends by path. Instances that use the same database share a
+# backend and therefore its connection.
+_sqlite_backends = {}
+_sqlite_backends_lock = threading.Lock()
+
+
+def get_sqlite_backend(path: str, expire_days: int) -> SqliteBackend:
+    key = os.path.abspath(path)
+
+    with _sqlite_backends_lock:
+        if not key in _sqlite_backends:
+            _sqlite_backends[key] = SqliteBackend(path, expire_days)
+
+        return _sqlite_backends[key]
+
 
 class BackendFactory:
     def __init__(self):
@@ -56,6 +650,17 @@ class BackendFactory:
         config: Config,
         redis_connector: callable = redis_connect, # makes testing easier
     ):
+        backend = config.get(CONFIG_CACHE_BACKEND, DEFAULT_CACHE_BACKEND)
+
+        if backend == CACHE_BACKEND_BLOOM:
+            return self.new_bloom_backend(config)
+
+        if backend == CACHE_BACKEND_SQLITE:
+            return self.new_sqlite_backend(config)
+
+        if backend != CACHE_BACKEND_REDIS:
+            raise CacheException(f'invalid cache backend {backend}')
+
         host = config.get(CONFIG_REDIS_HOST, DEFAULT_REDIS_HOST)
         port = config.get_int(CONFIG_REDIS_PORT, DEFAULT_REDIS_PORT)
         db = config.get_int(CONFIG_REDIS_DB_NUMBER, DEFAULT_REDIS_DB_NUMBER)
@@ -72,7 +677,8 @@ class BackendFactory:
         )
 
         return RedisBackend(
-            redis_connector(
+            get_redis_client(
+                redis_connector,
                 host=host,
                 port=port,
                 db=db,
@@ -82,11 +688,147 @@ class BackendFactory:
             ),
         )
 
+    def new_bloom_backend(self, config: Config):
+        path = config.get(CONFIG_BLOOM_PATH, DEFAULT_BLOOM_PATH)
+        capacity = config.get_int(
+            CONFIG_BLOOM_CAPACITY,
+            DEFAULT_BLOOM_CAPACITY,
+        )
+        false_positive_rate = float(config.get(
+            CONFIG_BLOOM_FALSE_POSITIVE_RATE,
+            DEFAULT_BLOOM_FALSE_POSITIVE_RATE,
+        ))
+        expire_days = config.get_int(
+            CONFIG_BLOOM_EXPIRE_DAYS,
+            DEFAULT_BLOOM_EXPIRE_DAYS,
+        )
+
+        if capacity <= 0:
+            raise CacheException(f'invalid Bloom filter capacity {capacity}')
+
+        if not 0 < false_positive_rate < 1:
+            raise CacheException(
+                f'invalid Bloom filter false positive rate {false_positive_rate}'
+            )
+
+        print_info(
+            f'using Bloom filter cache in {path}, capacity={capacity}, false_positive_rate={false_positive_rate}'
+        )
+
+        return get_bloom_backend(
+            path,
+            capacity,
+            false_positive_rate,
+            expire_days,
+        )
+
+    def new_sqlite_backend(self, config: Config):
+        path = config.get(CONFIG_SQLITE_PATH, DEFAULT_SQLITE_PATH)
+        expire_days = config.get_int(
+            CONFIG_SQLITE_EXPIRE_DAYS,
+            DEFAULT_SQLITE_EXPIRE_DAYS,
+        )
+
+        print_info(f'using SQLite cache {path}, expire_days={expire_days}')
+
+        return get_sqlite_backend(path, expire_days)
+
+
+def get_expire_days(config: Config) -> int:
+    # Each backend has its own expiry setting
+    backend = config.get(CONFIG_CACHE_BACKEND, DEFAULT_CACHE_BACKEND)
+
+    if backend == CACHE_BACKEND_BLOOM:
+        return config.get_int(
+            CONFIG_BLOOM_EXPIRE_DAYS,
+            DEFAULT_BLOOM_EXPIRE_DAYS,
+        )
+
+    if backend == CACHE_BACKEND_SQLITE:
+        return config.get_int(
+            CONFIG_SQLITE_EXPIRE_DAYS,
+            DEFAULT_SQLITE_EXPIRE_DAYS,
+        )
+
+    return config.get_int(
+        CONFIG_REDIS_EXPIRE_DAYS,
+        DEFAULT_REDIS_EXPIRE_DAYS,
+    )
+
+
+def digest(value) -> bytes:
+    return blake2b(to_bytes(value), digest_size=DIGEST_SIZE).digest()
+
+
+class DigestSet:
+    def __init__(self, size: int = DIGEST_SIZE):
+        # Fixed width digests are kept sorted in a single bytes buffer, which
+        # takes size bytes per digest instead of the 80 or so bytes of an
+        # entry in a set. Added digests are kept in a small set until there
+        # are enough of them to merge into the buffer.
+        self.size = size
+        self.data = b''
+        self.count = 0
+        self.added = set()
+
+    def get(self, index: int) -> bytes:
+        return self.data[index * self.size:(index + 1) * self.size]
+
+    def __contains__(self, item: bytes) -> bool:
+        if item in self.added:
+            return True
+
+        lo = 0
+        hi = self.count
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.get(mid)
+
+            if value == item:
+                return True
+
+            if value < item:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return False
+
+    def __len__(self) -> int:
+        return self.count + len(self.added)
+
+    def __iter__(self):
+        for i in range(0, self.count):
+            yield self.get(i)
+
+        yield from self.added
+
+    def add(self, item: bytes) -> None:
+        if item in self:
+            return
+
+        self.added.add(item)
+
+        # Merging once the added digests are a fraction of the buffer keeps
+        # the cost of merging proportional to the number of digests.
+        if len(self.added) >= max(DIGEST_SET_MERGE_SIZE, self.count // 8):
+            self.merge()
+
+    def merge(self) -> None:
+        items = sorted(self)
+        self.data = b''.join(items)
+        self.count = len(items)
+        self.added = set()
+
+    def intersection(self, items) -> set:
+        return set(item for item in items if item in self)
+
 
 class BufferedAddSetCache:
-    def __init__(self, s: set):
+    def __init__(self, s: set, buffer = None):
         self.s = s
-        self.buffer = set()
+        self.buffer = buffer if buffer is not None else set()
 
     def check_or_set(self, item: str) -> bool:
         if item in self.s or item in self.buffer:
@@ -100,67 +842,659 @@ class BufferedAddSetCache:
         return self.buffer
 
 
+class WriteBatch:
+    def __init__(
+        self,
+        log_records: dict,
+        record_ids: set,
+        record_id_sets: dict = None,
+    ):
+        # record_id_sets holds the record IDs by the key of the set they are
+        # added to
+        self.log_records = log_records
+        self.record_ids = record_ids
+        self.record_id_sets = record_id_sets if record_id_sets is not None \
+            else { LEGACY_RECORD_IDS_KEY: record_ids } if record_ids \
+            else {}
+
+
+def get_checkpoint_key(record_id: str) -> str:
+    return f'checkpoint:{record_id}'
+
+
+def get_record_ids_key(namespace: str, query_key: str, timestamp: int) -> str:
+    # Record IDs are kept in one set for each instance, query and hour of the
+    # record timestamp, in milliseconds since the epoch. Sets for hours that
+    # are no longer queried are not written again and expire on their own.
+    # Record IDs of records without a timestamp are kept in a single set for
+    # each instance and query so that they are found again on every run.
+    hour = UNDATED_RECORD_IDS_BUCKET if timestamp is None \
+        else datetime.utcfromtimestamp(timestamp // 1000).strftime('%Y%m%d%H')
+
+    return f'record_ids:{namespace}:{query_key}:{hour}'
+
+
 class DataCache:
-    def __init__(self, backend, expiry):
+    def __init__(
+        self,
+        backend,
+        expiry,
+        write_behind: bool = False,
+        batch_lookups: bool = False,
+        key_layout: str = DEFAULT_CACHE_KEY_LAYOUT,
+        namespace: str = '',
+        digests: bool = DEFAULT_CACHE_DIGESTS,
+        hourly_file_markers: bool = DEFAULT_CACHE_HOURLY_FILE_MARKERS,
+        log_file_checkpoints: bool = DEFAULT_CACHE_LOG_FILE_CHECKPOINTS,
+    ):
         self.backend = backend
         self.expiry = expiry
+        # With digests, log line and record IDs are replaced by fixed width
+        # binary digests, both in memory and in the cache. The digests are
+        # only ever looked up, never loaded, so batch lookups are always used.
+        self.digests = digests
+        # With the bucketed key layout, record IDs are added to time bucketed
+        # sets namespaced by instance and query instead of the single
+        # record_ids set. Sets can not be loaded across buckets so batch
+        # lookups are always used. Until the legacy set expires, record IDs
+        # not found in their bucket are also looked up in it.
+        if not key_layout in [KEY_LAYOUT_LEGACY, KEY_LAYOUT_BUCKETED]:
+            raise CacheException(f'invalid cache key layout {key_layout}')
+
+        self.key_layout = key_layout
+        self.namespace = namespace
+        self.legacy_record_ids = key_layout == KEY_LAYOUT_LEGACY
+        self.query_record_keys = {}
+        # With batch lookups, IDs are checked against the cache in batches
+        # instead of loading each set in full the first time it is used. The
+        # buffers then only hold the IDs seen during the current run. Sets
+        # can not be loaded from a Bloom filter and lookups in SQLite do not
+        # need a round trip so the local backends always use them.
+        self.batch_lookups = batch_lookups or digests or \
+            key_layout == KEY_LAYOUT_BUCKETED or \
+            isinstance(backend, (BloomBackend, SqliteBackend))
         self.log_records = {}
         self.query_records = None
+        # Log files may be processed by several workers at once so every
+        # access to the buffers goes through this lock.
+        self.lock = threading.RLock()
+        # With write behind, flushed buffers are written on a background
+        # thread. Until a batch is written it is kept in pending so that
+        # lookups still see its IDs.
+        self.write_behind = write_behind
+        self.executor = None
+        self.pending = []
+        self.write_error = None
+        # The record IDs known to be in the cache, with the time each was
+        # added, are mirrored in memory for the lifetime of the cache. When
+        # the exporter runs as a service, later runs use the mirror instead
+        # of loading the whole record_ids set again. record_ids_count is the
+        # size the record_ids set should have if only this cache wrote to it.
+        self.record_ids_l1 = {}
+        self.record_ids_count = None
+        # With hourly file markers, the log lines of Hourly log files are not
+        # checked against the cache. Instead, a single marker is set for each
+        # file once all of its log lines have been delivered. Until then, the
+        # files whose log lines have all been read are kept in
+        # log_file_markers.
+        self.hourly_file_markers = hourly_file_markers
+        self.log_file_markers = set()
+        # With log file checkpoints, the position in each log file of the
+        # last log line delivered is saved so that the log file can be resumed
+        # from there. Checkpoints are kept in hashes, which Bloom filters can
+        # not hold.
+        self.log_file_checkpoints = log_file_checkpoints
+
+        if log_file_checkpoints and not hasattr(backend, 'put_hash'):
+            print_warn(
+                'log file checkpoints require a Redis or SQLite cache, disabling'
+            )
+            self.log_file_checkpoints = False
+
+        # received and delivered count the logs of the current run handed to
+        # the pipeline and delivered by it. Callbacks waiting for logs to be
+        # delivered are kept in delivery_callbacks in the order they were
+        # added, with the number of logs that must be delivered first.
+        self.received = 0
+        self.delivered = 0
+        self.delivery_callbacks = deque()
+        self.now = time.time # makes testing easier
+
+    def new_buffer(self):
+        return DigestSet() if self.digests else set()
+
+    def is_pending_log_file(self, record_id: str) -> bool:
+        if record_id in self.log_file_markers:
+            return True
+
+        for batch in self.pending:
+            if len(batch.log_records.get(record_id, ())) > 0:
+                return True
+
+        return False
 
     def can_skip_downloading_logfile(self, record_id: str) -> bool:
         try:
-            return self.backend.exists(record_id)
+            with self.lock:
+                if self.is_pending_log_file(record_id):
+                    return True
+
+                return self.backend.exists(record_id)
         except Exception as e:
             raise CacheException(f'failed checking record {record_id}: {e}')
 
+    def can_skip_downloading_logfiles(self, record_ids: list) -> list[bool]:
+        try:
+            with self.lock:
+                results = [
+                    self.is_pending_log_file(record_id) \
+                        for record_id in record_ids
+                ]
+                missing = [
+                    i for i, result in enumerate(results) if not result
+                ]
+
+                if len(missing) > 0:
+                    exists = self.backend.exists_many(
+                        [record_ids[i] for i in missing],
+                    )
+
+                    for i, result in zip(missing, exists):
+                        results[i] = result
+
+                return results
+        except Exception as e:
+            raise CacheException(f'failed checking records: {e}')
+
+    def get_set(self, key: str, pending: callable) -> set:
+        s = self.backend.get_set(key)
+
+        for batch in self.pending:
+            values = pending(batch, key)
+            if values:
+                s = s.union(values)
+
+        return s
+
     def check_or_set_log_line(self, record_id: str, line: dict) -> bool:
         try:
-            if not record_id in self.log_records:
-                self.log_records[record_id] = BufferedAddSetCache(
-                    self.backend.get_set(record_id),
-                )
+            line_id = line['REQUEST_ID']
+        except Exception as e:
+            raise CacheException(f'failed checking record {record_id}: {e}')
+
+        return self.check_or_set_log_line_id(record_id, line_id)
+
+    def check_or_set_log_line_id(self, record_id: str, line_id: str) -> bool:
+        if self.batch_lookups:
+            return self.check_or_set_log_line_ids(record_id, [line_id])[0]
+
+        if line_id is None:
+            raise CacheException(
+                f'failed checking record {record_id}: missing REQUEST_ID'
+            )
+
+        try:
+            with self.lock:
+                if not record_id in self.log_records:
+                    self.log_records[record_id] = BufferedAddSetCache(
+                        self.get_set(
+                            record_id,
+                            lambda batch, key : batch.log_records.get(key),
+                        ),
+                    )
 
-            return self.log_records[record_id].check_or_set(line['REQUEST_ID'])
+                return self.log_records[record_id].check_or_set(line_id)
         except Exception as e:
             raise CacheException(f'failed checking record {record_id}: {e}')
 
-    def check_or_set_record_id(self, record_id: str) -> bool:
+    def check_or_set_log_line_ids(
+        self,
+        record_id: str,
+        line_ids: list,
+    ) -> list[bool]:
+        if None in line_ids:
+            raise CacheException(
+                f'failed checking record {record_id}: missing REQUEST_ID'
+            )
+
+        if not self.batch_lookups:
+            return [
+                self.check_or_set_log_line_id(record_id, line_id) \
+                    for line_id in line_ids
+            ]
+
+        if self.digests:
+            line_ids = [digest(line_id) for line_id in line_ids]
+
         try:
-            if not self.query_records:
-                self.query_records = BufferedAddSetCache(
-                    self.backend.get_set('record_ids'),
+            with self.lock:
+                if not record_id in self.log_records:
+                    self.log_records[record_id] = BufferedAddSetCache(
+                        set(),
+                        self.new_buffer(),
+                    )
+
+                return self.check_or_set_batch(
+                    self.log_records[record_id],
+                    [record_id] * len(line_ids),
+                    line_ids,
+                    lambda batch, key : batch.log_records.get(key),
                 )
+        except Exception as e:
+            raise CacheException(f'failed checking record {record_id}: {e}')
+
+    def lookup(self, key: str, ids: set, pending: callable) -> set:
+        # Returns the IDs found in the set at key or in any pending writes of
+        # that set
+        ids = list(ids)
+        seen = set(
+            id for id, found in zip(ids, self.backend.set_contains(key, ids)) \
+                if found
+        )
+
+        for batch in self.pending:
+            values = pending(batch, key)
+            if values:
+                seen.update(values.intersection(ids))
+
+        return seen
+
+    def check_or_set_batch(
+        self,
+        records: BufferedAddSetCache,
+        keys: list,
+        ids: list,
+        pending: callable,
+        on_found: callable = None,
+        fallback_key: str = None,
+    ) -> list[bool]:
+        # Looks up the IDs not already known in the set at the key given for
+        # each ID, then in the set at fallback_key if one is given, and checks
+        # or sets each ID in order so that repeated IDs are only reported as
+        # new once. on_found is called with the IDs found by the lookups.
+        buffer = records.get_buffer()
+        lookups = {}
+
+        for key, id in zip(keys, ids):
+            if not id in buffer and not id in records.s:
+                lookups.setdefault(key, set()).add(id)
+
+        seen = set()
+
+        for key, lookup in lookups.items():
+            seen.update(self.lookup(key, lookup, pending))
+
+        if fallback_key:
+            missing = set().union(*lookups.values()) - seen
+            if len(missing) > 0:
+                seen.update(self.lookup(fallback_key, missing, pending))
+
+        if on_found and len(seen) > 0:
+            on_found(seen)
+
+        return [id in seen or records.check_or_set(id) for id in ids]
+
+    def add_record_ids_l1(self, record_ids) -> None:
+        now = self.now()
+
+        for record_id in record_ids:
+            self.record_ids_l1[record_id] = now
+
+    def evict_record_ids_l1(self) -> None:
+        # Record IDs expire from the mirror when they would expire from the
+        # cache if they were not written again.
+        cutoff = self.now() - self.expiry * 86400
+
+        self.record_ids_l1 = {
+            record_id: added \
+                for record_id, added in self.record_ids_l1.items() \
+                    if added > cutoff
+        }
 
-            return self.query_records.check_or_set(record_id)
+    def sync_record_ids_l1(self) -> dict:
+        # Brings the mirror up to date before record IDs are checked. With
+        # batch lookups, IDs missing from the mirror are looked up as they are
+        # checked. Otherwise, Redis sets can not list the members added since
+        # a point in time, so the size of the set is compared to the size it
+        # should have if only this cache wrote to it and the set is only
+        # loaded again if it differs. Once the mirror has been loaded, the
+        # check is skipped while writes are pending since they would change
+        # the size.
+        self.evict_record_ids_l1()
+
+        if self.batch_lookups:
+            return self.record_ids_l1
+
+        if self.record_ids_count is not None and (
+            len(self.pending) > 0 or \
+                self.backend.set_size('record_ids') == self.record_ids_count
+        ):
+            return self.record_ids_l1
+
+        record_ids = self.backend.get_set('record_ids')
+
+        if len(self.pending) > 0:
+            # The IDs being written are already in the mirror but may not be
+            # in the set yet, so the set is added to the mirror and is loaded
+            # again on the first sync without pending writes.
+            self.add_record_ids_l1(record_ids)
+            return self.record_ids_l1
+
+        self.record_ids_l1 = {}
+        self.record_ids_count = len(record_ids)
+        self.add_record_ids_l1(record_ids)
+
+        return self.record_ids_l1
+
+    def check_or_set_record_id(self, record_id: str) -> bool:
+        if self.batch_lookups:
+            return self.check_or_set_record_ids([record_id])[0]
+
+        try:
+            with self.lock:
+                if not self.query_records:
+                    self.query_records = BufferedAddSetCache(
+                        self.sync_record_ids_l1(),
+                    )
+
+                return self.query_records.check_or_set(record_id)
         except Exception as e:
             raise CacheException(f'failed checking record {record_id}: {e}')
 
+    def get_record_ids_key(self, query_key: str, timestamp: int) -> str:
+        if self.key_layout == KEY_LAYOUT_LEGACY:
+            return LEGACY_RECORD_IDS_KEY
+
+        return get_record_ids_key(self.namespace, query_key, timestamp)
+
+    def check_or_set_record_ids(
+        self,
+        record_ids: list,
+        keys: list = None,
+    ) -> list[bool]:
+        # keys holds the key of the set each record ID belongs to, as returned
+        # by get_record_ids_key()
+        if not self.batch_lookups:
+            return [
+                self.check_or_set_record_id(record_id) \
+                    for record_id in record_ids
+            ]
+
+        if keys is None:
+            keys = [LEGACY_RECORD_IDS_KEY] * len(record_ids)
+
+        if self.digests:
+            record_ids = [digest(record_id) for record_id in record_ids]
+
+        try:
+            with self.lock:
+                if not self.query_records:
+                    self.query_records = BufferedAddSetCache(
+                        self.sync_record_ids_l1(),
+                        self.new_buffer(),
+                    )
+
+                    if self.key_layout == KEY_LAYOUT_BUCKETED:
+                        self.legacy_record_ids = self.backend.exists(
+                            LEGACY_RECORD_IDS_KEY,
+                        )
+
+                results = self.check_or_set_batch(
+                    self.query_records,
+                    keys,
+                    record_ids,
+                    lambda batch, key : batch.record_id_sets.get(key),
+                    self.add_record_ids_l1,
+                    LEGACY_RECORD_IDS_KEY \
+                        if self.key_layout == KEY_LAYOUT_BUCKETED and \
+                            self.legacy_record_ids \
+                        else None,
+                )
+
+                for record_id, key, seen in zip(record_ids, keys, results):
+                    if not seen and not record_id in self.query_record_keys:
+                        self.query_record_keys[record_id] = key
+
+                return results
+        except Exception as e:
+            raise CacheException(f'failed checking records: {e}')
+
+    def get_record_id_sets(self, record_ids: set) -> dict:
+        if self.key_layout == KEY_LAYOUT_LEGACY:
+            return { LEGACY_RECORD_IDS_KEY: record_ids } if record_ids else {}
+
+        sets = {}
+
+        for record_id in record_ids:
+            sets.setdefault(
+                self.query_record_keys.get(record_id, LEGACY_RECORD_IDS_KEY),
+                set(),
+            ).add(record_id)
+
+        return sets
+
+    def write_batch(self, batch: WriteBatch) -> None:
+        sets = dict(batch.log_records)
+        sets.update(batch.record_id_sets)
+
+        self.backend.write(list(batch.record_ids), sets, self.expiry)
+
+    def write_pending(self, batch: WriteBatch) -> None:
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            with self.lock:
+                if not self.write_error:
+                    self.write_error = e
+        finally:
+            with self.lock:
+                self.pending.remove(batch)
+
+    def raise_write_error(self) -> None:
+        with self.lock:
+            e = self.write_error
+            self.write_error = None
+
+        if e:
+            raise CacheException(f'failed writing cache: {e}')
+
+    def write(self, batch: WriteBatch) -> None:
+        if not self.write_behind:
+            self.write_batch(batch)
+            return
+
+        self.raise_write_error()
+
+        with self.lock:
+            self.pending.append(batch)
+
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix='sfexp-cache',
+                )
+
+            # A single thread writes the batches in the order they were
+            # flushed.
+            self.executor.submit(self.write_pending, batch)
+
+    def wait(self) -> None:
+        # Waits for any batches still being written in the background.
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+
+        if executor:
+            executor.shutdown(wait=True)
+
+        self.raise_write_error()
+
+    def get_log_file_checkpoint(self, record_id: str) -> dict:
+        try:
+            values = self.backend.get_hash(
+                get_checkpoint_key(record_id),
+                CHECKPOINT_FIELDS,
+            )
+        except Exception as e:
+            raise CacheException(
+                f'failed getting checkpoint for record {record_id}: {e}'
+            )
+
+        if None in values:
+            return None
+
+        values = [
+            value.decode('utf-8') if isinstance(value, bytes) else value \
+                for value in values
+        ]
+        checkpoint = {
+            field: int(value) \
+                for field, value in zip(CHECKPOINT_FIELDS[:-1], values)
+        }
+        checkpoint['header'] = tuple(json.loads(values[-1]))
+
+        return checkpoint
+
+    def put_log_file_checkpoint(self, record_id: str, checkpoint: dict) -> None:
+        key = get_checkpoint_key(record_id)
+        mapping = {
+            field: checkpoint[field] for field in CHECKPOINT_FIELDS[:-1]
+        }
+        mapping['header'] = json.dumps(list(checkpoint['header']))
+
+        try:
+            self.backend.put_hash(key, mapping)
+            self.backend.set_expiry(key, self.expiry)
+        except Exception as e:
+            raise CacheException(
+                f'failed saving checkpoint for record {record_id}: {e}'
+            )
+
+    def delete_log_file_checkpoint(self, record_id: str) -> None:
+        try:
+            self.backend.delete(get_checkpoint_key(record_id))
+        except Exception as e:
+            raise CacheException(
+                f'failed deleting checkpoint for record {record_id}: {e}'
+            )
+
+    def track_delivery(self, iter):
+        # Counts the logs handed to the pipeline during a run. Logs of a
+        # previous run that were never delivered are forgotten, and so are
+        # the log files of that run that were never marked, so that they are
+        # downloaded again.
+        with self.lock:
+            self.received = 0
+            self.delivered = 0
+            self.delivery_callbacks.clear()
+            self.log_file_markers = set()
+
+        for log in iter:
+            with self.lock:
+                self.received += 1
+
+            yield log
+
+    def on_delivered(self, callback: callable) -> None:
+        # Calls callback once every log received so far has been delivered
+        with self.lock:
+            if self.received > self.delivered:
+                self.delivery_callbacks.append((self.received, callback))
+                return
+
+        callback()
+
+    def set_delivered(self, count: int) -> None:
+        # Called with the number of logs in each batch the pipeline delivers,
+        # in the order the logs were received.
+        callbacks = []
+
+        with self.lock:
+            self.delivered += count
+
+            while len(self.delivery_callbacks) > 0 and \
+                self.delivery_callbacks[0][0] <= self.delivered:
+                callbacks.append(self.delivery_callbacks.popleft()[1])
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print_warn(f'failed updating delivered logs: {e}')
+
+    def add_log_file_marker(self, record_id: str) -> None:
+        with self.lock:
+            self.log_file_markers.add(record_id)
+
+    def write_log_file_markers(self) -> None:
+        # Sets the markers of the log files added since the last call. This
+        # must only be called once the log lines of those files have been
+        # delivered.
+        try:
+            with self.lock:
+                if len(self.log_file_markers) == 0:
+                    return
+
+                markers = self.log_file_markers
+                self.log_file_markers = set()
+
+            self.backend.write(list(markers), {}, self.expiry)
+        except Exception as e:
+            raise CacheException(f'failed writing log file markers: {e}')
+
+    def flush_log_file(self, record_id: str) -> None:
+        try:
+            with self.lock:
+                if not record_id in self.log_records:
+                    return
+
+                batch = WriteBatch(
+                    { record_id: self.log_records[record_id].get_buffer() },
+                    set(),
+                )
+
+                # attempt to reclaim memory
+                del self.log_records[record_id]
+
+            self.write(batch)
+        except CacheException:
+            raise
+        except Exception as e:
+            raise CacheException(f'failed flushing record {record_id}: {e}')
+
     def flush(self) -> None:
         try:
-            for record_id in self.log_records:
-                buf = self.log_records[record_id].get_buffer()
-                if len(buf) > 0:
-                    self.backend.set_add(record_id, *buf)
+            with self.lock:
+                if self.query_records:
+                    # The new record IDs are added to the mirror now since
+                    # they are about to be written.
+                    record_ids = self.query_records.get_buffer()
+                    self.add_record_ids_l1(record_ids)
 
-                self.backend.set_expiry(record_id, self.expiry)
+                    if self.record_ids_count is not None:
+                        self.record_ids_count += len(record_ids)
 
-            if self.query_records:
-                buf = self.query_records.get_buffer()
-                if len(buf) > 0:
-                    for id in buf:
-                        self.backend.put(id, 1)
-                        self.backend.set_expiry(id, self.expiry)
+                record_ids = self.query_records.get_buffer() \
+                    if self.query_records else set()
 
-                    self.backend.set_add('record_ids', *buf)
-                    self.backend.set_expiry('record_ids', self.expiry)
+                batch = WriteBatch(
+                    {
+                        record_id: records.get_buffer() \
+                            for record_id, records in self.log_records.items()
+                    },
+                    record_ids,
+                    self.get_record_id_sets(record_ids),
+                )
 
-            # attempt to reclaim memory
-            for record_id in self.log_records:
-                self.log_records[record_id] = None
+                # attempt to reclaim memory
+                self.log_records = {}
+                self.query_records = None
+                self.query_record_keys = {}
 
-            self.log_records = {}
-            self.query_records = None
+            self.write(batch)
 
             gc.collect()
+        except CacheException:
+            raise
         except Exception as e:
             raise CacheException(f'failed flushing cache: {e}')
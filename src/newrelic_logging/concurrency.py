@@ -0,0 +1,137 @@
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import queue
+import threading
+
+
+DEFAULT_BATCH_SIZE = 500
+QUEUE_PUT_TIMEOUT = 0.1
+
+
+_DONE = object()
+
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+class _Failure:
+    def __init__(self, e: BaseException):
+        self.e = e
+
+
+def merge_iterators(
+    factories: list[callable],
+    max_workers: int,
+    on_complete: callable = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    queue_size: int = None,
+):
+    # Each factory returns an iterator which is drained on a worker thread.
+    # Items are handed back to the calling thread in batches through a bounded
+    # queue so that no more than a few batches per worker are ever held in
+    # memory. By default the queue holds two batches per worker. Factories are
+    # started in the order given.
+
+    if len(factories) == 0:
+        return
+
+    q = queue.Queue(maxsize=queue_size if queue_size else max_workers * 2)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=QUEUE_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def run(index: int, factory: callable):
+        try:
+            batch = []
+
+            for item in factory():
+                batch.append(item)
+
+                if len(batch) == batch_size:
+                    if not put((index, batch)):
+                        return
+
+                    batch = []
+
+            if len(batch) > 0 and not put((index, batch)):
+                return
+
+            put((index, _DONE))
+        except BaseException as e:
+            put((index, _Failure(e)))
+
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix='sfexp-worker',
+    )
+
+    try:
+        for index, factory in enumerate(factories):
+            executor.submit(run, index, factory)
+
+        remaining = len(factories)
+
+        while remaining > 0:
+            index, item = q.get()
+
+            if item is _DONE:
+                remaining -= 1
+                if on_complete:
+                    on_complete(index)
+                continue
+
+            if isinstance(item, _Failure):
+                raise item.e
+
+            yield from item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    # Worker processes are slow to start so a single pool of each size is
+    # shared by all instances for the life of the exporter.
+    with _process_pools_lock:
+        pool = _process_pools.get(max_workers)
+
+        if pool is None:
+            pool = _process_pools[max_workers] = ProcessPoolExecutor(
+                max_workers=max_workers,
+            )
+
+        return pool
+
+
+def map_ordered(
+    executor: Executor,
+    fn: callable,
+    iter,
+    max_pending: int,
+):
+    # Calls fn with each item of iter on the executor and yields the results
+    # in the order of the items. No more than max_pending items are submitted
+    # ahead of the result being yielded so that the items are not all read
+    # into memory at once.
+    pending = deque()
+
+    try:
+        for item in iter:
+            pending.append(executor.submit(fn, item))
+
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while len(pending) > 0:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,333 @@
+import csv
+
+
+DEFAULT_READ_SIZE = 64 * 1024
+MAX_READ_SIZE = 4 * 1024 * 1024
+DEFAULT_ENCODING = 'utf-8'
+
+
+def parse_row(line: str) -> tuple:
+    for row in csv.reader([line]):
+        return tuple(row)
+
+    return ()
+
+
+def find_line_start(data: bytes, quotes: int) -> int:
+    # Returns the index in data right after the first line terminator that
+    # follows a number of quotes with the given parity, or None if there is
+    # no such line terminator.
+    count = 0
+    pos = 0
+
+    while True:
+        end = data.find(b'\n', pos)
+        if end < 0:
+            return None
+
+        count += data.count(b'"', pos, end)
+        if count % 2 == quotes:
+            return end + 1
+
+        pos = end + 1
+
+
+def find_record_end(data: bytes) -> int:
+    # Returns the index in data right after the last line terminator that
+    # follows an even number of quotes, or None if there is no such line
+    # terminator.
+    quotes = data.count(b'"')
+    end = len(data)
+
+    while True:
+        pos = data.rfind(b'\n', 0, end)
+        if pos < 0:
+            return None
+
+        quotes -= data.count(b'"', pos, end)
+        if quotes % 2 == 0:
+            return pos + 1
+
+        end = pos
+
+
+def is_record_start(
+    data: bytes,
+    columns: int,
+    encoding: str = DEFAULT_ENCODING,
+) -> bool:
+    # Returns True if data starts with one or more complete records of the
+    # given number of columns. The last record is ignored if it does not end
+    # in data.
+    end = data.rfind(b'\n')
+    if end < 0:
+        return False
+
+    try:
+        text = data[:end].decode(encoding)
+    except UnicodeDecodeError:
+        return False
+
+    records = 0
+    record = None
+    record_quotes = 0
+
+    for line in text.split('\n'):
+        quotes = line.count('"')
+
+        if record is not None:
+            record.append(line)
+            record_quotes += quotes
+
+            if record_quotes % 2 == 1:
+                continue
+
+            line = '\n'.join(record)
+            record = None
+        elif quotes % 2 == 1:
+            record = [line]
+            record_quotes = quotes
+            continue
+
+        if line.endswith('\r'):
+            line = line[:-1]
+
+        if not line:
+            continue
+
+        try:
+            if len(parse_row(line)) != columns:
+                return False
+        except csv.Error:
+            return False
+
+        records += 1
+
+    return records > 0
+
+
+def find_record_start(
+    data: bytes,
+    columns: int,
+    encoding: str = DEFAULT_ENCODING,
+) -> int:
+    # data is a block of a CSV file that starts at an arbitrary position,
+    # which may be inside a quoted field. Returns the index in data of the
+    # first record that starts in it, or None if it can not be told apart.
+    #
+    # A line terminator ends a record only if it follows an even number of
+    # quotes since the start of the file. That number is not known here so
+    # both parities are tried and a start is only returned if the records
+    # that follow it have the right number of columns for exactly one of
+    # them.
+    starts = []
+
+    for quotes in (0, 1):
+        start = find_line_start(data, quotes)
+
+        if start is not None and \
+            is_record_start(data[start:], columns, encoding):
+            starts.append(start)
+
+    return starts[0] if len(starts) == 1 else None
+
+
+class CsvParser:
+    def __init__(
+        self,
+        read: callable,
+        read_size: int = DEFAULT_READ_SIZE,
+        max_read_size: int = MAX_READ_SIZE,
+        encoding: str = DEFAULT_ENCODING,
+        header: tuple = None,
+        offset: int = 0,
+    ):
+        # read is called with a number of bytes and returns at most that many
+        # bytes of the CSV data, or an empty bytes object once all data has
+        # been read.
+        #
+        # When the data starts in the middle of a CSV file, offset is the
+        # position of the data in the file and header is the header row of the
+        # file, which is then not part of the data.
+        self.read = read
+        self.read_size = max(read_size, 1)
+        self.max_read_size = max(max_read_size, self.read_size)
+        self.encoding = encoding
+        self.buf = bytearray()
+        self.header = header
+        self.offset = offset
+        self.position = offset
+        self.block_end = offset
+        # rows is the number of data rows yielded so far. checkpoint is the
+        # position in the file right after the last row of a block that does
+        # not end inside a quoted field, with the number of data rows yielded
+        # before it, which is where parsing can be resumed.
+        self.rows = 0
+        self.checkpoint = (offset, 0)
+
+    def next_block(self) -> str:
+        # Returns the decoded text of all complete lines read so far, without
+        # the final line terminator. Bytes after the last line terminator stay
+        # in the buffer until the rest of the line is read. Since a line
+        # terminator is never part of a multi-byte character, each block can
+        # be decoded on its own.
+
+        while True:
+            data = self.read(self.read_size)
+
+            if not data:
+                if len(self.buf) == 0:
+                    return None
+
+                text = self.buf.decode(self.encoding)
+                self.buf.clear()
+                self.block_end = self.position
+                return text
+
+            self.position += len(data)
+
+            # The stream keeps up with the reads so read more at a time.
+            if len(data) >= self.read_size and \
+                self.read_size < self.max_read_size:
+                self.read_size = min(self.read_size * 2, self.max_read_size)
+
+            end = data.rfind(b'\n')
+            if end < 0:
+                self.buf += data
+                continue
+
+            self.buf += memoryview(data)[:end]
+            text = self.buf.decode(self.encoding)
+            self.buf.clear()
+            self.buf += memoryview(data)[end + 1:]
+            self.block_end = self.position - len(self.buf)
+
+            return text
+
+    def chunks(self, size: int):
+        # Yields the data after the header row as blocks of at least size
+        # bytes of complete records, except for the last block, without
+        # decoding or parsing the records. The header row is parsed and kept
+        # in self.header before the first block is yielded.
+        buf = bytearray()
+
+        while True:
+            data = self.read(self.read_size)
+            if not data:
+                break
+
+            self.position += len(data)
+
+            if len(data) >= self.read_size and \
+                self.read_size < self.max_read_size:
+                self.read_size = min(self.read_size * 2, self.max_read_size)
+
+            buf += data
+
+            # Blank lines before the header row are skipped
+            while self.header is None:
+                end = find_line_start(buf, 0)
+                if end is None:
+                    break
+
+                line = buf[:end].decode(self.encoding).rstrip('\r\n')
+                del buf[:end]
+
+                if line:
+                    self.header = parse_row(line)
+
+            if self.header is None or len(buf) < size:
+                continue
+
+            end = find_record_end(buf)
+            if end is None:
+                continue
+
+            self.block_end = self.position - len(buf) + end
+            yield bytes(buf[:end])
+            del buf[:end]
+
+        if self.header is None:
+            line = buf.decode(self.encoding).strip('\r\n')
+            if line:
+                self.header = parse_row(line)
+
+            return
+
+        if len(buf) > 0:
+            self.block_end = self.position
+            yield bytes(buf)
+
+    def __iter__(self):
+        # Yields the header row followed by each data row as a tuple of field
+        # values indexed by column position. Lines inside a quoted field are
+        # joined back together by tracking whether the number of quotes seen
+        # so far in the record is odd.
+
+        columns = None
+        quoted_size = 0
+        record = None
+        record_quotes = 0
+
+        if self.header is not None:
+            columns = len(self.header)
+            quoted_size = columns * 2
+            yield self.header
+
+        while True:
+            if record is None:
+                self.checkpoint = (self.block_end, self.rows)
+
+            text = self.next_block()
+            if text is None:
+                break
+
+            for line in text.split('\n'):
+                quotes = line.count('"')
+
+                if record is not None:
+                    record.append(line)
+                    record_quotes += quotes
+
+                    if record_quotes % 2 == 1:
+                        continue
+
+                    line = '\n'.join(record)
+                    quotes = record_quotes
+                    record = None
+                elif quotes % 2 == 1:
+                    record = [line]
+                    record_quotes = quotes
+                    continue
+
+                if line.endswith('\r'):
+                    line = line[:-1]
+
+                if not line:
+                    continue
+
+                if columns is None:
+                    self.header = parse_row(line)
+                    columns = len(self.header)
+                    quoted_size = columns * 2
+                    yield self.header
+                    continue
+
+                # When every field is quoted and no field contains a quote,
+                # the fields are exactly the text between the '","'
+                # separators, which avoids the csv module entirely.
+                if quotes == quoted_size and \
+                    line[0] == '"' and line[-1] == '"':
+                    row = line[1:-1].split('","')
+                    if len(row) == columns:
+                        self.rows += 1
+                        yield tuple(row)
+                        continue
+
+                self.rows += 1
+                yield parse_row(line)
+
+        # Unterminated quoted field at the end of the data
+        if record is not None:
+            self.rows += 1
+            yield parse_row('\n'.join(record))
@@ -8,6 +8,7 @@ from .auth import \
 from . import cache, newrelic
 from .config import Config
 from .instance import Instance
+from . import integration
 from .integration import Integration
 from .pipeline import Pipeline
 from .telemetry import print_info, Telemetry
@@ -24,6 +25,7 @@ class Factory:
         self,
         instance_config: Config,
         backend_factory: cache.BackendFactory,
+        namespace: str = '',
     ) -> cache.DataCache:
         if not instance_config.get_bool(
             cache.CONFIG_CACHE_ENABLED,
@@ -37,10 +39,32 @@ class Factory:
         try:
             return cache.DataCache(
                 backend_factory.new_backend(instance_config),
-                instance_config.get_int(
-                    cache.CONFIG_REDIS_EXPIRE_DAYS,
-                    cache.DEFAULT_REDIS_EXPIRE_DAYS,
-                )
+                cache.get_expire_days(instance_config),
+                instance_config.get_bool(
+                    cache.CONFIG_REDIS_WRITE_BEHIND,
+                    cache.DEFAULT_REDIS_WRITE_BEHIND,
+                ),
+                instance_config.get_bool(
+                    cache.CONFIG_REDIS_BATCH_LOOKUPS,
+                    cache.DEFAULT_REDIS_BATCH_LOOKUPS,
+                ),
+                instance_config.get(
+                    cache.CONFIG_CACHE_KEY_LAYOUT,
+                    cache.DEFAULT_CACHE_KEY_LAYOUT,
+                ),
+                namespace,
+                instance_config.get_bool(
+                    cache.CONFIG_CACHE_DIGESTS,
+                    cache.DEFAULT_CACHE_DIGESTS,
+                ),
+                instance_config.get_bool(
+                    cache.CONFIG_CACHE_HOURLY_FILE_MARKERS,
+                    cache.DEFAULT_CACHE_HOURLY_FILE_MARKERS,
+                ),
+                instance_config.get_bool(
+                    cache.CONFIG_CACHE_LOG_FILE_CHECKPOINTS,
+                    cache.DEFAULT_CACHE_LOG_FILE_CHECKPOINTS,
+                ),
             )
         except Exception as e:
             raise CacheException(f'failed creating backend: {e}')
@@ -78,7 +102,7 @@ class Factory:
         new_relic: newrelic.NewRelic,
         data_format: DataFormat,
         labels: dict,
-        numeric_fields_list: set,
+        numeric_fields_mapping: dict,
     ) -> Pipeline:
         return Pipeline(
             config,
@@ -86,7 +110,7 @@ class Factory:
             new_relic,
             data_format,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
     def new_instance(
@@ -98,11 +122,12 @@ class Factory:
         new_relic: newrelic.NewRelic,
         receivers: list[callable],
         labels: dict,
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
     ) -> Instance:
         data_cache = factory.new_data_cache(
             instance_config,
             factory.new_backend_factory(),
+            instance_name,
         )
 
         api = factory.new_api(
@@ -116,14 +141,15 @@ class Factory:
             new_relic,
             data_format,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
         for r in receivers:
             p.add_receiver(r(
                 instance_config,
                 data_cache,
-                api
+                api,
+                instance_name,
             ))
 
         return Instance(
@@ -137,7 +163,7 @@ class Factory:
         factory,
         config: Config,
         receivers: list[callable],
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
         instance_index: int = None
     ):
         if not 'instances' in config or len(config['instances']) == 0:
@@ -151,6 +177,19 @@ class Factory:
         else:
             raise ConfigException(f'invalid data format {data_format}')
 
+        execution_mode = config.get(
+            integration.CONFIG_EXECUTION_MODE,
+            integration.DEFAULT_EXECUTION_MODE,
+        ).lower()
+        if not execution_mode in [
+            integration.EXECUTION_MODE_SYNC,
+            integration.EXECUTION_MODE_THREADS,
+        ]:
+            raise ConfigException(
+                integration.CONFIG_EXECUTION_MODE,
+                f'invalid execution mode {execution_mode}',
+            )
+
         new_relic = factory.new_new_relic(config, data_format)
         telemetry = factory.new_telemetry(config, new_relic)
         instances = []
@@ -176,7 +215,7 @@ class Factory:
                 new_relic,
                 receivers,
                 labels,
-                numeric_fields_list,
+                numeric_fields_mapping,
             ))
         
         # Either create an integration with all instance or a single instance.
@@ -187,7 +226,19 @@ class Factory:
             i = config['instances'][instance_index]
             append_instance(i, instance_index)
 
-        return Integration(telemetry, instances)
+        return Integration(
+            telemetry,
+            instances,
+            execution_mode,
+            config.get_int(
+                integration.CONFIG_MAX_CONCURRENT_INSTANCES,
+                integration.DEFAULT_MAX_CONCURRENT_INSTANCES,
+            ),
+            config.get_int(
+                integration.CONFIG_MAX_CONCURRENT_UPLOADS,
+                integration.DEFAULT_MAX_CONCURRENT_UPLOADS,
+            ),
+        )
 
     def new_new_relic(self, config: Config, data_format: DataFormat):
         license_key = config.get(
@@ -1,3 +1,4 @@
+from concurrent.futures import Executor
 from requests import Session
 
 
@@ -23,3 +24,16 @@ class Instance:
     ) -> None:
         self.api.authenticate(session)
         self.pipeline.execute(session)
+
+    def harvest_threads(
+        self,
+        session: Session,
+        upload_executor: Executor,
+        max_pending_uploads: int,
+    ) -> None:
+        self.api.authenticate(session)
+        self.pipeline.execute_threads(
+            session,
+            upload_executor,
+            max_pending_uploads,
+        )
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from requests import Session
 
 
@@ -11,14 +12,30 @@ from .telemetry import print_info, print_err, Telemetry
 from .http_session import new_retry_session
 
 
+CONFIG_EXECUTION_MODE = 'execution_mode'
+CONFIG_MAX_CONCURRENT_INSTANCES = 'max_concurrent_instances'
+CONFIG_MAX_CONCURRENT_UPLOADS = 'max_concurrent_uploads'
+EXECUTION_MODE_SYNC = 'sync'
+EXECUTION_MODE_THREADS = 'threads'
+DEFAULT_EXECUTION_MODE = EXECUTION_MODE_SYNC
+DEFAULT_MAX_CONCURRENT_INSTANCES = 4
+DEFAULT_MAX_CONCURRENT_UPLOADS = 2
+
+
 class Integration:
     def __init__(
         self,
         telemetry: Telemetry,
         instances: list[instance.Instance],
+        execution_mode: str = DEFAULT_EXECUTION_MODE,
+        max_concurrent_instances: int = DEFAULT_MAX_CONCURRENT_INSTANCES,
+        max_concurrent_uploads: int = DEFAULT_MAX_CONCURRENT_UPLOADS,
     ):
         self.telemetry = telemetry
         self.instances = instances
+        self.execution_mode = execution_mode
+        self.max_concurrent_instances = max_concurrent_instances
+        self.max_concurrent_uploads = max_concurrent_uploads
 
     def process_telemetry(self, session: Session):
         if self.telemetry.is_empty():
@@ -28,14 +45,54 @@ class Integration:
         print_info("Sending telemetry data")
         self.telemetry.flush(session)
 
-    def run(self):
+    def run_sync(self):
         session = new_retry_session()
 
+        for instance in self.instances:
+            print_info(f'Running instance "{instance.name}"')
+            instance.harvest(session)
+            self.process_telemetry(session)
+
+    def run_threads(self):
+        # The I/O is still blocking. Instances are harvested on a pool of
+        # threads and the batches of all instances are uploaded on a shared
+        # pool of upload threads.
+        def harvest(instance):
+            print_info(f'Running instance "{instance.name}"')
+            # Each instance gets its own session so that connections are not
+            # shared between instances running at the same time.
+            instance.harvest_threads(
+                new_retry_session(),
+                upload_executor,
+                self.max_concurrent_uploads,
+            )
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrent_uploads,
+            thread_name_prefix='sfexp-upload',
+        ) as upload_executor:
+            with ThreadPoolExecutor(
+                max_workers=self.max_concurrent_instances,
+                thread_name_prefix='sfexp-instance',
+            ) as executor:
+                futures = [
+                    executor.submit(harvest, instance) \
+                        for instance in self.instances
+                ]
+
+        self.process_telemetry(new_retry_session())
+
+        for future in futures:
+            if future.exception():
+                raise future.exception()
+
+    def run(self):
         try:
-            for instance in self.instances:
-                print_info(f'Running instance "{instance.name}"')
-                instance.harvest(session)
-                self.process_telemetry(session)
+            if self.execution_mode == EXECUTION_MODE_THREADS:
+                self.run_threads()
+                return
+
+            self.run_sync()
         except LoginException as e:
             print_err(f'authentication failed: {e}')
             raise e
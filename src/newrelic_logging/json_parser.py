@@ -0,0 +1,137 @@
+import codecs
+import json
+
+
+DEFAULT_READ_SIZE = 64 * 1024
+DEFAULT_ENCODING = 'utf-8'
+WHITESPACE = ' \t\n\r'
+# Characters that can follow the part of a number decoded so far and still
+# belong to the number, like the fraction after 1948 in 1948.5
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class JsonRecordsParser:
+    def __init__(
+        self,
+        read: callable,
+        read_size: int = DEFAULT_READ_SIZE,
+        encoding: str = DEFAULT_ENCODING,
+    ):
+        # read is called with a number of bytes and returns at most that many
+        # bytes of a JSON object, or an empty bytes object once all data has
+        # been read.
+        #
+        # Iterating the parser yields each element of the records array of the
+        # object as soon as it has been read. All other fields of the object
+        # are kept in fields, which is complete once the iteration is done.
+        # has_records is True if the object has a records array.
+        self.read = read
+        self.read_size = max(read_size, 1)
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder(encoding)()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.fields = {}
+        self.has_records = False
+
+    def fill(self, size: int) -> bool:
+        # Reads until at least size characters are buffered after the current
+        # position. Returns False if the data ends first.
+        while len(self.buf) - self.pos < size and not self.eof:
+            data = self.read(self.read_size)
+
+            if self.pos > 0:
+                self.buf = self.buf[self.pos:]
+                self.pos = 0
+
+            if not data:
+                self.eof = True
+                self.buf += self.text.decode(b'', final=True)
+                break
+
+            self.buf += self.text.decode(data)
+
+        return len(self.buf) - self.pos >= size
+
+    def next_char(self) -> str:
+        # Skips whitespace and returns the next character without consuming
+        # it.
+        while True:
+            if not self.fill(1):
+                raise json.JSONDecodeError(
+                    'Unexpected end of data',
+                    self.buf,
+                    self.pos,
+                )
+
+            c = self.buf[self.pos]
+            if not c in WHITESPACE:
+                return c
+
+            self.pos += 1
+
+    def expect(self, chars: str) -> str:
+        c = self.next_char()
+        if not c in chars:
+            raise json.JSONDecodeError(
+                f'Expecting one of {chars}',
+                self.buf,
+                self.pos,
+            )
+
+        self.pos += 1
+        return c
+
+    def decode_value(self):
+        self.next_char()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+
+                # A number may continue in the next read, even after a part
+                # that decodes on its own like 1948 of 1948.5, so values are
+                # only complete if something that can not be part of a number
+                # follows them.
+                if self.eof or (
+                    end < len(self.buf) and not self.buf[end] in NUMBER_CHARS
+                ):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            # Read at least as much again as is buffered so that a large value
+            # is not decoded again for every read.
+            self.fill(max(2 * (len(self.buf) - self.pos), self.read_size))
+
+    def __iter__(self):
+        self.expect('{')
+
+        if self.next_char() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.decode_value()
+            self.expect(':')
+
+            if key == 'records' and self.next_char() == '[':
+                self.pos += 1
+                self.has_records = True
+
+                if self.next_char() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self.decode_value()
+
+                        if self.expect(',]') == ']':
+                            break
+            else:
+                self.fields[key] = self.decode_value()
+
+            if self.expect(',}') == '}':
+                return
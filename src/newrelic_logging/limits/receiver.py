@@ -84,7 +84,7 @@ class LimitsReceiver:
 
 
 def new_create_receiver_func() -> callable:
-    return lambda instance_config, data_cache, api : LimitsReceiver(
+    return lambda instance_config, data_cache, api, instance_name = '' : LimitsReceiver(
         api,
         Config(instance_config['limits']) \
             if 'limits' in instance_config \
@@ -1,6 +1,6 @@
 from enum import Enum
-import gzip
 import json
+import zlib
 from requests import RequestException, Session
 
 from . import \
@@ -8,7 +8,8 @@ from . import \
     NAME, \
     PROVIDER, \
     COLLECTOR_NAME, \
-    NewRelicApiException
+    NewRelicApiException, \
+    PayloadTooLargeException
 from .config import Config
 
 
@@ -26,6 +27,13 @@ FEDRAMP_EVENTS_ENDPOINT = 'https://gov-insights-collector.newrelic.com/v1/accoun
 
 CONTENT_ENCODING = 'gzip'
 MAX_EVENTS = 2000
+MAX_PAYLOAD_BYTES = 1000000
+HTTP_PAYLOAD_TOO_LARGE = 413
+# Window bits value that makes zlib write a gzip header and trailer.
+GZIP_WBITS = zlib.MAX_WBITS | 16
+# Number of uncompressed bytes after which the compressor is flushed so that
+# the running compressed size never lags far behind the data written.
+FLUSH_INTERVAL = 64 * 1024
 
 
 class Region(Enum):
@@ -80,6 +88,136 @@ def get_events_endpoint(region: str, account_id: str) -> str:
     return US_EVENTS_ENDPOINT.format(account_id=account_id)
 
 
+def add_log_attributes(log: dict) -> None:
+    if not 'attributes' in log:
+        log['attributes'] = {}
+    log['attributes']['instrumentation.name'] = NAME
+    log['attributes']['instrumentation.provider'] = PROVIDER
+    log['attributes']['instrumentation.version'] = VERSION
+    log['attributes']['collector.name'] = COLLECTOR_NAME
+
+
+def add_event_attributes(event: dict) -> None:
+    event['instrumentation.name'] = NAME
+    event['instrumentation.provider'] = PROVIDER
+    event['instrumentation.version'] = VERSION
+    event['collector.name'] = COLLECTOR_NAME
+
+
+class PayloadEncoder:
+    def __init__(
+        self,
+        prefix: bytes = b'[',
+        suffix: bytes = b']',
+        decorate: callable = None,
+    ):
+        # Records are written into the compressor as they are added so a
+        # pending payload is only ever held in memory in compressed form.
+        self.prefix = prefix
+        self.suffix = suffix
+        self.decorate = decorate
+        self.compressor = zlib.compressobj(wbits=GZIP_WBITS)
+        self.chunks = []
+        self.count = 0
+        self.size = 0
+        self.compressed_size = 0
+        self.pending_size = 0
+        self.payload = None
+        self.write(prefix)
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        self.pending_size += len(data)
+        self.emit(self.compressor.compress(data))
+
+        if self.pending_size >= FLUSH_INTERVAL:
+            self.emit(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def emit(self, data: bytes) -> None:
+        if not data:
+            return
+
+        self.chunks.append(data)
+        self.compressed_size += len(data)
+        self.pending_size = 0
+
+    def encode(self, record: dict) -> bytes:
+        if self.decorate:
+            self.decorate(record)
+
+        return json.dumps(record).encode()
+
+    def append(self, data: bytes) -> None:
+        if self.count > 0:
+            self.write(b',')
+
+        self.write(data)
+        self.count += 1
+
+    def add(self, record: dict) -> None:
+        self.append(self.encode(record))
+
+    def compression_ratio(self) -> float:
+        written = self.size - self.pending_size
+        if not self.compressed_size or not written:
+            return None
+
+        return self.compressed_size / written
+
+    def estimate_compressed_size(
+        self,
+        size: int = 0,
+        compression_ratio: float = 1.0,
+    ) -> float:
+        # The compressed size so far plus an estimate for the bytes still
+        # buffered in the compressor and the given number of bytes about to
+        # be written. The ratio seen so far is used when there is one.
+        ratio = self.compression_ratio() or compression_ratio
+        return self.compressed_size + (self.pending_size + size) * ratio
+
+    def finish(self) -> bytes:
+        if self.payload is None:
+            self.write(self.suffix)
+            self.emit(self.compressor.flush())
+            self.payload = b''.join(self.chunks)
+            self.chunks = []
+
+        return self.payload
+
+    def records(self) -> list[dict]:
+        data = zlib.decompress(self.finish(), GZIP_WBITS)
+
+        return json.loads(
+            b'[' + data[len(self.prefix):len(data) - len(self.suffix)] + b']'
+        )
+
+    def split(self):
+        records = self.records()
+        middle = len(records) // 2
+        halves = []
+
+        for part in [records[:middle], records[middle:]]:
+            encoder = PayloadEncoder(self.prefix, self.suffix, self.decorate)
+            for record in part:
+                encoder.add(record)
+
+            halves.append(encoder)
+
+        return halves[0], halves[1]
+
+
+def new_logs_encoder(common: dict) -> PayloadEncoder:
+    return PayloadEncoder(
+        b'[{"common": ' + json.dumps(common).encode() + b', "logs": [',
+        b']}]',
+        add_log_attributes,
+    )
+
+
+def new_events_encoder() -> PayloadEncoder:
+    return PayloadEncoder(b'[', b']', add_event_attributes)
+
+
 class NewRelic:
     def __init__(
         self,
@@ -91,20 +229,17 @@ class NewRelic:
         self.logs_api_endpoint = logs_api_endpoint
         self.events_api_endpoint = events_api_endpoint
 
-    def post_logs(self, session: Session, data: list[dict]) -> None:
-        # Append integration attributes
-        for log in data[0]['logs']:
-            if not 'attributes' in log:
-                log['attributes'] = {}
-            log['attributes']['instrumentation.name'] = NAME
-            log['attributes']['instrumentation.provider'] = PROVIDER
-            log['attributes']['instrumentation.version'] = VERSION
-            log['attributes']['collector.name'] = COLLECTOR_NAME
+    def post_logs_payload(
+        self,
+        session: Session,
+        encoder: PayloadEncoder,
+    ) -> tuple[int, int]:
+        compressed_payload = encoder.finish()
 
         try:
             r = session.post(
                 self.logs_api_endpoint,
-                data=gzip.compress(json.dumps(data).encode()),
+                data=compressed_payload,
                 headers={
                     'X-License-Key': self.license_key,
                     'X-Event-Source': LOGS_EVENT_SOURCE,
@@ -112,6 +247,11 @@ class NewRelic:
                 },
             )
 
+            if r.status_code == HTTP_PAYLOAD_TOO_LARGE:
+                raise PayloadTooLargeException(
+                    f'newrelic logs api rejected payload of {len(compressed_payload)} bytes'
+                )
+
             if r.status_code != 202:
                 raise NewRelicApiException(
                     f'newrelic logs api returned code {r.status_code}'
@@ -121,37 +261,62 @@ class NewRelic:
         except RequestException:
             raise NewRelicApiException('newrelic logs api request failed')
 
-    def post_events(self, session: Session, events: list[dict]) -> None:
-        # Append integration attributes
-        for event in events:
-            event['instrumentation.name'] = NAME
-            event['instrumentation.provider'] = PROVIDER
-            event['instrumentation.version'] = VERSION
-            event['collector.name'] = COLLECTOR_NAME
-
-        # This funky code produces an array of arrays where each one will be at most
-        # length 2000 with the last one being <= 2000. This is done to account for
-        # the fact that only 2000 events can be posted at a time.
-
-        slices = [events[i:(i + MAX_EVENTS)] \
-            for i in range(0, len(events), MAX_EVENTS)]
-
-        for slice in slices:
-            try:
-                r = session.post(
-                    self.events_api_endpoint,
-                    data=gzip.compress(json.dumps(slice).encode()),
-                    headers={
-                        'Api-Key': self.license_key,
-                        'Content-Encoding': CONTENT_ENCODING,
-                    },
+        return encoder.size, encoder.compressed_size
+
+    def post_logs(self, session: Session, data: list[dict]) -> tuple[int, int]:
+        encoder = new_logs_encoder(data[0]['common'])
+        for log in data[0]['logs']:
+            encoder.add(log)
+
+        return self.post_logs_payload(session, encoder)
+
+    def post_events_payload(
+        self,
+        session: Session,
+        encoder: PayloadEncoder,
+    ) -> tuple[int, int]:
+        compressed_payload = encoder.finish()
+
+        try:
+            r = session.post(
+                self.events_api_endpoint,
+                data=compressed_payload,
+                headers={
+                    'Api-Key': self.license_key,
+                    'Content-Encoding': CONTENT_ENCODING,
+                },
+            )
+
+            if r.status_code == HTTP_PAYLOAD_TOO_LARGE:
+                raise PayloadTooLargeException(
+                    f'newrelic events api rejected payload of {len(compressed_payload)} bytes'
+                )
+
+            if r.status_code != 200:
+                raise NewRelicApiException(
+                    f'newrelic events api returned code {r.status_code}'
                 )
 
-                if r.status_code != 200:
-                    raise NewRelicApiException(
-                        f'newrelic events api returned code {r.status_code}'
-                    )
+            response = r.content.decode("utf-8")
+        except RequestException:
+            raise NewRelicApiException('newrelic events api request failed')
+
+        return encoder.size, encoder.compressed_size
+
+    def post_events(self, session: Session, events: list[dict]) -> tuple[int, int]:
+        # Only 2000 events can be posted at a time so the events are sent in
+        # slices of at most that many.
+
+        size = compressed_size = 0
+
+        for i in range(0, len(events), MAX_EVENTS):
+            encoder = new_events_encoder()
+            for event in events[i:(i + MAX_EVENTS)]:
+                encoder.add(event)
+
+            sizes = self.post_events_payload(session, encoder)
+
+            size += sizes[0]
+            compressed_size += sizes[1]
 
-                response = r.content.decode("utf-8")
-            except RequestException:
-                raise NewRelicApiException('newrelic events api request failed')
+        return size, compressed_size
@@ -1,17 +1,119 @@
+from concurrent.futures import Executor
 import gc
 from requests import Session
+import threading
 
-from . import DataFormat
+from . import DataFormat, PayloadTooLargeException
 from .cache import DataCache
+from .concurrency import map_ordered
 from .config import Config
 from .http_session import new_retry_session
-from .newrelic import NewRelic
-from .telemetry import print_info
-from .util import maybe_convert_str_to_num
+from .newrelic import \
+    NewRelic, \
+    PayloadEncoder, \
+    new_events_encoder, \
+    new_logs_encoder, \
+    MAX_EVENTS, \
+    MAX_PAYLOAD_BYTES
+from .schema import CodecCache
+from .telemetry import print_info, print_warn
+
+
+DEFAULT_MAX_ROWS = None
+MAX_ROWS = 2000
+DEFAULT_MAX_PAYLOAD_BYTES = MAX_PAYLOAD_BYTES
+# Fraction of the payload limit that batches are filled up to. The compressed
+# size of a batch is only an estimate until the compressor is flushed.
+PAYLOAD_FILL_RATIO = 0.9
+# The compression ratio assumed before any payload has been sent. Starting at
+# 1 means the first batch can never exceed the limit.
+INITIAL_COMPRESSION_RATIO = 1.0
+MIN_COMPRESSION_RATIO = 0.01
 
 
-DEFAULT_MAX_ROWS = 1000
-MAX_ROWS = 2000
+class PayloadBatcher:
+    def __init__(
+        self,
+        new_encoder: callable = new_events_encoder,
+        max_rows: int = DEFAULT_MAX_ROWS,
+        max_payload_bytes: int = DEFAULT_MAX_PAYLOAD_BYTES,
+    ):
+        self.new_encoder = new_encoder
+        self.max_rows = max_rows
+        self.max_payload_bytes = max_payload_bytes * PAYLOAD_FILL_RATIO
+        self.compression_ratio = INITIAL_COMPRESSION_RATIO
+        # Batches may be sent from several upload threads at once
+        self.lock = threading.Lock()
+
+    def observe(self, size: int, compressed_size: int) -> None:
+        # Keep a moving average of the compression ratio of the payloads
+        # actually sent. It is used for a new batch until the encoder has
+        # compressed enough data to know its own ratio.
+        if not size or not compressed_size:
+            return
+
+        with self.lock:
+            self.compression_ratio = max(
+                (self.compression_ratio + compressed_size / size) / 2,
+                MIN_COMPRESSION_RATIO,
+            )
+
+    def batches(self, iter):
+        # Yields payload encoders holding the compressed rows of each batch.
+        encoder = self.new_encoder()
+
+        for row in iter:
+            data = encoder.encode(row)
+
+            # +1 for the separator between rows in the JSON array
+            if encoder.count > 0 and (
+                encoder.count == self.max_rows or
+                encoder.estimate_compressed_size(
+                    len(data) + 1,
+                    self.compression_ratio,
+                ) > self.max_payload_bytes
+            ):
+                yield encoder
+
+                encoder = self.new_encoder()
+
+            encoder.append(data)
+
+        if encoder.count > 0:
+            yield encoder
+
+    def send(self, send: callable, encoder: PayloadEncoder) -> int:
+        # Sends the encoded rows using the given callable. If the payload is
+        # rejected for being too large, the rows are split in half and each
+        # half is sent separately until they are accepted. Returns the number
+        # of rows that were sent.
+
+        try:
+            sizes = send(encoder)
+            if sizes:
+                self.observe(*sizes)
+
+            return encoder.count
+        except PayloadTooLargeException as e:
+            if encoder.count == 1:
+                print_warn(f'dropping record that is too large to send: {e}')
+                return 0
+
+            print_info(
+                f'payload with {encoder.count} records too large, splitting and retrying'
+            )
+
+            # The estimate was clearly too low so be more conservative from
+            # now on.
+            with self.lock:
+                self.compression_ratio = min(
+                    self.compression_ratio * 2,
+                    1.0,
+                )
+
+            first, second = encoder.split()
+
+            return self.send(send, first) + self.send(send, second)
 
 
 def load_as_logs(
@@ -19,38 +121,35 @@ def load_as_logs(
     new_relic: NewRelic,
     labels: dict,
     max_rows: int,
+    max_payload_bytes: int = DEFAULT_MAX_PAYLOAD_BYTES,
+    on_sent: callable = None,
 ) -> None:
+    # on_sent is called with the number of logs in each batch once the batch
+    # has been sent.
     nr_session = new_retry_session()
+    batcher = PayloadBatcher(
+        lambda : new_logs_encoder(labels),
+        max_rows,
+        max_payload_bytes,
+    )
+    total = 0
 
-    logs = []
-    count = total = 0
+    for logs in batcher.batches(iter):
+        count = batcher.send(
+            lambda encoder : new_relic.post_logs_payload(nr_session, encoder),
+            logs,
+        )
 
-    def send_logs():
-        nonlocal logs
-        nonlocal count
+        print_info(f'Sent {count} log messages.')
 
-        new_relic.post_logs(nr_session, [{'common': labels, 'logs': logs}])
+        total += count
 
-        print_info(f'Sent {count} log messages.')
+        if on_sent:
+            on_sent(logs.count)
 
         # Attempt to release memory
         del logs
 
-        logs = []
-        count = 0
-
-    for log in iter:
-        if count == max_rows:
-            send_logs()
-
-        logs.append(log)
-
-        count += 1
-        total += 1
-
-    if len(logs) > 0:
-        send_logs()
-
     print_info(f'Sent a total of {total} log messages.')
 
     # Attempt to reclaim memory
@@ -60,21 +159,20 @@ def load_as_logs(
 def pack_log_into_event(
     log: dict,
     labels: dict,
-    numeric_fields_list: set,
+    numeric_fields_mapping: dict,
+    codecs: CodecCache = None,
 ) -> dict:
-    log_event = {}
-
     attributes = log['attributes']
-    for key in attributes:
-        value = attributes[key]
 
-        if key in numeric_fields_list:
-            log_event[key] = \
-                maybe_convert_str_to_num(value) if value \
-                else 0
-            continue
+    if not codecs:
+        codecs = CodecCache(numeric_fields_mapping)
 
-        log_event[key] = value
+    # Log lines of the same event type nearly always have the same fields so
+    # the conversions are compiled once per event type and set of fields.
+    log_event = codecs.get(
+        attributes.get('EVENT_TYPE'),
+        tuple(attributes),
+    ).decode(attributes)
 
     log_event.update(labels)
     log_event['eventType'] = log_event.get('EVENT_TYPE', "UnknownSFEvent")
@@ -82,48 +180,55 @@ def pack_log_into_event(
     return log_event
 
 
+def get_max_events(max_rows: int) -> int:
+    return min(max_rows, MAX_EVENTS) if max_rows else MAX_EVENTS
+
+
 def load_as_events(
     iter,
     new_relic: NewRelic,
     labels: dict,
     max_rows: int,
-    numeric_fields_list: set,
+    numeric_fields_mapping: dict,
+    max_payload_bytes: int = DEFAULT_MAX_PAYLOAD_BYTES,
+    codecs: CodecCache = None,
+    on_sent: callable = None,
 ) -> None:
+    # on_sent is called with the number of events in each batch once the
+    # batch has been sent.
     nr_session = new_retry_session()
+    codecs = codecs or CodecCache(numeric_fields_mapping)
+    batcher = PayloadBatcher(
+        new_events_encoder,
+        get_max_events(max_rows),
+        max_payload_bytes,
+    )
+    total = 0
 
-    events = []
-    count = total = 0
-
-    def send_events():
-        nonlocal events
-        nonlocal count
+    events = (
+        pack_log_into_event(
+            log_entry,
+            labels,
+            numeric_fields_mapping,
+            codecs,
+        ) for log_entry in iter
+    )
 
-        new_relic.post_events(nr_session, events)
+    for batch in batcher.batches(events):
+        count = batcher.send(
+            lambda encoder : new_relic.post_events_payload(nr_session, encoder),
+            batch,
+        )
 
         print_info(f'Sent {count} events.')
 
-        # Attempt to release memory
-        del events
-
-        events = []
-        count = 0
-
+        total += count
 
-    for log_entry in iter:
-        if count == max_rows:
-            send_events()
+        if on_sent:
+            on_sent(batch.count)
 
-        events.append(pack_log_into_event(
-            log_entry,
-            labels,
-            numeric_fields_list,
-        ))
-
-        count += 1
-        total += 1
-
-    if len(events) > 0:
-        send_events()
+        # Attempt to release memory
+        del batch
 
     print_info(f'Sent a total of {total} events.')
 
@@ -137,7 +242,10 @@ def load_data(
     data_format: DataFormat,
     labels: dict,
     max_rows: int,
-    numeric_fields_list: set,
+    numeric_fields_mapping: dict,
+    max_payload_bytes: int = DEFAULT_MAX_PAYLOAD_BYTES,
+    codecs: CodecCache = None,
+    on_sent: callable = None,
 ):
     if data_format == DataFormat.LOGS:
         load_as_logs(
@@ -145,6 +253,8 @@ def load_data(
             new_relic,
             labels,
             max_rows,
+            max_payload_bytes,
+            on_sent,
         )
         return
 
@@ -153,7 +263,10 @@ def load_data(
         new_relic,
         labels,
         max_rows,
-        numeric_fields_list,
+        numeric_fields_mapping,
+        max_payload_bytes,
+        codecs,
+        on_sent,
     )
 
 
@@ -165,17 +278,24 @@ class Pipeline:
         new_relic: NewRelic,
         data_format: DataFormat,
         labels: dict,
-        numeric_fields_list: set,
+        numeric_fields_mapping: dict,
     ):
         self.config = config
         self.data_cache = data_cache
         self.new_relic = new_relic
         self.data_format = data_format
         self.labels = labels
-        self.numeric_fields_list = numeric_fields_list
-        self.max_rows = min(
-            self.config.get('max_rows', DEFAULT_MAX_ROWS),
-            MAX_ROWS,
+        self.numeric_fields_mapping = numeric_fields_mapping
+        self.codecs = CodecCache(numeric_fields_mapping)
+        max_rows = self.config.get_int('max_rows', DEFAULT_MAX_ROWS)
+        self.max_rows = min(max_rows, MAX_ROWS) if max_rows \
+            else DEFAULT_MAX_ROWS
+        self.max_payload_bytes = min(
+            self.config.get_int(
+                'max_payload_bytes',
+                DEFAULT_MAX_PAYLOAD_BYTES,
+            ),
+            MAX_PAYLOAD_BYTES,
         )
         self.receivers = []
 
@@ -185,6 +305,20 @@ class Pipeline:
     def yield_all(
         self,
         session: Session,
+    ):
+        # The logs handed over by the receivers are counted so that they can
+        # be told once the logs they handed over have been delivered.
+        if self.data_cache:
+            yield from self.data_cache.track_delivery(
+                self.execute_receivers(session),
+            )
+            return
+
+        yield from self.execute_receivers(session)
+
+    def execute_receivers(
+        self,
+        session: Session,
     ):
         for receiver in self.receivers:
             yield from receiver.execute(session)
@@ -199,5 +333,134 @@ class Pipeline:
             self.data_format,
             self.labels,
             self.max_rows,
-            self.numeric_fields_list,
+            self.numeric_fields_mapping,
+            self.max_payload_bytes,
+            self.codecs,
+            self.data_cache.set_delivered if self.data_cache else None,
         )
+
+        # Make sure everything flushed to the cache has been written before
+        # the run ends.
+        if self.data_cache:
+            self.data_cache.wait()
+
+        self.checkpoint()
+
+    def checkpoint(self) -> None:
+        # Records the progress of the run once everything it harvested has
+        # been sent: the markers of the log files that were read and the
+        # query watermarks.
+        if self.data_cache:
+            self.data_cache.write_log_file_markers()
+
+        for receiver in self.receivers:
+            if hasattr(receiver, 'save_watermarks'):
+                receiver.save_watermarks()
+
+    def new_batcher(self) -> PayloadBatcher:
+        if self.data_format == DataFormat.LOGS:
+            return PayloadBatcher(
+                lambda : new_logs_encoder(self.labels),
+                self.max_rows,
+                self.max_payload_bytes,
+            )
+
+        return PayloadBatcher(
+            new_events_encoder,
+            get_max_events(self.max_rows),
+            self.max_payload_bytes,
+        )
+
+    def pack(self, iter):
+        if self.data_format == DataFormat.LOGS:
+            yield from iter
+            return
+
+        for log in iter:
+            yield pack_log_into_event(
+                log,
+                self.labels,
+                self.numeric_fields_mapping,
+                self.codecs,
+            )
+
+    def send(
+        self,
+        nr_session: Session,
+        batcher: PayloadBatcher,
+        batch: PayloadEncoder,
+    ) -> None:
+        if self.data_format == DataFormat.LOGS:
+            count = batcher.send(
+                lambda encoder : self.new_relic.post_logs_payload(
+                    nr_session,
+                    encoder,
+                ),
+                batch,
+            )
+
+            print_info(f'Sent {count} log messages.')
+            return
+
+        count = batcher.send(
+            lambda encoder : self.new_relic.post_events_payload(
+                nr_session,
+                encoder,
+            ),
+            batch,
+        )
+
+        print_info(f'Sent {count} events.')
+
+    def execute_threads(
+        self,
+        session: Session,
+        upload_executor: Executor,
+        max_pending_uploads: int,
+    ):
+        # Batches are harvested on this thread and each one is uploaded on the
+        # upload executor, which lets the next batch be harvested while the
+        # previous ones are being sent. Batches may finish uploading in any
+        # order but are reported as delivered in the order they were
+        # harvested.
+        #
+        # Sessions are not thread-safe so each upload thread gets its own,
+        # which it keeps for the rest of the run to reuse its connections.
+
+        local = threading.local()
+        nr_sessions = []
+        batcher = self.new_batcher()
+        total = 0
+
+        def upload(batch: PayloadEncoder) -> int:
+            if not hasattr(local, 'nr_session'):
+                local.nr_session = new_retry_session()
+                nr_sessions.append(local.nr_session)
+
+            self.send(local.nr_session, batcher, batch)
+            return batch.count
+
+        for count in map_ordered(
+            upload_executor,
+            upload,
+            batcher.batches(self.pack(self.yield_all(session))),
+            max_pending_uploads,
+        ):
+            total += count
+
+            if self.data_cache:
+                self.data_cache.set_delivered(count)
+
+        # All uploads have finished by now so no session is still in use
+        for nr_session in nr_sessions:
+            nr_session.close()
+
+        if self.data_cache:
+            self.data_cache.wait()
+
+        self.checkpoint()
+
+        print_info(f'Sent a total of {total} records.')
+
+        # Attempt to reclaim memory
+        gc.collect()
@@ -1,12 +1,19 @@
 from copy import deepcopy
+from hashlib import blake2b
+import re
 from requests import Session
+import time
 
 
-from ..api import Api
+from .. import SalesforceApiException
+from ..api import Api, API_NAME_BULK, API_NAME_REST, DEFAULT_API_NAME
+from ..concurrency import merge_iterators
 from ..config import Config
+from ..csv_parser import DEFAULT_READ_SIZE
 from ..telemetry import print_info, print_warn
 from ..util import \
     get_iso_date_with_offset, \
+    is_logfile_response, \
     substitute
 
 
@@ -23,6 +30,132 @@ def has_more_records(response: dict) -> bool:
         not response['nextRecordsUrl'] == ''
 
 
+def get_query_key(query: str) -> str:
+    return blake2b(query.encode('utf-8'), digest_size=8).hexdigest()
+
+
+BULK_JOB_COMPLETE = 'JobComplete'
+BULK_JOB_FAILED = ['Failed', 'Aborted']
+DEFAULT_BULK_POLL_INTERVAL = 5
+DEFAULT_BULK_TIMEOUT = 3600
+DEFAULT_PREFETCH_PAGES = 0
+
+# Spaces in queries are replaced with + so both are matched as separators
+SELECT_PATTERN = re.compile(
+    r'^[+\s]*SELECT[+\s]+(.+?)[+\s]+FROM[+\s]+(\w+)',
+    re.IGNORECASE | re.DOTALL,
+)
+SUBQUERY_PATTERN = re.compile(r'\([+\s]*SELECT[+\s]', re.IGNORECASE)
+ORDER_BY_PATTERN = re.compile(
+    r'[+\s]+ORDER[+\s]+BY[+\s]+.*?(?=[+\s]+(?:LIMIT|OFFSET)[+\s]|$)',
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def get_count_query(query: str) -> str:
+    # Returns a query that counts the records returned by the given query, or
+    # None if the query has a subquery.
+    match = SELECT_PATTERN.match(query)
+    if not match or SUBQUERY_PATTERN.search(query):
+        return None
+
+    return ORDER_BY_PATTERN.sub(
+        '',
+        f'SELECT+COUNT()+FROM+{match.group(2)}{query[match.end():]}',
+    )
+
+
+def get_sobject_type(query: str) -> str:
+    match = SELECT_PATTERN.match(query)
+
+    return match.group(2) if match else None
+
+
+# The Bulk API returns datetimes in UTC with a Z suffix where the REST API
+# uses a +0000 offset.
+BULK_DATETIME_PATTERN = re.compile(
+    r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3})Z',
+)
+BULK_INT_FIELD_TYPES = set(['int', 'long'])
+BULK_FLOAT_FIELD_TYPES = set(['double', 'currency', 'percent'])
+
+
+def convert_bulk_value(value: str, field_type: str):
+    # Converts a value of the CSV results of a query job to the value the
+    # REST API returns for a field of the given type. The type is None for
+    # fields of related objects, whose datetimes are still converted.
+    if value == '':
+        return None
+
+    if field_type in BULK_INT_FIELD_TYPES:
+        return int(value)
+
+    if field_type in BULK_FLOAT_FIELD_TYPES:
+        return float(value)
+
+    if field_type == 'boolean':
+        return value == 'true'
+
+    if field_type is None or field_type == 'datetime':
+        match = BULK_DATETIME_PATTERN.fullmatch(value)
+        if match:
+            return f'{match.group(1)}+0000'
+
+    return value
+
+
+def get_field_types(describe: dict) -> dict:
+    return {
+        field['name']: field['type'] for field in describe.get('fields', [])
+    }
+
+
+def is_empty_record(record: dict) -> bool:
+    return all(
+        is_empty_record(value) if type(value) is dict else value is None \
+            for value in record.values()
+    )
+
+
+def bulk_records(rows, sobject_type: str, field_types: dict = {}):
+    # rows yields the header row followed by the values of each row of the
+    # CSV results of a query job. Yields each row as a record in the same
+    # form as the records returned by the REST API so that switching APIs
+    # changes neither the attributes sent to New Relic nor the record IDs.
+    # Values are converted using the field types of the queried object and
+    # the fields of related objects are nested in a record for the related
+    # object, which is null when all of its fields are.
+    header = None
+
+    for values in rows:
+        if header is None:
+            header = [field.split('.') for field in values]
+            continue
+
+        record = {}
+
+        for path, value in zip(header, values):
+            value = convert_bulk_value(
+                value,
+                field_types.get(path[0]) if len(path) == 1 else None,
+            )
+
+            parent = record
+            for name in path[:-1]:
+                parent = parent.setdefault(name, {})
+
+            parent[path[-1]] = value
+
+        for name, value in record.items():
+            if type(value) is dict and is_empty_record(value):
+                record[name] = None
+
+        if sobject_type:
+            record['attributes'] = { 'type': sobject_type }
+
+        yield record
+
+
 class Query:
     def __init__(
         self,
@@ -31,12 +164,20 @@ class Query:
         options: Config,
         api_ver: str = None,
         api_name: str = None,
+        key: str = None,
+        soql: str = None,
     ):
         self.api = api
         self.query = query
+        # soql is the text of the query as written, before spaces are replaced
+        # for the REST API URL. It is sent as is in Bulk API query jobs.
+        self.soql = soql if soql else query
         self.options = options
         self.api_ver = api_ver
         self.api_name = api_name
+        # key identifies the query across runs in cache keys, so it is built
+        # from the query before arguments are substituted.
+        self.key = key if key else get_query_key(query)
 
     def get(self, key: str, default = None):
         return self.options.get(key, default)
@@ -44,16 +185,124 @@ class Query:
     def get_config(self):
         return self.options
 
-    def execute(
+    def get_key(self) -> str:
+        return self.key
+
+    def is_bulk(self, session: Session) -> bool:
+        # Queries use the Bulk API when api_name is bulk or when bulk_threshold
+        # is set and the query returns at least that many records.
+        api_name = self.api_name.lower() if self.api_name \
+            else DEFAULT_API_NAME
+
+        if api_name == API_NAME_BULK:
+            return True
+
+        threshold = self.get('bulk_threshold')
+        if threshold is None or api_name != API_NAME_REST:
+            return False
+
+        count_query = get_count_query(self.query)
+        if not count_query:
+            print_warn(
+                f'can not count records for query {self.query}, not using bulk api'
+            )
+            return False
+
+        response = self.api.query(
+            session,
+            count_query,
+            self.api_ver,
+            self.api_name,
+        )
+
+        count = response.get('totalSize', 0) if response else 0
+
+        print_info(f'Query {self.query} returns {count} records')
+
+        return count >= int(threshold)
+
+    def wait_for_job(self, session: Session, job: dict) -> None:
+        job_id = job['id']
+        interval = float(
+            self.get('bulk_poll_interval', DEFAULT_BULK_POLL_INTERVAL),
+        )
+        deadline = time.monotonic() + float(
+            self.get('bulk_timeout', DEFAULT_BULK_TIMEOUT),
+        )
+
+        while job['state'] != BULK_JOB_COMPLETE:
+            if job['state'] in BULK_JOB_FAILED:
+                raise SalesforceApiException(
+                    -1,
+                    f'bulk query job {job_id} {job["state"].lower()}: ' \
+                    f'{job.get("errorMessage", "")}',
+                )
+
+            if time.monotonic() >= deadline:
+                raise SalesforceApiException(
+                    -1,
+                    f'timed out waiting for bulk query job {job_id}',
+                )
+
+            time.sleep(interval)
+
+            job = self.api.get_query_job(session, job_id, self.api_ver)
+
+    def execute_bulk(
         self,
         session: Session,
     ):
+        # The query is run as a Bulk API 2.0 query job and the results of the
+        # job are streamed as CSV once the job is complete.
+        job = self.api.create_query_job(
+            session,
+            self.soql,
+            self.api_ver,
+        )
+
+        print_info(f'Running bulk query job {job["id"]} for query {self.query}...')
+
+        self.wait_for_job(session, job)
+
+        sobject_type = get_sobject_type(self.query)
+        field_types = get_field_types(
+            self.api.describe_sobject(session, sobject_type, self.api_ver),
+        ) if sobject_type else {}
+        locator = None
+
+        while True:
+            rows, locator = self.api.get_query_job_results(
+                session,
+                job['id'],
+                DEFAULT_READ_SIZE,
+                locator,
+                self.get('bulk_max_records'),
+                self.api_ver,
+            )
+
+            yield from bulk_records(rows, sobject_type, field_types)
+
+            if not locator:
+                break
+
+            print_info(
+                f'Retrieving more bulk query job results using locator {locator}...'
+            )
+
+    def pages(
+        self,
+        session: Session,
+    ):
+        # Yields each page of results of the query
+        batch_size = self.get('batch_size')
+
         print_info(f'Running query {self.query}...')
         response = self.api.query(
             session,
             self.query,
             self.api_ver,
             self.api_name,
+            batch_size,
         )
 
         if not is_valid_records_response(response):
@@ -62,7 +311,7 @@ class Query:
 
         done = False
         while not done:
-            yield from response['records']
+            yield response
 
             if not has_more_records(response):
                 done = True
@@ -77,6 +326,7 @@ class Query:
             response = self.api.query_more(
                 session,
                 next_records_url,
+                batch_size,
             )
 
             if not is_valid_records_response(response):
@@ -85,6 +335,91 @@ class Query:
                 )
                 done = True
 
+    def stream_records(
+        self,
+        session: Session,
+    ):
+        # Yields the records of each page of results of the query as they are
+        # decoded from the response. The rest of the fields of a page are only
+        # known once all of its records have been read.
+        batch_size = self.get('batch_size')
+
+        print_info(f'Running query {self.query}...')
+        page = self.api.query(
+            session,
+            self.query,
+            self.api_ver,
+            self.api_name,
+            batch_size,
+            True,
+        )
+
+        while True:
+            records = iter(page)
+            first = next(records, None)
+
+            if not first is None:
+                # The records of EventLogFile queries only list the log files
+                # to download so their page is small. It is read in full
+                # before the first log file is downloaded so that its response
+                # is not held open for as long as the downloads take.
+                if is_logfile_response(first):
+                    records = list(records)
+
+                yield first
+                yield from records
+
+            if not page.has_records:
+                print_warn(f'no records returned for query {self.query}')
+                return
+
+            if not has_more_records(page.fields):
+                return
+
+            next_records_url = page.fields['nextRecordsUrl']
+
+            print_info(
+                f'Retrieving more query results using {next_records_url}...'
+            )
+
+            page = self.api.query_more(
+                session,
+                next_records_url,
+                batch_size,
+                True,
+            )
+
+    def execute(
+        self,
+        session: Session,
+    ):
+        if self.is_bulk(session):
+            yield from self.execute_bulk(session)
+            return
+
+        # With prefetch_pages, the pages are fetched on a worker thread while
+        # the records of the pages already fetched are consumed, and up to
+        # that many pages are kept ahead of the consumer.
+        prefetch_pages = int(
+            self.get('prefetch_pages', DEFAULT_PREFETCH_PAGES),
+        )
+
+        # Pages that are fetched ahead are decoded in full on the worker
+        # thread so records are only streamed without prefetching.
+        if prefetch_pages <= 0 and self.get('stream_records', False):
+            yield from self.stream_records(session)
+            return
+
+        pages = merge_iterators(
+            [lambda : self.pages(session)],
+            1,
+            batch_size=1,
+            queue_size=prefetch_pages,
+        ) if prefetch_pages > 0 else self.pages(session)
+
+        for response in pages:
+            yield from response['records']
+
 
 class QueryFactory:
     def __init__(self):
@@ -95,9 +430,11 @@ class QueryFactory:
         time_lag_minutes: int,
         last_to_timestamp: str,
         generation_interval: str,
+        to_timestamp: str = None,
     ):
         return {
-            'to_timestamp': get_iso_date_with_offset(time_lag_minutes),
+            'to_timestamp': to_timestamp if to_timestamp \
+                else get_iso_date_with_offset(time_lag_minutes),
             'from_timestamp': last_to_timestamp,
             'log_interval_type': generation_interval,
         }
@@ -115,22 +452,27 @@ class QueryFactory:
         time_lag_minutes: int,
         last_to_timestamp: str,
         generation_interval: str,
+        to_timestamp: str = None,
     ) -> Query:
         qp = deepcopy(q)
         qq = qp.pop('query', '')
+        soql = substitute(
+            self.build_args(
+                time_lag_minutes,
+                last_to_timestamp,
+                generation_interval,
+                to_timestamp,
+            ),
+            qq,
+            self.get_env(qp),
+        )
 
         return Query(
             api,
-            substitute(
-                self.build_args(
-                    time_lag_minutes,
-                    last_to_timestamp,
-                    generation_interval,
-                ),
-                qq,
-                self.get_env(qp),
-            ).replace(' ', '+'),
+            soql.replace(' ', '+'),
             Config(qp),
             qp.get('api_ver', None),
             qp.get('api_name', None),
+            get_query_key(qq),
+            soql,
         )
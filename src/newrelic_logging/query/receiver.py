@@ -1,29 +1,51 @@
-from copy import deepcopy
-import csv
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import io
+from itertools import islice
 from requests import Session
 
 
-from . import Query, QueryFactory
+from . import Query, QueryFactory, get_query_key
+from .watermark import new_watermark_store
 from ..api import Api
-from ..cache import DataCache
-from .. import config as mod_config
+from ..cache import DataCache, LOOKUP_CHUNK_SIZE
+from ..concurrency import get_process_pool, map_ordered, merge_iterators
+from ..csv_parser import \
+    CsvParser, \
+    DEFAULT_ENCODING, \
+    DEFAULT_READ_SIZE, \
+    find_line_start, \
+    find_record_start, \
+    parse_row
+from .. import config as mod_config, SalesforceApiException
+from ..schema import register_field_types
 from ..telemetry import print_info, print_warn
 from ..util import \
-    generate_record_id, \
+    new_record_id_generator, \
     get_timestamp, \
     get_iso_date_with_offset, \
     get_log_line_timestamp, \
+    get_time_windows, \
     is_logfile_response, \
+    parse_log_line_timestamp, \
     process_query_result, \
     regenerator
 
 
-DEFAULT_CHUNK_SIZE = 4096
+DEFAULT_CHUNK_SIZE = DEFAULT_READ_SIZE
+DEFAULT_DOWNLOAD_CONCURRENCY = 1
+DEFAULT_DOWNLOAD_RANGES = 1
+DEFAULT_DOWNLOAD_RANGE_MIN_SIZE = 16 * 1024 * 1024
+RANGE_PROBE_SIZE = 256 * 1024
+DEFAULT_PARSE_PROCESSES = 0
+PARSE_CHUNK_SIZE = 1024 * 1024
+DEFAULT_WINDOW_MINUTES = 0
+DEFAULT_WINDOW_CONCURRENCY = 1
 SALESFORCE_CREATED_DATE_QUERY = \
-    "SELECT Id,EventType,CreatedDate,LogDate,Interval,LogFile,Sequence From EventLogFile Where CreatedDate>={" \
+    "SELECT Id,EventType,CreatedDate,LogDate,Interval,LogFile,LogFileLength,LogFileFieldNames,LogFileFieldTypes,Sequence From EventLogFile Where CreatedDate>={" \
     "from_timestamp} AND CreatedDate<{to_timestamp} AND Interval='{log_interval_type}'"
 SALESFORCE_LOG_DATE_QUERY = \
-    "SELECT Id,EventType,CreatedDate,LogDate,Interval,LogFile,Sequence From EventLogFile Where LogDate>={" \
+    "SELECT Id,EventType,CreatedDate,LogDate,Interval,LogFile,LogFileLength,LogFileFieldNames,LogFileFieldTypes,Sequence From EventLogFile Where LogDate>={" \
     "from_timestamp} AND LogDate<{to_timestamp} AND Interval='{log_interval_type}'"
 
 
@@ -40,26 +62,58 @@ def init_fields_from_log_line(
 
         return attrs
 
-    return deepcopy(log_line)
+    # Log line values are all strings so a shallow copy is enough
+    return dict(log_line)
 
 
-def pack_log_line_into_log(
+class LogLinePlan:
+    def __init__(
+        self,
+        header: tuple,
+        record_event_type: str,
+        event_type_fields_mapping: dict,
+    ):
+        # Compiles the fields mapping for the event type against the header
+        # of a log file into the column positions of the fields to keep so
+        # that columns which are not mapped are never materialized.
+        indexes = { field: index for index, field in enumerate(header) }
+
+        fields = event_type_fields_mapping[record_event_type] \
+            if record_event_type in event_type_fields_mapping else header
+
+        # TIMESTAMP is converted into the log timestamp so it is never
+        # copied into the attributes.
+        self.columns = [
+            (field, indexes[field]) for field in fields \
+                if field != 'TIMESTAMP'
+        ]
+        self.size = len(header)
+        self.timestamp_index = indexes.get('TIMESTAMP')
+        self.request_id_index = indexes.get('REQUEST_ID')
+
+    def project(self, values: tuple) -> dict:
+        return { field: values[index] for field, index in self.columns }
+
+    def get_timestamp(self, values: tuple) -> str:
+        if self.timestamp_index is None:
+            return None
+
+        return values[self.timestamp_index]
+
+    def get_request_id(self, values: tuple) -> str:
+        if self.request_id_index is None:
+            return None
+
+        return values[self.request_id_index]
+
+
+def pack_attrs_into_log(
     query: Query,
     record_id: str,
-    record_event_type: str,
-    log_line: dict,
+    attrs: dict,
+    timestamp: int,
     line_no: int,
-    event_type_fields_mapping: dict,
 ) -> dict:
-    attrs = init_fields_from_log_line(
-        record_event_type,
-        log_line,
-        event_type_fields_mapping,
-    )
-
-    timestamp = int(get_log_line_timestamp(log_line))
-    attrs.pop('TIMESTAMP', None)
-
     attrs['LogFileId'] = record_id
 
     actual_event_type = attrs.pop('EVENT_TYPE', 'SFEvent')
@@ -80,16 +134,205 @@ def pack_log_line_into_log(
     return log_entry
 
 
+def pack_log_line_into_log(
+    query: Query,
+    record_id: str,
+    record_event_type: str,
+    log_line: dict,
+    line_no: int,
+    event_type_fields_mapping: dict,
+) -> dict:
+    attrs = init_fields_from_log_line(
+        record_event_type,
+        log_line,
+        event_type_fields_mapping,
+    )
+
+    timestamp = int(get_log_line_timestamp(log_line))
+    attrs.pop('TIMESTAMP', None)
+
+    return pack_attrs_into_log(query, record_id, attrs, timestamp, line_no)
+
+
 def export_log_lines(
     api: Api,
     session: Session,
     log_file_path: str,
     chunk_size: int,
+    offset: int = 0,
+    header: tuple = None,
 ):
+    if offset > 0:
+        print_info(
+            f'Downloading log lines for log file: {log_file_path} from byte offset {offset}'
+        )
+        return api.get_log_file(
+            session,
+            log_file_path,
+            chunk_size,
+            offset,
+            header,
+        )
+
     print_info(f'Downloading log lines for log file: {log_file_path}')
     return api.get_log_file(session, log_file_path, chunk_size)
 
 
+def get_log_file_range_starts(
+    length: int,
+    ranges: int,
+    min_size: int,
+) -> list[int]:
+    # Returns the offsets at which a log file of the given length is split
+    # into at most the given number of ranges of at least min_size bytes.
+    count = min(ranges, length // max(min_size, 1))
+    if count < 2:
+        return [0]
+
+    size = length // count
+
+    return [i * size for i in range(count)]
+
+
+def align_log_file_ranges(starts: list[int], probes: list[bytes]):
+    # probes holds the first bytes of the log file from each of the starts.
+    # Returns the header row of the log file and the start of the first
+    # record at or after each start. Starts where no record start can be
+    # found are dropped so the ranges on either side are merged.
+    header_end = find_line_start(probes[0], 0)
+    if header_end is None:
+        return None, [0]
+
+    header = parse_row(
+        probes[0][:header_end].decode(DEFAULT_ENCODING).rstrip('\r\n'),
+    )
+    bounds = [0]
+
+    for start, probe in zip(starts[1:], probes[1:]):
+        index = find_record_start(probe, len(header))
+        if index is None:
+            continue
+
+        if start + index >= header_end and start + index > bounds[-1]:
+            bounds.append(start + index)
+
+    return header, bounds
+
+
+def export_log_line_range(
+    api: Api,
+    session: Session,
+    log_file_path: str,
+    chunk_size: int,
+    start: int,
+    end: int,
+    header: tuple,
+):
+    # Yields the data rows in the bytes of the log file from start up to and
+    # including end, or up to the end of the log file if end is None.
+    rows = api.get_log_file(
+        session,
+        log_file_path,
+        chunk_size,
+        start,
+        header if start > 0 else None,
+        end,
+    )
+
+    # The whole log file is returned if the range was ignored
+    if rows.offset != start:
+        raise SalesforceApiException(
+            -1,
+            f'error reading log file {log_file_path} from byte offset {start}',
+        )
+
+    yield from islice(rows, 1, None)
+
+
+def export_log_line_ranges(
+    api: Api,
+    session: Session,
+    log_file_path: str,
+    chunk_size: int,
+    length: int,
+    ranges: int,
+    min_size: int,
+):
+    # Splits the log file into byte ranges which are downloaded and parsed
+    # concurrently. The rows of all ranges are merged as they are parsed so
+    # they are not in the order of the log file. A range may start inside a
+    # quoted field so the first bytes from each split point are fetched
+    # first to find where the next record starts.
+    starts = get_log_file_range_starts(length, ranges, min_size)
+    if len(starts) < 2:
+        return export_log_lines(api, session, log_file_path, chunk_size)
+
+    with ThreadPoolExecutor(
+        max_workers=len(starts),
+        thread_name_prefix='sfexp-probe',
+    ) as executor:
+        probes = list(executor.map(
+            lambda start : api.get_log_file_range(
+                session,
+                log_file_path,
+                start,
+                start + RANGE_PROBE_SIZE - 1,
+            ),
+            starts,
+        ))
+
+    if any(probe is None for probe in probes):
+        print_warn(
+            f'Range requests not supported for log file: {log_file_path}'
+        )
+        return export_log_lines(api, session, log_file_path, chunk_size)
+
+    header, bounds = align_log_file_ranges(starts, probes)
+    if len(bounds) < 2:
+        return export_log_lines(api, session, log_file_path, chunk_size)
+
+    print_info(
+        f'Downloading log lines for log file: {log_file_path} in {len(bounds)} ranges'
+    )
+
+    ends = [bound - 1 for bound in bounds[1:]] + [None]
+
+    return regenerator(
+        [header],
+        merge_iterators(
+            [
+                lambda start=start, end=end : export_log_line_range(
+                    api,
+                    session,
+                    log_file_path,
+                    chunk_size,
+                    start,
+                    end,
+                    header,
+                ) for start, end in zip(bounds, ends)
+            ],
+            len(bounds),
+        ),
+    )
+
+
+def skip_rows(rows, count: int):
+    # Yields the header row followed by the rows after the first count rows
+    header = True
+
+    for values in rows:
+        if header:
+            header = False
+            yield values
+            continue
+
+        if count > 0:
+            count -= 1
+            continue
+
+        yield values
+
+
 def transform_log_lines(
     iter,
     query: Query,
@@ -97,39 +340,208 @@ def transform_log_lines(
     record_event_type: str,
     data_cache: DataCache,
     event_type_fields_mapping: dict,
+    row_index: int = 0,
+    on_chunk: callable = None,
 ):
-    # iter is a generator iterator that yields a single line at a time
-    reader = csv.DictReader(iter)
+    # iter is an iterator that yields the header row followed by a tuple of
+    # field values for each log line. on_chunk is called with the index of
+    # the next log line each time the logs for at least LOOKUP_CHUNK_SIZE
+    # more rows have been yielded.
+
+    plan = None
+    rows = []
+    packed = 0
+
+    for values in iter:
+        if plan is None:
+            plan = LogLinePlan(
+                values,
+                record_event_type,
+                event_type_fields_mapping,
+            )
+            continue
 
-    # This should cause the reader to request the next line from the iterator
-    # which will cause the generator iterator to yield the next line
+        # Short rows are padded the same way csv.DictReader does
+        if len(values) < plan.size:
+            values = values + (None,) * (plan.size - len(values))
 
-    row_index = 0
+        rows.append(values)
+
+        # Without a cache there is nothing to look up so rows are packed as
+        # they are read. Otherwise the log lines are checked against the cache
+        # a chunk of rows at a time.
+        if not data_cache or len(rows) >= LOOKUP_CHUNK_SIZE:
+            packed += len(rows)
+            row_index = yield from pack_log_lines(
+                query,
+                record_id,
+                plan,
+                rows,
+                data_cache,
+                row_index,
+            )
+            rows = []
 
-    for row in reader:
+            if on_chunk and packed >= LOOKUP_CHUNK_SIZE:
+                on_chunk(row_index)
+                packed = 0
+
+    if len(rows) > 0:
+        yield from pack_log_lines(
+            query,
+            record_id,
+            plan,
+            rows,
+            data_cache,
+            row_index,
+        )
+
+
+def pack_log_lines(
+    query: Query,
+    record_id: str,
+    plan: LogLinePlan,
+    rows: list[tuple],
+    data_cache: DataCache,
+    row_index: int,
+):
+    # Yields a log for each row not already seen and returns the index of the
+    # next row
+    seen = data_cache.check_or_set_log_line_ids(
+        record_id,
+        [plan.get_request_id(values) for values in rows],
+    ) if data_cache else None
+
+    for i, values in enumerate(rows):
         # If we've already seen this log line, skip it
-        if data_cache and data_cache.check_or_set_log_line(record_id, row):
+        if seen and seen[i]:
             continue
 
         # Otherwise, pack it up for shipping and yield it for consumption
-        yield pack_log_line_into_log(
+        yield pack_attrs_into_log(
             query,
             record_id,
-            record_event_type,
-            row,
+            plan.project(values),
+            int(parse_log_line_timestamp(plan.get_timestamp(values))),
             row_index,
-            event_type_fields_mapping,
         )
 
         row_index += 1
 
+    return row_index
+
+
+def transform_log_chunk(
+    data: bytes,
+    header: tuple,
+    encoding: str,
+    query_options: dict,
+    record_id: str,
+    record_event_type: str,
+    event_type_fields_mapping: dict,
+) -> tuple[list, list]:
+    # Runs in a worker process. Parses a block of complete records of a log
+    # file and returns the REQUEST_ID and the log for each row. The message of
+    # each log is set once the rows already seen have been skipped.
+    plan = LogLinePlan(header, record_event_type, event_type_fields_mapping)
+    request_ids = []
+    logs = []
+
+    rows = CsvParser(
+        io.BytesIO(data).read,
+        max(len(data), 1),
+        encoding=encoding,
+        header=header,
+    )
+
+    for values in islice(rows, 1, None):
+        # Short rows are padded the same way csv.DictReader does
+        if len(values) < plan.size:
+            values = values + (None,) * (plan.size - len(values))
+
+        request_ids.append(plan.get_request_id(values))
+        logs.append(pack_attrs_into_log(
+            query_options,
+            record_id,
+            plan.project(values),
+            int(parse_log_line_timestamp(plan.get_timestamp(values))),
+            0,
+        ))
+
+    return request_ids, logs
+
+
+def transform_log_chunks(
+    rows: CsvParser,
+    executor,
+    max_pending: int,
+    query: Query,
+    record_id: str,
+    record_event_type: str,
+    data_cache: DataCache,
+    event_type_fields_mapping: dict,
+):
+    # The log file is split into blocks of complete records which are parsed
+    # and packed into logs on the executor so that only the lookups against
+    # the cache are done here. Blocks are yielded in the order of the log
+    # file.
+    chunks = rows.chunks(PARSE_CHUNK_SIZE)
+    first = next(chunks, None)
+    if first is None:
+        return
+
+    transform = partial(
+        transform_log_chunk,
+        header=rows.header,
+        encoding=rows.encoding,
+        query_options=query.get_config(),
+        record_id=record_id,
+        record_event_type=record_event_type,
+        event_type_fields_mapping=event_type_fields_mapping,
+    )
+    row_index = 0
+
+    for request_ids, logs in map_ordered(
+        executor,
+        transform,
+        regenerator([first], chunks),
+        max_pending,
+    ):
+        for i in range(0, len(logs), LOOKUP_CHUNK_SIZE):
+            seen = data_cache.check_or_set_log_line_ids(
+                record_id,
+                request_ids[i:i + LOOKUP_CHUNK_SIZE],
+            ) if data_cache else None
+
+            for j, log in enumerate(logs[i:i + LOOKUP_CHUNK_SIZE]):
+                if seen and seen[j]:
+                    continue
+
+                log['message'] = f'LogFile {record_id} row {row_index}'
+                yield log
+
+                row_index += 1
+
+
+def mark_log_file(iter, record_id: str, data_cache: DataCache):
+    # Adds the marker of the log file once all of its log lines have been
+    # read. The marker is only set once they have been delivered.
+    yield from iter
+
+    data_cache.add_log_file_marker(record_id)
+
 
 def pack_query_record_into_log(
     query: Query,
     record_id: str,
     record: dict,
+    attrs: dict = None,
 ) -> dict:
-    attrs = process_query_result(record)
+    # attrs are the flattened fields of the record if they were already
+    # computed by process_query_result()
+    if attrs is None:
+        attrs = process_query_result(record)
+
     if record_id:
         attrs['Id'] = record_id
 
@@ -167,17 +579,81 @@ def transform_query_records(iter, query: Query, data_cache: DataCache):
     # are event records not log lines so hopefully it is not as bad.
     # @TODO figure out if we can stream event records
 
-    for record in iter:
-        config = query.get_config()
+    config = query.get_config()
+    generate_record_id = new_record_id_generator(
+        config['id'] if 'id' in config else [],
+    )
+    records = []
 
+    for record in iter:
         record_id = record['Id'] if 'Id' in record \
-            else generate_record_id(
-                config['id'] if 'id' in config else [],
-                record,
-            )
+            else generate_record_id(record)
+
+        records.append((record_id, record))
+
+        # Records are checked against the cache a chunk at a time
+        if not data_cache or len(records) >= LOOKUP_CHUNK_SIZE:
+            yield from pack_query_records(query, records, data_cache)
+            records = []
+
+    if len(records) > 0:
+        yield from pack_query_records(query, records, data_cache)
+
+
+def get_record_event_type(query: Query, record: dict) -> str:
+    # Returns the event type the logs of a log file record or a query record
+    # are sent with.
+    if is_logfile_response(record):
+        return query.get('event_type', record.get('EventType'))
+
+    attributes = record.get('attributes')
+    if type(attributes) == dict and type(attributes.get('type')) == str:
+        return query.get('event_type', attributes['type'])
+
+    return query.get('event_type', 'SFEvent')
+
 
+def get_record_timestamp(attrs: dict, timestamp_attr: str) -> int:
+    # Returns the timestamp of a query record from its flattened fields the
+    # same way pack_query_record_into_log() does, or None if the record has
+    # no valid timestamp.
+    value = attrs.get(timestamp_attr)
+
+    if type(value) is str and value:
+        try:
+            return get_timestamp(value)
+        except ValueError:
+            pass
+
+    return None
+
+
+def pack_query_records(
+    query: Query,
+    records: list[tuple[str, dict]],
+    data_cache: DataCache,
+):
+    seen = None
+    attrs = None
+
+    if data_cache:
+        query_key = query.get_key()
+        timestamp_attr = query.get('timestamp_attr', 'CreatedDate')
+        attrs = [process_query_result(record) for _, record in records]
+
+        seen = data_cache.check_or_set_record_ids(
+            [record_id for record_id, _ in records],
+            [
+                data_cache.get_record_ids_key(
+                    query_key,
+                    get_record_timestamp(record_attrs, timestamp_attr),
+                ) for record_attrs in attrs
+            ],
+        )
+
+    for i, (record_id, record) in enumerate(records):
         # If we've already seen this event record, skip it.
-        if data_cache and data_cache.check_or_set_record_id(record_id):
+        if seen and seen[i]:
             continue
 
         # Build a New Relic log record from the SF event record
@@ -185,9 +661,17 @@ def transform_query_records(iter, query: Query, data_cache: DataCache):
             query,
             record_id,
             record,
+            attrs[i] if attrs else None,
         )
 
 
+def get_log_file_length(record: dict) -> float:
+    # LogFileLength is only present if the query selected it, which custom
+    # EventLogFile queries may not do.
+    length = record.get('LogFileLength')
+    return float(length) if length else 0
+
+
 def is_logs_enabled(instance_config: mod_config.Config) -> bool:
     if not 'logs_enabled' in instance_config:
         return True
@@ -242,6 +726,14 @@ class QueryReceiver:
         time_lag_minutes: int,
         generation_interval: str,
         read_chunk_size: int,
+        download_concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY,
+        watermarks = None,
+        download_ranges: int = DEFAULT_DOWNLOAD_RANGES,
+        download_range_min_size: int = DEFAULT_DOWNLOAD_RANGE_MIN_SIZE,
+        parse_processes: int = DEFAULT_PARSE_PROCESSES,
+        window_minutes: int = DEFAULT_WINDOW_MINUTES,
+        window_concurrency: int = DEFAULT_WINDOW_CONCURRENCY,
+        event_types: set = None,
     ):
         self.data_cache = data_cache
         self.api = api
@@ -255,39 +747,247 @@ class QueryReceiver:
         )
         self.queries = queries
         self.read_chunk_size = read_chunk_size
+        self.download_concurrency = download_concurrency
+        # With a watermark store, the end of the time range of each query is
+        # saved once everything it returned has been sent and is used as the
+        # start of the time range of the query on the next run, even after a
+        # restart. Until then it is kept in pending_watermarks.
+        self.watermarks = watermarks
+        self.pending_watermarks = {}
+        # Log files of at least twice download_range_min_size bytes are split
+        # into up to download_ranges byte ranges which are downloaded at the
+        # same time.
+        self.download_ranges = download_ranges
+        self.download_range_min_size = download_range_min_size
+        # With parse_processes, log files are parsed and packed into logs by
+        # a pool of that many worker processes.
+        self.parse_processes = parse_processes
+        # Time ranges wider than window_minutes are split into windows of at
+        # most window_minutes which are queried up to window_concurrency at
+        # the same time.
+        self.window_minutes = window_minutes
+        self.window_concurrency = window_concurrency
+        # With event_types, only log files and query records of those event
+        # types are exported.
+        self.event_types = event_types
+        # Set by set_time_range() to end the time range at a fixed date rather
+        # than at the current time minus time_lag_minutes.
+        self.to_timestamp = None
 
     def process_log_record(
         self,
         session: Session,
         query: Query,
         record: dict,
+        can_skip: bool = None,
     ):
+        # can_skip is the result of a batched lookup done by
+        # get_skippable_log_files() or None to look up the log file here.
         record_id = str(record['Id'])
         record_event_type = query.get('event_type', record['EventType'])
         log_file_path = record['LogFile']
         interval = record['Interval']
 
-        # NOTE: only Hourly logs can be skipped, because Daily logs can change
-        # and the same record_id can contain different data.
-        if interval == 'Hourly' and self.data_cache and \
-            self.data_cache.can_skip_downloading_logfile(record_id):
+        # LogFileFieldNames and LogFileFieldTypes are only present if the
+        # query selected them, which custom EventLogFile queries may not do.
+        register_field_types(
+            record_event_type,
+            record.get('LogFileFieldNames'),
+            record.get('LogFileFieldTypes'),
+        )
+
+        if can_skip is None:
+            # NOTE: only Hourly logs can be skipped, because Daily logs can
+            # change and the same record_id can contain different data.
+            can_skip = interval == 'Hourly' and self.data_cache and \
+                self.data_cache.can_skip_downloading_logfile(record_id)
+
+        if can_skip:
             print_info(
                 f'Log lines for logfile with id {record_id} already cached, skipping download'
             )
             return iter([])
 
-        return transform_log_lines(
-            export_log_lines(
-                self.api,
+        # Hourly logs never change once they are published so with hourly
+        # file markers the log lines are not checked against the cache.
+        # Instead the whole file is marked as seen once it has been delivered.
+        markers = interval == 'Hourly' and self.data_cache and \
+            self.data_cache.hourly_file_markers
+
+        # Log files can only be resumed when they are processed one at a time
+        # since the logs of each file must be delivered in order.
+        if self.data_cache and self.data_cache.log_file_checkpoints and \
+            self.download_concurrency <= 1 and self.window_concurrency <= 1:
+            logs = self.transform_log_file_with_checkpoints(
                 session,
+                query,
+                record_id,
+                record_event_type,
                 log_file_path,
-                self.read_chunk_size,
-            ),
+                None if markers else self.data_cache,
+            )
+        elif self.parse_processes > 0 and self.download_ranges <= 1:
+            logs = transform_log_chunks(
+                export_log_lines(
+                    self.api,
+                    session,
+                    log_file_path,
+                    self.read_chunk_size,
+                ),
+                get_process_pool(self.parse_processes),
+                self.parse_processes * 2,
+                query,
+                record_id,
+                record_event_type,
+                None if markers else self.data_cache,
+                self.event_type_fields_mapping,
+            )
+        else:
+            logs = transform_log_lines(
+                export_log_line_ranges(
+                    self.api,
+                    session,
+                    log_file_path,
+                    self.read_chunk_size,
+                    int(get_log_file_length(record)),
+                    self.download_ranges,
+                    self.download_range_min_size,
+                ) if self.download_ranges > 1 else export_log_lines(
+                    self.api,
+                    session,
+                    log_file_path,
+                    self.read_chunk_size,
+                ),
+                query,
+                record_id,
+                record_event_type,
+                None if markers else self.data_cache,
+                self.event_type_fields_mapping,
+            )
+
+        if markers:
+            return mark_log_file(logs, record_id, self.data_cache)
+
+        return logs
+
+    def transform_log_file_with_checkpoints(
+        self,
+        session: Session,
+        query: Query,
+        record_id: str,
+        record_event_type: str,
+        log_file_path: str,
+        data_cache: DataCache,
+    ):
+        # The position in the log file of the last row delivered is saved
+        # after every chunk of rows. If the log file is processed again before
+        # it was done, the rest of the log file is downloaded from the saved
+        # position on with the header row saved with it, and the rows between
+        # the position and the last row delivered are skipped. data_cache is
+        # the cache the log lines are checked against, if any.
+        checkpoint = self.data_cache.get_log_file_checkpoint(record_id)
+
+        rows = export_log_lines(
+            self.api,
+            session,
+            log_file_path,
+            self.read_chunk_size,
+            checkpoint['offset'] if checkpoint else 0,
+            checkpoint['header'] if checkpoint else None,
+        )
+
+        # The offset is 0 if the whole log file was returned anyway
+        base = checkpoint['rows'] if checkpoint and rows.offset > 0 else 0
+
+        def on_chunk(row_index: int):
+            offset, count = rows.checkpoint
+            if offset == 0:
+                return
+
+            next_checkpoint = {
+                'offset': offset,
+                'rows': base + count,
+                'delivered': base + rows.rows,
+                'row_index': row_index,
+                'header': rows.header,
+            }
+
+            self.data_cache.on_delivered(
+                lambda : self.data_cache.put_log_file_checkpoint(
+                    record_id,
+                    next_checkpoint,
+                )
+            )
+
+        yield from transform_log_lines(
+            skip_rows(rows, checkpoint['delivered'] - base if checkpoint else 0),
             query,
             record_id,
             record_event_type,
-            self.data_cache,
+            data_cache,
             self.event_type_fields_mapping,
+            checkpoint['row_index'] if checkpoint else 0,
+            on_chunk,
+        )
+
+        self.data_cache.on_delivered(
+            lambda : self.data_cache.delete_log_file_checkpoint(record_id)
+        )
+
+    def get_skippable_log_files(self, records: list[dict]) -> set:
+        # Returns the IDs of the log records whose log files are already
+        # cached, checking all records with a single batched lookup.
+        if not self.data_cache:
+            return set()
+
+        # NOTE: only Hourly logs can be skipped, because Daily logs can change
+        # and the same record_id can contain different data.
+        record_ids = [
+            str(record['Id']) for record in records \
+                if record['Interval'] == 'Hourly'
+        ]
+
+        if len(record_ids) == 0:
+            return set()
+
+        return set(
+            record_id for record_id, can_skip in zip(
+                record_ids,
+                self.data_cache.can_skip_downloading_logfiles(record_ids),
+            ) if can_skip
+        )
+
+    def process_log_records_concurrently(
+        self,
+        session: Session,
+        query: Query,
+        records: list[dict],
+    ):
+        # Start with the largest log files so that the longest downloads are
+        # not left for the end of the run.
+        records = sorted(
+            records,
+            key=get_log_file_length,
+            reverse=True,
+        )
+
+        skippable = self.get_skippable_log_files(records)
+
+        def on_complete(index: int):
+            if self.data_cache:
+                self.data_cache.flush_log_file(str(records[index]['Id']))
+
+        yield from merge_iterators(
+            [
+                lambda record=record : self.process_log_record(
+                    session,
+                    query,
+                    record,
+                    str(record['Id']) in skippable,
+                ) for record in records
+            ],
+            self.download_concurrency,
+            on_complete,
         )
 
     def process_query_records(
@@ -313,17 +1013,41 @@ class QueryReceiver:
 
         reiter = regenerator([first], iter)
 
-        if is_logfile_response(first):
-            for record in reiter:
-                if 'LogFile' in record:
-                    yield from self.process_log_record(
-                        session,
-                        query,
-                        record,
-                    )
+        if self.event_types:
+            reiter = (
+                record for record in reiter \
+                    if get_record_event_type(query, record) in self.event_types
+            )
 
-                if self.data_cache:
-                    self.data_cache.flush()
+        if is_logfile_response(first):
+            if self.download_concurrency > 1:
+                yield from self.process_log_records_concurrently(
+                    session,
+                    query,
+                    [record for record in reiter if 'LogFile' in record],
+                )
+                return
+
+            while True:
+                records = list(islice(reiter, LOOKUP_CHUNK_SIZE))
+                if len(records) == 0:
+                    break
+
+                skippable = self.get_skippable_log_files(
+                    [record for record in records if 'LogFile' in record],
+                )
+
+                for record in records:
+                    if 'LogFile' in record:
+                        yield from self.process_log_record(
+                            session,
+                            query,
+                            record,
+                            str(record['Id']) in skippable,
+                        )
+
+                    if self.data_cache:
+                        self.data_cache.flush()
 
             return
 
@@ -333,9 +1057,94 @@ class QueryReceiver:
         if self.data_cache:
             self.data_cache.flush()
 
-    def slide_time_range(self):
-        self.last_to_timestamp = get_iso_date_with_offset(
-            self.time_lag_minutes
+    def set_time_range(self, from_timestamp: str, to_timestamp: str) -> None:
+        self.last_to_timestamp = from_timestamp
+        self.to_timestamp = to_timestamp
+
+    def slide_time_range(self, to_timestamp: str = None):
+        self.last_to_timestamp = to_timestamp if to_timestamp \
+            else get_iso_date_with_offset(self.time_lag_minutes)
+
+    def get_watermarks(self, query_keys: list) -> dict:
+        if not self.watermarks:
+            return {}
+
+        return self.watermarks.get(query_keys)
+
+    def save_watermarks(self) -> None:
+        # Must only be called once everything returned by the queries of the
+        # run has been sent.
+        if not self.watermarks or len(self.pending_watermarks) == 0:
+            return
+
+        self.watermarks.put(self.pending_watermarks)
+        self.pending_watermarks = {}
+
+    def advance_watermark(self, query_key: str, watermark: str) -> None:
+        if not self.watermarks:
+            return
+
+        self.pending_watermarks[query_key] = watermark
+
+        # The watermark is saved as soon as everything handed over up to now
+        # has been delivered so that the windows before it are not queried
+        # again if the run fails later on.
+        if self.data_cache:
+            self.data_cache.on_delivered(
+                lambda : self.watermarks.put({ query_key: watermark })
+            )
+
+    def execute_windows(
+        self,
+        session: Session,
+        q: dict,
+        query_key: str,
+        windows: list[tuple[str, str]],
+    ):
+        # Windows can complete in any order so the watermark of the query only
+        # advances to the end of the oldest windows that have all completed.
+        queries = [
+            self.query_factory.new(
+                self.api,
+                q,
+                self.time_lag_minutes,
+                from_timestamp,
+                self.generation_interval,
+                to_timestamp,
+            ) for from_timestamp, to_timestamp in windows
+        ]
+        completed = [False] * len(windows)
+        next_window = 0
+        count = 0
+
+        def on_complete(index: int):
+            nonlocal next_window, count
+
+            completed[index] = True
+            count += 1
+            start = next_window
+
+            print_info(
+                f'Query {query_key}: completed window {windows[index][0]} - '
+                f'{windows[index][1]} ({count}/{len(windows)})'
+            )
+
+            while next_window < len(windows) and completed[next_window]:
+                next_window += 1
+
+            if next_window > start:
+                self.advance_watermark(query_key, windows[next_window - 1][1])
+
+        yield from merge_iterators(
+            [
+                lambda query=query : self.process_records(
+                    session,
+                    query,
+                    query.execute(session),
+                ) for query in queries
+            ],
+            self.window_concurrency,
+            on_complete,
         )
 
     def execute(
@@ -345,13 +1154,37 @@ class QueryReceiver:
         if len(self.queries) == 0:
             return
 
-        for q in self.queries:
+        # Every query of the run uses the same end of the time range, which is
+        # also the start of the time range of the next run, so that the time
+        # ranges of consecutive runs neither overlap nor leave gaps.
+        to_timestamp = self.to_timestamp if self.to_timestamp \
+            else get_iso_date_with_offset(self.time_lag_minutes)
+        query_keys = [get_query_key(q.get('query', '')) for q in self.queries]
+        watermarks = self.get_watermarks(query_keys)
+
+        for q, query_key in zip(self.queries, query_keys):
+            windows = get_time_windows(
+                watermarks.get(query_key, self.last_to_timestamp),
+                to_timestamp,
+                self.window_minutes,
+            )
+
+            if len(windows) > 1:
+                yield from self.execute_windows(
+                    session,
+                    q,
+                    query_key,
+                    windows,
+                )
+                continue
+
             query = self.query_factory.new(
                 self.api,
                 q,
                 self.time_lag_minutes,
-                self.last_to_timestamp,
+                windows[0][0],
                 self.generation_interval,
+                to_timestamp,
             )
 
             yield from self.process_records(
@@ -360,7 +1193,10 @@ class QueryReceiver:
                 query.execute(session),
             )
 
-        self.slide_time_range()
+            if self.watermarks:
+                self.pending_watermarks[query_key] = to_timestamp
+
+        self.slide_time_range(to_timestamp)
 
 
 def new_create_receiver_func(
@@ -369,7 +1205,7 @@ def new_create_receiver_func(
     event_type_fields_mapping: dict,
     initial_delay: int,
 ) -> callable:
-    return lambda instance_config, data_cache, api : QueryReceiver(
+    return lambda instance_config, data_cache, api, instance_name = '' : QueryReceiver(
         data_cache,
         api,
         query_factory,
@@ -392,5 +1228,30 @@ def new_create_receiver_func(
             mod_config.CONFIG_GENERATION_INTERVAL,
             mod_config.DEFAULT_GENERATION_INTERVAL,
         ),
-        instance_config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+        instance_config.get('chunk_size', DEFAULT_CHUNK_SIZE),
+        instance_config.get_int(
+            'download_concurrency',
+            DEFAULT_DOWNLOAD_CONCURRENCY,
+        ),
+        new_watermark_store(instance_config, data_cache, instance_name),
+        instance_config.get_int(
+            'download_ranges',
+            DEFAULT_DOWNLOAD_RANGES,
+        ),
+        instance_config.get_int(
+            'download_range_min_size',
+            DEFAULT_DOWNLOAD_RANGE_MIN_SIZE,
+        ),
+        instance_config.get_int(
+            'parse_processes',
+            DEFAULT_PARSE_PROCESSES,
+        ),
+        instance_config.get_int(
+            'window_minutes',
+            DEFAULT_WINDOW_MINUTES,
+        ),
+        instance_config.get_int(
+            'window_concurrency',
+            DEFAULT_WINDOW_CONCURRENCY,
+        ),
     )
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+
+
+from .. import ConfigException
+from ..cache import DataCache
+from ..config import Config
+from ..telemetry import print_info
+
+
+CONFIG_WATERMARK_STORE = 'watermark_store'
+CONFIG_WATERMARK_FILE = 'watermark_file'
+WATERMARK_STORE_MEMORY = 'memory'
+WATERMARK_STORE_CACHE = 'cache'
+WATERMARK_STORE_FILE = 'file'
+DEFAULT_WATERMARK_STORE = WATERMARK_STORE_MEMORY
+
+
+# Instances may share a watermark file and run on different threads so every
+# read and write of a watermark file goes through this lock. The watermarks of
+# each instance are kept in their own object in the file.
+_file_lock = threading.Lock()
+
+
+class CacheWatermarkStore:
+    def __init__(self, backend, namespace: str):
+        # The watermarks of an instance are kept in a single hash with a field
+        # for each query key.
+        self.backend = backend
+        self.key = f'watermarks:{namespace}'
+
+    def get(self, query_keys: list) -> dict:
+        values = self.backend.get_hash(self.key, query_keys)
+
+        return {
+            query_key: value.decode('utf-8') \
+                if isinstance(value, bytes) else value \
+                    for query_key, value in zip(query_keys, values) if value
+        }
+
+    def put(self, watermarks: dict) -> None:
+        self.backend.put_hash(self.key, watermarks)
+
+
+class FileWatermarkStore:
+    def __init__(self, path: str, namespace: str = ''):
+        self.path = path
+        self.namespace = namespace
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def get(self, query_keys: list) -> dict:
+        with _file_lock:
+            watermarks = self.load().get(self.namespace, {})
+
+        return {
+            query_key: watermarks[query_key] \
+                for query_key in query_keys if query_key in watermarks
+        }
+
+    def put(self, watermarks: dict) -> None:
+        # The file is replaced in one step so that it is never left half
+        # written if the exporter is stopped while it is being written.
+        with _file_lock:
+            data = self.load()
+            data.setdefault(self.namespace, {}).update(watermarks)
+
+            tmp_path = f'{self.path}.tmp'
+
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+
+            os.replace(tmp_path, self.path)
+
+
+class PrefixedWatermarkStore:
+    def __init__(self, store, prefix: str):
+        # Keeps watermarks in another store under query keys starting with
+        # prefix so that they do not replace the watermarks of the store.
+        self.store = store
+        self.prefix = prefix
+
+    def get(self, query_keys: list) -> dict:
+        watermarks = self.store.get(
+            [f'{self.prefix}{query_key}' for query_key in query_keys],
+        )
+
+        return {
+            query_key: watermarks[f'{self.prefix}{query_key}'] \
+                for query_key in query_keys \
+                    if f'{self.prefix}{query_key}' in watermarks
+        }
+
+    def put(self, watermarks: dict) -> None:
+        self.store.put({
+            f'{self.prefix}{query_key}': watermark \
+                for query_key, watermark in watermarks.items()
+        })
+
+
+def new_watermark_store(
+    instance_config: Config,
+    data_cache: DataCache,
+    namespace: str = '',
+):
+    # namespace is the name of the instance
+    store = instance_config.get(
+        CONFIG_WATERMARK_STORE,
+        DEFAULT_WATERMARK_STORE,
+    ).lower()
+
+    if store == WATERMARK_STORE_MEMORY:
+        return None
+
+    if store == WATERMARK_STORE_CACHE:
+        # Bloom filters can not hold values so watermarks can only be kept in
+        # a Redis or SQLite cache.
+        if not data_cache or not hasattr(data_cache.backend, 'put_hash'):
+            raise ConfigException(
+                CONFIG_WATERMARK_STORE,
+                'the cache watermark store requires a Redis or SQLite cache',
+            )
+
+        print_info('Using cache watermark store')
+
+        return CacheWatermarkStore(data_cache.backend, data_cache.namespace)
+
+    if store == WATERMARK_STORE_FILE:
+        path = instance_config.get(CONFIG_WATERMARK_FILE)
+        if not path:
+            raise ConfigException(
+                CONFIG_WATERMARK_FILE,
+                'missing watermark file',
+            )
+
+        print_info(f'Using watermark file {path}')
+
+        return FileWatermarkStore(path, namespace)
+
+    raise ConfigException(
+        CONFIG_WATERMARK_STORE,
+        f'invalid watermark store {store}',
+    )
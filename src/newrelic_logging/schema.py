@@ -0,0 +1,159 @@
+import re
+import threading
+
+
+from .telemetry import print_warn
+from .util import maybe_convert_str_to_num
+
+
+# LogFileFieldTypes values of fields that hold numbers
+NUMBER_FIELD_TYPES = set(['Number'])
+
+# Event type of the numeric fields mapping whose fields apply to all event types
+COMMON_EVENT_TYPE = 'Common'
+
+INT_PATTERN = re.compile(r'[+-]?\d+')
+FLOAT_PATTERN = re.compile(
+    r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+)
+
+
+# Salesforce field types by event type, collected from the LogFileFieldNames
+# and LogFileFieldTypes of the EventLogFile records seen so far. These are
+# kept for the lifetime of the process so they carry over between runs.
+_field_types = {}
+_field_types_version = 0
+_field_types_lock = threading.Lock()
+
+
+def register_field_types(
+    event_type: str,
+    field_names: str,
+    field_types: str,
+) -> None:
+    global _field_types_version
+
+    if not event_type or not field_names or not field_types:
+        return
+
+    types = dict(zip(field_names.split(','), field_types.split(',')))
+
+    with _field_types_lock:
+        current = _field_types.get(event_type, {})
+        if all(current.get(name) == t for name, t in types.items()):
+            return
+
+        _field_types[event_type] = { **current, **types }
+        _field_types_version += 1
+
+
+def get_field_types(event_type: str) -> dict:
+    with _field_types_lock:
+        return _field_types.get(event_type, {})
+
+
+def get_field_types_version() -> int:
+    return _field_types_version
+
+
+def convert_number(value):
+    # Returns the numeric value of the given value or None if it is not a
+    # number. Values that are not strings come from query results and are
+    # converted the same way they always have been.
+    if not type(value) is str:
+        return maybe_convert_str_to_num(value)
+
+    if INT_PATTERN.fullmatch(value):
+        return int(value)
+
+    if FLOAT_PATTERN.fullmatch(value):
+        return float(value)
+
+    return None
+
+
+class Codec:
+    def __init__(self, event_type: str, fields: tuple, numeric_fields: set):
+        self.event_type = event_type
+        self.numeric = [field in numeric_fields for field in fields]
+        self.warned = set()
+
+    def decode(self, attributes: dict) -> dict:
+        event = {}
+
+        for (key, value), numeric in zip(attributes.items(), self.numeric):
+            if not numeric:
+                event[key] = value
+                continue
+
+            if not value:
+                event[key] = 0
+                continue
+
+            number = convert_number(value)
+            if number is None:
+                # Only warn once per field instead of once per value
+                if not key in self.warned:
+                    self.warned.add(key)
+                    print_warn(
+                        f'Type conversion error for "{value}" in field {key} of event type {self.event_type}'
+                    )
+
+                event[key] = value
+                continue
+
+            event[key] = number
+
+        return event
+
+
+def get_numeric_fields(numeric_fields_mapping: dict, event_type: str) -> set:
+    # The fields of the Common event type apply to every event type. Event
+    # types that are not in the mapping, like the event types of custom
+    # queries, get the fields of all event types as they did before the
+    # mapping was keyed by event type.
+    if not event_type in numeric_fields_mapping:
+        return set(
+            field for fields in numeric_fields_mapping.values() \
+                for field in fields or []
+        )
+
+    return set(numeric_fields_mapping.get(COMMON_EVENT_TYPE) or []).union(
+        numeric_fields_mapping.get(event_type) or [],
+    )
+
+
+class CodecCache:
+    def __init__(self, numeric_fields_mapping: dict):
+        # numeric_fields_mapping holds the fields from the numeric fields
+        # mapping by event type, which are always converted to numbers in
+        # addition to the fields Salesforce reports as numbers.
+        self.numeric_fields_mapping = numeric_fields_mapping
+        self.codecs = {}
+        self.version = get_field_types_version()
+
+    def get(self, event_type: str, fields: tuple) -> Codec:
+        version = get_field_types_version()
+        if version != self.version:
+            self.codecs = {}
+            self.version = version
+
+        key = (event_type, fields)
+
+        codec = self.codecs.get(key)
+        if codec is None:
+            field_types = get_field_types(event_type)
+
+            codec = self.codecs[key] = Codec(
+                event_type,
+                fields,
+                get_numeric_fields(
+                    self.numeric_fields_mapping,
+                    event_type,
+                ).union(
+                    name for name, t in field_types.items() \
+                        if t in NUMBER_FIELD_TYPES
+                ),
+            )
+
+        return codec
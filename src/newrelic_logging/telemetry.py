@@ -1,4 +1,5 @@
 import json
+import threading
 import time
 from requests import Session
 
@@ -10,13 +11,17 @@ from .newrelic import NewRelic
 class Telemetry:
     logs = []
     integration_name = None
+    # Instances harvested on different threads record logs at the same time
+    # so the logs are only read and written while holding this lock.
+    lock = threading.Lock()
 
     def __init__(self, integration_name: str, new_relic: NewRelic) -> None:
         self.integration_name = integration_name
         self.new_relic = new_relic
 
     def is_empty(self):
-        return len(self.logs) == 0
+        with self.lock:
+            return len(self.logs) == 0
 
     def log_info(self, msg: str):
         self.record_log(msg, "info")
@@ -36,20 +41,29 @@ class Telemetry:
                 "level": level
             }
         }
-        self.logs.append(log)
+        with self.lock:
+            self.logs.append(log)
 
     def clear(self):
-        self.logs = []
+        with self.lock:
+            self.logs = []
 
     def flush(self, session: Session):
+        with self.lock:
+            logs = list(self.logs)
+
         self.new_relic.post_logs(
             session,
             [{
                 "common": {},
-                "logs": self.logs,
+                "logs": logs,
             }]
         )
-        self.clear()
+
+        # Only the logs that were sent are removed, logs recorded while they
+        # were being sent are kept for the next flush.
+        with self.lock:
+            self.logs = self.logs[len(logs):]
 
 
 def print_log(msg: str, level: str):
@@ -20,22 +20,32 @@ def regenerator(items: list[Any], itr):
     yield from itr
 
 
-def generate_record_id(id_keys: list[str], record: dict) -> str:
-    compound_id = ''
-    for key in id_keys:
-        if key not in record:
+def new_record_id_generator(id_keys: list[str]) -> callable:
+    # Builds the function that generates the compound ID of a record from the
+    # given keys once per query rather than once per record
+    id_keys = list(id_keys)
+
+    if len(id_keys) == 0:
+        return lambda record : ''
+
+    def generate(record: dict) -> str:
+        try:
+            compound_id = ''.join([str(record[key]) for key in id_keys])
+        except KeyError as e:
             raise Exception(
-                f'error building compound id, key \'{key}\' not found'
+                f'error building compound id, key \'{e.args[0]}\' not found'
             )
 
-        compound_id = compound_id + str(record.get(key, ''))
+        if compound_id != '':
+            return hashlib.sha3_256(compound_id.encode('utf-8')).hexdigest()
+
+        return ''
 
-    if compound_id != '':
-        m = hashlib.sha3_256()
-        m.update(compound_id.encode('utf-8'))
-        return m.hexdigest()
+    return generate
 
-    return ''
+
+def generate_record_id(id_keys: list[str], record: dict) -> str:
+    return new_record_id_generator(id_keys)(record)
 
 
 def maybe_convert_str_to_num(val: str) -> Union[int, str, float]:
@@ -113,6 +123,45 @@ def get_iso_date_with_offset(
     ) + 'Z'
 
 
+ISO_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def get_time_windows(
+    from_timestamp: str,
+    to_timestamp: str,
+    window_minutes: int,
+) -> list[tuple[str, str]]:
+    # Splits the time range between two dates returned by
+    # get_iso_date_with_offset() into consecutive windows of at most
+    # window_minutes, oldest first. The whole range is returned as a single
+    # window if it is not wider than that or either date has another format.
+    if window_minutes <= 0 or not from_timestamp or not to_timestamp:
+        return [(from_timestamp, to_timestamp)]
+
+    try:
+        start = datetime.strptime(from_timestamp, ISO_DATE_FORMAT)
+        end = datetime.strptime(to_timestamp, ISO_DATE_FORMAT)
+    except ValueError:
+        return [(from_timestamp, to_timestamp)]
+
+    size = timedelta(minutes=window_minutes)
+    if end - start <= size:
+        return [(from_timestamp, to_timestamp)]
+
+    windows = []
+    window_start = from_timestamp
+
+    while end - start > size:
+        start += size
+        window_end = start.isoformat(timespec='milliseconds') + 'Z'
+        windows.append((window_start, window_end))
+        window_start = window_end
+
+    windows.append((window_start, to_timestamp))
+
+    return windows
+
+
 # Make testing easier
 def _now():
     return datetime.now()
@@ -120,9 +169,96 @@ def _now():
 _NOW = _now
 
 
-def get_timestamp(date_string: str = None):
-    if not date_string:
-        return int(_NOW().timestamp() * 1000)
+# Number of distinct seconds kept by the timestamp caches below. Thousands of
+# rows usually share the same second so even a small cache avoids nearly all
+# of the date arithmetic.
+TIMESTAMP_CACHE_SIZE = 4096
+EPOCH = datetime(1970, 1, 1)
+
+_LOG_LINE_SECONDS = {}
+_RECORD_SECONDS = {}
+
+
+def get_cached_seconds(cache: dict, key: str, compute: callable) -> int:
+    seconds = cache.get(key)
+
+    if seconds is None:
+        if len(cache) >= TIMESTAMP_CACHE_SIZE:
+            cache.clear()
+
+        seconds = cache[key] = compute(key)
+
+    return seconds
+
+
+def get_epoch_seconds(
+    year: str,
+    month: str,
+    day: str,
+    hour: str,
+    minute: str,
+    second: str,
+) -> int:
+    # datetime() validates the fields the same way strptime() does
+    return (
+        datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+        ) - EPOCH
+    ) // timedelta(seconds=1)
+
+
+def get_microseconds(fraction: str) -> int:
+    # Returns the microseconds of a 1 to 6 digit fraction the same way the
+    # %f directive of strptime() does or None if the fraction is not valid.
+    if not 0 < len(fraction) <= 6 or not fraction.isdigit():
+        return None
+
+    return int(fraction.ljust(6, '0'))
+
+
+def get_record_seconds(key: str) -> int:
+    # key is the %Y-%m-%dT%H:%M:%S part of the date string followed by the
+    # +HHMM offset
+    offset = (int(key[20:22]) * 3600 + int(key[22:24]) * 60) * \
+        (-1 if key[19] == '-' else 1)
+
+    return get_epoch_seconds(
+        key[0:4],
+        key[5:7],
+        key[8:10],
+        key[11:13],
+        key[14:16],
+        key[17:19],
+    ) - offset
+
+
+def parse_timestamp(date_string: str) -> int:
+    # Fast path for the %Y-%m-%dT%H:%M:%S.%f+HHMM form Salesforce uses
+    if len(date_string) > 25 and date_string[19] == '.' and \
+        date_string[-5] in '+-' and date_string[-4:].isdigit() and \
+        date_string[4] == '-' and date_string[7] == '-' and \
+        date_string[10] == 'T' and date_string[13] == ':' and \
+        date_string[16] == ':':
+        microseconds = get_microseconds(date_string[20:-5])
+
+        if not microseconds is None:
+            try:
+                seconds = get_cached_seconds(
+                    _RECORD_SECONDS,
+                    date_string[:19] + date_string[-5:],
+                    get_record_seconds,
+                )
+
+                # Same arithmetic as datetime.timestamp() so that the results
+                # are identical
+                return int((seconds * 10**6 + microseconds) / 10**6 * 1000)
+            except ValueError:
+                pass
 
     return int(
         datetime.strptime(
@@ -132,15 +268,49 @@ def get_timestamp(date_string: str = None):
     )
 
 
+def get_timestamp(date_string: str = None):
+    if not date_string:
+        return int(_NOW().timestamp() * 1000)
+
+    return parse_timestamp(date_string)
+
+
 def get_log_line_timestamp(log_line: dict) -> float:
-    epoch = log_line.get('TIMESTAMP')
+    return parse_log_line_timestamp(log_line.get('TIMESTAMP'))
+
+
+def get_log_line_seconds(key: str) -> int:
+    # key is the %Y%m%d%H%M%S part of the TIMESTAMP
+    return get_epoch_seconds(
+        key[0:4],
+        key[4:6],
+        key[6:8],
+        key[8:10],
+        key[10:12],
+        key[12:14],
+    )
 
-    if epoch:
-        return pytz.utc.localize(
-            datetime.strptime(epoch, '%Y%m%d%H%M%S.%f')
-        ).replace(microsecond=0).timestamp()
 
-    return _UTCNOW().replace(microsecond=0).timestamp()
+def parse_log_line_timestamp(epoch: str) -> float:
+    if not epoch:
+        return _UTCNOW().replace(microsecond=0).timestamp()
+
+    # Fast path for the %Y%m%d%H%M%S.%f form of log line TIMESTAMPs. The
+    # fraction is only checked since timestamps are whole seconds.
+    if len(epoch) > 15 and epoch[14] == '.' and epoch[:14].isdigit() and \
+        not get_microseconds(epoch[15:]) is None:
+        try:
+            return float(get_cached_seconds(
+                _LOG_LINE_SECONDS,
+                epoch[:14],
+                get_log_line_seconds,
+            ))
+        except ValueError:
+            pass
+
+    return pytz.utc.localize(
+        datetime.strptime(epoch, '%Y%m%d%H%M%S.%f'),
+    ).replace(microsecond=0).timestamp()
 
 
 # NOTE: this sandbox can be jailbroken using the trick to exec statements inside
@@ -1,4 +1,7 @@
+from concurrent.futures import Executor
 from datetime import timedelta
+import gzip
+import io
 import json
 from redis import RedisError
 from requests import Session, RequestException
@@ -9,17 +12,20 @@ from newrelic_logging import \
     DataFormat, \
     LoginException, \
     NewRelicApiException, \
+    PayloadTooLargeException, \
     SalesforceApiException
 from newrelic_logging.api import Api
 from newrelic_logging.auth import Authenticator
 from newrelic_logging.cache import BackendFactory, DataCache
 from newrelic_logging.config import Config
+from newrelic_logging.csv_parser import CsvParser, DEFAULT_READ_SIZE
 from newrelic_logging.factory import Factory
 from newrelic_logging.instance import Instance
 from newrelic_logging.integration import Integration
+from newrelic_logging.json_parser import JsonRecordsParser
 from newrelic_logging.newrelic import NewRelic
 from newrelic_logging.pipeline import Pipeline
-from newrelic_logging.query import Query
+from newrelic_logging.query import get_query_key, Query
 from newrelic_logging.telemetry import Telemetry
 
 
@@ -33,6 +39,11 @@ class ApiStub:
         limits_result: dict = None,
         raise_error = False,
         raise_login_error = False,
+        read_size: int = DEFAULT_READ_SIZE,
+        supports_ranges: bool = True,
+        job_states: list[str] = None,
+        job_results: list[list[str]] = None,
+        sobject_fields: list[dict] = None,
     ):
         self.authenticator = authenticator
         self.api_ver = api_ver
@@ -43,11 +54,25 @@ class ApiStub:
         self.query_api_ver = None
         self.query_api_name = None
         self.next_records_url = None
+        self.next_records_urls = []
+        self.batch_size = None
         self.limits_api_ver = None
         self.log_file_path = None
         self.chunk_size = None
         self.raise_error = raise_error
         self.raise_login_error = raise_login_error
+        self.read_size = read_size
+        self.streamed_pages = []
+        self.supports_ranges = supports_ranges
+        self.ranges = []
+        self.probes = []
+        self.job_states = job_states if job_states else []
+        self.job_results = job_results if job_results else []
+        self.job_soql = None
+        self.job_polls = 0
+        self.job_locators = []
+        self.sobject_fields = sobject_fields if sobject_fields else []
+        self.described = []
 
     def authenticate(self, session: Session):
         if self.raise_login_error:
@@ -61,10 +86,13 @@ class ApiStub:
         soql: str,
         api_ver: str = None,
         api_name: str = None,
+        batch_size: int = None,
+        stream: bool = False,
     ) -> dict:
         self.soql = soql
         self.query_api_ver = api_ver
         self.query_api_name = api_name
+        self.batch_size = batch_size
 
         if self.raise_error:
             raise SalesforceApiException()
@@ -72,14 +100,19 @@ class ApiStub:
         if self.raise_login_error:
             raise LoginException()
 
-        return self.query_result
+        return self.query_stream(self.query_result) if stream \
+            else self.query_result
 
     def query_more(
         self,
         session: Session,
         next_records_url: str,
+        batch_size: int = None,
+        stream: bool = False,
     ) -> dict:
         self.next_records_url = next_records_url
+        self.next_records_urls.append(next_records_url)
+        self.batch_size = batch_size
 
         if self.raise_error:
             raise SalesforceApiException()
@@ -87,16 +120,116 @@ class ApiStub:
         if self.raise_login_error:
             raise LoginException()
 
-        return self.query_result[next_records_url]
+        return self.query_stream(self.query_result[next_records_url]) \
+            if stream else self.query_result[next_records_url]
+
+    def query_stream(self, result: dict) -> JsonRecordsParser:
+        # Nested pages are keyed by their next records URL
+        data = json.dumps({
+            key: value for key, value in result.items() \
+                if not key.startswith('/')
+        }).encode('utf-8')
+
+        page = JsonRecordsParser(io.BytesIO(data).read, self.read_size)
+        self.streamed_pages.append(page)
+
+        return page
+
+    def create_query_job(
+        self,
+        session: Session,
+        soql: str,
+        api_ver: str = None,
+    ) -> dict:
+        self.job_soql = soql
+        self.query_api_ver = api_ver
+
+        if self.raise_error:
+            raise SalesforceApiException()
+
+        if self.raise_login_error:
+            raise LoginException()
+
+        return { 'id': '750000000000001', 'state': 'UploadComplete' }
+
+    def get_query_job(
+        self,
+        session: Session,
+        job_id: str,
+        api_ver: str = None,
+    ) -> dict:
+        state = self.job_states[self.job_polls]
+        self.job_polls += 1
+
+        return { 'id': job_id, 'state': state, 'errorMessage': 'boom' }
+
+    def describe_sobject(
+        self,
+        session: Session,
+        sobject_type: str,
+        api_ver: str = None,
+    ) -> dict:
+        self.described.append(sobject_type)
+
+        return { 'name': sobject_type, 'fields': self.sobject_fields }
+
+    def get_query_job_results(
+        self,
+        session: Session,
+        job_id: str,
+        chunk_size: int,
+        locator: str = None,
+        max_records: int = None,
+        api_ver: str = None,
+    ) -> tuple[CsvParser, str]:
+        self.job_locators.append(locator)
+
+        index = int(locator) if locator else 0
+        data = ''.join(self.job_results[index]).encode('utf-8')
+
+        return (
+            CsvParser(io.BytesIO(data).read, self.read_size),
+            str(index + 1) if index + 1 < len(self.job_results) else None,
+        )
 
     def get_log_file(
         self,
         session: Session,
         log_file_path: str,
         chunk_size: int,
+        offset: int = 0,
+        header: tuple = None,
+        end: int = None,
     ):
         self.log_file_path = log_file_path
         self.chunk_size = chunk_size
+        self.offset = offset
+
+        if not end is None:
+            self.ranges.append((offset, end))
+
+        if self.raise_error or self.raise_login_error:
+            return self.raise_errors()
+
+        data = ''.join(self.lines).encode('utf-8')
+
+        return CsvParser(
+            io.BytesIO(
+                data[offset:] if end is None else data[offset:end + 1]
+            ).read,
+            self.read_size,
+            header=header,
+            offset=offset,
+        )
+
+    def get_log_file_range(
+        self,
+        session: Session,
+        log_file_path: str,
+        start: int,
+        end: int,
+    ) -> bytes:
+        self.probes.append((start, end))
 
         if self.raise_error:
             raise SalesforceApiException()
@@ -104,7 +237,19 @@ class ApiStub:
         if self.raise_login_error:
             raise LoginException()
 
-        yield from self.lines
+        if not self.supports_ranges:
+            return None
+
+        return ''.join(self.lines).encode('utf-8')[start:end + 1]
+
+    def raise_errors(self):
+        if self.raise_error:
+            raise SalesforceApiException()
+
+        if self.raise_login_error:
+            raise LoginException()
+
+        yield
 
     def list_limits(self, session: Session, api_ver: str = None) -> dict:
         self.limits_api_ver = api_ver
@@ -197,6 +342,8 @@ class DataCacheStub:
         cached_logs = {},
         cached_records = [],
         skip_record_ids = [],
+        hourly_file_markers: bool = False,
+        checkpoints: dict = None,
     ):
         self.instance_config = instance_config
         self.backend_factory = backend_factory
@@ -204,20 +351,104 @@ class DataCacheStub:
         self.cached_records = cached_records
         self.skip_record_ids = skip_record_ids
         self.flush_called = False
+        self.wait_called = False
+        self.flushed_log_files = []
+        self.skip_lookups = []
+        self.record_ids_keys = []
+        self.hourly_file_markers = hourly_file_markers
+        self.log_file_markers = []
+        self.written_log_file_markers = []
+        self.log_file_checkpoints = checkpoints is not None
+        self.checkpoints = checkpoints
+        self.delivered = 0
+        self.delivery_callbacks = []
 
     def can_skip_downloading_logfile(self, record_id: str) -> bool:
         return record_id in self.skip_record_ids
 
+    def can_skip_downloading_logfiles(self, record_ids: list) -> list[bool]:
+        self.skip_lookups.append(record_ids)
+        return [
+            self.can_skip_downloading_logfile(record_id) \
+                for record_id in record_ids
+        ]
+
     def check_or_set_log_line(self, record_id: str, row: dict) -> bool:
+        return self.check_or_set_log_line_id(record_id, row['REQUEST_ID'])
+
+    def check_or_set_log_line_id(self, record_id: str, line_id: str) -> bool:
         return record_id in self.cached_logs and \
-            row['REQUEST_ID'] in self.cached_logs[record_id]
+            line_id in self.cached_logs[record_id]
+
+    def check_or_set_log_line_ids(
+        self,
+        record_id: str,
+        line_ids: list,
+    ) -> list[bool]:
+        return [
+            self.check_or_set_log_line_id(record_id, line_id) \
+                for line_id in line_ids
+        ]
 
     def check_or_set_record_id(self, record_id: str) -> bool:
         return record_id in self.cached_records
 
+    def get_record_ids_key(self, query_key: str, timestamp: int) -> str:
+        if timestamp is None:
+            return f'record_ids:{query_key}:undated'
+
+        return f'record_ids:{query_key}:{timestamp // 3600000}'
+
+    def check_or_set_record_ids(
+        self,
+        record_ids: list,
+        keys: list = None,
+    ) -> list[bool]:
+        self.record_ids_keys.append(keys)
+        return [
+            self.check_or_set_record_id(record_id) \
+                for record_id in record_ids
+        ]
+
+    def get_log_file_checkpoint(self, record_id: str) -> dict:
+        return self.checkpoints.get(record_id)
+
+    def put_log_file_checkpoint(self, record_id: str, checkpoint: dict) -> None:
+        self.checkpoints[record_id] = checkpoint
+
+    def delete_log_file_checkpoint(self, record_id: str) -> None:
+        self.checkpoints.pop(record_id, None)
+
+    def track_delivery(self, iter):
+        yield from iter
+
+    def on_delivered(self, callback: callable) -> None:
+        self.delivery_callbacks.append(callback)
+
+    def set_delivered(self, count: int) -> None:
+        self.delivered += count
+
+        for callback in self.delivery_callbacks:
+            callback()
+
+        self.delivery_callbacks = []
+
+    def add_log_file_marker(self, record_id: str) -> None:
+        self.log_file_markers.append(record_id)
+
+    def write_log_file_markers(self) -> None:
+        self.written_log_file_markers.extend(self.log_file_markers)
+        self.log_file_markers = []
+
+    def flush_log_file(self, record_id: str) -> None:
+        self.flushed_log_files.append(record_id)
+
     def flush(self) -> None:
         self.flush_called = True
 
+    def wait(self) -> None:
+        self.wait_called = True
+
 
 class NewRelicStub:
     def __init__(
@@ -225,25 +456,42 @@ class NewRelicStub:
         config: Config = None,
         data_format: DataFormat = None,
         raise_error: bool = False,
+        max_records_per_post: int = None,
     ):
         self.config = config
         self.data_format = data_format
         self.logs = []
         self.events = []
         self.raise_error = raise_error
+        self.max_records_per_post = max_records_per_post
+        self.rejected = 0
+
+    def check_too_large(self, records: list[dict]) -> None:
+        if self.max_records_per_post and \
+            len(records) > self.max_records_per_post:
+            self.rejected += 1
+            raise PayloadTooLargeException()
 
     def post_logs(self, session: Session, data: list[dict]) -> None:
         if self.raise_error:
             raise NewRelicApiException()
 
+        self.check_too_large(data[0]['logs'])
         self.logs.append(data)
 
     def post_events(self, session: Session, events: list[dict]) -> None:
         if self.raise_error:
             raise NewRelicApiException()
 
+        self.check_too_large(events)
         self.events.append(events)
 
+    def post_logs_payload(self, session: Session, encoder) -> None:
+        self.post_logs(session, json.loads(gzip.decompress(encoder.finish())))
+
+    def post_events_payload(self, session: Session, encoder) -> None:
+        self.post_events(session, json.loads(gzip.decompress(encoder.finish())))
+
 
 class QueryStub:
     def __init__(
@@ -284,6 +532,12 @@ class QueryStub:
 
         return self.config
 
+    def get_key(self):
+        if self.wrapped:
+            return self.wrapped.get_key()
+
+        return get_query_key(self.query)
+
     def execute(self, session: Session = None):
         if self.raise_error:
             raise SalesforceApiException()
@@ -305,6 +559,7 @@ class QueryFactoryStub:
         self.query = query
         self.queries = [] if not query else None
         self.wrap = wrap
+        self.time_ranges = []
 
     def new(
         self,
@@ -313,7 +568,10 @@ class QueryFactoryStub:
         time_lag_minutes: int = 0,
         last_to_timestamp: str = '',
         generation_interval: str = '',
+        to_timestamp: str = None,
     ) -> Query:
+        self.time_ranges.append((last_to_timestamp, to_timestamp))
+
         if self.query:
             return self.query
 
@@ -336,7 +594,7 @@ class PipelineStub:
         new_relic: NewRelic = None,
         data_format: DataFormat = DataFormat.LOGS,
         labels: dict = {},
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
         raise_error: bool = False,
         raise_login_error: bool = False,
         raise_newrelic_error: bool = False,
@@ -346,7 +604,7 @@ class PipelineStub:
         self.new_relic = new_relic
         self.data_format = data_format
         self.labels = labels
-        self.numeric_fields_list = numeric_fields_list
+        self.numeric_fields_mapping = numeric_fields_mapping
         self.queries = []
         self.executed = False
         self.raise_error = raise_error
@@ -372,12 +630,21 @@ class PipelineStub:
 
         self.executed = True
 
+    def execute_threads(
+        self,
+        session: Session,
+        upload_executor: Executor,
+        max_pending_uploads: int,
+    ):
+        self.execute(session)
+
 
 class RedisStub:
     def __init__(self, test_cache, raise_error = False):
         self.expiry = {}
         self.test_cache = test_cache
         self.raise_error = raise_error
+        self.pipelines = []
 
     def exists(self, key):
         if self.raise_error:
@@ -403,6 +670,12 @@ class RedisStub:
 
         return self.test_cache[key]
 
+    def sismember(self, key, value):
+        return value in self.smembers(key)
+
+    def scard(self, key):
+        return len(self.smembers(key))
+
     def sadd(self, key, *values):
         if self.raise_error:
             raise RedisError('raise_error set')
@@ -422,26 +695,105 @@ class RedisStub:
 
         self.expiry[key] = time
 
+    def pipeline(self, transaction=True):
+        return RedisPipelineStub(self)
+
+
+class RedisPipelineStub:
+    def __init__(self, redis: RedisStub):
+        self.redis = redis
+        self.commands = []
+        self.executed = []
+
+    def set(self, key, item, ex=None):
+        self.commands.append(('set', key, item, ex))
+
+    def sadd(self, key, *values):
+        self.commands.append(('sadd', key, values))
+
+    def expire(self, key, time):
+        self.commands.append(('expire', key, time))
+
+    def exists(self, key):
+        self.commands.append(('exists', key))
+
+    def sismember(self, key, value):
+        self.commands.append(('sismember', key, value))
+
+    def execute(self):
+        self.executed.append(self.commands)
+        self.redis.pipelines.append(self.commands)
+        results = []
+
+        for command in self.commands:
+            if command[0] == 'exists':
+                results.append(1 if self.redis.exists(command[1]) else 0)
+                continue
+
+            if command[0] == 'sismember':
+                results.append(self.redis.sismember(command[1], command[2]))
+                continue
+
+            results.append(True)
+
+            if command[0] == 'set':
+                self.redis.set(command[1], command[2])
+                if command[3]:
+                    self.redis.expire(command[1], command[3])
+            elif command[0] == 'sadd':
+                self.redis.sadd(command[1], *command[2])
+            else:
+                self.redis.expire(command[1], command[2])
+
+        self.commands = []
+
+        return results
+
 
 class BackendStub:
     def __init__(self, test_cache, raise_error = False):
         self.redis = RedisStub(test_cache, raise_error)
+        self.get_set_keys = []
+        self.lookups = []
 
     def exists(self, key):
         return self.redis.exists(key)
 
+    def exists_many(self, keys: list) -> list[bool]:
+        self.lookups.append(('exists', keys))
+        return [self.redis.exists(key) for key in keys]
+
+    def set_contains(self, key, values: list) -> list[bool]:
+        self.lookups.append((key, values))
+        return [self.redis.sismember(key, value) for value in values]
+
     def put(self, key, item):
         self.redis.set(key, item)
 
     def get_set(self, key):
+        self.get_set_keys.append(key)
         return self.redis.smembers(key)
 
+    def set_size(self, key) -> int:
+        return self.redis.scard(key)
+
     def set_add(self, key, *values):
         self.redis.sadd(key, *values)
 
     def set_expiry(self, key, days):
         self.redis.expire(key, timedelta(days=days))
 
+    def write(self, keys: list, sets: dict, days: int) -> None:
+        for key in keys:
+            self.put(key, 1)
+            self.set_expiry(key, days)
+
+        for key, values in sets.items():
+            if len(values) > 0:
+                self.set_add(key, *values)
+
+            self.set_expiry(key, days)
+
 
 class BackendFactoryStub:
     def __init__(self, raise_error = False):
@@ -477,16 +829,43 @@ class MultiRequestSessionStub:
         return self.responses[self.count - 1]
 
 
+class RawStub:
+    def __init__(self, data: bytes):
+        self.stream = io.BytesIO(data)
+        self.read_sizes = []
+        self.decode_content = None
+
+    def read(self, amt: int = None, decode_content: bool = None) -> bytes:
+        self.read_sizes.append(amt)
+        self.decode_content = decode_content
+        return self.stream.read(amt)
+
+
 class ResponseStub:
-    def __init__(self, status_code, reason, text, lines, encoding=None):
+    def __init__(
+        self,
+        status_code,
+        reason,
+        text,
+        lines,
+        encoding=None,
+        headers=None,
+    ):
         self.status_code = status_code
         self.reason = reason
         self.text = text
         self.lines = lines
+        self.raw = RawStub('\n'.join(lines).encode('utf-8'))
         self.chunk_size = None
         self.decode_unicode = None
         self.encoding = encoding
         self.iter_lines_called = False
+        self.content = text.encode('utf-8') if type(text) is str else b''
+        self.closed = False
+        self.headers = headers if headers else {}
+
+    def close(self):
+        self.closed = True
 
     def iter_lines(self, *args, **kwargs):
         self.iter_lines_called = True
@@ -512,7 +891,7 @@ class InstanceStub:
         new_relic: NewRelic = None,
         receivers: list[callable] = [],
         labels: dict = {},
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
         api: Api = None,
         pipeline: Pipeline = None,
         queries: list[dict] = None,
@@ -528,7 +907,7 @@ class InstanceStub:
         self.new_relic = new_relic
         self.receivers = receivers
         self.labels = labels
-        self.numeric_fields_list = numeric_fields_list
+        self.numeric_fields_mapping = numeric_fields_mapping
         self.api = api
         self.pipeline = pipeline
         self.queries = queries
@@ -557,17 +936,25 @@ class InstanceStub:
 
         self.harvest_called = True
 
+    def harvest_threads(
+        self,
+        session: Session,
+        upload_executor: Executor,
+        max_pending_uploads: int,
+    ):
+        self.harvest(session)
+
 
 class IntegrationStub:
     def __init__(
         self,
         config: Config = Config({}),
         receivers: list[callable] = [],
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
     ):
         self.config = config
         self.receivers = receivers
-        self.numeric_fields_list = numeric_fields_list
+        self.numeric_fields_mapping = numeric_fields_mapping
 
 class ReceiverStub:
     def __init__(
@@ -586,6 +973,7 @@ class ReceiverStub:
         self.raise_login_error = raise_login_error
         self.raise_error = raise_error
         self.logs = logs
+        self.watermarks_saved = False
 
     def execute(
         self,
@@ -601,6 +989,9 @@ class ReceiverStub:
 
         yield from self.logs
 
+    def save_watermarks(self) -> None:
+        self.watermarks_saved = True
+
 
 class SessionStub:
     def __init__(self, raise_error=False, raise_connection_error=False):
@@ -610,6 +1001,7 @@ class SessionStub:
         self.headers = None
         self.url = None
         self.stream = None
+        self.data = None
 
     def get(self, *args, **kwargs):
         self.url = args[0]
@@ -625,6 +1017,16 @@ class SessionStub:
 
         return self.response
 
+    def post(self, *args, **kwargs):
+        self.url = args[0]
+        self.headers = kwargs['headers']
+        self.data = kwargs['data']
+
+        if self.raise_error:
+            raise RequestException('raise_error set')
+
+        return self.response
+
 
 class TelemetryStub:
     def __init__(
@@ -693,6 +1095,7 @@ class FactoryStub:
         self,
         instance_config: Config,
         backend_factory: BackendFactory,
+        namespace: str = '',
     ) -> DataCache:
         if self.data_cache:
             return self.data_cache
@@ -722,7 +1125,7 @@ class FactoryStub:
         new_relic: NewRelic,
         data_format: DataFormat,
         labels: dict,
-        numeric_fields_list: set,
+        numeric_fields_mapping: dict,
     ) -> Pipeline:
         if self.pipeline:
             return self.pipeline
@@ -733,7 +1136,7 @@ class FactoryStub:
             new_relic,
             data_format,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
     def new_instance(
@@ -745,7 +1148,7 @@ class FactoryStub:
         new_relic: NewRelic,
         receivers: list[callable],
         labels: dict,
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
     ) -> Instance:
         if self.instance:
             return self.instance
@@ -757,7 +1160,7 @@ class FactoryStub:
             new_relic,
             receivers,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
     def new_integration(
@@ -765,7 +1168,7 @@ class FactoryStub:
         factory,
         config: Config,
         receivers: list[callable],
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
     ) -> Integration:
         if self.integration:
             return self.integration
@@ -773,7 +1176,7 @@ class FactoryStub:
         return IntegrationStub(
             config,
             receivers,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
     def new_new_relic(self, config: Config, data_format: DataFormat):
@@ -828,11 +1231,16 @@ class DelegatingFactoryStub:
         self,
         instance_config: Config,
         backend_factory: BackendFactory,
+        namespace: str = '',
     ) -> DataCache:
         if self.data_cache:
             return self.data_cache
 
-        return self.f.new_data_cache(instance_config, backend_factory)
+        return self.f.new_data_cache(
+            instance_config,
+            backend_factory,
+            namespace,
+        )
 
     def new_authenticator(
         self,
@@ -857,7 +1265,7 @@ class DelegatingFactoryStub:
         new_relic: NewRelic,
         data_format: DataFormat,
         labels: dict,
-        numeric_fields_list: set,
+        numeric_fields_mapping: dict,
     ) -> Pipeline:
         if self.pipeline:
             return self.pipeline
@@ -868,7 +1276,7 @@ class DelegatingFactoryStub:
             new_relic,
             data_format,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
     def new_instance(
@@ -880,7 +1288,7 @@ class DelegatingFactoryStub:
         new_relic: NewRelic,
         receivers: list[callable],
         labels: dict,
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
     ) -> Instance:
         if self.instance:
             return self.instance
@@ -893,7 +1301,7 @@ class DelegatingFactoryStub:
             new_relic,
             receivers,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
     def new_integration(
@@ -901,7 +1309,7 @@ class DelegatingFactoryStub:
         factory,
         config: Config,
         receivers: list[callable],
-        numeric_fields_list: set = set(),
+        numeric_fields_mapping: dict = {},
     ) -> Integration:
         if self.integration:
             return self.integration
@@ -910,7 +1318,7 @@ class DelegatingFactoryStub:
             factory,
             config,
             receivers,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
     def new_new_relic(self, config: Config, data_format: DataFormat):
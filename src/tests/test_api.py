@@ -1,7 +1,12 @@
+import json
 from requests import Session
 import unittest
 
-from newrelic_logging import api, SalesforceApiException, LoginException
+from newrelic_logging import \
+    api, \
+    ApiCallBudgetException, \
+    SalesforceApiException, \
+    LoginException
 from . import \
     AuthenticatorStub, \
     ResponseStub, \
@@ -498,6 +503,32 @@ class TestApi(unittest.TestCase):
         self.assertTrue(response.decode_unicode)
         self.assertTrue(response.iter_lines_called)
 
+    def test_stream_rows_sets_fallback_encoding_and_returns_csv_parser(self):
+        '''
+        stream_rows() sets a default encoding on the response and returns a CSV parser over the raw response
+        given: a response
+        and given: a read size
+        when: stream_rows() is called
+        then: fallback utf-8 is used
+        and: a CSV parser that reads the raw response with the given read size is returned
+        '''
+
+        # setup
+        response = ResponseStub(
+            200,
+            'OK',
+            'OK',
+            ['"COL1","COL2"', '"foo","bar"'],
+        )
+
+        # execute
+        rows = api.stream_rows(response, 1024)
+
+        # verify
+        self.assertEqual(response.encoding, 'utf-8')
+        self.assertEqual(list(rows), [('COL1', 'COL2'), ('foo', 'bar')])
+        self.assertEqual(response.raw.read_sizes[0], 1024)
+
     def test_get_query_api_path_returns_rest_api_path_given_api_ver_and_rest_api_name(self):
         '''
         get_query_api_path() returns the ReST API query path given an api version and the rest API name
@@ -726,6 +757,99 @@ class TestApi(unittest.TestCase):
         self.assertTrue('foo' in resp)
         self.assertEqual(resp['foo'], 'bar')
 
+    def test_query_and_query_more_send_batch_size_in_query_options_header(self):
+        '''
+        query() and query_more() request pages of the given batch size with the Sforce-Query-Options header
+        given: an authenticator
+        and given: a session
+        and given: a query
+        and given: a batch size
+        when: query() or query_more() is called
+        then: session.get() is called with the Sforce-Query-Options header for the batch size
+        and when: no batch size is given
+        then: session.get() is called without the Sforce-Query-Options header
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(200, 'OK', '{"records": []}', [])
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        sf_api.query(session, 'SELECT+Id+FROM+Account', batch_size=500)
+
+        # verify
+        self.assertEqual(session.headers['Sforce-Query-Options'], 'batchSize=500')
+
+        # execute
+        sf_api.query_more(session, '/services/data/v55.0/query/01gA-2000', 500)
+
+        # verify
+        self.assertEqual(session.headers['Sforce-Query-Options'], 'batchSize=500')
+
+        # execute
+        sf_api.query_more(session, '/services/data/v55.0/query/01gA-4000')
+
+        # verify
+        self.assertFalse('Sforce-Query-Options' in session.headers)
+
+    def test_query_and_query_more_return_records_parser_given_stream(self):
+        '''
+        query() and query_more() return a parser over the records of the response when stream is set
+        given: an authenticator
+        and given: a session
+        and given: a query
+        when: query() or query_more() is called
+        and when: stream is True
+        then: session.get() is called with the stream flag set
+        and: returns a parser over the records of the response
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '',
+            [ '{"done": true, "records": [{"Id": "001A"}]}' ],
+        )
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        page = sf_api.query(session, 'SELECT+Id+FROM+Account', stream=True)
+
+        # verify
+        self.assertTrue(session.stream)
+        self.assertEqual(list(page), [{ 'Id': '001A' }])
+        self.assertEqual(page.fields, { 'done': True })
+
+        # setup
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '',
+            [ '{"done": true, "records": [{"Id": "001B"}]}' ],
+        )
+
+        # execute
+        page = sf_api.query_more(
+            session,
+            '/services/data/v55.0/query/01gA-2000',
+            stream=True,
+        )
+
+        # verify
+        self.assertTrue(session.stream)
+        self.assertEqual(list(page), [{ 'Id': '001B' }])
+
     def test_query_raises_salesforce_api_exception_if_get_query_api_path_does(self):
         '''
         query() raises a SalesforceApiException if get_query_api_path() does
@@ -956,6 +1080,161 @@ class TestApi(unittest.TestCase):
         self.assertEqual(session.headers['Authorization'], 'Bearer 123456')
         self.assertFalse(session.stream)
 
+    def test_create_query_job_posts_query_job_and_returns_json_response_on_success(self):
+        '''
+        create_query_job() posts a query job for the query to the Bulk API and returns the JSON response
+        given: an authenticator
+        and given: a session
+        and given: a query
+        and given: an api version
+        when: create_query_job() is called
+        then: session.post() is called with the query jobs URL and access token
+        and: the body is a JSON query job for the query
+        and: returns the JSON response
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '{"id": "750A", "state": "UploadComplete"}',
+            [],
+        )
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        resp = sf_api.create_query_job(session, 'SELECT Id FROM Account', '52.0')
+
+        # verify
+        self.assertEqual(
+            session.url,
+            'https://my.salesforce.test/services/data/v52.0/jobs/query',
+        )
+        self.assertEqual(session.headers['Authorization'], 'Bearer 123456')
+        self.assertEqual(session.headers['Content-Type'], 'application/json')
+        self.assertEqual(
+            json.loads(session.data),
+            { 'operation': 'query', 'query': 'SELECT Id FROM Account' },
+        )
+        self.assertEqual(resp, { 'id': '750A', 'state': 'UploadComplete' })
+
+    def test_describe_sobject_gets_describe_and_returns_json_response_on_success(self):
+        '''
+        describe_sobject() requests the describe of an object and returns the JSON response
+        given: an authenticator
+        and given: a session
+        and given: an object type
+        and given: an api version
+        when: describe_sobject() is called
+        then: session.get() is called with the describe URL and access token
+        and: returns the JSON response
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '{"name": "Account", "fields": [{"name": "Id", "type": "id"}]}',
+            [],
+        )
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        resp = sf_api.describe_sobject(session, 'Account', '52.0')
+
+        # verify
+        self.assertEqual(
+            session.url,
+            'https://my.salesforce.test/services/data/v52.0/sobjects/Account/describe',
+        )
+        self.assertEqual(session.headers['Authorization'], 'Bearer 123456')
+        self.assertEqual(
+            resp,
+            { 'name': 'Account', 'fields': [{ 'name': 'Id', 'type': 'id' }] },
+        )
+        self.assertEqual(sf_api.calls, 1)
+
+    def test_get_query_job_results_requests_csv_results_and_returns_parser_and_next_locator(self):
+        '''
+        get_query_job_results() requests the CSV results of a query job and returns a parser over the results and the next locator
+        given: an authenticator
+        and given: a session
+        and given: a query job ID
+        and given: a chunk size
+        and given: a locator
+        and given: a maximum number of records
+        when: get_query_job_results() is called
+        then: session.get() is called with the job results URL for the locator and maximum number of records
+        and: CSV results are requested
+        and: returns a parser over the results
+        and: returns the locator of the next results
+        and when: the locator header is null
+        then: returns None for the next locator
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '',
+            [ '"Id","Name"', '"001A","Acme"' ],
+            headers={ 'Sforce-Locator': 'MTAwMDA' },
+        )
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        rows, locator = sf_api.get_query_job_results(
+            session,
+            '750A',
+            8192,
+            'NTAwMDA',
+            10000,
+        )
+
+        # verify
+        self.assertEqual(
+            session.url,
+            'https://my.salesforce.test/services/data/v55.0/jobs/query/750A/results?locator=NTAwMDA&maxRecords=10000',
+        )
+        self.assertEqual(session.headers['Accept'], 'text/csv')
+        self.assertTrue(session.stream)
+        self.assertEqual(list(rows), [('Id', 'Name'), ('001A', 'Acme')])
+        self.assertEqual(locator, 'MTAwMDA')
+
+        # setup
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '',
+            [ '"Id","Name"' ],
+            headers={ 'Sforce-Locator': 'null' },
+        )
+
+        # execute
+        rows, locator = sf_api.get_query_job_results(session, '750A', 8192)
+
+        # verify
+        self.assertEqual(
+            session.url,
+            'https://my.salesforce.test/services/data/v55.0/jobs/query/750A/results',
+        )
+        self.assertIsNone(locator)
+
     def test_get_log_file_requests_correct_url_with_access_token_and_returns_generator_on_success(self):
         '''
         get_log_file() calls the correct url with the access token and returns a generator iterator
@@ -970,8 +1249,8 @@ class TestApi(unittest.TestCase):
         and when: response status code is 200
         and when: get() returns a response
         then: calls callback with response
-        and: iter_lines is called with the correct chunk size
-        and: returns a generator iterator
+        and: the raw response is read with the correct chunk size
+        and: returns an iterator over the CSV rows
         '''
 
         # setup
@@ -1004,17 +1283,222 @@ class TestApi(unittest.TestCase):
         self.assertEqual(session.headers['Authorization'], 'Bearer 123456')
         self.assertTrue(session.stream)
         self.assertIsNotNone(resp)
-        line = next(resp)
-        self.assertEqual('COL1,COL2,COL3', line)
-        line = next(resp)
-        self.assertEqual('foo,bar,baz', line)
-        line = next(resp, None)
-        self.assertIsNone(line)
-        # NOTE: this has to be done _after_ the generator iterator is called at
-        # least once since the generator function is not run until the first
-        # call to next()
-        self.assertTrue(session.response.iter_lines_called)
-        self.assertEqual(session.response.chunk_size, 8192)
+        rows = iter(resp)
+        row = next(rows)
+        self.assertEqual(('COL1', 'COL2', 'COL3'), row)
+        row = next(rows)
+        self.assertEqual(('foo', 'bar', 'baz'), row)
+        row = next(rows, None)
+        self.assertIsNone(row)
+        # NOTE: this has to be done _after_ the iterator is called at least
+        # once since the response is not read until the first call to next()
+        self.assertEqual(session.response.raw.read_sizes[0], 8192)
+        self.assertTrue(session.response.raw.decode_content)
+
+    def test_get_log_file_requests_range_given_offset(self):
+        '''
+        get_log_file() requests the log file from the given offset with a range request
+        given: an authenticator
+        and given: a session
+        and given: a log file path
+        and given: a chunk size
+        and given: an offset
+        and given: a header row
+        when: get_log_file() is called
+        then: session.get() is called with a Range header for the offset
+        and: compression is disabled
+        and when: response status code is 206
+        then: returns a parser over the rest of the log file starting with the given header
+        and when: response status code is 200
+        then: returns a parser over the whole log file
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(
+            206,
+            'Partial Content',
+            '',
+            [ 'foo,bar,baz' ],
+        )
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        resp = sf_api.get_log_file(
+            session,
+            '/services/data/v52.0/sobjects/EventLogFile/00001111AAAABBBB/LogFile',
+            8192,
+            1024,
+            ('COL1', 'COL2', 'COL3'),
+        )
+
+        # verify
+        self.assertEqual(session.headers['Authorization'], 'Bearer 123456')
+        self.assertEqual(session.headers['Range'], 'bytes=1024-')
+        self.assertEqual(session.headers['Accept-Encoding'], 'identity')
+        self.assertEqual(resp.offset, 1024)
+        self.assertEqual(
+            list(resp),
+            [('COL1', 'COL2', 'COL3'), ('foo', 'bar', 'baz')],
+        )
+
+        # setup
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '',
+            [ 'COL1,COL2,COL3', 'foo,bar,baz' ],
+        )
+
+        # execute
+        resp = sf_api.get_log_file(
+            session,
+            '/services/data/v52.0/sobjects/EventLogFile/00001111AAAABBBB/LogFile',
+            8192,
+            1024,
+            ('COL1', 'COL2', 'COL3'),
+        )
+
+        # verify
+        self.assertEqual(resp.offset, 0)
+        self.assertEqual(
+            list(resp),
+            [('COL1', 'COL2', 'COL3'), ('foo', 'bar', 'baz')],
+        )
+
+    def test_get_log_file_requests_bounded_range_given_end(self):
+        '''
+        get_log_file() requests only the given byte range of the log file when an end is given
+        given: an authenticator
+        and given: a session
+        and given: a log file path
+        and given: a chunk size
+        and given: an offset
+        and given: a header row
+        and given: an end
+        when: get_log_file() is called
+        then: session.get() is called with a Range header for the offset and end
+        and when: response status code is 206
+        then: returns a parser over the range starting with the given header
+        and when: response status code is 200
+        then: raises a SalesforceApiException
+        and: the response is closed
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(
+            206,
+            'Partial Content',
+            '',
+            [ 'foo,bar,baz' ],
+        )
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        resp = sf_api.get_log_file(
+            session,
+            '/services/data/v52.0/sobjects/EventLogFile/00001111AAAABBBB/LogFile',
+            8192,
+            1024,
+            ('COL1', 'COL2', 'COL3'),
+            2047,
+        )
+
+        # verify
+        self.assertEqual(session.headers['Range'], 'bytes=1024-2047')
+        self.assertEqual(session.headers['Accept-Encoding'], 'identity')
+        self.assertEqual(resp.offset, 1024)
+        self.assertEqual(
+            list(resp),
+            [('COL1', 'COL2', 'COL3'), ('foo', 'bar', 'baz')],
+        )
+
+        # setup
+        session.response = ResponseStub(
+            200,
+            'OK',
+            '',
+            [ 'COL1,COL2,COL3', 'foo,bar,baz' ],
+        )
+
+        # execute / verify
+        with self.assertRaises(SalesforceApiException) as _:
+            sf_api.get_log_file(
+                session,
+                '/services/data/v52.0/sobjects/EventLogFile/00001111AAAABBBB/LogFile',
+                8192,
+                0,
+                None,
+                2047,
+            )
+
+        self.assertEqual(session.headers['Range'], 'bytes=0-2047')
+        self.assertTrue(session.response.closed)
+
+    def test_get_log_file_range_returns_bytes_of_range(self):
+        '''
+        get_log_file_range() returns the bytes of the given range of the log file
+        given: an authenticator
+        and given: a session
+        and given: a log file path
+        and given: a start and end
+        when: get_log_file_range() is called
+        then: session.get() is called with a Range header for the start and end
+        and: compression is disabled
+        and when: response status code is 206
+        then: returns the response content
+        and when: response status code is 200
+        then: returns None
+        and: the response is closed
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(206, 'Partial Content', 'foo,bar', [])
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+        data = sf_api.get_log_file_range(
+            session,
+            '/services/data/v52.0/sobjects/EventLogFile/00001111AAAABBBB/LogFile',
+            1024,
+            2047,
+        )
+
+        # verify
+        self.assertEqual(session.headers['Authorization'], 'Bearer 123456')
+        self.assertEqual(session.headers['Range'], 'bytes=1024-2047')
+        self.assertEqual(session.headers['Accept-Encoding'], 'identity')
+        self.assertTrue(session.stream)
+        self.assertEqual(data, b'foo,bar')
+
+        # setup
+        session.response = ResponseStub(200, 'OK', 'foo,bar', [])
+
+        # execute
+        data = sf_api.get_log_file_range(
+            session,
+            '/services/data/v52.0/sobjects/EventLogFile/00001111AAAABBBB/LogFile',
+            1024,
+            2047,
+        )
+
+        # verify
+        self.assertIsNone(data)
+        self.assertTrue(session.response.closed)
 
     def test_get_log_file_raises_login_exception_if_get_does(self):
         '''
@@ -1261,3 +1745,55 @@ class TestApi(unittest.TestCase):
         self.assertTrue('Authorization' in session.headers)
         self.assertEqual(session.headers['Authorization'], 'Bearer 123456')
         self.assertFalse(session.stream)
+
+    def test_api_counts_calls_and_raises_once_max_calls_are_made(self):
+        '''
+        Api counts every API operation and raises an ApiCallBudgetException once max_calls operations have been made
+        given: an authenticator
+        and given: a session
+        and given: a max_calls value of 2
+        when: 2 API operations are called
+        then: both operations send a request and are counted in calls
+        and when: another API operation is called
+        then: raises an ApiCallBudgetException without sending a request
+        and: the exception is a SalesforceApiException
+        '''
+
+        # setup
+        auth = AuthenticatorStub(
+            instance_url='https://my.salesforce.test',
+            access_token='123456',
+        )
+        session = SessionStub()
+        session.response = ResponseStub(200, 'OK', '{"foo": "bar"}', [] )
+
+        sf_api = api.Api(auth, '55.0', 2)
+
+        # execute
+        sf_api.list_limits(session)
+        sf_api.query(session, 'SELECT+Id+FROM+Account')
+
+        # verify
+        self.assertEqual(sf_api.calls, 2)
+
+        # setup
+        session.url = None
+
+        # execute / verify
+        with self.assertRaises(ApiCallBudgetException) as _:
+            sf_api.query_more(session, '/services/data/v55.0/query/01gA-2000')
+
+        self.assertTrue(
+            issubclass(ApiCallBudgetException, SalesforceApiException),
+        )
+        self.assertIsNone(session.url)
+        self.assertEqual(sf_api.calls, 2)
+
+        # execute
+        sf_api = api.Api(auth, '55.0')
+
+        for _ in range(0, 3):
+            sf_api.list_limits(session)
+
+        # verify
+        self.assertEqual(sf_api.calls, 3)
@@ -0,0 +1,301 @@
+import os
+import tempfile
+import unittest
+
+
+from . import AuthenticatorStub, DataCacheStub, QueryFactoryStub
+from newrelic_logging import \
+    ApiCallBudgetException, \
+    ConfigException, \
+    api as mod_api, \
+    backfill, \
+    config as mod_config
+from newrelic_logging.query import receiver
+from newrelic_logging.query.watermark import \
+    FileWatermarkStore, \
+    PrefixedWatermarkStore
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse_backfill_date_returns_date_in_query_format(self):
+        '''
+        parse_backfill_date() returns a date in ISO-8601 format in the format used for query time ranges
+        given: a date
+        or given: a date and time
+        or given: a date and time with a time zone
+        when: parse_backfill_date() is called
+        then: returns the date and time in UTC with milliseconds and a Z suffix
+        and when: the date is not valid
+        then: raises a ConfigException
+        '''
+
+        # execute / verify
+        self.assertEqual(
+            backfill.parse_backfill_date('2024-03-01'),
+            '2024-03-01T00:00:00.000Z',
+        )
+        self.assertEqual(
+            backfill.parse_backfill_date('2024-03-01T12:30'),
+            '2024-03-01T12:30:00.000Z',
+        )
+        self.assertEqual(
+            backfill.parse_backfill_date('2024-03-01T12:30:00Z'),
+            '2024-03-01T12:30:00.000Z',
+        )
+        self.assertEqual(
+            backfill.parse_backfill_date('2024-03-01T12:30:00-05:00'),
+            '2024-03-01T17:30:00.000Z',
+        )
+
+        with self.assertRaises(ConfigException) as _:
+            backfill.parse_backfill_date('2024-02-30')
+
+    def test_get_instance_index_returns_index_of_instance(self):
+        '''
+        get_instance_index() returns the position of the instance to backfill
+        given: a config with 2 instances
+        when: get_instance_index() is called with the name of an instance
+        then: returns the position of the instance
+        and when: the instance does not exist
+        then: raises a ConfigException
+        and when: no instance name is given
+        then: raises a ConfigException
+        and when: the config has a single instance and no name is given
+        then: returns 0
+        '''
+
+        # setup
+        config = mod_config.Config({
+            'instances': [{ 'name': 'foo' }, { 'name': 'bar' }],
+        })
+
+        # execute / verify
+        self.assertEqual(backfill.get_instance_index(config, 'bar'), 1)
+
+        with self.assertRaises(ConfigException) as _:
+            backfill.get_instance_index(config, 'beep')
+
+        with self.assertRaises(ConfigException) as _:
+            backfill.get_instance_index(config)
+
+        self.assertEqual(
+            backfill.get_instance_index(
+                mod_config.Config({ 'instances': [{ 'name': 'foo' }] }),
+            ),
+            0,
+        )
+
+    def test_backfill_raises_given_empty_time_range(self):
+        '''
+        Backfill raises a ConfigException if the start date is not before the end date
+        given: a start date
+        and given: an end date that is the same as the start date
+        when: a Backfill is created
+        then: raises a ConfigException
+        '''
+
+        # execute / verify
+        with self.assertRaises(ConfigException) as _:
+            backfill.Backfill(
+                '2024-03-01T00:00:00.000Z',
+                '2024-03-01T00:00:00.000Z',
+            )
+
+    def test_backfill_new_create_receiver_func_configures_receiver(self):
+        '''
+        Backfill.new_create_receiver_func() returns a function creating query receivers for the backfill
+        given: a backfill of a time range
+        and given: a set of event types
+        and given: a max API calls value
+        and given: a concurrency value
+        and given: a backfill file
+        and given: an instance config that sets download_concurrency
+        when: the returned function is called
+        then: the receiver queries the time range in hourly windows
+        and: the windows are processed concurrency at a time
+        and: the download concurrency of the instance is kept
+        and: the instance config is not changed
+        and: only the given event types are exported
+        and: the progress is kept in the backfill file under prefixed query keys
+        and: the api raises once the max API calls have been made
+        '''
+
+        # setup
+        path = os.path.join(self.tmp.name, 'backfill.json')
+        b = backfill.Backfill(
+            '2024-03-01T00:00:00.000Z',
+            '2024-03-03T00:00:00.000Z',
+            'foo',
+            event_types=set(['Login']),
+            max_api_calls=100,
+            concurrency=8,
+            backfill_file=path,
+        )
+        instance_config = mod_config.Config({ 'download_concurrency': 2 })
+        api = mod_api.Api(AuthenticatorStub(), '55.0')
+        create_receiver = receiver.new_create_receiver_func(
+            mod_config.Config({}),
+            QueryFactoryStub(),
+            {},
+            0,
+        )
+
+        # execute
+        r = b.new_create_receiver_func(create_receiver)(
+            instance_config,
+            DataCacheStub(),
+            api,
+        )
+
+        # verify
+        self.assertEqual(r.last_to_timestamp, '2024-03-01T00:00:00.000Z')
+        self.assertEqual(r.to_timestamp, '2024-03-03T00:00:00.000Z')
+        self.assertEqual(
+            r.window_minutes,
+            backfill.DEFAULT_BACKFILL_WINDOW_MINUTES,
+        )
+        self.assertEqual(r.window_concurrency, 8)
+        self.assertEqual(r.download_concurrency, 2)
+        self.assertEqual(instance_config.config, { 'download_concurrency': 2 })
+        self.assertEqual(r.event_types, set(['Login']))
+        self.assertTrue(type(r.watermarks) is PrefixedWatermarkStore)
+        self.assertTrue(type(r.watermarks.store) is FileWatermarkStore)
+        self.assertEqual(r.watermarks.store.path, path)
+        self.assertEqual(
+            r.watermarks.prefix,
+            'backfill:foo:2024-03-01T00:00:00.000Z:2024-03-03T00:00:00.000Z:',
+        )
+        self.assertEqual(api.max_calls, 100)
+        self.assertEqual(b.apis, [api])
+
+    def test_backfill_keeps_progress_of_instances_apart(self):
+        '''
+        Backfills of different instances sharing a backfill file do not resume from each other's progress
+        given: a backfill file
+        and given: backfills of the same time range for 2 instances
+        when: the receiver of the first instance saves a watermark
+        then: the receiver of the first instance resumes from the watermark
+        and: the receiver of the second instance has no watermark
+        '''
+
+        # setup
+        path = os.path.join(self.tmp.name, 'backfill.json')
+        create_receiver = receiver.new_create_receiver_func(
+            mod_config.Config({}),
+            QueryFactoryStub(),
+            {},
+            0,
+        )
+        receivers = [
+            backfill.Backfill(
+                '2024-03-01T00:00:00.000Z',
+                '2024-03-03T00:00:00.000Z',
+                instance_name,
+                backfill_file=path,
+            ).new_create_receiver_func(create_receiver)(
+                mod_config.Config({}),
+                None,
+                mod_api.Api(AuthenticatorStub(), '55.0'),
+            ) for instance_name in ['foo', 'bar']
+        ]
+
+        # execute
+        receivers[0].watermarks.put({ 'q': '2024-03-02T00:00:00.000Z' })
+
+        # verify
+        self.assertEqual(
+            receivers[0].watermarks.get(['q']),
+            { 'q': '2024-03-02T00:00:00.000Z' },
+        )
+        self.assertEqual(receivers[1].watermarks.get(['q']), {})
+
+    def test_backfill_run_runs_integration_for_instance(self):
+        '''
+        Backfill.run() runs an integration for the instance to backfill with a query receiver
+        given: a backfill of an instance
+        and given: a factory
+        and given: a config with 2 instances
+        when: Backfill.run() is called
+        then: an integration is created for the instance with a single receiver and run
+        and when: the integration raises an ApiCallBudgetException
+        then: raises the ApiCallBudgetException
+        and when: the instance to backfill has no name
+        then: raises a ConfigException
+        '''
+
+        # setup
+        class IntegrationStub:
+            def __init__(self, raise_error: bool):
+                self.raise_error = raise_error
+                self.ran = False
+
+            def run(self):
+                self.ran = True
+
+                if self.raise_error:
+                    raise ApiCallBudgetException()
+
+        class FactoryStub:
+            def __init__(self, raise_error: bool = False):
+                self.integration = IntegrationStub(raise_error)
+                self.args = None
+
+            def new_integration(
+                self,
+                factory,
+                config: mod_config.Config,
+                receivers: list[callable],
+                numeric_fields_mapping: dict = {},
+                instance_index: int = None,
+            ):
+                self.args = (receivers, instance_index)
+                return self.integration
+
+        config = mod_config.Config({
+            'instances': [{ 'name': 'foo' }, { 'name': 'bar' }],
+        })
+        b = backfill.Backfill(
+            '2024-03-01T00:00:00.000Z',
+            '2024-03-03T00:00:00.000Z',
+            'bar',
+        )
+        factory = FactoryStub()
+
+        # execute
+        b.run(factory, config, {})
+
+        # verify
+        self.assertTrue(factory.integration.ran)
+        receivers, instance_index = factory.args
+        self.assertEqual(len(receivers), 1)
+        self.assertEqual(instance_index, 1)
+
+        # setup
+        factory = FactoryStub(True)
+
+        # execute / verify
+        with self.assertRaises(ApiCallBudgetException) as _:
+            b.run(factory, config, {})
+
+        # setup
+        b = backfill.Backfill(
+            '2024-03-01T00:00:00.000Z',
+            '2024-03-03T00:00:00.000Z',
+        )
+        factory = FactoryStub()
+
+        # execute / verify
+        with self.assertRaises(ConfigException) as _:
+            b.run(factory, mod_config.Config({ 'instances': [{}] }), {})
+
+        self.assertFalse(factory.integration.ran)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+
+
+from newrelic_logging import bloom
+
+
+class TestBloomFilter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'test.bloom')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_bloom_filter_contains_added_items(self):
+        '''
+        BloomFilter contains the items that were added to it
+        given: a new filter file
+        when: items are added to the filter
+        then: the filter contains each added item
+        and: the filter does not contain items that were not added
+        and: the count is the number of items added
+        '''
+
+        # setup
+        f = bloom.BloomFilter(self.path, 1000, 0.001)
+
+        # execute
+        for i in range(0, 500):
+            f.add(f'item-{i}'.encode('utf-8'))
+
+        # verify
+        for i in range(0, 500):
+            self.assertTrue(f.contains(f'item-{i}'.encode('utf-8')))
+
+        false_positives = sum(
+            1 for i in range(0, 10000) \
+                if f.contains(f'other-{i}'.encode('utf-8'))
+        )
+
+        self.assertLess(false_positives, 10)
+        self.assertEqual(f.count, 500)
+        self.assertFalse(f.is_full())
+
+        f.close()
+
+    def test_bloom_filter_persists_items_in_file(self):
+        '''
+        BloomFilter keeps its items in the file it was created with
+        given: a filter file with items added to it
+        when: the filter file is opened again
+        then: the filter contains the items that were added
+        and: the size of the filter is read from the file
+        '''
+
+        # setup
+        f = bloom.BloomFilter(self.path, 1000, 0.001)
+        f.add(b'foo')
+        f.add(b'bar')
+        f.flush()
+        f.close()
+
+        # execute
+        f = bloom.BloomFilter(self.path, 5, 0.5)
+
+        # verify
+        self.assertTrue(f.contains(b'foo'))
+        self.assertTrue(f.contains(b'bar'))
+        self.assertEqual(f.count, 2)
+        self.assertEqual(f.capacity, 1000)
+        self.assertEqual(
+            f.num_bits,
+            bloom.get_num_bits(1000, 0.001),
+        )
+        self.assertEqual(
+            os.path.getsize(self.path),
+            bloom.BLOOM_HEADER.size + f.num_bits // 8,
+        )
+
+        f.close()
+
+    def test_bloom_filter_raises_given_invalid_file(self):
+        '''
+        BloomFilter raises a ValueError given a file that is not a filter file
+        given: a file that is not a filter file
+        when: the filter is opened
+        then: raises a ValueError
+        '''
+
+        # setup
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 1024)
+
+        # execute / verify
+        with self.assertRaises(ValueError) as _:
+            bloom.BloomFilter(self.path, 1000, 0.001)
+
+    def test_get_num_bits_and_num_hashes(self):
+        '''
+        get_num_bits() and get_num_hashes() size the filter for the false positive rate
+        given: a capacity and a false positive rate
+        when: get_num_bits() and get_num_hashes() are called
+        then: the number of bits is about 14.4 bits per item for a rate of 0.001
+        and: the number of hashes is 10
+        '''
+
+        # execute
+        num_bits = bloom.get_num_bits(1000000, 0.001)
+        num_hashes = bloom.get_num_hashes(1000000, num_bits)
+
+        # verify
+        self.assertEqual(num_bits % 8, 0)
+        self.assertGreater(num_bits, 14370000)
+        self.assertLess(num_bits, 14390000)
+        self.assertEqual(num_hashes, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
+import math
+import os
+import sqlite3
 from redis import RedisError
+import tempfile
 from types import SimpleNamespace
+import threading
 import unittest
 
 from newrelic_logging import \
@@ -220,6 +225,542 @@ class TestRedisBackend(unittest.TestCase):
             backend.set_expiry('foo', 5)
 
 
+    def test_write_pipelines_commands_in_chunks(self):
+        '''
+        backend write sends all commands through pipelines of bounded size
+        given: a redis instance
+        when: write is called with keys and sets
+        then: each key is set with an expiry
+        and: the members of each set are added in chunks of bounded size
+        and: the expiry of each set is set
+        and: no pipeline holds more than the maximum number of commands
+        '''
+
+        # setup
+        redis = RedisStub({})
+        write_chunk_size = cache.WRITE_CHUNK_SIZE
+        set_add_chunk_size = cache.SET_ADD_CHUNK_SIZE
+        cache.WRITE_CHUNK_SIZE = 3
+        cache.SET_ADD_CHUNK_SIZE = 2
+
+        # execute
+        try:
+            backend = cache.RedisBackend(redis)
+            backend.write(
+                ['r1', 'r2'],
+                { 'foo': set(['a', 'b', 'c']), 'bar': set() },
+                5,
+            )
+        finally:
+            cache.WRITE_CHUNK_SIZE = write_chunk_size
+            cache.SET_ADD_CHUNK_SIZE = set_add_chunk_size
+
+        # verify
+        self.assertEqual(redis.test_cache['r1'], 1)
+        self.assertEqual(redis.test_cache['r2'], 1)
+        self.assertEqual(redis.test_cache['foo'], set(['a', 'b', 'c']))
+        self.assertFalse('bar' in redis.test_cache)
+        for key in ['r1', 'r2', 'foo', 'bar']:
+            self.assertEqual(redis.expiry[key], timedelta(days=5))
+        self.assertEqual(len(redis.pipelines), 2)
+        self.assertEqual(len(redis.pipelines[0]), 3)
+        self.assertEqual(len(redis.pipelines[1]), 3)
+        self.assertEqual(
+            [len(c[2]) for p in redis.pipelines for c in p if c[0] == 'sadd'],
+            [2, 1],
+        )
+
+    def test_exists_many_pipelines_exists_in_chunks(self):
+        '''
+        backend exists_many checks each key with pipelined EXISTS commands
+        given: a redis instance
+        when: exists_many is called with a list of keys
+        then: a list with the result of EXISTS for each key is returned
+        and: the keys are checked in pipelines of bounded size
+        '''
+
+        # setup
+        redis = RedisStub({ 'foo': 'bar', 'baz': set(['a']) })
+        lookup_chunk_size = cache.LOOKUP_CHUNK_SIZE
+        cache.LOOKUP_CHUNK_SIZE = 2
+
+        # execute
+        try:
+            backend = cache.RedisBackend(redis)
+            results = backend.exists_many(['foo', 'beep', 'baz'])
+        finally:
+            cache.LOOKUP_CHUNK_SIZE = lookup_chunk_size
+
+        # verify
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(len(redis.pipelines), 2)
+        self.assertEqual(
+            redis.pipelines[0],
+            [('exists', 'foo'), ('exists', 'beep')],
+        )
+        self.assertEqual(redis.pipelines[1], [('exists', 'baz')])
+
+    def test_set_contains_pipelines_sismember(self):
+        '''
+        backend set_contains checks each value with pipelined SISMEMBER commands
+        given: a redis instance
+        when: set_contains is called with a key and a list of values
+        then: a list with the membership of each value is returned
+        and: the set is not loaded with SMEMBERS
+        '''
+
+        # setup
+        redis = RedisStub({ 'foo': set(['a', 'c']) })
+
+        # execute
+        backend = cache.RedisBackend(redis)
+        results = backend.set_contains('foo', ['a', 'b', 'c'])
+        missing = backend.set_contains('bar', ['a'])
+
+        # verify
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(missing, [False])
+        self.assertEqual(
+            redis.pipelines[0],
+            [
+                ('sismember', 'foo', 'a'),
+                ('sismember', 'foo', 'b'),
+                ('sismember', 'foo', 'c'),
+            ],
+        )
+
+class TestBloomBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.today = datetime(2024, 3, 10, 12, 0, 0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def new_backend(self, capacity: int = 1000, expire_days: int = 2):
+        return cache.BloomBackend(
+            self.tmp.name,
+            capacity,
+            0.001,
+            expire_days,
+            lambda : self.today,
+        )
+
+    def test_write_adds_keys_and_set_members(self):
+        '''
+        backend write adds keys and set members to the filter of the expiry day
+        given: a Bloom backend
+        when: write is called with keys, sets and days
+        then: the keys and the sets with members exist
+        and: the empty sets do not exist
+        and: the set members are found only in their set
+        and: the filter file is named after the current day plus days
+        '''
+
+        # setup
+        backend = self.new_backend()
+
+        # execute
+        backend.write(
+            ['r1'],
+            { 'foo': set(['a', 'b']), 'bar': set() },
+            5,
+        )
+
+        # verify
+        self.assertEqual(
+            backend.exists_many(['r1', 'foo', 'bar', 'r2']),
+            [True, True, False, False],
+        )
+        self.assertTrue(backend.exists('foo'))
+        self.assertEqual(
+            backend.set_contains('foo', ['a', 'b', 'c']),
+            [True, True, False],
+        )
+        self.assertEqual(backend.set_contains('r1', ['a']), [False])
+        self.assertEqual(os.listdir(self.tmp.name), ['20240315-0000.bloom'])
+
+    def test_backend_loads_existing_filters(self):
+        '''
+        backend loads the filter files written by a previous backend
+        given: a Bloom backend that has written keys
+        when: a new Bloom backend is created with the same path
+        then: the keys written by the first backend exist
+        '''
+
+        # setup
+        backend = self.new_backend()
+        backend.write(['r1'], { 'foo': set(['a']) }, 5)
+
+        # execute
+        backend = self.new_backend()
+
+        # verify
+        self.assertTrue(backend.exists('r1'))
+        self.assertEqual(backend.set_contains('foo', ['a']), [True])
+
+    def test_backend_drops_expired_partitions(self):
+        '''
+        backend drops the filters of expiry days that have passed
+        given: a Bloom backend that has written keys on different days
+        when: the keys are looked up after the first keys expire
+        then: the keys that expired do not exist
+        and: the keys written since then exist
+        and: the filter file of the passed expiry day is deleted
+        '''
+
+        # setup
+        backend = self.new_backend(expire_days=1)
+        backend.write(['r1'], {}, 1)
+        self.today = datetime(2024, 3, 11, 12, 0, 0)
+        backend.write(['r2'], {}, 1)
+
+        # execute
+        self.today = datetime(2024, 3, 12, 1, 0, 0)
+        results = backend.exists_many(['r1', 'r2'])
+
+        # verify
+        self.assertEqual(results, [False, True])
+        self.assertEqual(os.listdir(self.tmp.name), ['20240312-0000.bloom'])
+
+    def test_write_honours_days(self):
+        '''
+        backend write keeps entries for the days passed to write
+        given: a Bloom backend
+        when: write is called with different days
+        then: each entry exists until its own expiry day has passed
+        '''
+
+        # setup
+        backend = self.new_backend()
+
+        # execute
+        backend.write(['r1'], {}, 1)
+        backend.write(['r2'], {}, 3)
+
+        # verify
+        self.today = datetime(2024, 3, 11, 23, 0, 0)
+        self.assertEqual(backend.exists_many(['r1', 'r2']), [True, True])
+        self.today = datetime(2024, 3, 12, 1, 0, 0)
+        self.assertEqual(backend.exists_many(['r1', 'r2']), [False, True])
+        self.today = datetime(2024, 3, 14, 1, 0, 0)
+        self.assertEqual(backend.exists_many(['r1', 'r2']), [False, False])
+
+    def test_filters_are_sized_for_share_of_false_positive_rate(self):
+        '''
+        backend sizes each filter so the rate of all filters stays bounded
+        given: a Bloom backend with a small capacity
+        when: more keys than the capacity are written on every partition day
+        then: each filter has a lower rate than the configured rate
+        and: the rates of all filters add up to less than the configured rate
+        and: reloaded filters keep their rate
+        '''
+
+        # setup
+        backend = self.new_backend(capacity=10)
+        keys = [f'r{i}' for i in range(0, 35)]
+
+        # execute
+        for day in range(0, 3):
+            backend.write([f'{key}-{day}' for key in keys], {}, day)
+
+        # verify
+        filters = backend.get_filters()
+        rates = [
+            (1 - math.exp(-f.num_hashes * f.capacity / f.num_bits)) \
+                ** f.num_hashes for f in filters
+        ]
+
+        self.assertEqual(len(filters), 12)
+        self.assertTrue(all(rate < 0.001 for rate in rates))
+        self.assertLess(sum(rates), 0.001)
+        self.assertEqual(
+            [f.num_bits for f in self.new_backend(capacity=10).get_filters()],
+            [f.num_bits for f in filters],
+        )
+
+    def test_backend_starts_new_segment_when_filter_is_full(self):
+        '''
+        backend starts a new filter file once the last one holds its capacity
+        given: a Bloom backend with a small capacity
+        when: more keys than the capacity are written
+        then: the keys are written to more than one filter file
+        and: all keys exist
+        '''
+
+        # setup
+        backend = self.new_backend(capacity=10)
+        keys = [f'r{i}' for i in range(0, 25)]
+
+        # execute
+        backend.write(keys, {}, 1)
+
+        # verify
+        self.assertEqual(
+            sorted(os.listdir(self.tmp.name)),
+            [
+                '20240311-0000.bloom',
+                '20240311-0001.bloom',
+                '20240311-0002.bloom',
+            ],
+        )
+        self.assertTrue(all(backend.exists_many(keys)))
+
+    def test_get_set_raises(self):
+        '''
+        backend get_set raises a CacheException
+        given: a Bloom backend
+        when: get_set is called
+        then: raises a CacheException
+        '''
+
+        # setup
+        backend = self.new_backend()
+
+        # execute / verify
+        with self.assertRaises(CacheException) as _:
+            backend.get_set('foo')
+
+
+class TestSqliteBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.db')
+        self.now = 1710072000
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def new_backend(self, expire_days: int = 2):
+        return cache.SqliteBackend(self.path, expire_days, lambda : self.now)
+
+    def test_write_adds_keys_and_set_members(self):
+        '''
+        backend write adds keys and set members in WAL mode
+        given: a SQLite backend
+        when: write is called with keys and sets
+        then: the keys and the sets with members exist
+        and: the empty sets do not exist
+        and: the set members are found only in their set
+        and: the database uses WAL mode
+        '''
+
+        # setup
+        backend = self.new_backend()
+
+        # execute
+        backend.write(
+            ['r1'],
+            { 'foo': set(['a', 'b']), 'bar': set() },
+            5,
+        )
+
+        # verify
+        self.assertEqual(
+            backend.exists_many(['r1', 'foo', 'bar', 'r2']),
+            [True, True, False, False],
+        )
+        self.assertEqual(
+            backend.set_contains('foo', ['a', 'b', 'c']),
+            [True, True, False],
+        )
+        self.assertEqual(backend.set_contains('r1', ['a']), [False])
+        self.assertEqual(backend.get_set('foo'), set(['a', 'b']))
+        self.assertEqual(
+            backend.db.execute('PRAGMA journal_mode').fetchone()[0],
+            'wal',
+        )
+
+    def test_backend_persists_entries(self):
+        '''
+        backend reads the entries written by a previous backend
+        given: a SQLite backend that has written keys and sets
+        when: a new SQLite backend is created with the same path
+        then: the keys and set members written by the first backend exist
+        '''
+
+        # setup
+        backend = self.new_backend()
+        backend.write(['r1'], { 'foo': set(['a']) }, 5)
+        backend.db.close()
+
+        # execute
+        backend = self.new_backend()
+
+        # verify
+        self.assertTrue(backend.exists('r1'))
+        self.assertEqual(backend.set_contains('foo', ['a']), [True])
+
+    def test_backend_expires_and_deletes_entries(self):
+        '''
+        backend expires entries after the expiry and deletes them
+        given: a SQLite backend that has written keys and sets
+        when: the keys are looked up after they expire
+        then: the keys and set members do not exist
+        and: the expired rows are deleted
+        and when: an expired set is written again
+        then: only the new members exist
+        '''
+
+        # setup
+        backend = self.new_backend(expire_days=1)
+        backend.write(['r1'], { 'foo': set(['a']) }, 1)
+
+        # execute
+        self.now += 86400
+        exists = backend.exists_many(['r1', 'foo'])
+        members = backend.set_contains('foo', ['a'])
+        rows = backend.db.execute('SELECT COUNT(*) FROM members').fetchone()
+        backend.write([], { 'foo': set(['b']) }, 1)
+
+        # verify
+        self.assertEqual(exists, [False, False])
+        self.assertEqual(members, [False])
+        self.assertEqual(rows[0], 0)
+        self.assertEqual(backend.set_contains('foo', ['a', 'b']), [False, True])
+
+    def test_write_expires_entries_after_given_days(self):
+        '''
+        backend write expires the entries after the given number of days
+        given: a SQLite backend with an expiry of 5 days
+        when: write is called with an expiry of 1 day
+        then: the keys and set members exist before the day is over
+        and: the keys and set members do not exist after the day is over
+        '''
+
+        # setup
+        backend = self.new_backend(expire_days=5)
+
+        # execute
+        backend.write(['r1'], { 'foo': set(['a']) }, 1)
+
+        # verify
+        self.now += 86399
+        self.assertEqual(backend.exists_many(['r1', 'foo']), [True, True])
+        self.assertEqual(backend.set_contains('foo', ['a']), [True])
+
+        self.now += 1
+        self.assertEqual(backend.exists_many(['r1', 'foo']), [False, False])
+        self.assertEqual(backend.set_contains('foo', ['a']), [False])
+
+    def test_backend_stores_hashes(self):
+        '''
+        backend stores hashes that do not expire and deletes them
+        given: a SQLite backend
+        when: put_hash is called
+        then: get_hash returns the values of the fields
+        and: the key exists even after the expiry
+        and when: delete is called
+        then: the key no longer exists
+        '''
+
+        # setup
+        backend = self.new_backend()
+
+        # execute
+        backend.put_hash('auth', { 'access_token': 'foo', 'instance_url': 'bar' })
+        self.now += 10 * 86400
+
+        # verify
+        self.assertEqual(
+            backend.get_hash('auth', ['access_token', 'instance_url', 'beep']),
+            ['foo', 'bar', None],
+        )
+        self.assertTrue(backend.exists('auth'))
+
+        backend.delete('auth')
+
+        self.assertFalse(backend.exists('auth'))
+        self.assertEqual(backend.get_hash('auth', ['access_token']), [None])
+
+    def test_backend_expires_and_deletes_hashes_given_expiry(self):
+        '''
+        backend expires hashes once an expiry is set on them and deletes them
+        given: a SQLite backend
+        when: put_hash and set_expiry are called
+        and when: put_hash is called again before the expiry
+        then: the hash exists with all of its fields before the expiry
+        and: the hash does not exist after the expiry
+        and: the expired rows are deleted
+        and: the hashes without an expiry are kept
+        and when: put_hash is called after the expiry
+        then: only the new fields exist and they do not expire
+        '''
+
+        # setup
+        backend = self.new_backend()
+        backend.put_hash('auth', { 'access_token': 'foo' })
+        backend.put_hash('checkpoint', { 'offset': 10, 'line': 1 })
+
+        # execute
+        backend.set_expiry('checkpoint', 1)
+        self.now += 3600
+        backend.put_hash('checkpoint', { 'offset': 20 })
+
+        # verify
+        self.assertEqual(
+            backend.get_hash('checkpoint', ['offset', 'line']),
+            ['20', '1'],
+        )
+        self.assertTrue(backend.exists('checkpoint'))
+
+        # execute
+        self.now += 86400
+        exists = backend.exists_many(['checkpoint', 'auth'])
+        values = backend.get_hash('checkpoint', ['offset', 'line'])
+        rows = backend.db.execute(
+            'SELECT key, field FROM hashes ORDER BY key, field',
+        ).fetchall()
+
+        # verify
+        self.assertEqual(exists, [False, True])
+        self.assertEqual(values, [None, None])
+        self.assertEqual(rows, [('auth', 'access_token')])
+
+        # execute
+        backend.put_hash('checkpoint', { 'offset': 30 })
+        self.now += 10 * 86400
+
+        # verify
+        self.assertEqual(
+            backend.get_hash('checkpoint', ['offset', 'line']),
+            ['30', None],
+        )
+
+    def test_backend_adds_hash_expiry_to_existing_database(self):
+        '''
+        backend adds the hash expiry column to a database created without it
+        given: a SQLite database with a hashes table without an expiry column
+        when: a SQLite backend is created with the database
+        then: the existing hashes are kept and do not expire
+        and: hashes can be expired
+        '''
+
+        # setup
+        db = sqlite3.connect(self.path)
+        db.execute(
+            '''CREATE TABLE hashes (
+                key TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (key, field)
+            ) WITHOUT ROWID'''
+        )
+        db.execute("INSERT INTO hashes VALUES ('auth', 'access_token', 'foo')")
+        db.commit()
+        db.close()
+
+        # execute
+        backend = self.new_backend()
+        backend.put_hash('checkpoint', { 'offset': 10 })
+        backend.set_expiry('checkpoint', 1)
+        self.now += 2 * 86400
+
+        # verify
+        self.assertEqual(backend.get_hash('auth', ['access_token']), ['foo'])
+        self.assertEqual(backend.exists_many(['auth', 'checkpoint']), [True, False])
+
+
 class TestBackendFactory(unittest.TestCase):
     def test_new_backend(self):
         '''
@@ -265,6 +806,116 @@ class TestBackendFactory(unittest.TestCase):
         self.assertEqual(r.ssl, True)
 
 
+    def test_new_backend_shares_redis_client_for_same_server(self):
+        '''
+        new_backend() shares one Redis client between instances using the same server
+        given: two instance configurations for the same Redis server
+        and given: an instance configuration for a different Redis database
+        when: new_backend() is called for each configuration
+        then: the backends for the same server share the Redis client
+        and: the backend for the different database uses its own Redis client
+        '''
+
+        # setup
+        def redis_connect(**kwargs):
+            return SimpleNamespace(**kwargs)
+
+        config = mod_config.Config({
+            'redis': { 'host': 'foo', 'port': 1234, 'password': 'beepboop' },
+        })
+        config2 = mod_config.Config({
+            'redis': {
+                'host': 'foo',
+                'port': 1234,
+                'db_number': 3,
+                'password': 'beepboop',
+            },
+        })
+
+        # execute
+        f = cache.BackendFactory()
+        backend1 = f.new_backend(config, redis_connector=redis_connect)
+        backend2 = f.new_backend(config, redis_connector=redis_connect)
+        backend3 = f.new_backend(config2, redis_connector=redis_connect)
+
+        # verify
+        self.assertIs(backend1.redis, backend2.redis)
+        self.assertIsNot(backend1.redis, backend3.redis)
+        self.assertEqual(backend3.redis.db, 3)
+
+    def test_new_backend_returns_bloom_backend_given_bloom_cache_backend(self):
+        '''
+        new_backend() returns a Bloom backend when the cache backend is bloom
+        given: an instance configuration with the cache backend set to bloom
+        when: new_backend() is called
+        then: a Bloom backend using the configured path, capacity, false positive rate and expiry is returned
+        '''
+
+        # setup
+        with tempfile.TemporaryDirectory() as tmp:
+            config = mod_config.Config({
+                'cache_backend': 'bloom',
+                'bloom': {
+                    'path': tmp,
+                    'capacity': 5000,
+                    'false_positive_rate': '0.01',
+                    'expire_days': 3,
+                },
+            })
+
+            # execute
+            f = cache.BackendFactory()
+            backend = f.new_backend(config)
+
+            # verify
+            self.assertTrue(type(backend) is cache.BloomBackend)
+            self.assertEqual(backend.path, tmp)
+            self.assertEqual(backend.capacity, 5000)
+            self.assertEqual(backend.false_positive_rate, 0.01)
+            self.assertEqual(backend.expire_days, 3)
+
+    def test_new_backend_returns_sqlite_backend_given_sqlite_cache_backend(self):
+        '''
+        new_backend() returns a SQLite backend when the cache backend is sqlite
+        given: an instance configuration with the cache backend set to sqlite
+        when: new_backend() is called
+        then: a SQLite backend using the configured path and expiry is returned
+        '''
+
+        # setup
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.db')
+            config = mod_config.Config({
+                'cache_backend': 'sqlite',
+                'sqlite': { 'path': path, 'expire_days': 3 },
+            })
+
+            # execute
+            f = cache.BackendFactory()
+            backend = f.new_backend(config)
+
+            # verify
+            self.assertTrue(type(backend) is cache.SqliteBackend)
+            self.assertEqual(backend.path, path)
+            self.assertEqual(backend.expire_days, 3)
+            self.assertTrue(os.path.exists(path))
+
+    def test_new_backend_raises_given_invalid_cache_backend(self):
+        '''
+        new_backend() raises a CacheException given an unknown cache backend
+        given: an instance configuration with an unknown cache backend
+        when: new_backend() is called
+        then: raises a CacheException
+        '''
+
+        # setup
+        config = mod_config.Config({ 'cache_backend': 'foo' })
+
+        # execute / verify
+        with self.assertRaises(CacheException) as _:
+            cache.BackendFactory().new_backend(config)
+
+
 class TestBufferedAddSetCache(unittest.TestCase):
     def test_check_or_set_true_when_item_exists(self):
         '''
@@ -318,201 +969,891 @@ class TestBufferedAddSetCache(unittest.TestCase):
         self.assertTrue('foo' in s.get_buffer())
 
         # execute
-        contains_foo = s.check_or_set('foo')
+        contains_foo = s.check_or_set('foo')
+
+        # verify
+        # this verifies that check_or_set also checks the buffer
+        self.assertTrue(contains_foo)
+
+
+class TestDigestSet(unittest.TestCase):
+    def test_digest_set_contains_added_digests(self):
+        '''
+        DigestSet contains the digests added to it before and after they are merged
+        given: a DigestSet
+        when: more digests are added than are kept before merging
+        then: the set contains each added digest
+        and: the set does not contain digests that were not added
+        and: adding a digest twice does not change the length
+        and: iterating the set returns each digest once
+        '''
+
+        # setup
+        digests = [
+            cache.digest(i) for i in range(0, cache.DIGEST_SET_MERGE_SIZE + 10)
+        ]
+
+        # execute
+        s = cache.DigestSet()
+        for d in digests:
+            s.add(d)
+        s.add(digests[0])
+        s.add(digests[-1])
+
+        # verify
+        self.assertEqual(len(s), len(digests))
+        self.assertEqual(s.count, cache.DIGEST_SET_MERGE_SIZE)
+        self.assertEqual(len(s.added), 10)
+        self.assertEqual(
+            len(s.data),
+            cache.DIGEST_SET_MERGE_SIZE * cache.DIGEST_SIZE,
+        )
+
+        for d in digests:
+            self.assertTrue(d in s)
+
+        self.assertFalse(cache.digest('foo') in s)
+        self.assertEqual(sorted(s), sorted(digests))
+        self.assertEqual(
+            s.intersection([digests[1], cache.digest('foo')]),
+            set([digests[1]]),
+        )
+
+    def test_digest_is_fixed_width(self):
+        '''
+        digest() returns a fixed width binary digest of the string form of a value
+        given: values of different types and lengths
+        when: digest() is called
+        then: each digest is DIGEST_SIZE bytes
+        and: the digest of a value is the digest of its string form
+        '''
+
+        # execute
+        d1 = cache.digest('foo')
+        d2 = cache.digest('a' * 64)
+        d3 = cache.digest(123)
+
+        # verify
+        self.assertEqual(len(d1), cache.DIGEST_SIZE)
+        self.assertEqual(len(d2), cache.DIGEST_SIZE)
+        self.assertEqual(d3, cache.digest('123'))
+        self.assertNotEqual(d1, d2)
+
+
+class TestDataCache(unittest.TestCase):
+    def test_can_skip_download_logfile_true_when_key_exists(self):
+        '''
+        dl logfile returns true if key exists in cache
+        given: a backend instance
+        when: can_skip_download_logfile is called
+        and when: the key exists in the cache
+        then: return true
+        '''
+
+        # setup
+        backend = BackendStub({ 'foo': ['bar'] })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        can = data_cache.can_skip_downloading_logfile('foo')
+
+        # verify
+        self.assertTrue(can)
+
+    def test_can_skip_download_logfile_false_when_key_missing(self):
+        '''
+        dl logfile returns false if key does not exist
+        given: a backend instance
+        when: can_skip_download_logfile is called
+        and when: the key does not exist in the backend
+        then: return false
+        '''
+
+        # setup
+        backend = BackendStub({})
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        can = data_cache.can_skip_downloading_logfile('foo')
+
+        # verify
+        self.assertFalse(can)
+
+    def test_can_skip_download_logfile_raises_if_backend_does(self):
+        '''
+        dl logfile raises CacheException if backend raises any Exception
+        given: a backend instance
+        when: can_skip_download_logfile is called
+        and when: backend raises any exception
+        then: a CacheException is raised
+        '''
+
+        # setup
+        backend = BackendStub({}, raise_error=True)
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+
+        # verify
+        with self.assertRaises(CacheException) as _:
+            data_cache.can_skip_downloading_logfile('foo')
+
+    def test_can_skip_download_logfiles_checks_all_records_at_once(self):
+        '''
+        can_skip_download_logfiles checks all records with a single lookup
+        given: a backend instance
+        when: can_skip_download_logfiles is called with a list of record IDs
+        then: a list with the result for each record is returned
+        and: the backend is called once for all records
+        '''
+
+        # setup
+        backend = BackendStub({ 'foo': set(['bar']), 'baz': set(['beep']) })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        results = data_cache.can_skip_downloading_logfiles(
+            ['foo', 'boop', 'baz'],
+        )
+
+        # verify
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(backend.lookups, [('exists', ['foo', 'boop', 'baz'])])
+
+    def test_check_or_set_log_line_true_when_exists(self):
+        '''
+        check_or_set_log_line returns true when line ID is in the cached set
+        given: a backend instance
+        when: check_or_set_log_line is called
+        and when: row['REQUEST_ID'] is in the set for key
+        then: returns true
+        '''
+
+        # setup
+        backend = BackendStub({ 'foo': set(['bar']) })
+        line = { 'REQUEST_ID': 'bar' }
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        val = data_cache.check_or_set_log_line('foo', line)
+
+        # verify
+        self.assertTrue(val)
+
+    def test_check_or_set_log_line_false_and_adds_when_missing(self):
+        '''
+        check_or_set_log_line returns false and adds line ID when line ID is not in the cached set
+        given: a backend instance
+        when: check_or_set_log_line is called
+        and when: row['REQUEST_ID'] is not in set for key
+        then: the line ID is added to the set and false is returned
+        '''
+
+        # setup
+        backend = BackendStub({ 'foo': set() })
+        row = { 'REQUEST_ID': 'bar' }
+
+        # preconditions
+        self.assertFalse('bar' in backend.redis.test_cache['foo'])
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        val = data_cache.check_or_set_log_line('foo', row)
+
+        # verify
+        self.assertFalse(val)
+
+        # Need to flush before we can check the cache as how it is stored
+        # in memory is an implementation detail
+        data_cache.flush()
+        self.assertTrue('bar' in backend.redis.test_cache['foo'])
+
+    def test_check_or_set_log_line_raises_if_backend_does(self):
+        '''
+        check_or_set_log_line raises CacheException if backend raises any Exception
+        given: a backend instance
+        when: check_or_set_log_line is called
+        and when: backend raises any exception
+        then: a CacheException is raised
+        '''
+
+        # setup
+        backend = BackendStub({}, raise_error=True)
+        line = { 'REQUEST_ID': 'bar' }
+
+        # execute / verify
+        data_cache = cache.DataCache(backend, 5)
+
+        with self.assertRaises(CacheException) as _:
+            data_cache.check_or_set_log_line('foo', line)
+
+    def test_check_or_set_log_line_id_raises_given_no_line_id(self):
+        '''
+        check_or_set_log_line_id raises CacheException if no line ID is given
+        given: a backend instance
+        when: check_or_set_log_line_id is called
+        and when: the line ID is None
+        then: a CacheException is raised
+        and: nothing is added to the cached set
+        '''
+
+        # setup
+        backend = BackendStub({ 'foo': set() })
+
+        # execute / verify
+        data_cache = cache.DataCache(backend, 5)
+
+        with self.assertRaises(CacheException) as _:
+            data_cache.check_or_set_log_line_id('foo', None)
+
+        data_cache.flush()
+        self.assertEqual(len(backend.redis.test_cache['foo']), 0)
+
+    def test_check_or_set_log_line_ids_looks_up_ids_given_batch_lookups(self):
+        '''
+        check_or_set_log_line_ids looks up each chunk of IDs instead of loading the set when batch lookups are enabled
+        given: a backend instance
+        and given: batch lookups are enabled
+        when: check_or_set_log_line_ids is called with IDs that are cached, new and repeated
+        then: the cached IDs are reported as seen
+        and: new IDs are reported as not seen the first time only
+        and: the cached set is never loaded
+        and: only the new IDs are written on flush
+        '''
+
+        # setup
+        backend = BackendStub({ 'foo': set(['bar']) })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5, batch_lookups=True)
+        results = data_cache.check_or_set_log_line_ids(
+            'foo',
+            ['bar', 'beep', 'beep', 'boop'],
+        )
+        results2 = data_cache.check_or_set_log_line_ids(
+            'foo',
+            ['beep', 'baz'],
+        )
+        result3 = data_cache.check_or_set_log_line_id('foo', 'bar')
+
+        # verify
+        self.assertEqual(results, [True, False, True, False])
+        self.assertEqual(results2, [True, False])
+        self.assertTrue(result3)
+        self.assertEqual(backend.get_set_keys, [])
+        self.assertEqual(
+            sorted(backend.lookups[0][1]),
+            ['bar', 'beep', 'boop'],
+        )
+        self.assertEqual(backend.lookups[1], ('foo', ['baz']))
+        self.assertEqual(backend.lookups[2], ('foo', ['bar']))
+        self.assertEqual(
+            data_cache.log_records['foo'].get_buffer(),
+            set(['beep', 'boop', 'baz']),
+        )
+
+    def test_check_or_set_uses_batch_lookups_given_bloom_backend(self):
+        '''
+        DataCache checks and sets IDs with batch lookups given a Bloom backend
+        given: a Bloom backend
+        when: log line and record IDs are checked and flushed
+        then: the IDs are reported as not seen the first time
+        and: the IDs are reported as seen after the cache is flushed
+        and: the log file can be skipped after the cache is flushed
+        '''
+
+        # setup
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = cache.BloomBackend(tmp, 1000, 0.001, 2)
+
+            # execute
+            data_cache = cache.DataCache(backend, 2)
+            lines = data_cache.check_or_set_log_line_ids('foo', ['a', 'b'])
+            record = data_cache.check_or_set_record_id('r1')
+            can_skip = data_cache.can_skip_downloading_logfile('foo')
+            data_cache.flush()
+
+            data_cache2 = cache.DataCache(backend, 2)
+            lines2 = data_cache2.check_or_set_log_line_ids('foo', ['a', 'c'])
+            record2 = data_cache2.check_or_set_record_id('r1')
+            can_skip2 = data_cache2.can_skip_downloading_logfile('foo')
+
+        # verify
+        self.assertTrue(data_cache.batch_lookups)
+        self.assertEqual(lines, [False, False])
+        self.assertFalse(record)
+        self.assertFalse(can_skip)
+        self.assertEqual(lines2, [True, False])
+        self.assertTrue(record2)
+        self.assertTrue(can_skip2)
+        '''
+        check_or_set_log_line_ids raises a CacheException if an ID is missing
+        given: a backend instance
+        when: check_or_set_log_line_ids is called with a None ID
+        then: raises a CacheException
+        '''
+
+        # setup
+        backend = BackendStub({})
+
+        # execute / verify
+        data_cache = cache.DataCache(backend, 5, batch_lookups=True)
+
+        with self.assertRaises(CacheException) as _:
+            data_cache.check_or_set_log_line_ids('foo', ['bar', None])
+
+    def test_check_or_set_record_id_true_when_exists(self):
+        '''
+        check_or_set_record_id returns true when record ID is in the cached set
+        given: a backend instance
+        when: check_or_set_record_id is called
+        and when: record ID is in the set 'record_ids'
+        then: returns true
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set(['foo']) })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        val = data_cache.check_or_set_record_id('foo')
+
+        # verify
+        self.assertTrue(val)
+
+    def test_check_or_set_record_id_false_and_adds_when_missing(self):
+        '''
+        check_or_set_record_id returns false and adds record ID when record ID is not in the cached set
+        given: a backend instance
+        when: check_or_set_record_id is called
+        and when: record ID is not in set 'record_ids'
+        then: the record ID is added to the set and False is returned
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set() })
+
+        # preconditions
+        self.assertFalse('foo' in backend.redis.test_cache['record_ids'])
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        val = data_cache.check_or_set_record_id('foo')
+
+        # verify
+        self.assertFalse(val)
+
+        # Need to flush before we can check the cache as how it is stored
+        # in memory is an implementation detail
+        data_cache.flush()
+        self.assertTrue('foo' in backend.redis.test_cache['record_ids'])
+
+    def test_check_or_set_record_id_raises_if_backend_does(self):
+        '''
+        check_or_set_record_id raises CacheException if backend raises any Exception
+        given: a backend instance
+        when: check_or_set_record_id is called
+        and when: backend raises any exception
+        then: a CacheException is raised
+        '''
+
+        # setup
+        backend = BackendStub({}, raise_error=True)
+
+        # execute / verify
+        data_cache = cache.DataCache(backend, 5)
+
+        with self.assertRaises(CacheException) as _:
+            data_cache.check_or_set_record_id('foo')
+
+    def test_check_or_set_record_ids_looks_up_ids_given_batch_lookups(self):
+        '''
+        check_or_set_record_ids looks up record IDs in the record_ids set without loading it when batch lookups are enabled
+        given: a backend instance
+        and given: batch lookups are enabled
+        when: check_or_set_record_ids is called
+        then: the cached record IDs are reported as seen
+        and: the new record IDs are reported as not seen
+        and: the record_ids set is never loaded
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set(['foo']) })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5, batch_lookups=True)
+        results = data_cache.check_or_set_record_ids(['foo', 'bar'])
+
+        # verify
+        self.assertEqual(results, [True, False])
+        self.assertEqual(backend.get_set_keys, [])
+        self.assertEqual(
+            data_cache.query_records.get_buffer(),
+            set(['bar']),
+        )
+
+    def test_check_or_set_record_ids_loads_set_given_no_batch_lookups(self):
+        '''
+        check_or_set_record_ids loads the record_ids set when batch lookups are disabled
+        given: a backend instance
+        when: check_or_set_record_ids is called
+        then: the record_ids set is loaded once
+        and: the results match check_or_set_record_id
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set(['foo']) })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        results = data_cache.check_or_set_record_ids(['foo', 'bar', 'bar'])
+
+        # verify
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(backend.get_set_keys, ['record_ids'])
+        self.assertEqual(backend.lookups, [])
+
+    def test_check_or_set_record_id_uses_warm_record_ids_between_runs(self):
+        '''
+        check_or_set_record_id uses the in-memory record IDs instead of loading the record_ids set again after a flush
+        given: a backend instance
+        when: record IDs are checked and the cache is flushed
+        and when: record IDs are checked again
+        then: the record_ids set is only loaded once
+        and: the record IDs written by the first run are seen by the second run
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set(['foo']) })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        result1 = data_cache.check_or_set_record_id('foo')
+        result2 = data_cache.check_or_set_record_id('bar')
+        data_cache.flush()
+
+        result3 = data_cache.check_or_set_record_id('foo')
+        result4 = data_cache.check_or_set_record_id('bar')
+        result5 = data_cache.check_or_set_record_id('beep')
+        data_cache.flush()
+
+        # verify
+        self.assertTrue(result1)
+        self.assertFalse(result2)
+        self.assertTrue(result3)
+        self.assertTrue(result4)
+        self.assertFalse(result5)
+        self.assertEqual(backend.get_set_keys, ['record_ids'])
+        self.assertEqual(data_cache.record_ids_count, 3)
+        self.assertEqual(
+            backend.redis.test_cache['record_ids'],
+            set(['foo', 'bar', 'beep']),
+        )
+
+    def test_check_or_set_record_id_reloads_record_ids_when_set_changes(self):
+        '''
+        check_or_set_record_id loads the record_ids set again when it was changed by another writer
+        given: a backend instance
+        when: record IDs are checked and the cache is flushed
+        and when: another writer adds a record ID to the record_ids set
+        and when: record IDs are checked again
+        then: the record_ids set is loaded again
+        and: the record ID added by the other writer is seen
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set(['foo']) })
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        data_cache.check_or_set_record_id('bar')
+        data_cache.flush()
+
+        backend.redis.test_cache['record_ids'].add('beep')
+        result = data_cache.check_or_set_record_id('beep')
+
+        # verify
+        self.assertTrue(result)
+        self.assertEqual(backend.get_set_keys, ['record_ids', 'record_ids'])
+
+    def test_check_or_set_record_ids_evicts_warm_record_ids_by_age(self):
+        '''
+        check_or_set_record_ids evicts in-memory record IDs older than the expiry
+        given: a backend instance
+        and given: batch lookups are enabled
+        when: record IDs are checked and the cache is flushed
+        and when: record IDs are checked again before the expiry
+        then: the record IDs seen in the first run are not looked up again
+        and when: record IDs are checked again after the expiry
+        then: the record IDs seen in the first run are looked up again
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set(['foo']) })
+        now = 1000000
+
+        # execute
+        data_cache = cache.DataCache(backend, 1, batch_lookups=True)
+        data_cache.now = lambda : now
+        data_cache.check_or_set_record_ids(['foo', 'bar'])
+        data_cache.flush()
 
-        # verify
-        # this verifies that check_or_set also checks the buffer
-        self.assertTrue(contains_foo)
+        now += 3600
+        results1 = data_cache.check_or_set_record_ids(['foo', 'bar', 'beep'])
+        data_cache.flush()
 
+        now += 86400
+        results2 = data_cache.check_or_set_record_ids(['foo', 'bar', 'boop'])
 
-class TestDataCache(unittest.TestCase):
-    def test_can_skip_download_logfile_true_when_key_exists(self):
+        # verify
+        self.assertEqual(results1, [True, True, False])
+        self.assertEqual(results2, [True, True, False])
+        self.assertEqual(len(backend.lookups), 3)
+        self.assertEqual(
+            sorted(backend.lookups[0][1]),
+            ['bar', 'foo'],
+        )
+        self.assertEqual(backend.lookups[1], ('record_ids', ['beep']))
+        self.assertEqual(
+            sorted(backend.lookups[2][1]),
+            ['bar', 'boop', 'foo'],
+        )
+
+    def test_check_or_set_record_ids_uses_bucketed_keys(self):
         '''
-        dl logfile returns true if key exists in cache
+        check_or_set_record_ids looks up and writes record IDs in time bucketed sets when the key layout is bucketed
         given: a backend instance
-        when: can_skip_download_logfile is called
-        and when: the key exists in the cache
-        then: return true
+        and given: the bucketed key layout
+        when: record IDs with keys for different hours are checked
+        and when: the cache is flushed
+        then: each record ID is looked up in the set for its hour
+        and: the new record IDs are written to the set for their hour
+        and: nothing is written to the record_ids set
         '''
 
         # setup
-        backend = BackendStub({ 'foo': ['bar'] })
+        key1 = cache.get_record_ids_key('inst', 'q', 1710072000000)
+        key2 = cache.get_record_ids_key('inst', 'q', 1710075600000)
+        backend = BackendStub({ key1: set(['foo']) })
 
         # execute
-        data_cache = cache.DataCache(backend, 5)
-        can = data_cache.can_skip_downloading_logfile('foo')
+        data_cache = cache.DataCache(
+            backend,
+            5,
+            key_layout=cache.KEY_LAYOUT_BUCKETED,
+            namespace='inst',
+        )
+        results = data_cache.check_or_set_record_ids(
+            ['foo', 'bar', 'beep'],
+            [key1, key1, key2],
+        )
+        data_cache.flush()
 
         # verify
-        self.assertTrue(can)
+        self.assertEqual(key1, 'record_ids:inst:q:2024031012')
+        self.assertEqual(key2, 'record_ids:inst:q:2024031013')
+        self.assertEqual(
+            cache.get_record_ids_key('inst', 'q', None),
+            'record_ids:inst:q:undated',
+        )
+        self.assertEqual(
+            data_cache.get_record_ids_key('q', 1710072000000),
+            key1,
+        )
+        self.assertEqual(results, [True, False, False])
+        self.assertTrue(data_cache.batch_lookups)
+        self.assertEqual(
+            backend.redis.test_cache[key1],
+            set(['foo', 'bar']),
+        )
+        self.assertEqual(backend.redis.test_cache[key2], set(['beep']))
+        self.assertFalse('record_ids' in backend.redis.test_cache)
+        self.assertEqual(backend.redis.expiry[key2], timedelta(days=5))
 
-    def test_can_skip_download_logfile_false_when_key_missing(self):
+    def test_check_or_set_record_ids_falls_back_to_legacy_set(self):
         '''
-        dl logfile returns false if key does not exist
-        given: a backend instance
-        when: can_skip_download_logfile is called
-        and when: the key does not exist in the backend
-        then: return false
+        check_or_set_record_ids looks up record IDs in the legacy record_ids set while it exists when the key layout is bucketed
+        given: a backend instance with a legacy record_ids set
+        and given: the bucketed key layout
+        when: record IDs are checked
+        then: record IDs in the legacy set are seen
+        and: record IDs found in their bucket are not looked up in the legacy set
         '''
 
         # setup
-        backend = BackendStub({})
+        key = cache.get_record_ids_key('inst', 'q', 1710072000000)
+        backend = BackendStub({
+            key: set(['foo']),
+            'record_ids': set(['bar']),
+        })
 
         # execute
-        data_cache = cache.DataCache(backend, 5)
-        can = data_cache.can_skip_downloading_logfile('foo')
+        data_cache = cache.DataCache(
+            backend,
+            5,
+            key_layout=cache.KEY_LAYOUT_BUCKETED,
+            namespace='inst',
+        )
+        results = data_cache.check_or_set_record_ids(
+            ['foo', 'bar', 'beep'],
+            [key, key, key],
+        )
 
         # verify
-        self.assertFalse(can)
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(backend.lookups[1][0], 'record_ids')
+        self.assertEqual(sorted(backend.lookups[1][1]), ['bar', 'beep'])
 
-    def test_can_skip_download_logfile_raises_if_backend_does(self):
+    def test_check_or_set_record_ids_stores_digests(self):
         '''
-        dl logfile raises CacheException if backend raises any Exception
-        given: a backend instance
-        when: can_skip_download_logfile is called
-        and when: backend raises any exception
-        then: a CacheException is raised
+        check_or_set_record_ids looks up and writes digests of record IDs when digests are enabled
+        given: a backend instance with the digest of a record ID
+        and given: digests are enabled
+        when: record IDs are checked
+        and when: the cache is flushed
+        then: the record ID with a cached digest is seen
+        and: record IDs are seen once
+        and: the digests of the new record IDs are written to the cache
         '''
 
         # setup
-        backend = BackendStub({}, raise_error=True)
+        backend = BackendStub({ 'record_ids': set([cache.digest('foo')]) })
 
         # execute
-        data_cache = cache.DataCache(backend, 5)
+        data_cache = cache.DataCache(backend, 5, digests=True)
+        results = data_cache.check_or_set_record_ids(['foo', 'bar', 'bar'])
+        data_cache.flush()
 
         # verify
-        with self.assertRaises(CacheException) as _:
-            data_cache.can_skip_downloading_logfile('foo')
+        self.assertTrue(data_cache.batch_lookups)
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(
+            backend.redis.test_cache['record_ids'],
+            set([cache.digest('foo'), cache.digest('bar')]),
+        )
+        self.assertEqual(
+            data_cache.check_or_set_record_ids(['bar']),
+            [True],
+        )
 
-    def test_check_or_set_log_line_true_when_exists(self):
+    def test_check_or_set_log_line_ids_stores_digests(self):
         '''
-        check_or_set_log_line returns true when line ID is in the cached set
-        given: a backend instance
-        when: check_or_set_log_line is called
-        and when: row['REQUEST_ID'] is in the set for key
-        then: returns true
+        check_or_set_log_line_ids looks up and writes digests of log line IDs when digests are enabled
+        given: a backend instance with the digest of a log line ID
+        and given: digests are enabled
+        when: log line IDs are checked
+        and when: the cache is flushed
+        then: the log line ID with a cached digest is seen
+        and: the digests of the new log line IDs are written to the set for the log file
         '''
 
         # setup
-        backend = BackendStub({ 'foo': set(['bar']) })
-        line = { 'REQUEST_ID': 'bar' }
+        backend = BackendStub({ '00001111AAAABBBB': set([cache.digest('foo')]) })
 
         # execute
-        data_cache = cache.DataCache(backend, 5)
-        val = data_cache.check_or_set_log_line('foo', line)
+        data_cache = cache.DataCache(backend, 5, digests=True)
+        results = data_cache.check_or_set_log_line_ids(
+            '00001111AAAABBBB',
+            ['foo', 'bar'],
+        )
+        data_cache.flush()
 
         # verify
-        self.assertTrue(val)
+        self.assertEqual(results, [True, False])
+        self.assertEqual(
+            backend.redis.test_cache['00001111AAAABBBB'],
+            set([cache.digest('foo'), cache.digest('bar')]),
+        )
 
-    def test_check_or_set_log_line_false_and_adds_when_missing(self):
+    def test_write_log_file_markers_writes_markers_of_added_log_files(self):
         '''
-        check_or_set_log_line returns false and adds line ID when line ID is not in the cached set
+        write_log_file_markers writes a marker for each log file added since the last call
         given: a backend instance
-        when: check_or_set_log_line is called
-        and when: row['REQUEST_ID'] is not in set for key
-        then: the line ID is added to the set and false is returned
+        and given: hourly file markers are enabled
+        when: log file markers are added
+        then: the log files can be skipped before the markers are written
+        and: nothing is written to the cache
+        and when: write_log_file_markers is called
+        then: a marker is written for each log file with the expiry
+        and: calling write_log_file_markers again does not write anything
         '''
 
         # setup
-        backend = BackendStub({ 'foo': set() })
-        row = { 'REQUEST_ID': 'bar' }
+        backend = BackendStub({})
 
-        # preconditions
-        self.assertFalse('bar' in backend.redis.test_cache['foo'])
+        # execute
+        data_cache = cache.DataCache(backend, 5, hourly_file_markers=True)
+        data_cache.add_log_file_marker('00001111AAAABBBB')
+        data_cache.add_log_file_marker('00002222AAAABBBB')
+
+        # verify
+        self.assertTrue(data_cache.hourly_file_markers)
+        self.assertTrue(
+            data_cache.can_skip_downloading_logfile('00001111AAAABBBB'),
+        )
+        self.assertEqual(
+            data_cache.can_skip_downloading_logfiles(
+                ['00002222AAAABBBB', '00003333AAAABBBB'],
+            ),
+            [True, False],
+        )
+        self.assertEqual(len(backend.redis.test_cache), 0)
 
         # execute
-        data_cache = cache.DataCache(backend, 5)
-        val = data_cache.check_or_set_log_line('foo', row)
+        data_cache.write_log_file_markers()
 
         # verify
-        self.assertFalse(val)
+        self.assertEqual(backend.redis.test_cache['00001111AAAABBBB'], 1)
+        self.assertEqual(backend.redis.test_cache['00002222AAAABBBB'], 1)
+        self.assertEqual(
+            backend.redis.expiry['00001111AAAABBBB'],
+            timedelta(days=5),
+        )
+        self.assertEqual(len(data_cache.log_file_markers), 0)
 
-        # Need to flush before we can check the cache as how it is stored
-        # in memory is an implementation detail
-        data_cache.flush()
-        self.assertTrue('bar' in backend.redis.test_cache['foo'])
+        # execute
+        backend.redis.test_cache = {}
+        data_cache.write_log_file_markers()
 
-    def test_check_or_set_log_line_raises_if_backend_does(self):
+        # verify
+        self.assertEqual(len(backend.redis.test_cache), 0)
+
+    def test_log_file_checkpoints_are_saved_in_cache(self):
         '''
-        check_or_set_log_line raises CacheException if backend raises any Exception
-        given: a backend instance
-        when: check_or_set_log_line is called
-        and when: backend raises any exception
-        then: a CacheException is raised
+        put_log_file_checkpoint saves a checkpoint that get_log_file_checkpoint returns until it is deleted
+        given: a SQLite backend
+        and given: log file checkpoints are enabled
+        when: a checkpoint is saved for a log file
+        then: get_log_file_checkpoint returns the checkpoint
+        and when: the checkpoint is deleted
+        then: get_log_file_checkpoint returns None
         '''
 
         # setup
-        backend = BackendStub({}, raise_error=True)
-        line = { 'REQUEST_ID': 'bar' }
+        tmp = tempfile.TemporaryDirectory()
+        backend = cache.SqliteBackend(os.path.join(tmp.name, 'cache.db'), 5)
+        checkpoint = {
+            'offset': 1024,
+            'rows': 10,
+            'delivered': 12,
+            'row_index': 11,
+            'header': ('EVENT_TYPE', 'REQUEST_ID'),
+        }
 
-        # execute / verify
-        data_cache = cache.DataCache(backend, 5)
+        # execute
+        data_cache = cache.DataCache(backend, 5, log_file_checkpoints=True)
 
-        with self.assertRaises(CacheException) as _:
-            data_cache.check_or_set_log_line('foo', line)
+        # preconditions
+        self.assertTrue(data_cache.log_file_checkpoints)
+        self.assertIsNone(
+            data_cache.get_log_file_checkpoint('00001111AAAABBBB'),
+        )
 
-    def test_check_or_set_record_id_true_when_exists(self):
+        # execute
+        data_cache.put_log_file_checkpoint('00001111AAAABBBB', checkpoint)
+
+        # verify
+        self.assertEqual(
+            data_cache.get_log_file_checkpoint('00001111AAAABBBB'),
+            checkpoint,
+        )
+
+        # execute
+        data_cache.delete_log_file_checkpoint('00001111AAAABBBB')
+
+        # verify
+        self.assertIsNone(
+            data_cache.get_log_file_checkpoint('00001111AAAABBBB'),
+        )
+
+        backend.db.close()
+        tmp.cleanup()
+
+    def test_log_file_checkpoints_disabled_given_backend_without_hashes(self):
         '''
-        check_or_set_record_id returns true when record ID is in the cached set
-        given: a backend instance
-        when: check_or_set_record_id is called
-        and when: record ID is in the set 'record_ids'
-        then: returns true
+        DataCache disables log file checkpoints given a backend that can not hold hashes
+        given: a backend without hashes
+        when: a DataCache is created with log file checkpoints enabled
+        then: log file checkpoints are disabled
         '''
 
-        # setup
-        backend = BackendStub({ 'record_ids': set(['foo']) })
-
         # execute
-        data_cache = cache.DataCache(backend, 5)
-        val = data_cache.check_or_set_record_id('foo')
+        data_cache = cache.DataCache(
+            BackendStub({}),
+            5,
+            log_file_checkpoints=True,
+        )
 
         # verify
-        self.assertTrue(val)
+        self.assertFalse(data_cache.log_file_checkpoints)
 
-    def test_check_or_set_record_id_false_and_adds_when_missing(self):
+    def test_on_delivered_calls_callbacks_once_logs_are_delivered(self):
         '''
-        check_or_set_record_id returns false and adds record ID when record ID is not in the cached set
+        on_delivered calls each callback once the logs received before it was added have been delivered
         given: a backend instance
-        when: check_or_set_record_id is called
-        and when: record ID is not in set 'record_ids'
-        then: the record ID is added to the set and False is returned
+        when: logs are received through track_delivery
+        and when: callbacks are added after some of the logs
+        then: no callback is called before any logs are delivered
+        and when: logs are delivered
+        then: the callbacks of the delivered logs are called in order
+        and: a callback added when all logs are delivered is called at once
+        and when: a new run starts
+        then: callbacks of the previous run are forgotten
         '''
 
         # setup
-        backend = BackendStub({ 'record_ids': set() })
+        data_cache = cache.DataCache(BackendStub({}), 5)
+        called = []
 
-        # preconditions
-        self.assertFalse('foo' in backend.redis.test_cache['record_ids'])
+        def logs():
+            yield 1
+            data_cache.on_delivered(lambda : called.append('a'))
+            yield 2
+            yield 3
+            data_cache.on_delivered(lambda : called.append('b'))
 
         # execute
-        data_cache = cache.DataCache(backend, 5)
-        val = data_cache.check_or_set_record_id('foo')
+        received = list(data_cache.track_delivery(logs()))
 
         # verify
-        self.assertFalse(val)
+        self.assertEqual(received, [1, 2, 3])
+        self.assertEqual(called, [])
 
-        # Need to flush before we can check the cache as how it is stored
-        # in memory is an implementation detail
-        data_cache.flush()
-        self.assertTrue('foo' in backend.redis.test_cache['record_ids'])
+        # execute
+        data_cache.set_delivered(2)
 
-    def test_check_or_set_record_id_raises_if_backend_does(self):
+        # verify
+        self.assertEqual(called, ['a'])
+
+        # execute
+        data_cache.set_delivered(1)
+        data_cache.on_delivered(lambda : called.append('c'))
+
+        # verify
+        self.assertEqual(called, ['a', 'b', 'c'])
+
+        # execute
+        it = data_cache.track_delivery(logs())
+        next(it)
+        next(it)
+        it = data_cache.track_delivery(iter([4]))
+        list(it)
+        data_cache.set_delivered(1)
+
+        # verify
+        self.assertEqual(called, ['a', 'b', 'c'])
+
+    def test_data_cache_raises_given_invalid_key_layout(self):
         '''
-        check_or_set_record_id raises CacheException if backend raises any Exception
+        DataCache raises a CacheException given an unknown key layout
         given: a backend instance
-        when: check_or_set_record_id is called
-        and when: backend raises any exception
-        then: a CacheException is raised
+        when: a DataCache is created with an unknown key layout
+        then: raises a CacheException
         '''
 
-        # setup
-        backend = BackendStub({}, raise_error=True)
-
         # execute / verify
-        data_cache = cache.DataCache(backend, 5)
-
         with self.assertRaises(CacheException) as _:
-            data_cache.check_or_set_record_id('foo')
+            cache.DataCache(BackendStub({}), 5, key_layout='foo')
 
     def test_flush_does_not_affect_cache_when_add_buffers_empty(self):
         '''
@@ -713,3 +2054,158 @@ class TestDataCache(unittest.TestCase):
 
         with self.assertRaises(CacheException) as _:
             data_cache.flush()
+
+    def test_flush_log_file_writes_only_given_log_file(self):
+        '''
+        flush_log_file writes the buffered log lines for the given log file only
+        given: a backend instance
+        when: flush_log_file is called
+        and when: the log lines add buffers for several log files are not empty
+        then: the backend cache is updated with items from the add buffer of the given log file
+        and: the add buffers of other log files are left untouched
+        '''
+
+        # setup
+        backend = BackendStub({})
+
+        # execute
+        data_cache = cache.DataCache(backend, 5)
+        data_cache.check_or_set_log_line('foo', { 'REQUEST_ID': 'bar' })
+        data_cache.check_or_set_log_line('beep', { 'REQUEST_ID': 'boop' })
+        data_cache.flush_log_file('foo')
+
+        # verify
+        self.assertEqual(backend.redis.test_cache['foo'], set(['bar']))
+        self.assertTrue('foo' in backend.redis.expiry)
+        self.assertFalse('beep' in backend.redis.test_cache)
+        self.assertFalse('foo' in data_cache.log_records)
+        self.assertTrue('beep' in data_cache.log_records)
+
+        # flushing an unknown log file is a no-op
+        data_cache.flush_log_file('bim')
+        self.assertFalse('bim' in backend.redis.test_cache)
+
+
+    def test_flush_writes_in_background_given_write_behind(self):
+        '''
+        flush writes the buffers on a background thread when write behind is enabled
+        given: a backend instance
+        and given: write behind is enabled
+        when: flush is called
+        then: flush returns before the buffers are written
+        and: IDs being written are still seen by lookups
+        and when: wait is called
+        then: the buffers have been written
+        '''
+
+        # setup
+        backend = BackendStub({})
+        started = threading.Event()
+        release = threading.Event()
+        write = backend.write
+
+        def blocking_write(keys, sets, days):
+            started.set()
+            release.wait(5)
+            write(keys, sets, days)
+
+        backend.write = blocking_write
+
+        # execute
+        data_cache = cache.DataCache(backend, 5, write_behind=True)
+        data_cache.check_or_set_log_line_id('foo', 'bar')
+        data_cache.check_or_set_record_id('r1')
+        data_cache.flush()
+
+        # verify
+        self.assertTrue(started.wait(5))
+        self.assertEqual(backend.redis.test_cache, {})
+        self.assertTrue(data_cache.can_skip_downloading_logfile('foo'))
+        self.assertTrue(data_cache.check_or_set_log_line_id('foo', 'bar'))
+        self.assertTrue(data_cache.check_or_set_record_id('r1'))
+
+        release.set()
+        data_cache.wait()
+
+        self.assertEqual(len(data_cache.pending), 0)
+        self.assertEqual(backend.redis.test_cache['foo'], set(['bar']))
+        self.assertEqual(backend.redis.test_cache['record_ids'], set(['r1']))
+        self.assertEqual(backend.redis.test_cache['r1'], 1)
+
+    def test_check_or_set_record_id_loads_record_ids_while_writes_are_pending(self):
+        '''
+        check_or_set_record_id loads the record IDs of the cache on the first check even while writes are pending
+        given: a backend instance with a record ID
+        and given: write behind is enabled
+        when: a log file is flushed
+        and when: check_or_set_record_id is called while the log file is being written
+        then: the record ID in the cache is seen
+        and: a new record ID is not seen
+        and when: the writes are done
+        then: both record IDs are seen
+        '''
+
+        # setup
+        backend = BackendStub({ 'record_ids': set(['r1']) })
+        started = threading.Event()
+        release = threading.Event()
+        write = backend.write
+
+        def blocking_write(keys, sets, days):
+            started.set()
+            release.wait(5)
+            write(keys, sets, days)
+
+        backend.write = blocking_write
+
+        data_cache = cache.DataCache(backend, 5, write_behind=True)
+        data_cache.check_or_set_log_line_id('foo', 'bar')
+
+        # execute
+        data_cache.flush_log_file('foo')
+
+        # verify
+        self.assertTrue(started.wait(5))
+        self.assertTrue(data_cache.check_or_set_record_id('r1'))
+        self.assertFalse(data_cache.check_or_set_record_id('r2'))
+        self.assertIsNone(data_cache.record_ids_count)
+
+        # execute
+        release.set()
+        data_cache.flush()
+        data_cache.wait()
+
+        # verify
+        self.assertTrue(data_cache.check_or_set_record_id('r1'))
+        self.assertTrue(data_cache.check_or_set_record_id('r2'))
+        self.assertEqual(
+            backend.redis.test_cache['record_ids'],
+            set(['r1', 'r2']),
+        )
+
+    def test_wait_raises_if_background_write_fails(self):
+        '''
+        wait raises CacheException if a background write failed
+        given: a backend instance
+        and given: write behind is enabled
+        when: flush is called
+        and when: the backend raises an exception writing the buffers
+        then: wait raises a CacheException
+        '''
+
+        # setup
+        backend = BackendStub({})
+
+        def failing_write(keys, sets, days):
+            raise RedisError('write failed')
+
+        backend.write = failing_write
+
+        # execute
+        data_cache = cache.DataCache(backend, 5, write_behind=True)
+        data_cache.check_or_set_record_id('r1')
+        data_cache.flush()
+
+        # verify
+        with self.assertRaises(CacheException) as _:
+            data_cache.wait()
@@ -0,0 +1,193 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+
+from newrelic_logging import SalesforceApiException
+from newrelic_logging.concurrency import \
+    get_process_pool, \
+    map_ordered, \
+    merge_iterators
+
+
+class TestConcurrency(unittest.TestCase):
+    def test_merge_iterators_yields_all_items_and_calls_on_complete(self):
+        '''
+        merge_iterators() yields every item from every iterator and calls on_complete once per iterator
+        given: a list of iterator factories
+        and given: a maximum number of workers
+        and given: a completion callback
+        when: merge_iterators() is called
+        then: every item from every iterator is yielded
+        and: the completion callback is called once for each iterator
+        and: the items from each iterator are yielded in order
+        '''
+
+        # setup
+        factories = [
+            lambda : iter(range(0, 1000)),
+            lambda : iter(range(1000, 1010)),
+            lambda : iter([]),
+        ]
+        completed = []
+
+        # execute
+        items = list(merge_iterators(
+            factories,
+            2,
+            lambda index : completed.append(index),
+            batch_size=7,
+        ))
+
+        # verify
+        self.assertEqual(len(items), 1010)
+        self.assertEqual(sorted(items), list(range(0, 1010)))
+        self.assertEqual(
+            [i for i in items if i < 1000],
+            list(range(0, 1000)),
+        )
+        self.assertEqual(sorted(completed), [0, 1, 2])
+
+    def test_merge_iterators_runs_iterators_concurrently(self):
+        '''
+        merge_iterators() drains up to max_workers iterators at the same time
+        given: a list of iterator factories
+        and given: a maximum number of workers
+        when: merge_iterators() is called
+        then: the iterators are drained on separate threads at the same time
+        '''
+
+        # setup
+        barrier = threading.Barrier(3, timeout=5)
+
+        def gen(i):
+            barrier.wait()
+            yield i
+
+        # execute
+        items = list(merge_iterators(
+            [lambda i=i : gen(i) for i in range(0, 3)],
+            3,
+        ))
+
+        # verify
+        self.assertEqual(sorted(items), [0, 1, 2])
+
+    def test_merge_iterators_raises_if_iterator_does(self):
+        '''
+        merge_iterators() raises the exception raised by any of the iterators
+        given: a list of iterator factories
+        and given: a maximum number of workers
+        when: merge_iterators() is called
+        and when: one of the iterators raises an exception
+        then: the exception is raised in the calling thread
+        '''
+
+        # setup
+        def gen():
+            yield 1
+            raise SalesforceApiException(-1, 'raise_error set')
+
+        # execute / verify
+        with self.assertRaises(SalesforceApiException) as _:
+            list(merge_iterators([gen], 1))
+
+    def test_merge_iterators_stops_workers_when_closed(self):
+        '''
+        merge_iterators() stops the workers when the generator is closed early
+        given: a list of iterator factories
+        and given: a maximum number of workers
+        when: merge_iterators() is called
+        and when: the generator is closed before all items are consumed
+        then: the workers stop without draining their iterators
+        '''
+
+        # setup
+        produced = 0
+
+        def gen():
+            nonlocal produced
+            for i in range(0, 100000):
+                produced += 1
+                yield i
+
+        # execute
+        itr = merge_iterators([gen], 1, batch_size=10)
+        next(itr)
+        itr.close()
+        time.sleep(0.2)
+
+        # verify
+        self.assertLess(produced, 100000)
+
+    def test_map_ordered_yields_results_in_order_with_bounded_pending_items(self):
+        '''
+        map_ordered() calls the function with each item on the executor and yields the results in the order of the items
+        given: an executor
+        and given: a function
+        and given: an iterator of items
+        and given: a maximum number of pending items
+        when: map_ordered() is called
+        then: the result for each item is yielded in the order of the items
+        and: no more than the maximum number of items are read ahead of the results yielded
+        '''
+
+        # setup
+        read = []
+
+        def items():
+            for i in range(0, 20):
+                read.append(i)
+                yield i
+
+        def fn(i):
+            time.sleep(0.001 * (20 - i))
+            return i * 2
+
+        # execute
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = []
+
+            for result in map_ordered(executor, fn, items(), 3):
+                self.assertLessEqual(len(read), len(results) + 3)
+                results.append(result)
+
+        # verify
+        self.assertEqual(results, [i * 2 for i in range(0, 20)])
+
+    def test_map_ordered_raises_exception_if_function_does(self):
+        '''
+        map_ordered() raises the exception raised by the function
+        given: an executor
+        and given: a function that raises an exception
+        when: map_ordered() is called
+        then: the exception is raised
+        '''
+
+        # setup
+        def fn(i):
+            if i == 3:
+                raise SalesforceApiException(-1, 'boom')
+
+            return i
+
+        # execute / verify
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            with self.assertRaises(SalesforceApiException) as _:
+                list(map_ordered(executor, fn, iter(range(0, 10)), 2))
+
+    def test_get_process_pool_returns_shared_pool(self):
+        '''
+        get_process_pool() returns the same process pool for the same number of workers
+        given: a number of workers
+        when: get_process_pool() is called more than once
+        then: the same pool is returned
+        and: the pool runs functions in worker processes
+        '''
+
+        # execute
+        pool = get_process_pool(2)
+
+        # verify
+        self.assertIs(get_process_pool(2), pool)
+        self.assertEqual(pool.submit(abs, -5).result(timeout=30), 5)
@@ -0,0 +1,265 @@
+import csv
+import io
+import unittest
+
+
+from newrelic_logging import csv_parser
+
+
+class TestCsvParser(unittest.TestCase):
+    def setUp(self):
+        with open('./tests/sample_log_lines.csv') as stream:
+            self.log_rows = stream.readlines()
+
+    def parse(self, data: str, read_size: int = 1024, max_read_size: int = 1024):
+        stream = io.BytesIO(data.encode('utf-8'))
+        return list(csv_parser.CsvParser(stream.read, read_size, max_read_size))
+
+    def test_csv_parser_yields_header_and_rows_as_tuples(self):
+        '''
+        CsvParser yields the header row followed by one tuple of field values for each row
+        given: CSV data with a header row and data rows
+        when: the parser is iterated
+        then: the header row is yielded first
+        and: each data row is yielded as a tuple indexed by column position
+        and: the rows match the rows produced by the csv module
+        '''
+
+        # setup
+        data = ''.join(self.log_rows)
+
+        # execute
+        rows = self.parse(data)
+
+        # verify
+        self.assertEqual(
+            rows,
+            [tuple(row) for row in csv.reader(self.log_rows)],
+        )
+        self.assertEqual(rows[0][0], 'EVENT_TYPE')
+        self.assertEqual(rows[1][17], '"https://test.local.test"')
+
+    def test_csv_parser_handles_quoted_fields(self):
+        '''
+        CsvParser handles line terminators, separators and quotes inside quoted fields
+        given: CSV data with fields containing line terminators, separators and escaped quotes
+        and given: CSV data with unquoted fields, blank lines and CRLF line terminators
+        when: the parser is iterated
+        then: the rows match the rows produced by the csv module
+        '''
+
+        # setup
+        data = \
+            '"A","B","C"\r\n' \
+            '"multi\nline","a "",""quoted"" value","x"\r\n' \
+            '\r\n' \
+            'plain,"",3\r\n' \
+            '"crlf\r\ninside","b","c"'
+
+        # execute
+        rows = self.parse(data, read_size=4, max_read_size=4)
+
+        # verify
+        self.assertEqual(
+            rows,
+            [
+                tuple(row) for row in csv.reader(io.StringIO(data, newline=''))
+                if row
+            ],
+        )
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][0], 'multi\nline')
+        self.assertEqual(rows[1][1], 'a ","quoted" value')
+        self.assertEqual(rows[3][0], 'crlf\r\ninside')
+
+    def test_csv_parser_decodes_characters_split_across_reads(self):
+        '''
+        CsvParser decodes multi-byte characters that are split across reads
+        given: CSV data with multi-byte characters
+        and given: a read size of 1 byte
+        when: the parser is iterated
+        then: the multi-byte characters are decoded correctly
+        '''
+
+        # execute
+        rows = self.parse('"NAME"\n"héllo ☃"\n', 1, 1)
+
+        # verify
+        self.assertEqual(rows, [('NAME',), ('héllo ☃',)])
+
+    def test_csv_parser_grows_read_size_up_to_max_read_size(self):
+        '''
+        CsvParser grows the read size while reads return the full amount requested
+        given: CSV data larger than the initial read size
+        when: the parser is iterated
+        then: the read size doubles after each full read
+        and: the read size never exceeds the max read size
+        '''
+
+        # setup
+        data = '"A","B"\n' + ''.join([f'"{i}","x"\n' for i in range(0, 1000)])
+        stream = io.BytesIO(data.encode('utf-8'))
+        sizes = []
+
+        def read(size: int) -> bytes:
+            sizes.append(size)
+            return stream.read(size)
+
+        # execute
+        rows = list(csv_parser.CsvParser(read, 16, 256))
+
+        # verify
+        self.assertEqual(len(rows), 1001)
+        self.assertEqual(sizes[:6], [16, 32, 64, 128, 256, 256])
+        self.assertEqual(max(sizes), 256)
+
+    def test_csv_parser_resumes_from_checkpoint(self):
+        '''
+        CsvParser resumes parsing from any checkpoint it reports
+        given: CSV data with quoted fields containing line terminators and multi-byte characters
+        when: the parser is iterated with a small read size
+        then: checkpoints are reported at the end of blocks not ending inside a quoted field
+        and when: a parser is created with the header and the offset of a checkpoint over the data after the offset
+        then: the parser yields the header followed by the rows after the number of rows of the checkpoint
+        and: the checkpoints of the parser are positions in the whole data
+        '''
+
+        # setup
+        lines = ['"A","B"'] + [
+            f'"{i}","multi\nline é {i}"' if i % 7 == 0 else f'"{i}","x{i}"' \
+                for i in range(0, 200)
+        ]
+        data = ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+        # execute
+        parser = csv_parser.CsvParser(io.BytesIO(data).read, 50, 200)
+        it = iter(parser)
+        header = next(it)
+        rows = []
+        checkpoints = set()
+
+        for row in it:
+            rows.append(row)
+            checkpoints.add(parser.checkpoint)
+
+        # verify
+        self.assertEqual(len(rows), 200)
+        self.assertEqual(parser.rows, 200)
+        self.assertEqual(parser.header, ('A', 'B'))
+        self.assertEqual(parser.checkpoint, (len(data), 200))
+        self.assertGreater(len(checkpoints), 10)
+
+        for offset, count in checkpoints:
+            if offset == 0:
+                continue
+
+            # execute
+            resumed = csv_parser.CsvParser(
+                io.BytesIO(data[offset:]).read,
+                37,
+                100,
+                header=header,
+                offset=offset,
+            )
+
+            # verify
+            self.assertEqual(data[offset - 1:offset], b'\n')
+            self.assertEqual(list(resumed), [header] + rows[count:])
+            self.assertEqual(resumed.checkpoint, (len(data), 200 - count))
+
+    def test_csv_parser_yields_nothing_given_no_data(self):
+        '''
+        CsvParser yields nothing when there is no data
+        given: empty CSV data
+        when: the parser is iterated
+        then: no rows are yielded
+        '''
+
+        # execute / verify
+        self.assertEqual(self.parse(''), [])
+
+
+    def test_csv_parser_chunks_yields_blocks_of_complete_records(self):
+        '''
+        CsvParser.chunks() yields the data after the header row in blocks of complete records
+        given: CSV data with quoted line breaks
+        when: the chunks of the parser are iterated
+        then: the header row is parsed into the header
+        and: each block but the last is at least the given size
+        and: each block ends at the end of a record
+        and: the blocks together are the data after the header row
+        '''
+
+        # setup
+        header = ('A', 'B')
+        rows = [(f'{i}', f'x\n{i}') for i in range(0, 200)]
+        data = ('\n"A","B"\n' + ''.join(
+            f'"{a}","{b}"\n' for a, b in rows
+        )).encode('utf-8')
+        parser = csv_parser.CsvParser(io.BytesIO(data).read, 37, 100)
+
+        # execute
+        chunks = list(parser.chunks(256))
+
+        # verify
+        self.assertEqual(parser.header, header)
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(b''.join(chunks), data[len('\n"A","B"\n'):])
+
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 256)
+
+        parsed = []
+
+        for chunk in chunks:
+            self.assertEqual(chunk[-2:], b'"\n')
+            parsed.extend(list(csv_parser.CsvParser(
+                io.BytesIO(chunk).read,
+                header=header,
+            ))[1:])
+
+        self.assertEqual(parsed, rows)
+
+    def test_find_record_start_returns_start_of_first_record(self):
+        '''
+        find_record_start() returns the index of the first record that starts in a block of CSV data
+        given: CSV data with quoted line breaks
+        when: find_record_start() is called with the data from each position
+        then: returns the index of the first record after the position
+        and: returns None when no complete record follows the position
+        '''
+
+        # setup
+        data = b'"A","B","C"\n"1","x\ny","3"\n"4","5","6"\n"7","8","9"\n'
+        records = [0, 12, 26, 38, len(data)]
+
+        for i in range(1, len(data)):
+            # execute
+            index = csv_parser.find_record_start(data[i:], 3)
+
+            # verify
+            start = next(start for start in records if start > i)
+
+            if start == len(data):
+                self.assertIsNone(index)
+                continue
+
+            self.assertEqual(i + index, start)
+
+    def test_find_record_start_returns_none_given_ambiguous_data(self):
+        '''
+        find_record_start() returns None when the start of a record can not be told apart
+        given: CSV data where the records after the first line break have the right number of columns whether or not the data starts inside a quoted field
+        when: find_record_start() is called
+        then: returns None
+        '''
+
+        # setup
+        data = b'\n,\n"\n,\n'
+
+        # execute / verify
+        self.assertIsNone(csv_parser.find_record_start(data, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 import unittest
 from unittest.mock import patch
 
@@ -119,6 +120,45 @@ class TestFactory(unittest.TestCase):
         self.assertTrue(type(data_cache.backend) is BackendStub)
         self.assertEqual(data_cache.expiry, 300)
 
+    def test_new_data_cache_returns_data_cache_with_expiry_days_of_cache_backend(self):
+        '''
+        new_data_cache() returns DataCache instance with the expiry days of the configured cache backend
+        given: an instance configuration
+        and given: a backend factory
+        when: new_data_cache() is called
+        and when: cache_backend is sqlite or bloom in instance configuration
+        and when: expire_days is specified for that backend and for redis
+        then: return a DataCache with the expiry set to the value of that backend
+        '''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for cache_backend, expire_days in [('sqlite', 7), ('bloom', 3)]:
+                # setup
+                instance_config = mod_config.Config({
+                    'cache_enabled': 'true',
+                    'cache_backend': cache_backend,
+                    'redis': { 'expire_days': 300 },
+                    'sqlite': {
+                        'path': os.path.join(tmp, 'cache.db'),
+                        'expire_days': 7,
+                    },
+                    'bloom': {
+                        'path': os.path.join(tmp, 'bloom'),
+                        'capacity': 100,
+                        'expire_days': 3,
+                    },
+                })
+
+                # execute
+                f = factory.Factory()
+                data_cache = f.new_data_cache(
+                    instance_config,
+                    cache.BackendFactory(),
+                )
+
+                # verify
+                self.assertEqual(data_cache.expiry, expire_days)
+
     def test_new_data_cache_raises_if_backend_factory_does(self):
         '''
         new_data_cache() raises CacheException if backend factory does
@@ -319,7 +359,7 @@ class TestFactory(unittest.TestCase):
         data_cache = DataCacheStub({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set(['foo', 'bar'])
+        numeric_fields_mapping = { 'Common': ['foo', 'bar'] }
 
         # execute
         f = factory.Factory()
@@ -329,7 +369,7 @@ class TestFactory(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
         # verify
@@ -340,7 +380,7 @@ class TestFactory(unittest.TestCase):
         self.assertEqual(p.new_relic, new_relic)
         self.assertEqual(p.data_format, DataFormat.LOGS)
         self.assertEqual(p.labels, labels)
-        self.assertEqual(p.numeric_fields_list, numeric_fields_list)
+        self.assertEqual(p.numeric_fields_mapping, numeric_fields_mapping)
 
     def test_new_instance_returns_instance_with_given_values(self):
         '''
@@ -352,15 +392,17 @@ class TestFactory(unittest.TestCase):
         and given: a NewRelic instance
         and given: a list of receiver creation functions
         and given: a dict of labels
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         then: return an Instance instance with an instance name and a properly
             configured Api instance and Pipeline instance
+        and: the receiver creation functions are passed the instance name
         '''
 
         # setup
         receiver_1 = None
         receiver_1_called = False
+        receiver_instance_names = []
         receiver_2 = None
         receiver_2_called = False
 
@@ -368,10 +410,12 @@ class TestFactory(unittest.TestCase):
             instance_config: mod_config.Config,
             data_cache: cache.DataCache,
             api: mod_api.Api,
+            instance_name: str = '',
         ):
             nonlocal receiver_1_called
             nonlocal receiver_1
             receiver_1_called = True
+            receiver_instance_names.append(instance_name)
             receiver_1 = ReceiverStub(
                 instance_config=instance_config,
                 data_cache=data_cache,
@@ -383,10 +427,12 @@ class TestFactory(unittest.TestCase):
             instance_config: mod_config.Config,
             data_cache: cache.DataCache,
             api: mod_api.Api,
+            instance_name: str = '',
         ):
             nonlocal receiver_2_called
             nonlocal receiver_2
             receiver_2_called = True
+            receiver_instance_names.append(instance_name)
             receiver_2 = ReceiverStub(
                 instance_config=instance_config,
                 data_cache=data_cache,
@@ -423,7 +469,7 @@ class TestFactory(unittest.TestCase):
             new_relic,
             [new_receiver_1, new_receiver_2],
             { 'foo': 'bar' },
-            set(),
+            {},
         )
 
         # verify
@@ -437,6 +483,7 @@ class TestFactory(unittest.TestCase):
         self.assertEqual(instance.pipeline, p)
         self.assertTrue(receiver_1_called)
         self.assertTrue(receiver_2_called)
+        self.assertEqual(receiver_instance_names, ['test-inst-1', 'test-inst-1'])
         self.assertEqual(len(instance.pipeline.receivers), 2)
         r = instance.pipeline.receivers[0]
         self.assertEqual(r, receiver_1)
@@ -455,7 +502,7 @@ class TestFactory(unittest.TestCase):
         given: a factory
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         and when: the integration configuration does not contain an 'instances'
             property
@@ -470,7 +517,7 @@ class TestFactory(unittest.TestCase):
             f = factory.Factory()
             fs = FactoryStub()
 
-            _ = f.new_integration(fs, config, [], set())
+            _ = f.new_integration(fs, config, [], {})
 
     def test_new_integration_raises_config_exception_given_no_instances(self):
         '''
@@ -478,7 +525,7 @@ class TestFactory(unittest.TestCase):
         given: a factory
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         and when: the integration configuration contains an 'instances' property
             that is the empty list
@@ -495,14 +542,14 @@ class TestFactory(unittest.TestCase):
             f = factory.Factory()
             fs = FactoryStub()
 
-            _ = f.new_integration(fs, config, [], set())
+            _ = f.new_integration(fs, config, [], {})
 
     def test_new_integration_raises_config_exception_given_invalid_data_format(self):
         '''
         new_integration() raises a ConfigException given an integration configuration that has an invalid data format value
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         and when: the integration configuration specifies an invalid property
             for newrelic.data_format
@@ -526,14 +573,85 @@ class TestFactory(unittest.TestCase):
             f = factory.Factory()
             fs = FactoryStub()
 
-            _ = f.new_integration(fs, config, [], set())
+            _ = f.new_integration(fs, config, [], {})
+
+    def test_new_integration_raises_config_exception_given_invalid_execution_mode(self):
+        '''
+        new_integration() raises a ConfigException given an integration configuration that has an invalid execution mode value
+        and given: an integration configuration
+        and given: a list of receiver creation functions
+        and given: a numeric fields mapping
+        when: new_instance() is called
+        and when: the integration configuration specifies an invalid property
+            for execution_mode
+        then: raise a ConfigException
+        '''
+
+        # setup
+        config = mod_config.Config({
+            'instances': [
+                {
+                    'name': 'test-inst-1',
+                },
+            ],
+            'execution_mode': 'invalid',
+        })
+
+        # execute / verify
+        with self.assertRaises(ConfigException) as _:
+            f = factory.Factory()
+            fs = FactoryStub()
+
+            _ = f.new_integration(fs, config, [], {})
+
+    def test_new_integration_returns_integration_given_threads_execution_mode_and_concurrency_limits(self):
+        '''
+        new_integration() returns an integration instance with the given execution mode and concurrency limits
+        and given: an integration configuration
+        and given: a list of receiver creation functions
+        and given: a numeric fields mapping
+        when: new_instance() is called
+        and when: the integration configuration specifies the threads execution
+            mode and concurrency limits
+        then: return an integration with the threads execution mode and the given
+            concurrency limits
+        '''
+
+        # setup
+        config = mod_config.Config({
+            'instances': [
+                {
+                    'name': 'test-inst-1',
+                    'arguments': {
+                        'token_url': 'https://my.salesforce.test',
+                    }
+                },
+            ],
+            'execution_mode': 'THREADS',
+            'max_concurrent_instances': 3,
+            'max_concurrent_uploads': 5,
+        })
+
+        # execute
+        f = factory.Factory()
+        fs = FactoryStub(
+            new_relic=NewRelicStub(),
+            telemetry=TelemetryStub(),
+        )
+
+        i = f.new_integration(fs, config, [], {})
+
+        # verify
+        self.assertEqual(i.execution_mode, integration.EXECUTION_MODE_THREADS)
+        self.assertEqual(i.max_concurrent_instances, 3)
+        self.assertEqual(i.max_concurrent_uploads, 5)
 
     def test_new_integration_raises_config_exception_given_missing_instance_name(self):
         '''
         new_integration() raises a ConfigException given an integration configuration that has an instance without a 'name' property
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         and when: the integration configuration contains an instance without a
             'name' property
@@ -553,14 +671,14 @@ class TestFactory(unittest.TestCase):
             f = factory.Factory()
             fs = FactoryStub()
 
-            _ = f.new_integration(fs, config, [], set())
+            _ = f.new_integration(fs, config, [], {})
 
     def test_new_integration_returns_integration_given_default_data_format_and_single_instance_with_no_labels_or_prefix(self):
         '''
         new_integration() returns an integration instance with the default data format and a single instance with the given instance configuration
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         and when: the integration configuration contains a single valid instance
             configuration
@@ -574,6 +692,7 @@ class TestFactory(unittest.TestCase):
             instance_config: mod_config.Config,
             data_cache: cache.DataCache,
             api: mod_api.Api,
+            instance_name: str = '',
         ):
             return ReceiverStub()
 
@@ -598,7 +717,7 @@ class TestFactory(unittest.TestCase):
             telemetry=telemetry
         )
 
-        i = f.new_integration(fs, config, [new_receiver_func], set())
+        i = f.new_integration(fs, config, [new_receiver_func], {})
 
         # verify
         self.assertIsNotNone(i)
@@ -618,14 +737,14 @@ class TestFactory(unittest.TestCase):
         self.assertEqual(len(instance.receivers), 1)
         self.assertEqual(instance.receivers[0], new_receiver_func)
         self.assertEqual(instance.labels, { 'nr-labs': 'data' })
-        self.assertEqual(instance.numeric_fields_list, set())
+        self.assertEqual(instance.numeric_fields_mapping, {})
 
     def test_new_integration_returns_integration_given_events_data_format_and_single_instance_with_labels_and_no_prefix(self):
         '''
         new_integration() returns an integration instance with the events data format and a single instance with the given instance configuration
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         and when: the integration configuration contains a single valid instance
             configuration
@@ -641,6 +760,7 @@ class TestFactory(unittest.TestCase):
             instance_config: mod_config.Config,
             data_cache: cache.DataCache,
             api: mod_api.Api,
+            instance_name: str = '',
         ):
             return ReceiverStub()
 
@@ -669,7 +789,7 @@ class TestFactory(unittest.TestCase):
             telemetry=telemetry
         )
 
-        i = f.new_integration(fs, config, [new_receiver_func], set())
+        i = f.new_integration(fs, config, [new_receiver_func], {})
 
         # verify
         self.assertIsNotNone(i)
@@ -689,14 +809,14 @@ class TestFactory(unittest.TestCase):
         self.assertEqual(len(instance.receivers), 1)
         self.assertEqual(instance.receivers[0], new_receiver_func)
         self.assertEqual(instance.labels, { 'nr-labs': 'data', 'foo': 'bar' })
-        self.assertEqual(instance.numeric_fields_list, set())
+        self.assertEqual(instance.numeric_fields_mapping, {})
 
     def test_new_integration_returns_integration_given_logs_data_format_and_single_instance_with_labels_and_prefix(self):
         '''
         new_integration() returns an integration instance with the logs data format and a single instance with the given instance configuration
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         when: new_instance() is called
         and when: the integration configuration contains a single valid instance
             configuration
@@ -713,6 +833,7 @@ class TestFactory(unittest.TestCase):
             instance_config: mod_config.Config,
             data_cache: cache.DataCache,
             api: mod_api.Api,
+            instance_name: str = '',
         ):
             return ReceiverStub()
 
@@ -742,7 +863,7 @@ class TestFactory(unittest.TestCase):
             telemetry=telemetry
         )
 
-        i = f.new_integration(fs, config, [new_receiver_func], set())
+        i = f.new_integration(fs, config, [new_receiver_func], {})
 
         # verify
         self.assertIsNotNone(i)
@@ -763,14 +884,14 @@ class TestFactory(unittest.TestCase):
         self.assertEqual(instance.receivers[0], new_receiver_func)
         self.assertEqual(instance.labels, { 'nr-labs': 'data', 'foo': 'bar' })
         self.assertEqual(instance.instance_config.prefix, 'NR_')
-        self.assertEqual(instance.numeric_fields_list, set())
+        self.assertEqual(instance.numeric_fields_mapping, {})
 
     def test_new_integration_returns_integration_given_default_data_format_and_single_instance_and_instance_index(self):
         '''
         new_integration() returns an integration instance with the events data format and a single instance with the given instance configuration
         and given: an integration configuration
         and given: a list of receiver creation functions
-        and given: a numeric fields set
+        and given: a numeric fields mapping
         and given: an instance index
         when: new_instance() is called
         and when: the integration configuration contains a single valid instance
@@ -787,6 +908,7 @@ class TestFactory(unittest.TestCase):
             instance_config: mod_config.Config,
             data_cache: cache.DataCache,
             api: mod_api.Api,
+            instance_name: str = '',
         ):
             return ReceiverStub()
 
@@ -811,7 +933,7 @@ class TestFactory(unittest.TestCase):
             telemetry=telemetry
         )
 
-        i = f.new_integration(fs, config, [new_receiver_func], set(), 0)
+        i = f.new_integration(fs, config, [new_receiver_func], {}, 0)
 
         # verify
         self.assertIsNotNone(i)
@@ -831,7 +953,7 @@ class TestFactory(unittest.TestCase):
         self.assertEqual(len(instance.receivers), 1)
         self.assertEqual(instance.receivers[0], new_receiver_func)
         self.assertEqual(instance.labels, { 'nr-labs': 'data' })
-        self.assertEqual(instance.numeric_fields_list, set())
+        self.assertEqual(instance.numeric_fields_mapping, {})
 
     def test_new_new_relic_raises_new_relic_api_exception_given_missing_license_key(self):
         '''
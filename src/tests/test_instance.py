@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import unittest
 
 
@@ -98,3 +99,36 @@ class TestInstance(unittest.TestCase):
 
         with self.assertRaises(NewRelicApiException) as _:
             inst.harvest(session)
+
+    def test_harvest_threads_calls_authenticate_and_executes_pipeline(self):
+        '''
+        harvest_threads() calls api.authenticate() and executes the pipeline
+        given: an instance name
+        and given: an API instance
+        and given: a pipeline
+        and given: an http session
+        and given: an upload executor
+        when: harvest_threads() is called
+        then: api.authenticate() is called
+        and: the pipeline is executed
+        '''
+
+        # setup
+        authenticator = AuthenticatorStub()
+        api = ApiStub(authenticator=authenticator)
+        p = PipelineStub()
+        session = SessionStub()
+
+        # execute
+        inst = instance.Instance(
+            'my_instance',
+            api,
+            p,
+        )
+
+        with ThreadPoolExecutor(1) as executor:
+            inst.harvest_threads(session, executor, 1)
+
+        # verify
+        self.assertTrue(authenticator.authenticate_called)
+        self.assertTrue(p.executed)
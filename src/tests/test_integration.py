@@ -215,3 +215,70 @@ class TestIntegration(unittest.TestCase):
 
         with self.assertRaises(Exception) as _:
             i.run()
+
+    def test_integration_run_calls_harvest_threads_for_each_instance_given_threads_execution_mode(self):
+        '''
+        Integration.run() calls the Instance.harvest_threads() method on each instance given the threads execution mode
+        given: a Telemetry instance
+        and given: a set of instance dicts from the configuration
+        and given: the threads execution mode
+        when: Integration.run() is called
+        then: Instance.harvest_threads() is called on each instance
+        and: telemetry is processed once
+        '''
+
+        # setup
+        telemetry = TelemetryStub(empty=False)
+        instances = [
+            InstanceStub('instance_1'),
+            InstanceStub('instance_2'),
+            InstanceStub('instance_3'),
+        ]
+
+        # execute
+        i = integration.Integration(
+            telemetry,
+            instances,
+            integration.EXECUTION_MODE_THREADS,
+            2,
+            1,
+        )
+
+        i.run()
+
+        # verify
+        self.assertTrue(instances[0].harvest_called)
+        self.assertTrue(instances[1].harvest_called)
+        self.assertTrue(instances[2].harvest_called)
+        self.assertTrue(telemetry.flush_called)
+
+    def test_integration_run_harvests_all_instances_and_raises_given_threads_execution_mode_and_instance_harvest_raises(self):
+        '''
+        Integration.run() harvests the remaining instances and raises the exception if Instance.harvest_threads() raises given the threads execution mode
+        given: a Telemetry instance
+        and given: a set of instance dicts from the configuration
+        and given: the threads execution mode
+        when: Integration.run() is called
+        and when: Instance.harvest_threads() raises a SalesforceApiException
+        then: Instance.harvest_threads() is called on the other instances
+        and: raise a SalesforceApiException
+        '''
+
+        # setup
+        telemetry = TelemetryStub()
+        instances = [
+            InstanceStub('instance_1', raise_error=True),
+            InstanceStub('instance_2'),
+        ]
+
+        # execute / verify
+        i = integration.Integration(
+            telemetry,
+            instances,
+            integration.EXECUTION_MODE_THREADS,
+        )
+
+        with self.assertRaises(SalesforceApiException) as _:
+            i.run()
+
+        self.assertTrue(instances[1].harvest_called)
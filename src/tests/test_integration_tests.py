@@ -94,7 +94,7 @@ class TestIntegrationTests(unittest.TestCase):
             fs,
             mod_config.Config(self.config_logs_to_logs),
             [r],
-            set(),
+            {},
         )
         i.run()
 
@@ -209,7 +209,7 @@ class TestIntegrationTests(unittest.TestCase):
             fs,
             mod_config.Config(self.config_logs_to_events),
             [r],
-            set(),
+            {},
         )
         i.run()
 
@@ -296,7 +296,7 @@ class TestIntegrationTests(unittest.TestCase):
             fs,
             mod_config.Config(self.config_query_to_logs),
             [r],
-            set(),
+            {},
         )
         i.run()
 
@@ -407,7 +407,7 @@ class TestIntegrationTests(unittest.TestCase):
             fs,
             mod_config.Config(self.config_query_to_events),
             [r],
-            set(),
+            {},
         )
         i.run()
 
@@ -489,7 +489,7 @@ class TestIntegrationTests(unittest.TestCase):
             fs,
             mod_config.Config(self.config_limits_to_logs),
             [r],
-            set(),
+            {},
         )
         i.run()
 
@@ -592,7 +592,7 @@ class TestIntegrationTests(unittest.TestCase):
             fs,
             mod_config.Config(self.config_limits_to_events),
             [r],
-            set(),
+            {},
         )
         i.run()
 
@@ -0,0 +1,154 @@
+import io
+import json
+import unittest
+
+
+from newrelic_logging import json_parser
+
+
+class TestJsonRecordsParser(unittest.TestCase):
+    def setUp(self):
+        with open('./tests/sample_event_records.json') as stream:
+            self.event_records = json.load(stream)
+
+    def new_parser(self, data: str, read_size: int = 1024):
+        stream = io.BytesIO(data.encode('utf-8'))
+        return json_parser.JsonRecordsParser(stream.read, read_size)
+
+    def test_json_records_parser_yields_records_and_keeps_other_fields(self):
+        '''
+        JsonRecordsParser yields each element of the records array and keeps the other fields of the object
+        given: a page of query results
+        and given: a read size of 7 bytes
+        when: the parser is iterated
+        then: each record is yielded in order
+        and: the other fields are kept in the fields of the parser whether they come before or after the records
+        '''
+
+        # setup
+        data = '{"totalSize": 1234567, "done": false, "records": ' + \
+            json.dumps(self.event_records, indent=2) + \
+            ', "nextRecordsUrl": "/services/data/v55.0/query/01gA-2000"}'
+
+        # execute
+        parser = self.new_parser(data, 7)
+        records = list(parser)
+
+        # verify
+        self.assertEqual(records, self.event_records)
+        self.assertTrue(parser.has_records)
+        self.assertEqual(
+            parser.fields,
+            {
+                'totalSize': 1234567,
+                'done': False,
+                'nextRecordsUrl': '/services/data/v55.0/query/01gA-2000',
+            },
+        )
+
+    def test_json_records_parser_yields_records_before_all_data_is_read(self):
+        '''
+        JsonRecordsParser yields each record as soon as it has been read
+        given: a page of query results with many records
+        when: the first record is yielded
+        then: only the start of the data has been read
+        '''
+
+        # setup
+        data = json.dumps({
+            'done': True,
+            'records': [{ 'Id': f'{i}', 'Display': 'x' * 100 } for i in range(0, 1000)],
+        }).encode('utf-8')
+        stream = io.BytesIO(data)
+
+        # execute
+        parser = json_parser.JsonRecordsParser(stream.read, 1024)
+        record = next(iter(parser))
+
+        # verify
+        self.assertEqual(record, { 'Id': '0', 'Display': 'x' * 100 })
+        self.assertLess(stream.tell(), 4096)
+
+    def test_json_records_parser_decodes_characters_split_across_reads(self):
+        '''
+        JsonRecordsParser decodes multi-byte characters that are split across reads
+        given: a page of query results with multi-byte characters
+        and given: a read size of 1 byte
+        when: the parser is iterated
+        then: the multi-byte characters are decoded correctly
+        '''
+
+        # execute
+        parser = self.new_parser('{"records":[{"Name":"héllo ☃"}],"done":true}', 1)
+
+        # verify
+        self.assertEqual(list(parser), [{ 'Name': 'héllo ☃' }])
+        self.assertEqual(parser.fields, { 'done': True })
+
+    def test_json_records_parser_decodes_numbers_split_across_reads(self):
+        '''
+        JsonRecordsParser decodes numbers that are split across reads
+        given: a page of query results with numbers
+        and given: a read size of 1 byte
+        when: the parser is iterated
+        then: the numbers are decoded whole
+        '''
+
+        # execute
+        parser = self.new_parser(
+            '{"totalSize":1948.5,"records":[1948.25,-12e3,{"N":7E-2}],"n":10}',
+            1,
+        )
+
+        # verify
+        self.assertEqual(list(parser), [1948.25, -12e3, { 'N': 7E-2 }])
+        self.assertEqual(parser.fields, { 'totalSize': 1948.5, 'n': 10 })
+
+    def test_json_records_parser_yields_nothing_given_no_records(self):
+        '''
+        JsonRecordsParser yields nothing when there is no records array
+        given: an object with an empty records array
+        or given: an object with no records array
+        when: the parser is iterated
+        then: no records are yielded
+        and: has_records is True only if there is a records array
+        '''
+
+        # execute
+        parser = self.new_parser('{ "records" : [ ], "done": true }', 3)
+
+        # verify
+        self.assertEqual(list(parser), [])
+        self.assertTrue(parser.has_records)
+        self.assertEqual(parser.fields, { 'done': True })
+
+        # execute
+        parser = self.new_parser('{}')
+
+        # verify
+        self.assertEqual(list(parser), [])
+        self.assertFalse(parser.has_records)
+
+    def test_json_records_parser_raises_given_incomplete_data(self):
+        '''
+        JsonRecordsParser raises a JSONDecodeError when the data ends before the object
+        given: an incomplete page of query results
+        when: the parser is iterated
+        then: the records before the end of the data are yielded
+        and: raises a JSONDecodeError
+        '''
+
+        # setup
+        parser = self.new_parser('{"records": [{"Id": "1"}, {"Id": "2"', 4)
+        records = []
+
+        # execute / verify
+        with self.assertRaises(json.JSONDecodeError) as _:
+            for record in parser:
+                records.append(record)
+
+        self.assertEqual(records, [{ 'Id': '1' }])
+
+
+if __name__ == '__main__':
+    unittest.main()
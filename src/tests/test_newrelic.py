@@ -1,7 +1,13 @@
+import gzip
+import json
 import unittest
 
 
-from newrelic_logging import NewRelicApiException, newrelic
+from . import ResponseStub, SessionStub
+from newrelic_logging import \
+    NewRelicApiException, \
+    newrelic, \
+    PayloadTooLargeException
 
 
 class TestNewRelic(unittest.TestCase):
@@ -193,3 +199,174 @@ class TestNewRelic(unittest.TestCase):
             endpoint,
             newrelic.FEDRAMP_EVENTS_ENDPOINT.format(account_id=12345),
         )
+
+    def test_payload_encoder_finish_returns_gzipped_json_of_added_records(self):
+        '''
+        PayloadEncoder.finish() returns the gzipped JSON array of the added records
+        given: a payload encoder
+        when: records are added to the encoder
+        and when: PayloadEncoder.finish() is called
+        then: the gzipped JSON array of the records is returned
+        and: the encoder reports the uncompressed and compressed sizes
+        '''
+
+        # setup
+        encoder = newrelic.PayloadEncoder()
+        records = [{ 'foo': f'bar {i}' } for i in range(0, 10)]
+
+        # execute
+        for record in records:
+            encoder.add(record)
+
+        payload = encoder.finish()
+
+        # verify
+        self.assertEqual(encoder.count, 10)
+        self.assertEqual(json.loads(gzip.decompress(payload)), records)
+        self.assertEqual(encoder.size, len(gzip.decompress(payload)))
+        self.assertEqual(encoder.compressed_size, len(payload))
+        self.assertEqual(encoder.finish(), payload)
+        self.assertEqual(encoder.records(), records)
+
+    def test_payload_encoder_reports_running_compressed_size(self):
+        '''
+        PayloadEncoder holds written data compressed and reports the running compressed size
+        given: a payload encoder
+        when: more than the flush interval of data is added to the encoder
+        then: the compressed size reflects the data written so far
+        and: the estimated compressed size is within a flush interval of the final size
+        '''
+
+        # setup
+        encoder = newrelic.PayloadEncoder()
+
+        # execute
+        for i in range(0, 5000):
+            encoder.add({ 'message': f'log message {i}' })
+
+        estimate = encoder.estimate_compressed_size()
+        compressed_size = encoder.compressed_size
+
+        # verify
+        self.assertTrue(encoder.size > newrelic.FLUSH_INTERVAL)
+        self.assertTrue(compressed_size > 0)
+        self.assertTrue(compressed_size < encoder.size)
+        self.assertTrue(encoder.pending_size < newrelic.FLUSH_INTERVAL)
+        self.assertTrue(encoder.compression_ratio() < 1)
+        final_size = len(encoder.finish())
+        self.assertTrue(abs(final_size - estimate) < newrelic.FLUSH_INTERVAL)
+
+    def test_payload_encoder_split_returns_two_encoders_with_halves_of_records(self):
+        '''
+        PayloadEncoder.split() returns two encoders holding each half of the records
+        given: a logs payload encoder
+        when: records are added to the encoder
+        and when: PayloadEncoder.split() is called
+        then: two encoders are returned holding the first and second half of the records
+        and: each encoder produces a logs payload with the common attributes
+        '''
+
+        # setup
+        encoder = newrelic.new_logs_encoder({ 'foo': 'bar' })
+
+        # execute
+        for i in range(0, 5):
+            encoder.add({ 'message': f'log {i}' })
+
+        first, second = encoder.split()
+
+        # verify
+        self.assertEqual(first.count, 2)
+        self.assertEqual(second.count, 3)
+        data = json.loads(gzip.decompress(second.finish()))
+        self.assertEqual(data[0]['common'], { 'foo': 'bar' })
+        self.assertEqual(
+            [log['message'] for log in data[0]['logs']],
+            ['log 2', 'log 3', 'log 4'],
+        )
+        self.assertEqual(
+            data[0]['logs'][0]['attributes']['collector.name'],
+            newrelic.COLLECTOR_NAME,
+        )
+
+    def test_post_logs_posts_compressed_payload_and_returns_payload_sizes(self):
+        '''
+        NewRelic.post_logs() posts the gzipped payload and returns the uncompressed and compressed payload sizes
+        given: a NewRelic instance
+        and given: an http session
+        and given: a logs payload
+        when: NewRelic.post_logs() is called
+        and when: the logs api returns a 202
+        then: the gzipped payload is posted with the integration attributes
+        and: the uncompressed and compressed payload sizes are returned
+        '''
+
+        # setup
+        session = SessionStub()
+        session.response = ResponseStub(202, 'Accepted', '{}', [])
+        data = [{ 'common': {}, 'logs': [{ 'message': 'foo' }] }]
+
+        # execute
+        nr = newrelic.NewRelic('12345', newrelic.US_LOGS_ENDPOINT, None)
+        size, compressed_size = nr.post_logs(session, data)
+
+        # verify
+        self.assertEqual(session.url, newrelic.US_LOGS_ENDPOINT)
+        self.assertEqual(session.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed_size, len(session.data))
+        payload = gzip.decompress(session.data)
+        self.assertEqual(size, len(payload))
+        logs = json.loads(payload)[0]['logs']
+        self.assertEqual(logs[0]['message'], 'foo')
+        self.assertEqual(
+            logs[0]['attributes']['collector.name'],
+            newrelic.COLLECTOR_NAME,
+        )
+
+    def test_post_logs_raises_payload_too_large_exception_on_413(self):
+        '''
+        NewRelic.post_logs() raises a PayloadTooLargeException when the logs api returns a 413
+        given: a NewRelic instance
+        and given: an http session
+        and given: a logs payload
+        when: NewRelic.post_logs() is called
+        and when: the logs api returns a 413
+        then: raise a PayloadTooLargeException
+        '''
+
+        # setup
+        session = SessionStub()
+        session.response = ResponseStub(413, 'Payload Too Large', '', [])
+        data = [{ 'common': {}, 'logs': [{ 'message': 'foo' }] }]
+
+        # execute / verify
+        nr = newrelic.NewRelic('12345', newrelic.US_LOGS_ENDPOINT, None)
+
+        with self.assertRaises(PayloadTooLargeException) as _:
+            nr.post_logs(session, data)
+
+    def test_post_events_raises_payload_too_large_exception_on_413(self):
+        '''
+        NewRelic.post_events() raises a PayloadTooLargeException when the events api returns a 413
+        given: a NewRelic instance
+        and given: an http session
+        and given: an events payload
+        when: NewRelic.post_events() is called
+        and when: the events api returns a 413
+        then: raise a PayloadTooLargeException
+        '''
+
+        # setup
+        session = SessionStub()
+        session.response = ResponseStub(413, 'Payload Too Large', '', [])
+        events = [{ 'eventType': 'foo' }]
+
+        # execute / verify
+        nr = newrelic.NewRelic(
+            '12345',
+            None,
+            newrelic.get_events_endpoint('US', '1'),
+        )
+
+        with self.assertRaises(PayloadTooLargeException) as _:
+            nr.post_events(session, events)
@@ -1,16 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
 import copy
 import json
+import threading
 import unittest
 
 
 from newrelic_logging import \
+    cache, \
     config as mod_config, \
     DataFormat, \
     LoginException, \
+    newrelic, \
     NewRelicApiException, \
     pipeline, \
     SalesforceApiException
 from . import \
+    BackendStub, \
+    DataCacheStub, \
     NewRelicStub, \
     ReceiverStub, \
     SessionStub
@@ -177,14 +183,212 @@ class TestPipeline(unittest.TestCase):
         self.assertTrue('common' in l)
         self.assertEqual(len(l['logs']), 3)
 
+    def test_load_as_logs_sends_multiple_requests_when_payload_size_exceeds_max_payload_bytes(self):
+        '''
+        load_as_logs() cuts batches based on the estimated payload size when no max rows value is given
+        given: an iterator over log entries
+        and given: a NewRelic instance
+        and given: a dict of key:value pairs to use as labels
+        and given: no max rows value
+        and given: a max payload bytes value
+        when: load_as_logs() is called
+        and when: the size of the log entries is greater than max payload bytes
+        then: multiple Logs API requests are made
+        and: all log entries are sent in order
+        '''
+
+        # setup
+        new_relic = NewRelicStub()
+        row_size = len(json.dumps(next(self.logs(1)))) + 1
+
+        # execute
+        pipeline.load_as_logs(
+            self.logs(50),
+            new_relic,
+            {},
+            None,
+            row_size * 10,
+        )
+
+        # verify
+        self.assertTrue(len(new_relic.logs) > 1)
+        messages = []
+        for l in new_relic.logs:
+            self.assertTrue(len(l[0]['logs']) <= 10)
+            messages.extend([log['message'] for log in l[0]['logs']])
+        self.assertEqual(messages, [f'log {i}' for i in range(0, 50)])
+
+    def test_load_as_logs_cuts_batches_by_compressed_payload_size(self):
+        '''
+        load_as_logs() cuts batches based on the compressed size of the payload
+        given: an iterator over log entries
+        and given: a NewRelic instance
+        and given: a dict of key:value pairs to use as labels
+        and given: no max rows value
+        and given: a max payload bytes value
+        when: load_as_logs() is called
+        and when: the uncompressed size of the log entries is greater than max payload bytes
+        and when: the compressed size of the log entries is less than max payload bytes
+        then: a single Logs API request is made
+        and: all log entries are sent
+        '''
+
+        # setup
+        new_relic = NewRelicStub()
+        max_payload_bytes = 100000
+
+        # execute
+        pipeline.load_as_logs(
+            self.logs(5000),
+            new_relic,
+            {},
+            None,
+            max_payload_bytes,
+        )
+
+        # verify
+        self.assertEqual(len(new_relic.logs), 1)
+        self.assertTrue(
+            len(json.dumps(new_relic.logs[0])) > max_payload_bytes
+        )
+        self.assertEqual(len(new_relic.logs[0][0]['logs']), 5000)
+
+    def test_load_as_logs_splits_and_retries_when_payload_too_large(self):
+        '''
+        load_as_logs() splits a batch in half and retries each half when the Logs API rejects it as too large
+        given: an iterator over log entries
+        and given: a NewRelic instance
+        and given: a dict of key:value pairs to use as labels
+        and given: a max rows value
+        when: load_as_logs() is called
+        and when: the Logs API rejects payloads with more than 20 log entries
+        then: the rejected batch is split and retried until accepted
+        and: all log entries are sent in order
+        '''
+
+        # setup
+        new_relic = NewRelicStub(max_records_per_post=20)
+
+        # execute
+        pipeline.load_as_logs(
+            self.logs(50),
+            new_relic,
+            {},
+            50,
+        )
+
+        # verify
+        self.assertTrue(new_relic.rejected > 0)
+        messages = []
+        for l in new_relic.logs:
+            self.assertTrue(len(l[0]['logs']) <= 20)
+            messages.extend([log['message'] for log in l[0]['logs']])
+        self.assertEqual(messages, [f'log {i}' for i in range(0, 50)])
+
+    def test_payload_batcher_drops_single_record_too_large_to_send(self):
+        '''
+        PayloadBatcher.send() drops a single record rejected as too large
+        given: a payload batcher
+        and given: a send function that rejects all payloads as too large
+        when: PayloadBatcher.send() is called with one record
+        then: the record is dropped
+        and: 0 is returned
+        '''
+
+        # setup
+        new_relic = NewRelicStub(max_records_per_post=-1)
+        batcher = pipeline.PayloadBatcher()
+
+        # execute
+        encoder = newrelic.new_events_encoder()
+        encoder.add({ 'foo': 'bar' })
+        count = batcher.send(
+            lambda encoder : new_relic.post_events_payload(None, encoder),
+            encoder,
+        )
+
+        # verify
+        self.assertEqual(count, 0)
+        self.assertEqual(len(new_relic.events), 0)
+
+    def test_payload_batcher_observe_updates_compression_ratio(self):
+        '''
+        PayloadBatcher.observe() moves the compression ratio toward the observed ratio
+        given: a payload batcher
+        when: PayloadBatcher.observe() is called with payload sizes
+        then: the compression ratio moves toward the observed ratio
+        and: payload sizes of zero are ignored
+        '''
+
+        # setup
+        batcher = pipeline.PayloadBatcher()
+
+        # execute
+        batcher.observe(1000, 100)
+        ratio = batcher.compression_ratio
+        batcher.observe(0, 0)
+
+        # verify
+        self.assertEqual(ratio, (pipeline.INITIAL_COMPRESSION_RATIO + 0.1) / 2)
+        self.assertEqual(batcher.compression_ratio, ratio)
+
+    def test_payload_batcher_send_keeps_compression_ratio_given_concurrent_sends(self):
+        '''
+        PayloadBatcher.send() keeps the compression ratio within bounds when batches are sent from several threads
+        given: a payload batcher
+        and given: a send function that rejects payloads with more than 5 records as too large
+        and given: a send function that returns the payload sizes once accepted
+        when: PayloadBatcher.send() is called on several threads at once
+        then: all records are sent
+        and: the compression ratio is between the minimum ratio and 1
+        '''
+
+        # setup
+        new_relic = NewRelicStub(max_records_per_post=5)
+        batcher = pipeline.PayloadBatcher()
+        barrier = threading.Barrier(8)
+        counts = []
+
+        def send(encoder):
+            new_relic.post_events_payload(None, encoder)
+            return 1000, 100
+
+        def run(n: int):
+            encoder = newrelic.new_events_encoder()
+            for i in range(0, 20):
+                encoder.add({ 'thread': n, 'index': i })
+
+            barrier.wait()
+
+            for _ in range(0, 50):
+                batcher.observe(1000, 10)
+
+            counts.append(batcher.send(send, encoder))
+
+        # execute
+        threads = [
+            threading.Thread(target=run, args=(n,)) for n in range(0, 8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # verify
+        self.assertEqual(counts, [20] * 8)
+        self.assertEqual(sum(len(e) for e in new_relic.events), 160)
+        self.assertTrue(
+            pipeline.MIN_COMPRESSION_RATIO <= batcher.compression_ratio <= 1.0
+        )
+
     def test_pack_log_into_event_returns_event_given_log_labels_and_empty_numeric_fields_set(self):
         '''
         pack_log_into_event() return an event with properties for each attribute in the given log entry and an event type where no attributes are converted to numeric values
         given: a single log entry
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: pack_log_into_event() is called
-        and when: the set of numeric field names is the empty set
+        and when: the numeric fields mapping is empty
         and when: the log entry contains an 'EVENT_TYPE' property
         then: return a single event with a property for each attribute specified
             in the 'attributes' field of the log
@@ -202,7 +406,7 @@ class TestPipeline(unittest.TestCase):
         event = pipeline.pack_log_into_event(
             log,
             { 'foo': 'bar' },
-            set(),
+            {},
         )
 
         # verify
@@ -220,15 +424,15 @@ class TestPipeline(unittest.TestCase):
         pack_log_into_event() return an event with properties for each attribute in the given log entry and an event type where specified attributes are converted to numeric values
         given: a single log entry
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: pack_log_into_event() is called
-        and when: the set of numeric field names is not empty
+        and when: the numeric fields mapping has fields for the event type
         and when: the log entry contains an 'EVENT_TYPE' property
         then: return a single event with a property for each attribute specified
             in the 'attributes' field of the log
         and: an 'eventType' property set to the value of the `EVENT_TYPE`
             property of the log entry
-        and: attribute values for fields specified in the numeric fields set
+        and: attribute values for fields of the event type in the numeric fields mapping
             are converted to numeric values
         '''
 
@@ -242,7 +446,7 @@ class TestPipeline(unittest.TestCase):
         event = pipeline.pack_log_into_event(
             log,
             { 'foo': 'bar' },
-            set(['RUN_TIME', 'CPU_TIME', 'SUCCESS', 'URI']),
+            { 'ApexCallout': ['RUN_TIME', 'CPU_TIME', 'SUCCESS', 'URI'] },
         )
 
         # verify
@@ -257,9 +461,9 @@ class TestPipeline(unittest.TestCase):
         pack_log_into_event() return an event with properties for each attribute in the given log entry and the default event type where no attributes are converted to numeric values
         given: a single log entry
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: pack_log_into_event() is called
-        and when: the set of numeric field names is the empty set
+        and when: the numeric fields mapping is empty
         and when: the log entry does not contain an 'EVENT_TYPE' property
         then: return a single event with a property for each attribute specified
             in the 'attributes' field of the log
@@ -280,7 +484,7 @@ class TestPipeline(unittest.TestCase):
         event = pipeline.pack_log_into_event(
             log,
             { 'foo': 'bar' },
-            set(),
+            {},
         )
 
         # verify
@@ -295,9 +499,9 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a dict of key:value pairs to use as labels
         and given: a max rows value
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: load_as_events() is called
-        and when: the set of numeric field names is the empty set
+        and when: the numeric fields mapping is empty
         and when: the number of log entries to send is less than max rows
         then: a single Events API request is made
         and: one event is sent for each log entry
@@ -317,7 +521,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             labels,
             pipeline.DEFAULT_MAX_ROWS,
-            set(),
+            {},
         )
 
         # verify
@@ -339,7 +543,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a dict of key:value pairs to use as labels
         and given: a max rows value
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: load_as_events() is called
         and when: the number of log entries to send is a multiple of max rows
         then: n / max Events API requests are made
@@ -360,7 +564,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             labels,
             50,
-            set(),
+            {},
         )
 
         # verify
@@ -376,7 +580,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a dict of key:value pairs to use as labels
         and given: a max rows value
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: load_as_events() is called
         and when: the number of log entries to send is greater than max rows but
             not a multiple
@@ -399,7 +603,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             labels,
             50,
-            set(),
+            {},
         )
 
         # verify
@@ -417,7 +621,7 @@ class TestPipeline(unittest.TestCase):
         and given: a data format
         and given: a dict of key:value pairs to use as labels
         and given: a max rows value
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: load_data() is called
         and when: the data format is set to DataFormat.LOGS
         then: log entries are sent via the New Relic Logs API
@@ -438,7 +642,7 @@ class TestPipeline(unittest.TestCase):
             DataFormat.LOGS,
             labels,
             50,
-            set()
+            {}
         )
 
         # verify
@@ -456,7 +660,7 @@ class TestPipeline(unittest.TestCase):
         and given: a data format
         and given: a dict of key:value pairs to use as labels
         and given: a max rows value
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: load_data() is called
         and when: the data format is set to DataFormat.EVENTS
         then: log entries are sent via the New Relic Events API
@@ -477,7 +681,7 @@ class TestPipeline(unittest.TestCase):
             DataFormat.EVENTS,
             labels,
             50,
-            set()
+            {}
         )
 
         # verify
@@ -493,7 +697,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: Pipeline.__init__() is called
         and when: no max_rows value is specified in the instance config
         and when: the data cache is None
@@ -505,7 +709,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
 
         # execute
         p = pipeline.Pipeline(
@@ -514,7 +718,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
         # verify
@@ -523,7 +727,7 @@ class TestPipeline(unittest.TestCase):
         self.assertEqual(p.new_relic, new_relic)
         self.assertEqual(p.data_format, DataFormat.LOGS)
         self.assertEqual(p.labels, labels)
-        self.assertEqual(p.numeric_fields_list, numeric_fields_list)
+        self.assertEqual(p.numeric_fields_mapping, numeric_fields_mapping)
         self.assertEqual(p.max_rows, pipeline.DEFAULT_MAX_ROWS)
         self.assertEqual(p.receivers, [])
 
@@ -535,7 +739,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: Pipeline.__init__() is called
         and when: a max_rows value is specified in the instance config
         and when: the max_rows value is less than MAX_ROWS
@@ -550,7 +754,7 @@ class TestPipeline(unittest.TestCase):
         })
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
 
         # execute
         p = pipeline.Pipeline(
@@ -559,7 +763,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
         # verify
@@ -568,7 +772,7 @@ class TestPipeline(unittest.TestCase):
         self.assertEqual(p.new_relic, new_relic)
         self.assertEqual(p.data_format, DataFormat.LOGS)
         self.assertEqual(p.labels, labels)
-        self.assertEqual(p.numeric_fields_list, numeric_fields_list)
+        self.assertEqual(p.numeric_fields_mapping, numeric_fields_mapping)
         self.assertEqual(p.max_rows, 52)
         self.assertEqual(p.receivers, [])
 
@@ -580,7 +784,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         when: Pipeline.__init__() is called
         and when: a max_rows value is specified in the instance config
         and when: the max_rows value is greater than MAX_ROWS
@@ -595,7 +799,7 @@ class TestPipeline(unittest.TestCase):
         })
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
 
         # execute
         p = pipeline.Pipeline(
@@ -604,7 +808,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
 
         # verify
@@ -613,7 +817,7 @@ class TestPipeline(unittest.TestCase):
         self.assertEqual(p.new_relic, new_relic)
         self.assertEqual(p.data_format, DataFormat.LOGS)
         self.assertEqual(p.labels, labels)
-        self.assertEqual(p.numeric_fields_list, numeric_fields_list)
+        self.assertEqual(p.numeric_fields_mapping, numeric_fields_mapping)
         self.assertEqual(p.max_rows, pipeline.MAX_ROWS)
         self.assertEqual(p.receivers, [])
 
@@ -625,7 +829,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: a receiver
         when: Pipeline.add_receiver() is called
         then: the receiver is added to the receivers list
@@ -635,7 +839,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver = ReceiverStub()
 
         # execute
@@ -645,7 +849,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver)
 
@@ -661,7 +865,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.yield_all() is called
@@ -672,7 +876,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver1 = ReceiverStub(
             logs=[
                 {
@@ -705,7 +909,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver1)
         p.add_receiver(receiver2)
@@ -750,7 +954,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.yield_all() is called
@@ -762,7 +966,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver = ReceiverStub(raise_login_error=True)
         session = SessionStub()
 
@@ -773,7 +977,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver)
 
@@ -792,7 +996,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.yield_all() is called
@@ -804,7 +1008,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver = ReceiverStub(raise_error=True)
         session = SessionStub()
 
@@ -815,7 +1019,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver)
 
@@ -834,7 +1038,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.execute() is called
@@ -846,7 +1050,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver1 = ReceiverStub(
             logs=[
                 {
@@ -879,7 +1083,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver1)
         p.add_receiver(receiver2)
@@ -915,6 +1119,207 @@ class TestPipeline(unittest.TestCase):
         self.assertTrue('beep' in l['attributes'])
         self.assertEqual(l['attributes']['beep'], 'boop')
 
+    def test_pipeline_execute_waits_for_data_cache_writes(self):
+        '''
+        Pipeline.execute() waits for pending data cache writes to finish
+        given: an instance config
+        and given: a data cache
+        and given: a NewRelic instance
+        and given: a receiver
+        and given: an http session
+        when: Pipeline.execute() is called
+        then: the receiver should be executed
+        and: the data cache wait() method should be called
+        '''
+
+        # setup
+        instance_config = mod_config.Config({})
+        data_cache = DataCacheStub()
+        new_relic = NewRelicStub()
+        receiver = ReceiverStub(
+            logs=[
+                {
+                    'message': 'log 1',
+                    'attributes': { 'foo': 'bar' },
+                },
+            ]
+        )
+        session = SessionStub()
+
+        # execute
+        p = pipeline.Pipeline(
+            instance_config,
+            data_cache,
+            new_relic,
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        p.add_receiver(receiver)
+        p.execute(session)
+
+        # verify
+        self.assertTrue(receiver.executed)
+        self.assertEqual(len(new_relic.logs), 1)
+        self.assertTrue(data_cache.wait_called)
+
+    def test_pipeline_execute_writes_log_file_markers_once_logs_are_sent(self):
+        '''
+        Pipeline.execute() writes the log file markers and saves the watermarks once all logs are sent
+        given: an instance config
+        and given: a data cache with a log file marker
+        and given: a NewRelic instance
+        and given: a receiver
+        and given: an http session
+        when: Pipeline.execute() is called
+        then: the logs are sent
+        and: the data cache is told the logs were delivered
+        and: the log file markers are written
+        and: the receiver watermarks are saved
+        and when: sending the logs fails
+        then: the log file markers are not written
+        and: the receiver watermarks are not saved
+        '''
+
+        # setup
+        instance_config = mod_config.Config({})
+        data_cache = DataCacheStub()
+        data_cache.add_log_file_marker('00001111AAAABBBB')
+        new_relic = NewRelicStub()
+        receiver = ReceiverStub(
+            logs=[
+                {
+                    'message': 'log 1',
+                    'attributes': { 'foo': 'bar' },
+                },
+            ]
+        )
+        session = SessionStub()
+
+        # execute
+        p = pipeline.Pipeline(
+            instance_config,
+            data_cache,
+            new_relic,
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        p.add_receiver(receiver)
+        p.execute(session)
+
+        # verify
+        self.assertEqual(len(new_relic.logs), 1)
+        self.assertEqual(data_cache.delivered, 1)
+        self.assertEqual(
+            data_cache.written_log_file_markers,
+            ['00001111AAAABBBB'],
+        )
+        self.assertTrue(receiver.watermarks_saved)
+
+        # setup
+        data_cache = DataCacheStub()
+        data_cache.add_log_file_marker('00002222AAAABBBB')
+
+        # execute
+        p = pipeline.Pipeline(
+            instance_config,
+            data_cache,
+            NewRelicStub(raise_error=True),
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        receiver = ReceiverStub(logs=receiver.logs)
+        p.add_receiver(receiver)
+
+        with self.assertRaises(Exception) as _:
+            p.execute(session)
+
+        # verify
+        self.assertEqual(data_cache.written_log_file_markers, [])
+        self.assertFalse(receiver.watermarks_saved)
+
+    def test_pipeline_execute_downloads_log_file_again_after_failed_run(self):
+        '''
+        Pipeline.execute() downloads a log file again if the run that read it failed before the logs were sent
+        given: an instance config
+        and given: a data cache with hourly file markers
+        and given: a receiver that marks the log file it reads
+        and given: an http session
+        when: Pipeline.execute() is called
+        and when: sending the logs fails
+        then: the log file marker is not written
+        and when: Pipeline.execute() is called again with the same data cache
+        then: the log file is downloaded again
+        and: the log file marker is written once the logs are sent
+        '''
+
+        # setup
+        class MarkingReceiverStub(ReceiverStub):
+            def __init__(self, data_cache: cache.DataCache):
+                super().__init__(data_cache=data_cache)
+                self.downloads = 0
+
+            def execute(self, session):
+                if self.data_cache.can_skip_downloading_logfile(
+                    '00001111AAAABBBB',
+                ):
+                    return
+
+                self.downloads += 1
+
+                yield {
+                    'message': 'log 1',
+                    'attributes': { 'foo': 'bar' },
+                }
+
+                self.data_cache.add_log_file_marker('00001111AAAABBBB')
+
+        instance_config = mod_config.Config({})
+        backend = BackendStub({})
+        data_cache = cache.DataCache(backend, 5, hourly_file_markers=True)
+        receiver = MarkingReceiverStub(data_cache)
+        session = SessionStub()
+
+        p = pipeline.Pipeline(
+            instance_config,
+            data_cache,
+            NewRelicStub(raise_error=True),
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        p.add_receiver(receiver)
+
+        # execute
+        with self.assertRaises(Exception) as _:
+            p.execute(session)
+
+        # verify
+        self.assertEqual(receiver.downloads, 1)
+        self.assertFalse('00001111AAAABBBB' in backend.redis.test_cache)
+
+        # setup
+        new_relic = NewRelicStub()
+        p = pipeline.Pipeline(
+            instance_config,
+            data_cache,
+            new_relic,
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        p.add_receiver(receiver)
+
+        # execute
+        p.execute(session)
+
+        # verify
+        self.assertEqual(receiver.downloads, 2)
+        self.assertEqual(len(new_relic.logs), 1)
+        self.assertEqual(backend.redis.test_cache['00001111AAAABBBB'], 1)
+
     def test_pipeline_execute_raises_login_exception_if_receiver_does(self):
         '''
         Pipeline.execute() raises a LoginException if receiver.execute() does
@@ -923,7 +1328,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.execute() is called
@@ -935,7 +1340,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver = ReceiverStub(raise_login_error=True)
         session = SessionStub()
 
@@ -949,7 +1354,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver)
 
@@ -964,7 +1369,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.execute() is called
@@ -976,7 +1381,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub()
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver = ReceiverStub(raise_error=True)
         session = SessionStub()
 
@@ -990,7 +1395,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver)
 
@@ -1005,7 +1410,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.execute() is called
@@ -1017,7 +1422,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub(raise_error=True)
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver = ReceiverStub(
             logs=[
                 {
@@ -1042,7 +1447,7 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.LOGS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver)
 
@@ -1057,7 +1462,7 @@ class TestPipeline(unittest.TestCase):
         and given: a NewRelic instance
         and given: a data format
         and given: a dict of key:value pairs to use as labels
-        and given: a set of numeric field names
+        and given: a numeric fields mapping
         and given: there are two receivers
         and given: an http session
         when: Pipeline.execute() is called
@@ -1069,7 +1474,7 @@ class TestPipeline(unittest.TestCase):
         instance_config = mod_config.Config({})
         new_relic = NewRelicStub(raise_error=True)
         labels = { 'foo': 'bar' }
-        numeric_fields_list = set()
+        numeric_fields_mapping = {}
         receiver = ReceiverStub(
             logs=[
                 {
@@ -1094,12 +1499,243 @@ class TestPipeline(unittest.TestCase):
             new_relic,
             DataFormat.EVENTS,
             labels,
-            numeric_fields_list,
+            numeric_fields_mapping,
         )
         p.add_receiver(receiver)
 
         with self.assertRaises(NewRelicApiException) as _:
             p.execute(session)
 
+    def test_pipeline_execute_threads_sends_batches_of_max_rows(self):
+        '''
+        Pipeline.execute_threads() executes all receivers and sends data to New Relic in batches of at most max_rows
+        given: an instance config with max_rows
+        and given: a NewRelic instance
+        and given: a data format
+        and given: a dict of key:value pairs to use as labels
+        and given: a numeric fields mapping
+        and given: a receiver
+        and given: an http session
+        and given: an upload executor
+        when: Pipeline.execute_threads() is called
+        then: the receiver should be executed
+        and: all receiver results are sent to New Relic in batches of at most max_rows
+        '''
+
+        # setup
+        instance_config = mod_config.Config({ 'max_rows': 20 })
+        new_relic = NewRelicStub()
+        labels = { 'foo': 'bar' }
+        receiver = ReceiverStub(logs=list(self.logs(50)))
+        session = SessionStub()
+        max_uploads = 2
+
+        # execute
+        p = pipeline.Pipeline(
+            instance_config,
+            None,
+            new_relic,
+            DataFormat.LOGS,
+            labels,
+            {},
+        )
+        p.add_receiver(receiver)
+        with ThreadPoolExecutor(max_uploads) as executor:
+            p.execute_threads(session, executor, max_uploads)
+
+        # verify
+        self.assertTrue(receiver.executed)
+        self.assertEqual(len(new_relic.logs), 3)
+        self.assertEqual(
+            sorted([len(l[0]['logs']) for l in new_relic.logs]),
+            [10, 20, 20],
+        )
+        self.assertEqual(new_relic.logs[0][0]['common'], labels)
+
+    def test_pipeline_execute_threads_reports_batches_delivered_in_order(self):
+        '''
+        Pipeline.execute_threads() tells the data cache each batch was delivered in the order the batches were harvested
+        given: an instance config with max_rows
+        and given: a data cache
+        and given: a NewRelic instance
+        and given: a receiver that waits for some of its logs to be delivered
+        and given: an http session
+        and given: an upload executor
+        when: Pipeline.execute_threads() is called
+        then: all logs are sent
+        and: the receiver is told its logs were delivered in order
+        '''
+
+        # setup
+        instance_config = mod_config.Config({ 'max_rows': 20 })
+        data_cache = cache.DataCache(BackendStub({}), 5)
+        new_relic = NewRelicStub()
+        session = SessionStub()
+        delivered = []
+
+        def logs():
+            for i, log in enumerate(self.logs(50)):
+                yield log
+
+                if (i + 1) % 20 == 0 or i == 49:
+                    data_cache.on_delivered(
+                        lambda i=i : delivered.append(i + 1)
+                    )
+        max_uploads = 3
+
+        # execute
+        p = pipeline.Pipeline(
+            instance_config,
+            data_cache,
+            new_relic,
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        p.add_receiver(ReceiverStub(logs=logs()))
+        with ThreadPoolExecutor(max_uploads) as executor:
+            p.execute_threads(session, executor, max_uploads)
+
+        # verify
+        self.assertEqual(len(new_relic.logs), 3)
+        self.assertEqual(delivered, [20, 40, 50])
+        self.assertEqual(data_cache.delivered, 50)
+
+    def test_pipeline_execute_threads_uses_a_session_per_upload_thread(self):
+        '''
+        Pipeline.execute_threads() sends the batches of each upload thread with a session of its own
+        given: an instance config with max_rows
+        and given: a NewRelic instance that rejects payloads with more than 5 logs as too large
+        and given: a receiver
+        and given: an http session
+        and given: an upload executor with several threads
+        when: Pipeline.execute_threads() is called
+        then: all logs are sent
+        and: no New Relic session is used by more than one thread
+        '''
+
+        # setup
+        instance_config = mod_config.Config({ 'max_rows': 20 })
+        new_relic = NewRelicStub(max_records_per_post=5)
+        receiver = ReceiverStub(logs=list(self.logs(200)))
+        session = SessionStub()
+        max_uploads = 4
+        threads_by_session = {}
+        post_logs = new_relic.post_logs
+
+        def post_logs_by_thread(nr_session, data):
+            threads_by_session.setdefault(id(nr_session), set()).add(
+                threading.get_ident(),
+            )
+            post_logs(nr_session, data)
+
+        new_relic.post_logs = post_logs_by_thread
+
+        # execute
+        p = pipeline.Pipeline(
+            instance_config,
+            None,
+            new_relic,
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        p.add_receiver(receiver)
+        with ThreadPoolExecutor(max_uploads) as executor:
+            p.execute_threads(session, executor, max_uploads)
+
+        # verify
+        self.assertTrue(new_relic.rejected > 0)
+        self.assertEqual(
+            sorted(log['message'] for l in new_relic.logs for log in l[0]['logs']),
+            sorted(f'log {i}' for i in range(0, 200)),
+        )
+        self.assertTrue(len(threads_by_session) > 0)
+        for threads in threads_by_session.values():
+            self.assertEqual(len(threads), 1)
+
+    def test_pipeline_execute_threads_sends_events_given_data_format_is_events(self):
+        '''
+        Pipeline.execute_threads() sends events given the data format is events
+        given: an instance config
+        and given: a NewRelic instance
+        and given: a data format
+        and given: a dict of key:value pairs to use as labels
+        and given: a numeric fields mapping
+        and given: a receiver
+        and given: an http session
+        and given: an upload executor
+        when: Pipeline.execute_threads() is called
+        and when: the data format is events
+        then: all receiver results are sent to New Relic as events
+        '''
+
+        # setup
+        instance_config = mod_config.Config({})
+        new_relic = NewRelicStub()
+        labels = { 'foo': 'bar' }
+        receiver = ReceiverStub(logs=list(self.logs(5)))
+        session = SessionStub()
+        max_uploads = 1
+
+        # execute
+        p = pipeline.Pipeline(
+            instance_config,
+            None,
+            new_relic,
+            DataFormat.EVENTS,
+            labels,
+            {},
+        )
+        p.add_receiver(receiver)
+        with ThreadPoolExecutor(max_uploads) as executor:
+            p.execute_threads(session, executor, max_uploads)
+
+        # verify
+        self.assertEqual(len(new_relic.logs), 0)
+        self.assertEqual(len(new_relic.events), 1)
+        self.assertEqual(len(new_relic.events[0]), 5)
+        self.assertEqual(new_relic.events[0][0]['eventType'], 'SFEvent0')
+        self.assertEqual(new_relic.events[0][0]['foo'], 'bar')
+
+    def test_pipeline_execute_threads_raises_newrelic_exception_if_new_relic_post_logs_does(self):
+        '''
+        Pipeline.execute_threads() raises a NewRelicApiException if NewRelic.post_logs() does
+        given: an instance config
+        and given: a NewRelic instance
+        and given: a data format
+        and given: a dict of key:value pairs to use as labels
+        and given: a numeric fields mapping
+        and given: a receiver
+        and given: an http session
+        and given: an upload executor
+        when: Pipeline.execute_threads() is called
+        and when: NewRelic.post_logs() raises a NewRelicApiException
+        then: raise a NewRelicApiException
+        '''
+
+        # setup
+        instance_config = mod_config.Config({})
+        new_relic = NewRelicStub(raise_error=True)
+        receiver = ReceiverStub(logs=list(self.logs(5)))
+        session = SessionStub()
+        max_uploads = 1
+
+        # execute / verify
+        p = pipeline.Pipeline(
+            instance_config,
+            None,
+            new_relic,
+            DataFormat.LOGS,
+            {},
+            {},
+        )
+        p.add_receiver(receiver)
+
+        with self.assertRaises(NewRelicApiException) as _:
+            with ThreadPoolExecutor(max_uploads) as executor:
+                p.execute_threads(session, executor, max_uploads)
+
+
 if __name__ == '__main__':
     unittest.main()
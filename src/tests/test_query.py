@@ -1,4 +1,5 @@
 from datetime import datetime
+import time
 import unittest
 
 from newrelic_logging import LoginException, SalesforceApiException
@@ -573,6 +574,434 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(records[2]['bip'], 'bop')
 
 class TestQueryFactory(unittest.TestCase):
+    def test_execute_prefetches_pages_given_prefetch_pages_and_passes_batch_size(self):
+        '''
+        execute() fetches up to prefetch_pages pages ahead of the records being consumed and requests pages of batch_size records
+        given: an api instance
+        and given: a query string
+        and given: a configuration with prefetch_pages and batch_size
+        and given: an http session
+        when: execute() is called
+        and when: only the first record is consumed
+        then: the next pages are fetched
+        and: no more than prefetch_pages pages are fetched ahead of the page being consumed and the one being fetched
+        and when: all records are consumed
+        then: all records of all pages are yielded in order
+        and: api.query() and api.query_more() are called with the batch size
+        '''
+
+        # setup
+        result = { 'done': False, 'nextRecordsUrl': '/more1', 'records': [ { 'page': 0 } ] }
+
+        for i in range(1, 7):
+            result[f'/more{i}'] = {
+                'done': i == 6,
+                'nextRecordsUrl': f'/more{i + 1}' if i < 6 else '',
+                'records': [ { 'page': i } ],
+            }
+
+        api = ApiStub(query_result=result)
+        config = mod_config.Config({ 'prefetch_pages': 2, 'batch_size': 500 })
+        session = SessionStub()
+
+        # execute
+        q = query.Query(
+            api,
+            'SELECT+LogFile+FROM+EventLogFile',
+            config,
+        )
+
+        resp = q.execute(session)
+        first = next(resp)
+
+        deadline = time.monotonic() + 5
+        while len(api.next_records_urls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        time.sleep(0.05)
+
+        # verify
+        self.assertEqual(first, { 'page': 0 })
+        self.assertEqual(api.next_records_urls, ['/more1', '/more2', '/more3'])
+
+        # execute
+        records = [first] + list(resp)
+
+        # verify
+        self.assertEqual(records, [ { 'page': i } for i in range(0, 7) ])
+        self.assertEqual(len(api.next_records_urls), 6)
+        self.assertEqual(api.batch_size, 500)
+
+    def test_execute_streams_records_of_all_pages_given_stream_records(self):
+        '''
+        execute() decodes the records of each page of results as they are read when stream_records is set
+        given: an api instance
+        and given: a query string
+        and given: a configuration with stream_records set
+        and given: an http session
+        when: execute() is called
+        and when: there are multiple pages of results
+        then: yields every record of every page in order
+        and: the next page is requested once the records of a page have been read
+        and when: the response has no records
+        then: yields nothing
+        '''
+
+        # setup
+        api = ApiStub(
+            query_result={
+                'records': [ { 'foo': 'bar' }, { 'beep': 'boop' } ],
+                'done': False,
+                'nextRecordsUrl': '/more1',
+                '/more1': {
+                    'done': True,
+                    'records': [ { 'bip': 'bop' } ],
+                },
+            },
+            read_size=8,
+        )
+        config = mod_config.Config({ 'stream_records': True })
+        session = SessionStub()
+
+        # execute
+        q = query.Query(
+            api,
+            'SELECT+LogFile+FROM+EventLogFile',
+            config,
+        )
+
+        resp = q.execute(session)
+        first = next(resp)
+
+        # verify
+        self.assertEqual(first, { 'foo': 'bar' })
+        self.assertEqual(api.next_records_urls, [])
+
+        # execute
+        records = [first] + list(resp)
+
+        # verify
+        self.assertEqual(
+            records,
+            [ { 'foo': 'bar' }, { 'beep': 'boop' }, { 'bip': 'bop' } ],
+        )
+        self.assertEqual(api.next_records_urls, ['/more1'])
+
+        # setup
+        api = ApiStub(query_result={ 'done': True })
+
+        # execute
+        q = query.Query(api, 'SELECT+LogFile+FROM+EventLogFile', config)
+
+        # verify
+        self.assertEqual(list(q.execute(session)), [])
+
+    def test_execute_reads_log_file_pages_in_full_given_stream_records(self):
+        '''
+        execute() reads each page of log file records in full before yielding its records when stream_records is set
+        given: an api instance
+        and given: an EventLogFile query string
+        and given: a configuration with stream_records set
+        and given: an http session
+        when: execute() is called
+        and when: the results are log file records
+        then: the page has been read to the end when its first record is yielded
+        and: yields every record of every page in order
+        '''
+
+        # setup
+        api = ApiStub(
+            query_result={
+                'records': [
+                    { 'Id': '1', 'LogFile': '/log1' },
+                    { 'Id': '2', 'LogFile': '/log2' },
+                ],
+                'done': False,
+                'nextRecordsUrl': '/more1',
+                '/more1': {
+                    'done': True,
+                    'records': [ { 'Id': '3', 'LogFile': '/log3' } ],
+                },
+            },
+            read_size=8,
+        )
+        config = mod_config.Config({ 'stream_records': True })
+        session = SessionStub()
+
+        # execute
+        q = query.Query(
+            api,
+            'SELECT+LogFile+FROM+EventLogFile',
+            config,
+        )
+
+        resp = q.execute(session)
+        first = next(resp)
+
+        # verify
+        self.assertEqual(first, { 'Id': '1', 'LogFile': '/log1' })
+        self.assertEqual(len(api.streamed_pages), 1)
+        self.assertTrue(api.streamed_pages[0].eof)
+
+        # execute
+        records = [first] + list(resp)
+
+        # verify
+        self.assertEqual([record['Id'] for record in records], ['1', '2', '3'])
+        self.assertEqual(api.next_records_urls, ['/more1'])
+
+    def test_get_count_query_returns_count_query_for_query(self):
+        '''
+        get_count_query() returns a query that counts the records returned by the given query
+        given: a query string
+        when: get_count_query() is called
+        then: returns the query with the select list replaced by COUNT() and without ORDER BY
+        and when: the query has a subquery
+        then: returns None
+        '''
+
+        # execute / verify
+        self.assertEqual(
+            query.get_count_query(
+                'SELECT+Id,Name+FROM+Account+WHERE+CreatedDate>=2024-03-11T00:00:00Z+ORDER+BY+CreatedDate+DESC+LIMIT+10',
+            ),
+            'SELECT+COUNT()+FROM+Account+WHERE+CreatedDate>=2024-03-11T00:00:00Z+LIMIT+10',
+        )
+        self.assertEqual(
+            query.get_count_query('select Id from SetupAuditTrail order by CreatedDate'),
+            'SELECT+COUNT()+FROM+SetupAuditTrail',
+        )
+        self.assertIsNone(query.get_count_query(
+            'SELECT+Id,(SELECT+Id+FROM+Contacts)+FROM+Account',
+        ))
+
+    def test_execute_runs_bulk_query_job_and_yields_records_given_bulk_api_name(self):
+        '''
+        execute() runs a Bulk API query job and yields a record for each row of the job results when the api name is bulk
+        given: an api instance
+        and given: a query string
+        and given: a configuration
+        and given: the bulk api name
+        and given: an http session
+        and given: the text of the query
+        when: execute() is called
+        then: creates a query job for the text of the query as is
+        and: polls the query job until it is complete
+        and: yields a record for each row of each page of the job results
+        and: the records have the type of the queried object
+        and: empty values are None
+        and: the fields of related objects are nested
+        '''
+
+        # setup
+        api = ApiStub(
+            job_states=['InProgress', 'JobComplete'],
+            job_results=[
+                [ '"Id","Name","Owner.Name"\n', '"001A","Acme",""\n' ],
+                [ '"Id","Name","Owner.Name"\n', '"001B","Beep","Bob"\n' ],
+            ],
+        )
+        config = mod_config.Config({ 'bulk_poll_interval': 0 })
+        session = SessionStub()
+        soql = 'SELECT Id,Name,Owner.Name FROM Account ' \
+            'WHERE Name LIKE \'a+b%20%\''
+
+        # execute
+        q = query.Query(
+            api,
+            soql.replace(' ', '+'),
+            config,
+            '52.0',
+            'bulk',
+            soql=soql,
+        )
+
+        records = list(q.execute(session))
+
+        # verify
+        self.assertIsNone(api.soql)
+        self.assertEqual(api.job_soql, soql)
+        self.assertEqual(api.query_api_ver, '52.0')
+        self.assertEqual(api.job_polls, 2)
+        self.assertEqual(api.job_locators, [None, '1'])
+        self.assertEqual(api.described, ['Account'])
+        self.assertEqual(
+            records,
+            [
+                {
+                    'Id': '001A',
+                    'Name': 'Acme',
+                    'Owner': None,
+                    'attributes': { 'type': 'Account' },
+                },
+                {
+                    'Id': '001B',
+                    'Name': 'Beep',
+                    'Owner': { 'Name': 'Bob' },
+                    'attributes': { 'type': 'Account' },
+                },
+            ],
+        )
+
+    def test_execute_converts_bulk_values_like_rest_api(self):
+        '''
+        execute() converts the values of the Bulk API query job results to the values returned by the REST API
+        given: an api instance
+        and given: the describe fields of the queried object
+        and given: a query string
+        and given: the bulk api name
+        and given: an http session
+        when: execute() is called
+        then: values of number fields are numbers
+        and: values of boolean fields are booleans
+        and: datetimes use a +0000 offset, including in related objects
+        and: the record IDs are the same as the record IDs of REST records
+        '''
+
+        # setup
+        api = ApiStub(
+            job_states=['JobComplete'],
+            job_results=[[
+                '"Id","NumberOfEmployees","AnnualRevenue","IsDeleted",' \
+                    '"CreatedDate","Owner.CreatedDate","Name"\n',
+                '"001A","12","1500","true","2024-03-10T12:00:00.000Z",' \
+                    '"2024-01-01T00:00:00.000Z","Acme"\n',
+            ]],
+            sobject_fields=[
+                { 'name': 'Id', 'type': 'id' },
+                { 'name': 'NumberOfEmployees', 'type': 'int' },
+                { 'name': 'AnnualRevenue', 'type': 'currency' },
+                { 'name': 'IsDeleted', 'type': 'boolean' },
+                { 'name': 'CreatedDate', 'type': 'datetime' },
+                { 'name': 'Name', 'type': 'string' },
+            ],
+        )
+        config = mod_config.Config({ 'bulk_poll_interval': 0 })
+        session = SessionStub()
+        rest_record = {
+            'attributes': { 'type': 'Account' },
+            'Id': '001A',
+            'NumberOfEmployees': 12,
+            'AnnualRevenue': 1500.0,
+            'IsDeleted': True,
+            'CreatedDate': '2024-03-10T12:00:00.000+0000',
+            'Owner': {
+                'attributes': { 'type': 'User' },
+                'CreatedDate': '2024-01-01T00:00:00.000+0000',
+            },
+            'Name': 'Acme',
+        }
+        id_keys = ['Id', 'NumberOfEmployees', 'IsDeleted', 'CreatedDate']
+
+        # execute
+        q = query.Query(
+            api,
+            'SELECT+Id+FROM+Account',
+            config,
+            '52.0',
+            'bulk',
+        )
+
+        records = list(q.execute(session))
+
+        # verify
+        self.assertEqual(len(records), 1)
+        self.assertEqual(
+            util.process_query_result(records[0]),
+            util.process_query_result(rest_record),
+        )
+        self.assertEqual(
+            util.generate_record_id(id_keys, records[0]),
+            util.generate_record_id(id_keys, rest_record),
+        )
+
+    def test_execute_raises_salesforce_api_exception_if_bulk_query_job_fails(self):
+        '''
+        execute() raises a SalesforceApiException if the Bulk API query job fails
+        given: an api instance
+        and given: a query string
+        and given: a configuration
+        and given: the bulk api name
+        and given: an http session
+        when: execute() is called
+        and when: the query job fails
+        then: raises a SalesforceApiException
+        '''
+
+        # setup
+        api = ApiStub(job_states=['Failed'])
+        config = mod_config.Config({ 'bulk_poll_interval': 0 })
+        session = SessionStub()
+
+        # execute / verify
+        q = query.Query(
+            api,
+            'SELECT+Id+FROM+Account',
+            config,
+            '52.0',
+            'bulk',
+        )
+
+        with self.assertRaises(SalesforceApiException) as _:
+            list(q.execute(session))
+
+    def test_execute_uses_bulk_api_given_count_at_least_bulk_threshold(self):
+        '''
+        execute() counts the records of the query and uses the Bulk API when the count is at least the bulk threshold
+        given: an api instance
+        and given: a query string
+        and given: a configuration with a bulk threshold
+        and given: an http session
+        when: execute() is called
+        then: calls api.query() with a count query
+        and when: the count is at least the bulk threshold
+        then: runs a Bulk API query job
+        and when: the count is less than the bulk threshold
+        then: calls api.query() with the query string
+        '''
+
+        # setup
+        api = ApiStub(
+            query_result={ 'totalSize': 5000, 'records': [] },
+            job_states=['JobComplete'],
+            job_results=[[ '"Id"\n', '"001A"\n' ]],
+        )
+        config = mod_config.Config({
+            'bulk_threshold': 5000,
+            'bulk_poll_interval': 0,
+        })
+        session = SessionStub()
+
+        # execute
+        q = query.Query(
+            api,
+            'SELECT+Id+FROM+Account',
+            config,
+            '52.0',
+            soql='SELECT Id FROM Account',
+        )
+        records = list(q.execute(session))
+
+        # verify
+        self.assertEqual(api.soql, 'SELECT+COUNT()+FROM+Account')
+        self.assertEqual(api.job_soql, 'SELECT Id FROM Account')
+        self.assertEqual(
+            records,
+            [ { 'Id': '001A', 'attributes': { 'type': 'Account' } } ],
+        )
+
+        # setup
+        api = ApiStub(query_result={ 'totalSize': 4999, 'records': [] })
+
+        # execute
+        q = query.Query(api, 'SELECT+Id+FROM+Account', config, '52.0')
+        records = list(q.execute(session))
+
+        # verify
+        self.assertEqual(api.soql, 'SELECT+Id+FROM+Account')
+        self.assertIsNone(api.job_soql)
+        self.assertEqual(records, [])
+
     def test_build_args_creates_expected_dict(self):
         '''
         build_args() returns dictionary with expected properties
@@ -615,6 +1044,31 @@ class TestQueryFactory(unittest.TestCase):
         self.assertTrue('log_interval_type' in args)
         self.assertEqual(args['log_interval_type'], 'Daily')
 
+    def test_build_args_uses_given_to_timestamp(self):
+        '''
+        build_args() uses the given end of the time range
+        given: a query factory
+        and given: a time lag value
+        and given: a timestamp
+        and given: a generation interval value
+        and given: a to timestamp
+        when: build_args() is called
+        then: return dict with the given to timestamp
+        '''
+
+        # execute
+        f = query.QueryFactory()
+        args = f.build_args(
+            500,
+            '2024-03-10T12:00:00.000Z',
+            'Daily',
+            '2024-03-10T13:00:00.000Z',
+        )
+
+        # verify
+        self.assertEqual(args['from_timestamp'], '2024-03-10T12:00:00.000Z')
+        self.assertEqual(args['to_timestamp'], '2024-03-10T13:00:00.000Z')
+
     def test_get_env_returns_empty_dict_if_no_env(self):
         '''
         get_env() returns an empty dict if env is not in the passed query dict
@@ -698,6 +1152,7 @@ class TestQueryFactory(unittest.TestCase):
         and given: a generation interval value
         when: new() is called
         then: return a query instance with the input query with arguments replaced and URL encoded
+        and: the text of the query with arguments replaced is kept as is
         '''
 
         # setup
@@ -733,6 +1188,10 @@ class TestQueryFactory(unittest.TestCase):
             q.query,
             f'SELECT+LogFile+FROM+EventLogFile+WHERE+CreatedDate>={last_to_timestamp}+AND+CreatedDate<{to_timestamp}+AND+LogIntervalType=Daily+AND+Foo={now}'
         )
+        self.assertEqual(
+            q.soql,
+            f'SELECT LogFile FROM EventLogFile WHERE CreatedDate>={last_to_timestamp} AND CreatedDate<{to_timestamp} AND LogIntervalType=Daily AND Foo={now}'
+        )
 
     def test_new_returns_query_obj_with_expected_config(self):
         '''
@@ -910,3 +1369,38 @@ class TestQueryFactory(unittest.TestCase):
 
         # verify
         self.assertIsNone(q.api_name)
+
+    def test_new_returns_query_obj_with_key_of_unsubstituted_query(self):
+        '''
+        new() returns a query instance with a key that does not depend on the substituted arguments
+        given: a query factory
+        and given: a query dict with a query that uses substitution arguments
+        when: new() is called with different timestamps
+        then: the queries have different query strings
+        and: the queries have the same key
+        and: a query with a different query string has a different key
+        '''
+
+        # setup
+        api = ApiStub()
+        q = {
+            'query': 'SELECT Id FROM Account WHERE CreatedDate>={from_timestamp}',
+        }
+
+        # execute
+        f = query.QueryFactory()
+        q1 = f.new(api, q, 500, '2024-03-10T00:00:00.000Z', 'Daily')
+        q2 = f.new(api, q, 500, '2024-03-11T00:00:00.000Z', 'Daily')
+        q3 = f.new(
+            api,
+            { 'query': 'SELECT Id FROM Contact' },
+            500,
+            '2024-03-11T00:00:00.000Z',
+            'Daily',
+        )
+
+        # verify
+        self.assertNotEqual(q1.query, q2.query)
+        self.assertEqual(q1.get_key(), q2.get_key())
+        self.assertEqual(len(q1.get_key()), 16)
+        self.assertNotEqual(q1.get_key(), q3.get_key())
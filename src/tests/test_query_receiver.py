@@ -1,6 +1,8 @@
 import copy
+import csv
 from datetime import datetime, timedelta
 import json
+import time
 import unittest
 
 
@@ -13,8 +15,8 @@ from . import \
 from newrelic_logging import \
     LoginException, \
     SalesforceApiException
-from newrelic_logging import util, config as mod_config
-from newrelic_logging.query import receiver
+from newrelic_logging import util, config as mod_config, schema
+from newrelic_logging.query import get_query_key, receiver
 
 
 class TestQueryReceiver(unittest.TestCase):
@@ -256,7 +258,7 @@ class TestQueryReceiver(unittest.TestCase):
         when: export_log_line() is called
         then: api.get_log_file() is called
         and when: the api.get_log_file() response produces a 200 status code
-        then: return a generator iterator that yields one line of data at a time
+        then: return an iterator that yields the header and one tuple of field values per row
         '''
 
         # setup
@@ -271,15 +273,16 @@ class TestQueryReceiver(unittest.TestCase):
             lines.append(line)
 
         # verify
+        rows = [tuple(row) for row in csv.reader(self.log_rows)]
         self.assertEqual(len(lines), 3)
-        self.assertEqual(lines[0], self.log_rows[0])
-        self.assertEqual(lines[1], self.log_rows[1])
-        self.assertEqual(lines[2], self.log_rows[2])
+        self.assertEqual(lines[0], rows[0])
+        self.assertEqual(lines[1], rows[1])
+        self.assertEqual(lines[2], rows[2])
 
     def test_transform_log_lines_with_no_data_cache(self):
         '''
         transform_log_lines() returns one New Relic Logs API log entry for each log line
-        given: an iterable of log rows
+        given: an iterable over the header and log rows
         given: a query object
         and given: a record ID
         and given: an object type
@@ -296,7 +299,7 @@ class TestQueryReceiver(unittest.TestCase):
 
         # execute
         logs = receiver.transform_log_lines(
-            self.log_rows,
+            csv.reader(self.log_rows),
             query,
             '00001111AAAABBBB',
             'ApexCallout',
@@ -327,10 +330,100 @@ class TestQueryReceiver(unittest.TestCase):
         self.assertTrue('timestamp' in attrs)
         self.assertEqual(attrs['timestamp'], 1710176400)
 
+    def test_transform_log_lines_projects_mapped_fields(self):
+        '''
+        transform_log_lines() only copies the mapped fields when the event type is in the event fields mapping
+        given: an iterable over the header and log rows
+        given: a query object
+        and given: a record ID
+        and given: an object type
+        and given: a data cache
+        and given: an event fields mapping containing the object type
+        when: transform_log_lines() is called
+        then: return a generator iterator that yields one New Relic Logs API log
+            entry for each row containing only the mapped fields
+        and: the timestamp is taken from the TIMESTAMP field
+        and: the REQUEST_ID field is checked against the data cache
+        '''
+
+        # setup
+        query = QueryStub()
+
+        # execute
+        logs = receiver.transform_log_lines(
+            csv.reader(self.log_rows),
+            query,
+            '00001111AAAABBBB',
+            'ApexCallout',
+            DataCacheStub(cached_logs={
+                '00001111AAAABBBB': [ 'YYZ:abcdef123456' ]
+            }),
+            { 'ApexCallout': ['URI', 'RUN_TIME'] },
+        )
+
+        l = []
+
+        for log in logs:
+            l.append(log)
+
+        # verify
+        self.assertEqual(len(l), 1)
+        self.assertEqual(l[0]['message'], 'LogFile 00001111AAAABBBB row 0')
+        self.assertEqual(
+            l[0]['attributes'],
+            {
+                'URI': 'TEST-LOG-2',
+                'RUN_TIME': '5150',
+                'LogFileId': '00001111AAAABBBB',
+                'EVENT_TYPE': 'SFEvent',
+                'timestamp': 1710176400,
+            },
+        )
+        self.assertEqual(l[0]['timestamp'], 1710176400)
+
+    def test_log_line_plan_projects_columns_by_position(self):
+        '''
+        LogLinePlan maps field names to column positions of the header
+        given: a log file header
+        and given: an event type
+        and given: an event fields mapping
+        when: a LogLinePlan is created
+        and when: the event type is not in the event fields mapping
+        then: all columns except TIMESTAMP are projected
+        and when: the event type is in the event fields mapping
+        then: only the mapped columns are projected
+        and when: a mapped field is not in the header
+        then: a KeyError is raised
+        '''
+
+        # setup
+        header = ('EVENT_TYPE', 'TIMESTAMP', 'REQUEST_ID', 'URI')
+        values = ('URI', '20240311160000.000', 'YYZ:1', '/foo')
+
+        # execute
+        plan = receiver.LogLinePlan(header, 'URI', {})
+        mapped_plan = receiver.LogLinePlan(header, 'URI', { 'URI': ['URI'] })
+
+        # verify
+        self.assertEqual(
+            plan.project(values),
+            { 'EVENT_TYPE': 'URI', 'REQUEST_ID': 'YYZ:1', 'URI': '/foo' },
+        )
+        self.assertEqual(plan.get_timestamp(values), '20240311160000.000')
+        self.assertEqual(plan.get_request_id(values), 'YYZ:1')
+        self.assertEqual(mapped_plan.project(values), { 'URI': '/foo' })
+        self.assertEqual(mapped_plan.get_request_id(values), 'YYZ:1')
+        self.assertIsNone(
+            receiver.LogLinePlan(('URI',), 'URI', {}).get_timestamp(('/foo',)),
+        )
+
+        with self.assertRaises(KeyError) as _:
+            receiver.LogLinePlan(header, 'URI', { 'URI': ['CPU_TIME'] })
+
     def test_transform_log_lines_skips_cached_lines_given_data_cache(self):
         '''
         transform_log_lines() skips cached log lines when a data cache is given
-        given: an iterable of log rows
+        given: an iterable over the header and log rows
         given: a query object
         and given: a record ID
         and given: an object type
@@ -349,7 +442,7 @@ class TestQueryReceiver(unittest.TestCase):
 
         # execute
         logs = receiver.transform_log_lines(
-            self.log_rows,
+            csv.reader(self.log_rows),
             query,
             '00001111AAAABBBB',
             'ApexCallout',
@@ -1151,6 +1244,88 @@ class TestQueryReceiver(unittest.TestCase):
             'My Last Account',
         )
 
+    def test_transform_query_records_passes_record_ids_keys_to_data_cache(self):
+        '''
+        transform_query_records() checks each record ID against the key of the set for its query and timestamp
+        given: a list of query records
+        and given: a query
+        and given: a data cache
+        when: transform_query_records() is called
+        then: the data cache is given the key for the query and the timestamp of each record
+        '''
+
+        # setup
+        query = QueryStub(query='SELECT Id FROM Account')
+        data_cache = DataCacheStub()
+
+        # execute
+        logs = list(receiver.transform_query_records(
+            self.event_records,
+            query,
+            data_cache,
+        ))
+
+        # verify
+        self.assertEqual(len(logs), 3)
+        self.assertEqual(len(data_cache.record_ids_keys), 1)
+        self.assertEqual(
+            data_cache.record_ids_keys[0],
+            [
+                f'record_ids:{query.get_key()}:{log["attributes"]["timestamp"] // 3600000}' \
+                    for log in logs
+            ],
+        )
+
+    def test_transform_query_records_uses_flattened_and_undated_record_ids_keys(self):
+        '''
+        transform_query_records() checks record IDs against the set for the timestamp of the flattened record or the undated set if there is none
+        given: a query with a nested timestamp_attr
+        and given: a record with the nested timestamp
+        and given: a record without the timestamp
+        and given: a data cache
+        when: transform_query_records() is called twice
+        then: the first record is checked against the set for its nested timestamp
+        and: the second record is checked against the undated set both times
+        '''
+
+        # setup
+        query = QueryStub(
+            query='SELECT Id FROM Account',
+            config={ 'timestamp_attr': 'Parent.CreatedDate' },
+        )
+        records = [
+            {
+                'Id': '1',
+                'Parent': { 'CreatedDate': '2024-03-10T12:30:00.000+0000' },
+            },
+            { 'Id': '2' },
+        ]
+        data_cache = DataCacheStub()
+
+        # execute
+        logs = list(receiver.transform_query_records(
+            records,
+            query,
+            data_cache,
+        ))
+        list(receiver.transform_query_records(records, query, data_cache))
+
+        # verify
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(
+            logs[0]['attributes']['timestamp'],
+            1710073800000,
+        )
+        self.assertEqual(
+            data_cache.record_ids_keys,
+            [
+                [
+                    f'record_ids:{query.get_key()}:{1710073800000 // 3600000}',
+                    f'record_ids:{query.get_key()}:undated',
+                ],
+            ] * 2,
+        )
+
     def test_is_logs_enabled_given_instance_config_has_no_logs_enabled(self):
         '''
         is_logs_enabled() returns the default (True) when the 'logs_enabled' property is not in the instance config
@@ -1793,9 +1968,9 @@ class TestQueryReceiver(unittest.TestCase):
         self.assertTrue('REQUEST_ID' in log0['attributes'])
         self.assertEqual(log1['attributes']['REQUEST_ID'], f'YYZ:fedcba654321')
 
-    def test_query_receiver_process_log_record_skips_cached_records(self):
+    def test_query_receiver_process_log_record_registers_field_types(self):
         '''
-        QueryReceiver.process_log_record() does not yield log entries for cached log records
+        QueryReceiver.process_log_record() registers the field types of the log record
         given: a data cache
         and given: an api
         and given: a query factory
@@ -1806,33 +1981,28 @@ class TestQueryReceiver(unittest.TestCase):
         and given: a generation interval
         and given: a read chunk size
         and given: an http session
-        and given: a query object
-        and given: a log record
+        and given: a query object with an event_type option
+        and given: a log record with LogFileFieldNames and LogFileFieldTypes
         when: QueryReceiver.process_log_record() is called
-        and when: a data cache is specified
-        and when: a record ID matches a record ID in the data cache
-        then: do not yield a log entry for the cached record
+        then: the field types are registered for the event type used for the
+            log entries
         '''
 
         # setup
         api = ApiStub(lines=self.log_rows)
-        data_cache = DataCacheStub(skip_record_ids=['00001111AAAABBBB'])
         session = SessionStub()
-        query = QueryStub()
+        query = QueryStub(config={ 'event_type': 'FieldTypesTestEvent' })
         query_factory = QueryFactoryStub()
-        queries = [
-            {
-                'query': 'foo',
-            },
-        ]
-        record = self.log_records[0]
+        record = copy.deepcopy(self.log_records[0])
+        record['LogFileFieldNames'] = 'EVENT_TYPE,RUN_TIME'
+        record['LogFileFieldTypes'] = 'String,Number'
 
         # execute
         r = receiver.QueryReceiver(
-            data_cache,
+            None,
             api,
             query_factory,
-            queries,
+            [{ 'query': 'foo' }],
             {},
             5,
             300,
@@ -1840,22 +2010,18 @@ class TestQueryReceiver(unittest.TestCase):
             4096,
         )
 
-        iter = r.process_log_record(
-            session,
-            query,
-            record,
-        )
-
-        logs = []
-        for log in iter:
-            logs.append(log)
+        logs = list(r.process_log_record(session, query, record))
 
         # verify
-        self.assertEqual(len(logs), 0)
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(
+            schema.get_field_types('FieldTypesTestEvent'),
+            { 'EVENT_TYPE': 'String', 'RUN_TIME': 'Number' },
+        )
 
-    def test_query_receiver_process_log_record_yields_cached_records_when_interval_not_hourly(self):
+    def test_query_receiver_process_log_record_skips_cached_records(self):
         '''
-        QueryReceiver.process_log_record() yields log entries even for cached log records when the generation interval is not Hourly
+        QueryReceiver.process_log_record() does not yield log entries for cached log records
         given: a data cache
         and given: an api
         and given: a query factory
@@ -1871,8 +2037,7 @@ class TestQueryReceiver(unittest.TestCase):
         when: QueryReceiver.process_log_record() is called
         and when: a data cache is specified
         and when: a record ID matches a record ID in the data cache
-        and when: the generation interval is not 'Hourly'
-        then: yield one log entry for each log line even for cached records
+        then: do not yield a log entry for the cached record
         '''
 
         # setup
@@ -1886,8 +2051,7 @@ class TestQueryReceiver(unittest.TestCase):
                 'query': 'foo',
             },
         ]
-        record = copy.deepcopy(self.log_records[0])
-        record['Interval'] = 'Daily'
+        record = self.log_records[0]
 
         # execute
         r = receiver.QueryReceiver(
@@ -1898,7 +2062,7 @@ class TestQueryReceiver(unittest.TestCase):
             {},
             5,
             300,
-            'Daily',
+            'Hourly',
             4096,
         )
 
@@ -1913,12 +2077,12 @@ class TestQueryReceiver(unittest.TestCase):
             logs.append(log)
 
         # verify
-        self.assertEqual(len(logs), 2)
+        self.assertEqual(len(logs), 0)
 
-    def test_query_receiver_process_log_record_raises_login_exception_if_export_log_lines_does(self):
+    def test_query_receiver_process_log_record_marks_hourly_log_files_given_hourly_file_markers(self):
         '''
-        QueryReceiver.process_log_record() raises a LoginException if export_log_lines() does
-        given: a data cache
+        QueryReceiver.process_log_record() does not check the log lines of hourly log files against the cache and marks the file once all log lines are read when hourly file markers are enabled
+        given: a data cache with hourly file markers enabled
         and given: an api
         and given: a query factory
         and given: a list of queries
@@ -1929,15 +2093,19 @@ class TestQueryReceiver(unittest.TestCase):
         and given: a read chunk size
         and given: an http session
         and given: a query object
-        and given: a log record
+        and given: an hourly log record
         when: QueryReceiver.process_log_record() is called
-        and when: no data cache is specified
-        and when: export_log_lines() raises a LoginException
-        then: raise a LoginException
+        and when: the data cache contains the REQUEST_ID of a log line
+        then: yield a log entry for every log line
+        and: the log file is marked only once all log lines have been read
         '''
 
         # setup
-        api = ApiStub(raise_login_error=True)
+        api = ApiStub(lines=self.log_rows)
+        data_cache = DataCacheStub(
+            cached_logs={ '00001111AAAABBBB': [ 'YYZ:abcdef123456' ] },
+            hourly_file_markers=True,
+        )
         session = SessionStub()
         query = QueryStub()
         query_factory = QueryFactoryStub()
@@ -1950,32 +2118,44 @@ class TestQueryReceiver(unittest.TestCase):
 
         # execute
         r = receiver.QueryReceiver(
-            None,
+            data_cache,
             api,
             query_factory,
             queries,
             {},
             5,
             300,
-            'Daily',
+            'Hourly',
             4096,
         )
 
-        with self.assertRaises(LoginException) as _:
-            iter = r.process_log_record(
-                session,
-                query,
-                record,
-            )
-            # Have to use next to cause the generator to execute the function
-            # else get_log_file() won't get executed and our stub won't have
-            # a chance to throw the fake exception.
-            next(iter)
+        iter = r.process_log_record(
+            session,
+            query,
+            record,
+        )
 
-    def test_query_receiver_process_log_record_raises_salesforce_exception_if_export_log_lines_does(self):
+        logs = [next(iter)]
+
+        # verify
+        self.assertEqual(data_cache.log_file_markers, [])
+
+        # execute
+        for log in iter:
+            logs.append(log)
+
+        # verify
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(
+            logs[0]['attributes']['REQUEST_ID'],
+            'YYZ:abcdef123456',
+        )
+        self.assertEqual(data_cache.log_file_markers, ['00001111AAAABBBB'])
+
+    def test_query_receiver_process_log_record_resumes_log_file_from_checkpoint(self):
         '''
-        QueryReceiver.process_log_record() raises a SalesforceApiException if export_log_lines() does
-        given: a data cache
+        QueryReceiver.process_log_record() resumes a log file from the checkpoint of the last delivered rows when log file checkpoints are enabled
+        given: a data cache with log file checkpoints enabled
         and given: an api
         and given: a query factory
         and given: a list of queries
@@ -1986,15 +2166,25 @@ class TestQueryReceiver(unittest.TestCase):
         and given: a read chunk size
         and given: an http session
         and given: a query object
-        and given: a log record
+        and given: a log record with a large log file
         when: QueryReceiver.process_log_record() is called
-        and when: no data cache is specified
-        and when: export_log_lines() raises a SalesforceApiException
-        then: raise a SalesforceApiException
+        and when: only part of the log lines are read
+        then: no checkpoint is saved until the log lines are delivered
+        and when: the log lines read are delivered
+        then: a checkpoint is saved for the last chunk of rows read
+        and when: QueryReceiver.process_log_record() is called again
+        then: the log file is downloaded from the byte offset of the checkpoint
+        and: the log lines after the last delivered row are yielded
+        and: the checkpoint is deleted once all log lines are delivered
         '''
 
         # setup
-        api = ApiStub(raise_error=True)
+        lines = ['"EVENT_TYPE","TIMESTAMP","REQUEST_ID"\n'] + [
+            f'"ApexCallout","20240311160000.000","YYZ:{i:06d}"\n' \
+                for i in range(0, 3000)
+        ]
+        api = ApiStub(lines=lines, read_size=512)
+        data_cache = DataCacheStub(checkpoints={})
         session = SessionStub()
         query = QueryStub()
         query_factory = QueryFactoryStub()
@@ -2007,31 +2197,62 @@ class TestQueryReceiver(unittest.TestCase):
 
         # execute
         r = receiver.QueryReceiver(
-            None,
+            data_cache,
             api,
             query_factory,
             queries,
             {},
             5,
             300,
-            'Daily',
+            'Hourly',
             4096,
         )
 
-        with self.assertRaises(SalesforceApiException) as _:
-            iter = r.process_log_record(
-                session,
-                query,
-                record,
-            )
-            # Have to use next to cause the generator to execute the function
-            # else get_log_file() won't get executed and our stub won't have
-            # a chance to throw the fake exception.
-            next(iter)
+        iter = r.process_log_record(session, query, record)
+        logs = [next(iter) for _ in range(0, 2500)]
 
-    def test_query_receiver_process_query_records_yields_log_entries_given_query_records(self):
+        # verify
+        self.assertEqual(len(data_cache.checkpoints), 0)
+        self.assertEqual(api.offset, 0)
+
+        # execute
+        data_cache.set_delivered(len(logs))
+
+        # verify
+        checkpoint = data_cache.checkpoints['00001111AAAABBBB']
+        self.assertEqual(checkpoint['delivered'], 2000)
+        self.assertEqual(checkpoint['row_index'], 2000)
+        self.assertEqual(
+            checkpoint['header'],
+            ('EVENT_TYPE', 'TIMESTAMP', 'REQUEST_ID'),
+        )
+        self.assertLessEqual(checkpoint['rows'], 2000)
+        self.assertGreater(checkpoint['offset'], 0)
+
+        # execute
+        iter = r.process_log_record(session, query, record)
+        logs = [log for log in iter]
+
+        # verify
+        self.assertEqual(api.offset, checkpoint['offset'])
+        self.assertEqual(len(logs), 1000)
+        self.assertEqual(
+            logs[0]['message'],
+            'LogFile 00001111AAAABBBB row 2000',
+        )
+        self.assertEqual(logs[0]['attributes']['REQUEST_ID'], 'YYZ:002000')
+        self.assertEqual(logs[-1]['attributes']['REQUEST_ID'], 'YYZ:002999')
+        self.assertTrue('00001111AAAABBBB' in data_cache.checkpoints)
+
+        # execute
+        data_cache.set_delivered(len(logs))
+
+        # verify
+        self.assertFalse('00001111AAAABBBB' in data_cache.checkpoints)
+
+    def test_query_receiver_process_log_record_downloads_log_file_in_ranges(self):
         '''
-        QueryReceiver.process_query_records() yields one log entry for each query record
+        QueryReceiver.process_log_record() downloads a large log file in byte ranges that start at record boundaries when download_ranges is greater than 1
         given: a data cache
         and given: an api
         and given: a query factory
@@ -2041,55 +2262,441 @@ class TestQueryReceiver(unittest.TestCase):
         and given: a time lag minutes value
         and given: a generation interval
         and given: a read chunk size
+        and given: a download concurrency
+        and given: a number of download ranges
+        and given: a minimum download range size
+        and given: an http session
         and given: a query object
-        and given: a set of query records
-        when: QueryReceiver.process_query_records() is called
-        and when: no data cache is specified
-        and when: the data cache is None
-        then: yield one log entry for each query record
+        and given: a log record with a log file with quoted line breaks
+        when: QueryReceiver.process_log_record() is called
+        then: the first bytes of the log file at each split point are fetched
+        and: the log file is downloaded in consecutive ranges that each start at a record
+        and: one log entry is yielded for each log line
+        and when: range requests are not supported
+        then: the whole log file is downloaded
+        and: one log entry is yielded for each log line
         '''
 
         # setup
-        api = ApiStub(lines=self.log_rows)
+        lines = ['"EVENT_TYPE","TIMESTAMP","REQUEST_ID","MESSAGE"\n'] + [
+            f'"ApexCallout","20240311160000.000","YYZ:{i:06d}","a\n""b""\nc"\n' \
+                for i in range(0, 1000)
+        ]
+        length = len(''.join(lines).encode('utf-8'))
+        api = ApiStub(lines=lines, read_size=512)
+        data_cache = DataCacheStub()
         session = SessionStub()
-        query = QueryStub(config={ 'id': ['Name'] })
+        query = QueryStub()
         query_factory = QueryFactoryStub()
         queries = [
             {
                 'query': 'foo',
             },
         ]
+        record = copy.deepcopy(self.log_records[0])
+        record['LogFileLength'] = length
 
         # execute
         r = receiver.QueryReceiver(
-            None,
+            data_cache,
             api,
             query_factory,
             queries,
             {},
             5,
             300,
-            'Daily',
+            'Hourly',
             4096,
+            1,
+            None,
+            4,
+            1024,
         )
 
-        iter = r.process_query_records(
-            query,
-            self.event_records,
-        )
-
-        logs = []
-        for log in iter:
-            logs.append(log)
+        logs = [log for log in r.process_log_record(session, query, record)]
 
         # verify
-        log0 = logs[0]
-        log1 = logs[1]
-        log2 = logs[2]
+        self.assertEqual(len(api.probes), 4)
+        self.assertEqual(len(api.ranges), 3)
+        self.assertEqual(api.ranges[0][0], 0)
+        self.assertEqual(api.offset, api.ranges[-1][1] + 1)
 
-        self.assertTrue('message' in log0)
-        self.assertEqual(log0['message'], 'Account 2024-03-11T00:00:00.000+0000')
-        self.assertTrue('attributes' in log0)
+        data = ''.join(lines).encode('utf-8')
+        for start, end in api.ranges[1:] + [(api.offset, None)]:
+            self.assertEqual(data[start:start + 14], b'"ApexCallout",')
+            self.assertEqual(data[start - 2:start], b'"\n')
+
+        for i in range(1, len(api.ranges)):
+            self.assertEqual(api.ranges[i][0], api.ranges[i - 1][1] + 1)
+
+        self.assertEqual(len(logs), 1000)
+        self.assertEqual(
+            sorted([log['attributes']['REQUEST_ID'] for log in logs]),
+            [f'YYZ:{i:06d}' for i in range(0, 1000)],
+        )
+        self.assertTrue(all(
+            log['attributes']['MESSAGE'] == 'a\n"b"\nc' for log in logs
+        ))
+        self.assertEqual(
+            sorted([log['message'] for log in logs]),
+            sorted([f'LogFile 00001111AAAABBBB row {i}' for i in range(0, 1000)]),
+        )
+
+        # setup
+        api = ApiStub(lines=lines, read_size=512, supports_ranges=False)
+
+        # execute
+        r = receiver.QueryReceiver(
+            data_cache,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Hourly',
+            4096,
+            1,
+            None,
+            4,
+            1024,
+        )
+
+        logs = [log for log in r.process_log_record(session, query, record)]
+
+        # verify
+        self.assertEqual(len(api.ranges), 0)
+        self.assertEqual(api.offset, 0)
+        self.assertEqual(len(logs), 1000)
+
+    def test_query_receiver_process_log_record_parses_log_file_in_worker_processes(self):
+        '''
+        QueryReceiver.process_log_record() parses and packs log lines in worker processes when parse_processes is greater than 0
+        given: a data cache
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: an event type fields mapping
+        and given: an initial delay value
+        and given: a time lag minutes value
+        and given: a generation interval
+        and given: a read chunk size
+        and given: a number of parse processes
+        and given: an http session
+        and given: a query object
+        and given: a log record
+        when: QueryReceiver.process_log_record() is called
+        then: yields the same log entries in the same order as when log lines are parsed in the exporter process
+        and when: some log lines are in the data cache
+        then: the cached log lines are skipped
+        and: the log entries are numbered without the skipped log lines
+        '''
+
+        # setup
+        lines = ['"EVENT_TYPE","TIMESTAMP","REQUEST_ID","URI"\n'] + [
+            f'"ApexCallout","20240311160000.000","YYZ:{i:06d}","/a\n{i}"\n' \
+                for i in range(0, 30000)
+        ]
+        session = SessionStub()
+        query = QueryStub(config=mod_config.Config({ 'event_type': 'Foo' }))
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+            },
+        ]
+        record = copy.deepcopy(self.log_records[0])
+        record['Interval'] = 'Daily'
+
+        def process(data_cache: DataCacheStub, parse_processes: int):
+            r = receiver.QueryReceiver(
+                data_cache,
+                ApiStub(lines=lines),
+                query_factory,
+                queries,
+                { 'ApexCallout': ['REQUEST_ID', 'URI'] },
+                5,
+                300,
+                'Hourly',
+                4096,
+                1,
+                None,
+                1,
+                receiver.DEFAULT_DOWNLOAD_RANGE_MIN_SIZE,
+                parse_processes,
+            )
+
+            return list(r.process_log_record(session, query, record))
+
+        # execute
+        expected = process(None, 0)
+        logs = process(None, 2)
+
+        # verify
+        self.assertEqual(len(logs), 30000)
+        self.assertEqual(logs, expected)
+        self.assertEqual(logs[1]['attributes']['URI'], '/a\n1')
+        self.assertEqual(logs[1]['attributes']['EVENT_TYPE'], 'Foo')
+
+        # execute
+        logs = process(
+            DataCacheStub(
+                cached_logs={
+                    '00001111AAAABBBB': set(
+                        f'YYZ:{i:06d}' for i in range(0, 30000, 2)
+                    ),
+                },
+            ),
+            2,
+        )
+
+        # verify
+        self.assertEqual(len(logs), 15000)
+        self.assertEqual(logs[0]['attributes']['REQUEST_ID'], 'YYZ:000001')
+        self.assertEqual(logs[0]['message'], 'LogFile 00001111AAAABBBB row 0')
+        self.assertEqual(logs[-1]['attributes']['REQUEST_ID'], 'YYZ:029999')
+        self.assertEqual(
+            logs[-1]['message'],
+            'LogFile 00001111AAAABBBB row 14999',
+        )
+
+    def test_query_receiver_process_log_record_yields_cached_records_when_interval_not_hourly(self):
+        '''
+        QueryReceiver.process_log_record() yields log entries even for cached log records when the generation interval is not Hourly
+        given: a data cache
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: an event type fields mapping
+        and given: an initial delay value
+        and given: a time lag minutes value
+        and given: a generation interval
+        and given: a read chunk size
+        and given: an http session
+        and given: a query object
+        and given: a log record
+        when: QueryReceiver.process_log_record() is called
+        and when: a data cache is specified
+        and when: a record ID matches a record ID in the data cache
+        and when: the generation interval is not 'Hourly'
+        then: yield one log entry for each log line even for cached records
+        '''
+
+        # setup
+        api = ApiStub(lines=self.log_rows)
+        data_cache = DataCacheStub(skip_record_ids=['00001111AAAABBBB'])
+        session = SessionStub()
+        query = QueryStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+            },
+        ]
+        record = copy.deepcopy(self.log_records[0])
+        record['Interval'] = 'Daily'
+
+        # execute
+        r = receiver.QueryReceiver(
+            data_cache,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Daily',
+            4096,
+        )
+
+        iter = r.process_log_record(
+            session,
+            query,
+            record,
+        )
+
+        logs = []
+        for log in iter:
+            logs.append(log)
+
+        # verify
+        self.assertEqual(len(logs), 2)
+
+    def test_query_receiver_process_log_record_raises_login_exception_if_export_log_lines_does(self):
+        '''
+        QueryReceiver.process_log_record() raises a LoginException if export_log_lines() does
+        given: a data cache
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: an event type fields mapping
+        and given: an initial delay value
+        and given: a time lag minutes value
+        and given: a generation interval
+        and given: a read chunk size
+        and given: an http session
+        and given: a query object
+        and given: a log record
+        when: QueryReceiver.process_log_record() is called
+        and when: no data cache is specified
+        and when: export_log_lines() raises a LoginException
+        then: raise a LoginException
+        '''
+
+        # setup
+        api = ApiStub(raise_login_error=True)
+        session = SessionStub()
+        query = QueryStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+            },
+        ]
+        record = self.log_records[0]
+
+        # execute
+        r = receiver.QueryReceiver(
+            None,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Daily',
+            4096,
+        )
+
+        with self.assertRaises(LoginException) as _:
+            iter = r.process_log_record(
+                session,
+                query,
+                record,
+            )
+            # Have to use next to cause the generator to execute the function
+            # else get_log_file() won't get executed and our stub won't have
+            # a chance to throw the fake exception.
+            next(iter)
+
+    def test_query_receiver_process_log_record_raises_salesforce_exception_if_export_log_lines_does(self):
+        '''
+        QueryReceiver.process_log_record() raises a SalesforceApiException if export_log_lines() does
+        given: a data cache
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: an event type fields mapping
+        and given: an initial delay value
+        and given: a time lag minutes value
+        and given: a generation interval
+        and given: a read chunk size
+        and given: an http session
+        and given: a query object
+        and given: a log record
+        when: QueryReceiver.process_log_record() is called
+        and when: no data cache is specified
+        and when: export_log_lines() raises a SalesforceApiException
+        then: raise a SalesforceApiException
+        '''
+
+        # setup
+        api = ApiStub(raise_error=True)
+        session = SessionStub()
+        query = QueryStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+            },
+        ]
+        record = self.log_records[0]
+
+        # execute
+        r = receiver.QueryReceiver(
+            None,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Daily',
+            4096,
+        )
+
+        with self.assertRaises(SalesforceApiException) as _:
+            iter = r.process_log_record(
+                session,
+                query,
+                record,
+            )
+            # Have to use next to cause the generator to execute the function
+            # else get_log_file() won't get executed and our stub won't have
+            # a chance to throw the fake exception.
+            next(iter)
+
+    def test_query_receiver_process_query_records_yields_log_entries_given_query_records(self):
+        '''
+        QueryReceiver.process_query_records() yields one log entry for each query record
+        given: a data cache
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: an event type fields mapping
+        and given: an initial delay value
+        and given: a time lag minutes value
+        and given: a generation interval
+        and given: a read chunk size
+        and given: a query object
+        and given: a set of query records
+        when: QueryReceiver.process_query_records() is called
+        and when: no data cache is specified
+        and when: the data cache is None
+        then: yield one log entry for each query record
+        '''
+
+        # setup
+        api = ApiStub(lines=self.log_rows)
+        session = SessionStub()
+        query = QueryStub(config={ 'id': ['Name'] })
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+            },
+        ]
+
+        # execute
+        r = receiver.QueryReceiver(
+            None,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Daily',
+            4096,
+        )
+
+        iter = r.process_query_records(
+            query,
+            self.event_records,
+        )
+
+        logs = []
+        for log in iter:
+            logs.append(log)
+
+        # verify
+        log0 = logs[0]
+        log1 = logs[1]
+        log2 = logs[2]
+
+        self.assertTrue('message' in log0)
+        self.assertEqual(log0['message'], 'Account 2024-03-11T00:00:00.000+0000')
+        self.assertTrue('attributes' in log0)
         self.assertTrue('Id' in log0['attributes'])
         self.assertEqual(log0['attributes']['Id'], f'000012345')
         self.assertTrue('Name' in log0['attributes'])
@@ -2375,17 +2982,169 @@ class TestQueryReceiver(unittest.TestCase):
         self.assertTrue('REQUEST_ID' in attrs)
         self.assertEqual(attrs['REQUEST_ID'], 'YYZ:abcdef123456')
 
-        log = logs[3]
-        self.assertTrue('message' in log)
-        self.assertEqual(f'LogFile 00002222AAAABBBB row 1', log['message'])
-        self.assertTrue('attributes' in log)
-        attrs = log['attributes']
-        self.assertTrue('LogFileId' in attrs)
-        self.assertEqual(attrs['LogFileId'], '00002222AAAABBBB')
-        self.assertTrue('EVENT_TYPE' in attrs)
-        self.assertEqual(attrs['EVENT_TYPE'], 'ApexCallout')
-        self.assertTrue('REQUEST_ID' in attrs)
-        self.assertEqual(attrs['REQUEST_ID'], 'YYZ:fedcba654321')
+        log = logs[3]
+        self.assertTrue('message' in log)
+        self.assertEqual(f'LogFile 00002222AAAABBBB row 1', log['message'])
+        self.assertTrue('attributes' in log)
+        attrs = log['attributes']
+        self.assertTrue('LogFileId' in attrs)
+        self.assertEqual(attrs['LogFileId'], '00002222AAAABBBB')
+        self.assertTrue('EVENT_TYPE' in attrs)
+        self.assertEqual(attrs['EVENT_TYPE'], 'ApexCallout')
+        self.assertTrue('REQUEST_ID' in attrs)
+        self.assertEqual(attrs['REQUEST_ID'], 'YYZ:fedcba654321')
+
+    def test_query_receiver_process_records_checks_cached_log_files_in_one_lookup(self):
+        '''
+        QueryReceiver.process_records() checks whether log files are cached with a single lookup for all log records
+        given: a data cache
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: a query object
+        and given: a set of Hourly log records
+        and given: the first log file is cached
+        when: QueryReceiver.process_records() is called
+        then: the data cache is checked once for all log records
+        and: only the log lines of the log file that is not cached are yielded
+        '''
+
+        # setup
+        api = ApiStub(lines=self.log_rows)
+        data_cache = DataCacheStub(skip_record_ids=['00001111AAAABBBB'])
+        session = SessionStub()
+        query = QueryStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+            },
+        ]
+        records = iter(self.log_records)
+
+        # execute
+        r = receiver.QueryReceiver(
+            data_cache,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Hourly',
+            4096,
+        )
+
+        logs = list(r.process_records(session, query, records))
+
+        # verify
+        self.assertEqual(
+            data_cache.skip_lookups,
+            [['00001111AAAABBBB', '00002222AAAABBBB']],
+        )
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(
+            logs[0]['message'],
+            'LogFile 00002222AAAABBBB row 0',
+        )
+        self.assertEqual(
+            logs[1]['message'],
+            'LogFile 00002222AAAABBBB row 1',
+        )
+
+    def test_query_receiver_process_records_downloads_log_files_concurrently_given_download_concurrency(self):
+        '''
+        QueryReceiver.process_records() yields one log entry for each log line given log records and a download concurrency greater than one
+        given: a data cache
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: an event type fields mapping
+        and given: an initial delay value
+        and given: a time lag minutes value
+        and given: a generation interval
+        and given: a read chunk size
+        and given: a download concurrency greater than one
+        and given: a query object
+        and given: a set of query records
+        when: QueryReceiver.process_records() is called
+        and when: the first query record is a 'LogFile' record
+        and when: a data cache is specified
+        then: yield one log entry for each log line of each log file
+        and: flush the data cache for each log file
+        '''
+
+        # setup
+        api = ApiStub(lines=self.log_rows)
+        data_cache = DataCacheStub()
+        session = SessionStub()
+        query = QueryStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+            },
+        ]
+        records = iter(self.log_records)
+
+        # execute
+        r = receiver.QueryReceiver(
+            data_cache,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Hourly',
+            4096,
+            2,
+        )
+
+        itr = r.process_records(
+            session,
+            query,
+            records,
+        )
+
+        logs = []
+        for log in itr:
+            logs.append(log)
+
+        # verify
+        self.assertEqual(len(logs), 4)
+        self.assertEqual(
+            sorted([log['message'] for log in logs]),
+            [
+                'LogFile 00001111AAAABBBB row 0',
+                'LogFile 00001111AAAABBBB row 1',
+                'LogFile 00002222AAAABBBB row 0',
+                'LogFile 00002222AAAABBBB row 1',
+            ],
+        )
+        self.assertEqual(
+            sorted(data_cache.flushed_log_files),
+            ['00001111AAAABBBB', '00002222AAAABBBB'],
+        )
+
+    def test_get_log_file_length(self):
+        '''
+        get_log_file_length() returns the LogFileLength of a log record or 0
+        given: a log record
+        when: get_log_file_length() is called
+        then: the LogFileLength field is returned if present and 0 otherwise
+        '''
+
+        # execute / verify
+        self.assertEqual(
+            receiver.get_log_file_length({ 'LogFileLength': 1024.0 }),
+            1024,
+        )
+        self.assertEqual(receiver.get_log_file_length({}), 0)
+        self.assertEqual(
+            receiver.get_log_file_length({ 'LogFileLength': None }),
+            0,
+        )
 
     def test_query_receiver_process_records_yields_log_entries_given_query_records(self):
         '''
@@ -2577,6 +3336,427 @@ class TestQueryReceiver(unittest.TestCase):
         self.assertTrue('CreatedBy.Profile.Name' in attrs)
         self.assertEqual(attrs['CreatedBy.Profile.Name'], 'Beep Boop')
 
+    def test_query_receiver_execute_uses_watermarks(self):
+        '''
+        QueryReceiver.execute() starts the time range of each query at its watermark and saves the end of the time range
+        given: a watermark store with a watermark for one query
+        and given: an api
+        and given: a query factory
+        and given: a list of queries
+        and given: an event type fields mapping
+        and given: an initial delay value
+        and given: a time lag minutes value
+        and given: a generation interval
+        and given: a read chunk size
+        and given: an http session
+        when: QueryReceiver.execute() is called
+        then: the time range of the query with a watermark starts at the watermark
+        and: the time range of the other query starts at last_to_timestamp
+        and: both time ranges end at the same timestamp
+        and: no watermarks are stored until save_watermarks() is called
+        and when: save_watermarks() is called
+        then: the end of the time range is stored for each query
+        and: the next time range starts at the end of the time range
+        '''
+
+        # setup
+        _now = datetime.utcnow()
+
+        def _utcnow():
+            nonlocal _now
+            return _now
+
+        util._UTCNOW = _utcnow
+
+        class WatermarkStoreStub:
+            def __init__(self, watermarks: dict):
+                self.watermarks = watermarks
+
+            def get(self, query_keys: list) -> dict:
+                return {
+                    k: self.watermarks[k] \
+                        for k in query_keys if k in self.watermarks
+                }
+
+            def put(self, watermarks: dict) -> None:
+                self.watermarks.update(watermarks)
+
+        store = WatermarkStoreStub({
+            get_query_key('foo'): '2024-03-10T12:00:00.000Z',
+        })
+        api = ApiStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+                'results': [],
+            },
+            {
+                'query': 'bar',
+                'results': [],
+            },
+        ]
+        session = SessionStub()
+
+        # execute
+        r = receiver.QueryReceiver(
+            None,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Hourly',
+            4096,
+            watermarks=store,
+        )
+
+        last_to_before = r.last_to_timestamp
+
+        for _ in r.execute(session):
+            pass
+
+        # verify
+        to_timestamp = util.get_iso_date_with_offset(300)
+
+        self.assertEqual(
+            query_factory.time_ranges,
+            [
+                ('2024-03-10T12:00:00.000Z', to_timestamp),
+                (last_to_before, to_timestamp),
+            ],
+        )
+        self.assertEqual(r.last_to_timestamp, to_timestamp)
+        self.assertEqual(len(store.watermarks), 1)
+
+        # execute
+        r.save_watermarks()
+
+        # verify
+        self.assertEqual(
+            store.watermarks,
+            {
+                get_query_key('foo'): to_timestamp,
+                get_query_key('bar'): to_timestamp,
+            },
+        )
+        self.assertEqual(len(r.pending_watermarks), 0)
+
+    def test_query_receiver_execute_splits_wide_time_ranges_into_windows(self):
+        '''
+        QueryReceiver.execute() queries each window of a time range wider than window_minutes
+        given: a watermark store with a watermark 150 minutes before the end of the time range
+        and given: an api
+        and given: a query factory
+        and given: a query
+        and given: a window size of 60 minutes
+        and given: a window concurrency of 2
+        and given: an http session
+        when: QueryReceiver.execute() is called
+        then: the query is executed once for each of the 3 windows of the time range
+        and: the results of every window are yielded
+        and: the pending watermark of the query is the end of the time range
+        '''
+
+        # setup
+        _now = datetime(2024, 3, 11, 12, 0, 0)
+
+        def _utcnow():
+            nonlocal _now
+            return _now
+
+        util._UTCNOW = _utcnow
+
+        class WatermarkStoreStub:
+            def __init__(self, watermarks: dict):
+                self.watermarks = watermarks
+
+            def get(self, query_keys: list) -> dict:
+                return {
+                    k: self.watermarks[k] \
+                        for k in query_keys if k in self.watermarks
+                }
+
+            def put(self, watermarks: dict) -> None:
+                self.watermarks.update(watermarks)
+
+        store = WatermarkStoreStub({
+            get_query_key('foo'): '2024-03-11T04:30:00.000Z',
+        })
+        api = ApiStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+                'results': [{ 'foo': 'bar' }],
+            },
+        ]
+        session = SessionStub()
+
+        # execute
+        r = receiver.QueryReceiver(
+            None,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Hourly',
+            4096,
+            watermarks=store,
+            window_minutes=60,
+            window_concurrency=2,
+        )
+
+        logs = list(r.execute(session))
+
+        # verify
+        self.assertEqual(
+            query_factory.time_ranges,
+            [
+                ('2024-03-11T04:30:00.000Z', '2024-03-11T05:30:00.000Z'),
+                ('2024-03-11T05:30:00.000Z', '2024-03-11T06:30:00.000Z'),
+                ('2024-03-11T06:30:00.000Z', '2024-03-11T07:00:00.000Z'),
+            ],
+        )
+        self.assertEqual(len(query_factory.queries), 3)
+        self.assertTrue(all(query.executed for query in query_factory.queries))
+        self.assertEqual(len(logs), 3)
+        self.assertTrue(
+            all(log['attributes']['foo'] == 'bar' for log in logs),
+        )
+        self.assertEqual(
+            r.pending_watermarks,
+            { get_query_key('foo'): '2024-03-11T07:00:00.000Z' },
+        )
+        self.assertEqual(r.last_to_timestamp, '2024-03-11T07:00:00.000Z')
+
+    def test_query_receiver_execute_advances_watermark_past_oldest_completed_windows(self):
+        '''
+        QueryReceiver.execute() only advances the watermark to the end of the oldest windows that have all completed
+        given: a watermark store
+        and given: a data cache
+        and given: an api
+        and given: a query factory returning a query per window
+        and given: 3 windows of which the second one fails after the third one completed
+        and given: a window concurrency of 3
+        and given: an http session
+        when: QueryReceiver.execute() is called
+        then: raises a SalesforceApiException
+        and: the pending watermark of the query is the end of the first window
+        and: nothing is stored until the logs handed over have been delivered
+        and when: the logs handed over have been delivered
+        then: the end of the first window is stored
+        '''
+
+        # setup
+        _now = datetime(2024, 3, 11, 12, 0, 0)
+
+        def _utcnow():
+            nonlocal _now
+            return _now
+
+        util._UTCNOW = _utcnow
+
+        class WatermarkStoreStub:
+            def __init__(self, watermarks: dict):
+                self.watermarks = watermarks
+
+            def get(self, query_keys: list) -> dict:
+                return {
+                    k: self.watermarks[k] \
+                        for k in query_keys if k in self.watermarks
+                }
+
+            def put(self, watermarks: dict) -> None:
+                self.watermarks.update(watermarks)
+
+        def fail_later():
+            time.sleep(0.2)
+            raise SalesforceApiException()
+            yield
+
+        results = [
+            [{ 'Id': '1' }],
+            fail_later(),
+            [{ 'Id': '3' }],
+        ]
+
+        class WindowQueryFactoryStub(QueryFactoryStub):
+            def new(
+                self,
+                api,
+                q: dict,
+                time_lag_minutes: int = 0,
+                last_to_timestamp: str = '',
+                generation_interval: str = '',
+                to_timestamp: str = None,
+            ):
+                self.time_ranges.append((last_to_timestamp, to_timestamp))
+                return QueryStub(
+                    api,
+                    q['query'],
+                    { 'results': results[len(self.time_ranges) - 1] },
+                )
+
+        store = WatermarkStoreStub({
+            get_query_key('foo'): '2024-03-11T04:30:00.000Z',
+        })
+        data_cache = DataCacheStub()
+        api = ApiStub()
+        query_factory = WindowQueryFactoryStub()
+        queries = [{ 'query': 'foo' }]
+        session = SessionStub()
+
+        r = receiver.QueryReceiver(
+            data_cache,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Hourly',
+            4096,
+            watermarks=store,
+            window_minutes=60,
+            window_concurrency=3,
+        )
+
+        logs = []
+
+        # execute / verify
+        with self.assertRaises(SalesforceApiException) as _:
+            for log in r.execute(session):
+                logs.append(log)
+
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(
+            r.pending_watermarks,
+            { get_query_key('foo'): '2024-03-11T05:30:00.000Z' },
+        )
+        self.assertEqual(
+            store.watermarks,
+            { get_query_key('foo'): '2024-03-11T04:30:00.000Z' },
+        )
+
+        # execute
+        data_cache.set_delivered(len(logs))
+
+        # verify
+        self.assertEqual(
+            store.watermarks,
+            { get_query_key('foo'): '2024-03-11T05:30:00.000Z' },
+        )
+
+    def test_get_record_event_type(self):
+        '''
+        get_record_event_type() returns the event type the logs of a record are sent with
+        given: a query
+        when: get_record_event_type() is called
+        and when: the record is a log file record
+        then: returns the EventType of the record
+        and when: the record is a query record with a type attribute
+        then: returns the type attribute
+        and when: the record is a query record without a type attribute
+        then: returns SFEvent
+        and when: the query has an event_type option
+        then: returns the event_type option
+        '''
+
+        # setup
+        query = QueryStub(config={})
+        query_with_event_type = QueryStub(config={ 'event_type': 'Foo' })
+        log_record = { 'LogFile': '/foo', 'EventType': 'Login' }
+        query_record = { 'Id': '1', 'attributes': { 'type': 'Account' } }
+
+        # execute / verify
+        self.assertEqual(
+            receiver.get_record_event_type(query, log_record),
+            'Login',
+        )
+        self.assertEqual(
+            receiver.get_record_event_type(query, query_record),
+            'Account',
+        )
+        self.assertEqual(
+            receiver.get_record_event_type(query, { 'Id': '1' }),
+            'SFEvent',
+        )
+        self.assertEqual(
+            receiver.get_record_event_type(query_with_event_type, log_record),
+            'Foo',
+        )
+        self.assertEqual(
+            receiver.get_record_event_type(
+                query_with_event_type,
+                query_record,
+            ),
+            'Foo',
+        )
+
+    def test_query_receiver_execute_uses_time_range_and_event_types(self):
+        '''
+        QueryReceiver.execute() uses the time range given to set_time_range() and only yields records of the given event types
+        given: an api
+        and given: a query factory
+        and given: a query returning records of 2 event types
+        and given: a set of event types with one of the event types
+        and given: an http session
+        when: set_time_range() is called
+        and when: QueryReceiver.execute() is called
+        then: the time range of the query is the given time range
+        and: only the records of the given event type are yielded
+        '''
+
+        # setup
+        api = ApiStub()
+        query_factory = QueryFactoryStub()
+        queries = [
+            {
+                'query': 'foo',
+                'results': [
+                    { 'Id': '1', 'attributes': { 'type': 'Account' } },
+                    { 'Id': '2', 'attributes': { 'type': 'Contact' } },
+                    { 'Id': '3', 'attributes': { 'type': 'Account' } },
+                ],
+            },
+        ]
+        session = SessionStub()
+
+        r = receiver.QueryReceiver(
+            None,
+            api,
+            query_factory,
+            queries,
+            {},
+            5,
+            300,
+            'Hourly',
+            4096,
+            event_types=set(['Account']),
+        )
+
+        # execute
+        r.set_time_range(
+            '2024-03-01T00:00:00.000Z',
+            '2024-03-01T01:00:00.000Z',
+        )
+        logs = list(r.execute(session))
+
+        # verify
+        self.assertEqual(
+            query_factory.time_ranges,
+            [('2024-03-01T00:00:00.000Z', '2024-03-01T01:00:00.000Z')],
+        )
+        self.assertEqual(
+            [log['attributes']['Id'] for log in logs],
+            ['1', '3'],
+        )
+        self.assertEqual(r.last_to_timestamp, '2024-03-01T01:00:00.000Z')
+
     def test_query_receiver_slide_time_range(self):
         '''
         QueryReceiver.slide_time_range() updates the last_to_timestamp
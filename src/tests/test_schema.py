@@ -0,0 +1,203 @@
+import unittest
+from yaml import Loader, load
+
+
+from newrelic_logging import schema
+
+
+class TestSchema(unittest.TestCase):
+    def test_convert_number_converts_without_exceptions(self):
+        '''
+        convert_number() returns the numeric value of a string or None if it is not a number
+        given: a value
+        when: convert_number() is called
+        then: integers are returned as int
+        and: decimals are returned as float
+        and: None is returned for values that are not numbers
+        and: values that are not strings are converted as before
+        '''
+
+        # execute / verify
+        self.assertEqual(schema.convert_number('42'), 42)
+        self.assertEqual(schema.convert_number('-42'), -42)
+        self.assertEqual(schema.convert_number('1.5'), 1.5)
+        self.assertEqual(schema.convert_number('.5'), 0.5)
+        self.assertEqual(schema.convert_number('1e3'), 1000.0)
+        self.assertIsNone(schema.convert_number('foo'))
+        self.assertIsNone(schema.convert_number('1.2.3'))
+        self.assertEqual(schema.convert_number(7), 7)
+
+    def test_codec_cache_converts_fields_typed_as_numbers(self):
+        '''
+        CodecCache compiles codecs that convert fields Salesforce reports as numbers and fields in the numeric fields mapping
+        given: the field types of an event type
+        and given: a numeric fields mapping
+        when: a codec is retrieved for the event type and a set of fields
+        and when: the codec decodes a set of attributes
+        then: fields typed as numbers are converted to numbers
+        and: fields of the event type in the numeric fields mapping are
+            converted to numbers
+        and: empty numeric fields are set to 0
+        and: other fields are left as is
+        and: the same codec is returned for the same event type and fields
+        '''
+
+        # setup
+        schema.register_field_types(
+            'SchemaTestEvent1',
+            'EVENT_TYPE,RUN_TIME,CPU_TIME,URI,STATUS',
+            'String,Number,Number,String,String',
+        )
+        codecs = schema.CodecCache({ 'SchemaTestEvent1': ['STATUS'] })
+        attributes = {
+            'EVENT_TYPE': 'SchemaTestEvent1',
+            'RUN_TIME': '2112',
+            'CPU_TIME': '',
+            'URI': '1234',
+            'STATUS': '1.5',
+        }
+
+        # execute
+        codec = codecs.get('SchemaTestEvent1', tuple(attributes))
+        event = codec.decode(attributes)
+
+        # verify
+        self.assertEqual(
+            event,
+            {
+                'EVENT_TYPE': 'SchemaTestEvent1',
+                'RUN_TIME': 2112,
+                'CPU_TIME': 0,
+                'URI': '1234',
+                'STATUS': 1.5,
+            },
+        )
+        self.assertIs(codecs.get('SchemaTestEvent1', tuple(attributes)), codec)
+
+    def test_codec_cache_recompiles_codecs_when_field_types_change(self):
+        '''
+        CodecCache recompiles codecs when new field types are registered
+        given: a codec cache
+        and given: a codec compiled before the field types of the event type were registered
+        when: the field types of the event type are registered
+        then: a new codec that uses the field types is compiled
+        and: registering the same field types again keeps the codec
+        '''
+
+        # setup
+        codecs = schema.CodecCache({})
+        attributes = { 'RUN_TIME': '10' }
+        fields = tuple(attributes)
+        codec = codecs.get('SchemaTestEvent2', fields)
+
+        # execute
+        schema.register_field_types('SchemaTestEvent2', 'RUN_TIME', 'Number')
+        codec2 = codecs.get('SchemaTestEvent2', fields)
+        schema.register_field_types('SchemaTestEvent2', 'RUN_TIME', 'Number')
+        codec3 = codecs.get('SchemaTestEvent2', fields)
+
+        # verify
+        self.assertEqual(codec.decode(attributes), { 'RUN_TIME': '10' })
+        self.assertIsNot(codec2, codec)
+        self.assertIs(codec3, codec2)
+        self.assertEqual(codec2.decode(attributes), { 'RUN_TIME': 10 })
+
+    def test_codec_cache_converts_numeric_fields_of_event_type(self):
+        '''
+        CodecCache only converts the fields of the numeric fields mapping listed for the event type or for all event types
+        given: a numeric fields mapping with fields for 2 event types
+        and given: fields for the Common event type
+        when: a codec is retrieved for each event type
+        and when: the codecs decode the same set of attributes
+        then: the fields of the event type and the Common fields are converted
+        and: the fields of the other event type are left as is
+        and when: a codec is retrieved for an event type not in the mapping
+        then: the fields of all event types are converted
+        '''
+
+        # setup
+        codecs = schema.CodecCache({
+            'Common': ['RUN_TIME'],
+            'SchemaTestEvent4': ['CPU_TIME'],
+            'SchemaTestEvent5': ['STATUS'],
+        })
+        attributes = { 'RUN_TIME': '1', 'CPU_TIME': '2', 'STATUS': '3' }
+        fields = tuple(attributes)
+
+        # execute
+        event4 = codecs.get('SchemaTestEvent4', fields).decode(attributes)
+        event5 = codecs.get('SchemaTestEvent5', fields).decode(attributes)
+        event6 = codecs.get('SchemaTestEvent6', fields).decode(attributes)
+
+        # verify
+        self.assertEqual(
+            event4,
+            { 'RUN_TIME': 1, 'CPU_TIME': 2, 'STATUS': '3' },
+        )
+        self.assertEqual(
+            event5,
+            { 'RUN_TIME': 1, 'CPU_TIME': '2', 'STATUS': 3 },
+        )
+        self.assertEqual(
+            event6,
+            { 'RUN_TIME': 1, 'CPU_TIME': 2, 'STATUS': 3 },
+        )
+
+    def test_codec_cache_converts_custom_query_fields_given_numeric_fields_file(self):
+        '''
+        CodecCache converts the fields of custom query events using the numeric fields mapping file in the repository
+        given: the numeric fields mapping from numeric_fields.yml
+        when: a codec is retrieved for the event type of a custom query
+        and when: the codec decodes a set of attributes
+        then: fields listed for any event type in the mapping are converted
+        and: other fields are left as is
+        '''
+
+        # setup
+        with open('../numeric_fields.yml') as stream:
+            mapping = load(stream, Loader=Loader)['mapping']
+
+        codecs = schema.CodecCache(mapping)
+        attributes = {
+            'Id': '001',
+            'CPU_TIME': '12',
+            'RUN_TIME': '34',
+            'DURATION': '5.5',
+        }
+
+        # execute
+        event = codecs.get(
+            'MyCustomQueryEvent',
+            tuple(attributes),
+        ).decode(attributes)
+
+        # verify
+        self.assertEqual(
+            event,
+            { 'Id': '001', 'CPU_TIME': 12, 'RUN_TIME': 34, 'DURATION': 5.5 },
+        )
+
+    def test_codec_decode_keeps_values_that_are_not_numbers(self):
+        '''
+        Codec.decode() keeps numeric field values that are not numbers
+        given: a codec for a numeric field
+        when: the codec decodes a value that is not a number
+        then: the value is kept as is
+        and: only one warning is recorded per field
+        '''
+
+        # setup
+        codec = schema.Codec('SchemaTestEvent3', ('RUN_TIME',), set(['RUN_TIME']))
+
+        # execute
+        event1 = codec.decode({ 'RUN_TIME': 'foo' })
+        event2 = codec.decode({ 'RUN_TIME': 'bar' })
+
+        # verify
+        self.assertEqual(event1, { 'RUN_TIME': 'foo' })
+        self.assertEqual(event2, { 'RUN_TIME': 'bar' })
+        self.assertEqual(codec.warned, set(['RUN_TIME']))
+
+
+if __name__ == '__main__':
+    unittest.main()
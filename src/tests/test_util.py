@@ -165,6 +165,37 @@ class TestUtilities(unittest.TestCase):
 
         self.assertEqual(expected, record_id)
 
+    def test_new_record_id_generator(self):
+        '''
+        new_record_id_generator() returns a function that generates the same IDs as generate_record_id()
+        given: a set of id keys
+        when: new_record_id_generator() is called
+        then: the returned function returns the same ID as generate_record_id() for each record
+        and: the returned function raises given a record without one of the keys
+        '''
+
+        # setup
+        records = [
+            { 'Name': 'foo', 'Id': '1' },
+            { 'Name': 'bar', 'Id': '2' },
+            { 'Name': '', 'Id': '' },
+        ]
+
+        # execute
+        generate = util.new_record_id_generator([ 'Name', 'Id' ])
+
+        # verify
+        for record in records:
+            self.assertEqual(
+                generate(record),
+                util.generate_record_id([ 'Name', 'Id' ], record),
+            )
+
+        self.assertEqual(util.new_record_id_generator([])(records[0]), '')
+
+        with self.assertRaises(Exception) as _:
+            generate({ 'Name': 'foo' })
+
     def test_maybe_convert_str_to_num(self):
         '''
         given: a string
@@ -287,6 +318,52 @@ class TestUtilities(unittest.TestCase):
         # verify
         self.assertEqual(val, isonow)
 
+    def test_get_time_windows_splits_wide_time_ranges(self):
+        '''
+        get_time_windows() splits a time range into consecutive windows of at most the given size
+        given: a time range of 150 minutes
+        when: get_time_windows() is called with a window size of 60 minutes
+        then: returns 3 consecutive windows, oldest first, the last one holding the remainder
+        and when: the window size is 0 or not smaller than the time range
+        then: returns the time range as a single window
+        and when: a date of the time range has another format
+        then: returns the time range as a single window
+        '''
+
+        # setup
+        from_timestamp = '2024-03-10T23:30:00.000Z'
+        to_timestamp = '2024-03-11T02:00:00.000Z'
+
+        # execute
+        windows = util.get_time_windows(from_timestamp, to_timestamp, 60)
+
+        # verify
+        self.assertEqual(
+            windows,
+            [
+                ('2024-03-10T23:30:00.000Z', '2024-03-11T00:30:00.000Z'),
+                ('2024-03-11T00:30:00.000Z', '2024-03-11T01:30:00.000Z'),
+                ('2024-03-11T01:30:00.000Z', '2024-03-11T02:00:00.000Z'),
+            ],
+        )
+
+        for window_minutes in [0, 150, 200]:
+            # execute / verify
+            self.assertEqual(
+                util.get_time_windows(
+                    from_timestamp,
+                    to_timestamp,
+                    window_minutes,
+                ),
+                [(from_timestamp, to_timestamp)],
+            )
+
+        # execute / verify
+        self.assertEqual(
+            util.get_time_windows('2024-03-10', to_timestamp, 60),
+            [('2024-03-10', to_timestamp)],
+        )
+
     def test_is_primitive_true_for_primitive_types(self):
         '''
         is_primitive() returns true for types considered to be "primitive" (str, int, float, bool, None)
@@ -623,5 +700,75 @@ class TestUtilities(unittest.TestCase):
         self.assertEqual(ts1, ts2)
 
 
+    def test_get_timestamp_matches_strptime_for_offsets_and_fractions(self):
+        '''
+        get_timestamp() returns the same posix time in ms as strptime() for any offset and fraction
+        given: date strings with different offsets and fraction lengths
+        when: get_timestamp() is called
+        then: returns the same posix time in ms as strptime()
+        and: a date string with an invalid date raises a ValueError
+        '''
+
+        # setup
+        date_strings = [
+            '2024-03-11T16:00:00.123+0000',
+            '2024-03-11T16:00:00.1-0800',
+            '2024-03-11T16:00:00.999999+0530',
+            '2024-02-29T23:59:59.001-1130',
+            '1999-12-31T23:59:59.5+1400',
+            '2024-03-11T16:00:00.123Z',
+        ]
+
+        for date_string in date_strings:
+            time = datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S.%f%z')
+            expected = int(time.timestamp() * 1000)
+
+            # execute
+            timestamp = util.get_timestamp(date_string)
+
+            # verify
+            self.assertEqual(expected, timestamp)
+
+        with self.assertRaises(ValueError) as _:
+            util.get_timestamp('2024-02-30T00:00:00.000+0000')
+
+    def test_parse_log_line_timestamp_matches_strptime_for_fractions(self):
+        '''
+        parse_log_line_timestamp() returns the same posix time in whole seconds as strptime() for any fraction
+        given: TIMESTAMP values with different fraction lengths
+        when: parse_log_line_timestamp() is called
+        then: returns the posix time in whole seconds
+        and: returns the same value as strptime() without the microseconds
+        and: an invalid TIMESTAMP value raises a ValueError
+        '''
+
+        # setup
+        epochs = {
+            '20240311160000.123': 1710172800.0,
+            '20240311160000.5': 1710172800.0,
+            '20240311160001.999999': 1710172801.0,
+            '20240229235959.000': 1709251199.0,
+        }
+
+        for epoch, expected in epochs.items():
+            # execute
+            ts = util.parse_log_line_timestamp(epoch)
+
+            # verify
+            self.assertEqual(expected, ts)
+            self.assertEqual(
+                pytz.utc.localize(
+                    datetime.strptime(epoch, '%Y%m%d%H%M%S.%f')
+                ).replace(microsecond=0).timestamp(),
+                ts,
+            )
+
+        with self.assertRaises(ValueError) as _:
+            util.parse_log_line_timestamp('20241311000000.000')
+
+        with self.assertRaises(ValueError) as _:
+            util.parse_log_line_timestamp('20240311160000.12x')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,256 @@
+import json
+import os
+import tempfile
+import unittest
+
+
+from . import BackendStub, DataCacheStub
+from newrelic_logging import ConfigException, cache, config as mod_config
+from newrelic_logging.query import watermark
+
+
+class TestWatermarkStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_file_watermark_store_puts_and_gets_watermarks(self):
+        '''
+        FileWatermarkStore keeps watermarks in a JSON file
+        given: a watermark file path
+        when: watermarks are put in the store
+        then: the watermarks are written to the file
+        and: get() returns the watermarks of the given query keys that exist
+        and: putting more watermarks keeps the existing ones
+        '''
+
+        # setup
+        path = os.path.join(self.tmp.name, 'watermarks.json')
+        store = watermark.FileWatermarkStore(path)
+
+        # preconditions
+        self.assertEqual(store.get(['foo']), {})
+
+        # execute
+        store.put({ 'foo': '2024-03-10T12:00:00.000Z' })
+        store.put({ 'bar': '2024-03-10T13:00:00.000Z' })
+
+        # verify
+        self.assertEqual(
+            store.get(['foo', 'bar', 'beep']),
+            {
+                'foo': '2024-03-10T12:00:00.000Z',
+                'bar': '2024-03-10T13:00:00.000Z',
+            },
+        )
+
+        with open(path) as f:
+            self.assertEqual(len(json.load(f)['']), 2)
+
+        self.assertFalse(os.path.exists(f'{path}.tmp'))
+
+    def test_file_watermark_store_keeps_watermarks_of_instances_apart(self):
+        '''
+        FileWatermarkStore keeps the watermarks of each instance sharing a file apart
+        given: a watermark file path
+        and given: stores for 2 instances using the same file
+        when: watermarks for the same query key are put in both stores
+        then: get() on each store returns the watermark of its instance
+        and: the watermarks are written to the file under the instance names
+        '''
+
+        # setup
+        path = os.path.join(self.tmp.name, 'watermarks.json')
+        foo = watermark.FileWatermarkStore(path, 'foo')
+        bar = watermark.FileWatermarkStore(path, 'bar')
+
+        # execute
+        foo.put({ 'q': '2024-03-10T12:00:00.000Z' })
+
+        # verify
+        self.assertEqual(bar.get(['q']), {})
+
+        # execute
+        bar.put({ 'q': '2024-03-10T13:00:00.000Z' })
+
+        # verify
+        self.assertEqual(foo.get(['q']), { 'q': '2024-03-10T12:00:00.000Z' })
+        self.assertEqual(bar.get(['q']), { 'q': '2024-03-10T13:00:00.000Z' })
+
+        with open(path) as f:
+            self.assertEqual(
+                json.load(f),
+                {
+                    'foo': { 'q': '2024-03-10T12:00:00.000Z' },
+                    'bar': { 'q': '2024-03-10T13:00:00.000Z' },
+                },
+            )
+
+    def test_cache_watermark_store_puts_and_gets_watermarks(self):
+        '''
+        CacheWatermarkStore keeps the watermarks of an instance in a cache hash
+        given: a SQLite backend
+        and given: a namespace
+        when: watermarks are put in the store
+        then: get() returns the watermarks of the given query keys that exist
+        and: the watermarks are stored in the hash for the namespace
+        '''
+
+        # setup
+        backend = cache.SqliteBackend(
+            os.path.join(self.tmp.name, 'cache.db'),
+            5,
+        )
+        store = watermark.CacheWatermarkStore(backend, 'inst')
+
+        # execute
+        store.put({ 'foo': '2024-03-10T12:00:00.000Z' })
+
+        # verify
+        self.assertEqual(
+            store.get(['foo', 'bar']),
+            { 'foo': '2024-03-10T12:00:00.000Z' },
+        )
+        self.assertEqual(
+            backend.get_hash('watermarks:inst', ['foo']),
+            ['2024-03-10T12:00:00.000Z'],
+        )
+
+        backend.db.close()
+
+    def test_prefixed_watermark_store_keeps_watermarks_apart(self):
+        '''
+        PrefixedWatermarkStore keeps watermarks in another store under prefixed query keys
+        given: a store with a watermark
+        and given: a prefix
+        when: watermarks are put in the prefixed store
+        then: the watermarks are put in the store under the prefixed query keys
+        and: the watermark of the store is kept
+        and: get() returns the watermarks of the given query keys that exist without the prefix
+        '''
+
+        # setup
+        path = os.path.join(self.tmp.name, 'watermarks.json')
+        store = watermark.FileWatermarkStore(path)
+        store.put({ 'foo': '2024-03-10T12:00:00.000Z' })
+
+        prefixed = watermark.PrefixedWatermarkStore(store, 'backfill:')
+
+        # preconditions
+        self.assertEqual(prefixed.get(['foo']), {})
+
+        # execute
+        prefixed.put({ 'foo': '2024-03-01T05:00:00.000Z' })
+
+        # verify
+        self.assertEqual(
+            store.get(['foo', 'backfill:foo']),
+            {
+                'foo': '2024-03-10T12:00:00.000Z',
+                'backfill:foo': '2024-03-01T05:00:00.000Z',
+            },
+        )
+        self.assertEqual(
+            prefixed.get(['foo', 'bar']),
+            { 'foo': '2024-03-01T05:00:00.000Z' },
+        )
+
+    def test_new_watermark_store_returns_store_for_config(self):
+        '''
+        new_watermark_store() returns the store given by the watermark_store attribute
+        given: an instance config
+        and given: a data cache
+        and given: an instance name
+        when: new_watermark_store() is called
+        and when: watermark_store is not set or is memory
+        then: returns None
+        and when: watermark_store is file
+        then: returns a FileWatermarkStore for the watermark_file and instance
+        and when: watermark_store is cache
+        then: returns a CacheWatermarkStore for the data cache backend
+        '''
+
+        # setup
+        path = os.path.join(self.tmp.name, 'watermarks.json')
+        backend = cache.SqliteBackend(
+            os.path.join(self.tmp.name, 'cache.db'),
+            5,
+        )
+        data_cache = cache.DataCache(backend, 5, namespace='inst')
+
+        # execute / verify
+        self.assertIsNone(watermark.new_watermark_store(
+            mod_config.Config({}),
+            data_cache,
+        ))
+        self.assertIsNone(watermark.new_watermark_store(
+            mod_config.Config({ 'watermark_store': 'memory' }),
+            None,
+        ))
+
+        store = watermark.new_watermark_store(
+            mod_config.Config({
+                'watermark_store': 'file',
+                'watermark_file': path,
+            }),
+            None,
+            'inst',
+        )
+        self.assertTrue(type(store) is watermark.FileWatermarkStore)
+        self.assertEqual(store.path, path)
+        self.assertEqual(store.namespace, 'inst')
+
+        store = watermark.new_watermark_store(
+            mod_config.Config({ 'watermark_store': 'cache' }),
+            data_cache,
+        )
+        self.assertTrue(type(store) is watermark.CacheWatermarkStore)
+        self.assertEqual(store.key, 'watermarks:inst')
+
+        backend.db.close()
+
+    def test_new_watermark_store_raises_given_invalid_config(self):
+        '''
+        new_watermark_store() raises a ConfigException given an invalid configuration
+        given: an instance config
+        when: new_watermark_store() is called
+        and when: watermark_store is cache and there is no data cache
+        then: raises a ConfigException
+        and when: watermark_store is cache and the backend can not hold values
+        then: raises a ConfigException
+        and when: watermark_store is file and watermark_file is not set
+        then: raises a ConfigException
+        and when: watermark_store is unknown
+        then: raises a ConfigException
+        '''
+
+        # execute / verify
+        with self.assertRaises(ConfigException) as _:
+            watermark.new_watermark_store(
+                mod_config.Config({ 'watermark_store': 'cache' }),
+                None,
+            )
+
+        with self.assertRaises(ConfigException) as _:
+            watermark.new_watermark_store(
+                mod_config.Config({ 'watermark_store': 'cache' }),
+                cache.DataCache(BackendStub({}), 5),
+            )
+
+        with self.assertRaises(ConfigException) as _:
+            watermark.new_watermark_store(
+                mod_config.Config({ 'watermark_store': 'file' }),
+                DataCacheStub(),
+            )
+
+        with self.assertRaises(ConfigException) as _:
+            watermark.new_watermark_store(
+                mod_config.Config({ 'watermark_store': 'foo' }),
+                None,
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()